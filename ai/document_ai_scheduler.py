@@ -43,15 +43,18 @@ def esegui_analisi_ai():
         'errori': 0
     }
     
+    # Presenza dei file dal manifest dello storage, senza uno stat per documento
+    from services.storage_scanner import presence_map
+    percorsi = {documento.id: documento.file_path for documento in tutti_documenti}
+    presenza = presence_map(percorsi.values())
+    
     for documento in tutti_documenti:
         try:
             # Verifica se il file esiste
-            if not hasattr(documento, 'file_path') or not documento.file_path:
-                # Usa il filename come fallback
-                documento.file_path = os.path.join('uploads', documento.filename)
+            percorso = percorsi[documento.id]
             
-            if not os.path.exists(documento.file_path):
-                print(f"[AI] File non trovato per documento {documento.id}: {documento.file_path}")
+            if not presenza[percorso]:
+                print(f"[AI] File non trovato per documento {documento.id}: {percorso or documento.filename}")
                 statistiche['errori'] += 1
                 continue
             
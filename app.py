@@ -7,11 +7,10 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-from flask import Flask, flash, render_template, session, redirect, url_for, request, send_file, jsonify
+from flask import Flask, flash, render_template, session, redirect, url_for, request, jsonify
 from flask_wtf import CSRFProtect
 from flask_login import LoginManager, login_required, current_user, logout_user
 from flask_migrate import Migrate
-from flask_session import Session
 from cryptography.fernet import Fernet
 from flask.cli import with_appcontext
 from logging.handlers import RotatingFileHandler
@@ -42,10 +41,10 @@ from routes.ai_routes import ai_bp
 from routes.manus_webhook import manus_webhook_bp
 from routes.manus_admin import manus_admin_bp
 from routes.manus_mapping_admin import manus_map_bp
-from app_socket import socketio
+from routes.resumable_upload import resumable_bp
+from app_socket import socketio, init_socketio
 from models import User, Document, AdminLog, DiarioEntry, PrincipioPersonale
 from werkzeug.utils import secure_filename
-from googleapiclient.http import MediaFileUpload
 import uuid
 import click
 
@@ -78,11 +77,15 @@ if not app.debug:
 # === CONFIG ===
 app.config.update({
     'SECRET_KEY': os.getenv('SECRET_KEY'),
-    'SESSION_TYPE': 'filesystem',
+    # Sessioni: cookie firmato (default), redis o filesystem (vedi services.session_backend)
+    'SESSION_BACKEND': os.getenv("SESSION_BACKEND", "cookie"),
+    'SESSION_REDIS_URL': os.getenv("SESSION_REDIS_URL"),
+    'SESSION_LEGACY_DIR': os.getenv("SESSION_LEGACY_DIR") or os.path.join(basedir, 'flask_session'),
     'WTF_CSRF_TIME_LIMIT': 3600,
     'WTF_CSRF_ENABLED': True,
     'UPLOAD_FOLDER': os.path.join(basedir, 'uploads'),
-    'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(basedir, 'gestione.db')}",
+    # Override per ambienti separati (benchmark, staging); default il file SQLite del progetto
+    'SQLALCHEMY_DATABASE_URI': os.getenv("SQLALCHEMY_DATABASE_URI") or f"sqlite:///{os.path.join(basedir, 'gestione.db')}",
     'SQLALCHEMY_TRACK_MODIFICATIONS': False,
     'MAIL_SERVER': os.getenv('MAIL_SERVER'),
     'MAIL_PORT': int(os.getenv('MAIL_PORT', 587)),
@@ -98,15 +101,93 @@ app.config.update({
     'MANUS_BASE_URL': os.getenv("MANUS_BASE_URL", "https://api.manus.example/v1"),
     'MANUS_API_KEY': os.getenv("MANUS_API_KEY", ""),
     'MANUS_WEBHOOK_SECRET': os.getenv("MANUS_WEBHOOK_SECRET", ""),
+    'MANUS_MAX_WORKERS': int(os.getenv("MANUS_MAX_WORKERS", "4")),
+    'MANUS_PAGE_SIZE': int(os.getenv("MANUS_PAGE_SIZE", "100")),
+    'MANUS_TIMEOUT': int(os.getenv("MANUS_TIMEOUT", "20")),
     # Redis Configuration
     'REDIS_URL': os.getenv("REDIS_URL", "redis://localhost:6379/2"),
-    'IDEMP_TTL_SEC': int(os.getenv("IDEMP_TTL_SEC", "7200"))  # 2h
+    'IDEMP_TTL_SEC': int(os.getenv("IDEMP_TTL_SEC", "7200")),  # 2h
+    # Scheduler singleton (embedded / external / off) e backend di leader election
+    'SCHEDULER_MODE': os.getenv("SCHEDULER_MODE", "embedded"),
+    'SCHEDULER_LOCK_BACKEND': os.getenv("SCHEDULER_LOCK_BACKEND", "auto"),
+    'SCHEDULER_LEASE_SEC': int(os.getenv("SCHEDULER_LEASE_SEC", "60")),
+    'VISIBILITY_INDEX_ENABLED': os.getenv("VISIBILITY_INDEX_ENABLED", "true").lower() == "true",
+    # Cache identità utente tra richieste (0 = disabilitata)
+    'IDENTITY_CACHE_TTL_SEC': int(os.getenv("IDENTITY_CACHE_TTL_SEC", "30")),
+    # Google Drive (sincronizzazione in background)
+    'GOOGLE_DRIVE_ROOT_FOLDER_ID': os.getenv("GOOGLE_DRIVE_ROOT_FOLDER_ID") or os.getenv("DRIVE_ROOT_FOLDER_ID"),
+    'GOOGLE_DRIVE_DISCOVERY_URL': os.getenv("GOOGLE_DRIVE_DISCOVERY_URL"),  # endpoint Drive locale/fake
+    'DRIVE_UPLOAD_CHUNK_SIZE': int(os.getenv("DRIVE_UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024))),
+    # Blob store content-addressable (default: UPLOAD_FOLDER/blobs)
+    'BLOB_STORE_ROOT': os.getenv("BLOB_STORE_ROOT") or os.path.join(basedir, 'uploads', 'blobs'),
+    # Consegna download: "python" (worker) o "x-accel" (nginx X-Accel-Redirect)
+    'FILE_DELIVERY_BACKEND': os.getenv("FILE_DELIVERY_BACKEND", "python"),
+    'X_ACCEL_MAPPINGS': os.getenv("X_ACCEL_MAPPINGS", f"{os.path.join(basedir, 'uploads')}=/protected/uploads"),
+    # Cache preview per hash contenuto, con budget su disco (LRU) e rendering in background
+    'PREVIEW_CACHE_DIR': os.getenv("PREVIEW_CACHE_DIR") or os.path.join(basedir, 'uploads', 'preview_cache'),
+    'PREVIEW_CACHE_MAX_BYTES': int(os.getenv("PREVIEW_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024))),
+    'PREVIEW_WORKERS': int(os.getenv("PREVIEW_WORKERS", "2")),
+    'PREVIEW_MAX_PAGES': int(os.getenv("PREVIEW_MAX_PAGES", "20")),
+    'PREVIEW_RENDER_TIMEOUT': int(os.getenv("PREVIEW_RENDER_TIMEOUT", "120")),
+    'PREVIEW_ASYNC': os.getenv("PREVIEW_ASYNC", "true").lower() == "true",
+    # Manifest storage: root scansionate (default UPLOAD_FOLDER), sweep periodiche e inotify
+    'STORAGE_SCAN_ROOTS': os.getenv("STORAGE_SCAN_ROOTS"),
+    'STORAGE_SCAN_INTERVAL_MIN': int(os.getenv("STORAGE_SCAN_INTERVAL_MIN", "60")),
+    'STORAGE_SCAN_HASH': os.getenv("STORAGE_SCAN_HASH", "true").lower() == "true",
+    'STORAGE_WATCH_ENABLED': os.getenv("STORAGE_WATCH_ENABLED", "true").lower() == "true",
+    # Rollup report: aggiornamento incrementale e giorni recenti sempre ricalcolati
+    'REPORT_ROLLUP_INTERVAL_MIN': int(os.getenv("REPORT_ROLLUP_INTERVAL_MIN", "15")),
+    'REPORT_ROLLUP_LOOKBACK_DAYS': int(os.getenv("REPORT_ROLLUP_LOOKBACK_DAYS", "2")),
+    # App ASGI (asgi.py): thread per le sessioni database dei router FastAPI
+    'ASGI_DB_THREADS': int(os.getenv("ASGI_DB_THREADS", "8")),
+    # Socket.IO multi-worker: message queue ('auto' = REDIS_URL se raggiungibile), presenza e coalescenza KPI
+    'SOCKETIO_MESSAGE_QUEUE': os.getenv("SOCKETIO_MESSAGE_QUEUE", "auto"),
+    'SOCKETIO_CHANNEL': os.getenv("SOCKETIO_CHANNEL", "synthia-socketio"),
+    'SOCKETIO_PRESENCE_TTL_SEC': int(os.getenv("SOCKETIO_PRESENCE_TTL_SEC", "60")),
+    'SOCKETIO_KPI_COALESCE_MS': int(os.getenv("SOCKETIO_KPI_COALESCE_MS", "500")),
+    # Profilo SQLite (pragma per connessione) e coda di scrittura per l'audit delle richieste
+    'SQLITE_PRAGMAS_ENABLED': os.getenv("SQLITE_PRAGMAS_ENABLED", "true").lower() == "true",
+    'SQLITE_JOURNAL_MODE': os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    'SQLITE_BUSY_TIMEOUT_MS': int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    'SQLITE_SYNCHRONOUS': os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    'SQLITE_MMAP_SIZE': int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    'SQLITE_CACHE_SIZE_KB': int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536")),
+    'DB_WRITE_QUEUE_ENABLED': os.getenv("DB_WRITE_QUEUE_ENABLED", "true").lower() == "true",
+    'DB_WRITE_QUEUE_BATCH': int(os.getenv("DB_WRITE_QUEUE_BATCH", "200")),
+    'DB_WRITE_QUEUE_FLUSH_MS': int(os.getenv("DB_WRITE_QUEUE_FLUSH_MS", "200")),
+    # Sessioni di reporting: primary (pool dedicato), replica o snapshot SQLite, in sola lettura con timeout
+    'REPORTING_DATABASE_MODE': os.getenv("REPORTING_DATABASE_MODE", "primary"),
+    'REPORTING_DATABASE_URI': os.getenv("REPORTING_DATABASE_URI"),
+    'REPORTING_SNAPSHOT_PATH': os.getenv("REPORTING_SNAPSHOT_PATH") or os.path.join(basedir, 'instance', 'reporting_snapshot.db'),
+    'REPORT_SNAPSHOT_INTERVAL_MIN': int(os.getenv("REPORT_SNAPSHOT_INTERVAL_MIN", "15")),
+    'REPORTING_STATEMENT_TIMEOUT_MS': int(os.getenv("REPORTING_STATEMENT_TIMEOUT_MS", "30000")),
+    'REPORTING_POOL_SIZE': int(os.getenv("REPORTING_POOL_SIZE", "2")),
+    # Metriche query per richiesta e rilevamento N+1 (header solo in sviluppo)
+    'QUERY_METRICS_ENABLED': os.getenv("QUERY_METRICS_ENABLED", "true").lower() == "true",
+    'QUERY_METRICS_HEADERS': os.getenv("QUERY_METRICS_HEADERS", "false").lower() == "true",
+    'QUERY_METRICS_N_PLUS_ONE_THRESHOLD': int(os.getenv("QUERY_METRICS_N_PLUS_ONE_THRESHOLD", "10")),
+    'QUERY_METRICS_LOG_MIN_QUERIES': int(os.getenv("QUERY_METRICS_LOG_MIN_QUERIES", "50")),
+    'QUERY_METRICS_SLOW_MS': int(os.getenv("QUERY_METRICS_SLOW_MS", "500")),
+    'QUERY_METRICS_LOG_PATH': os.getenv("QUERY_METRICS_LOG_PATH") or os.path.join(basedir, 'logs', 'query_metrics.jsonl'),
+    # Upload a chunk riprendibili (tus): file oltre MAX_CONTENT_LENGTH inviati a chunk
+    'RESUMABLE_UPLOAD_DIR': os.getenv("RESUMABLE_UPLOAD_DIR"),
+    'RESUMABLE_UPLOAD_MAX_MB': int(os.getenv("RESUMABLE_UPLOAD_MAX_MB", "2048")),
+    'RESUMABLE_UPLOAD_EXPIRE_HOURS': int(os.getenv("RESUMABLE_UPLOAD_EXPIRE_HOURS", "24")),
+    'RESUMABLE_UPLOAD_MAX_PENDING': int(os.getenv("RESUMABLE_UPLOAD_MAX_PENDING", "10")),
+    # Registro eventi unificato: partizioni mensili, archivio JSONL gzip e retention
+    'EVENT_STORE_ENABLED': os.getenv("EVENT_STORE_ENABLED", "false").lower() == "true",
+    'EVENT_STORE_CAPTURE': os.getenv("EVENT_STORE_CAPTURE"),
+    'EVENT_STORE_LIVE_MONTHS': int(os.getenv("EVENT_STORE_LIVE_MONTHS", "3")),
+    'EVENT_STORE_RETENTION_MONTHS': int(os.getenv("EVENT_STORE_RETENTION_MONTHS", "24")),
+    'EVENT_STORE_SOURCE_RETENTION_MONTHS': int(os.getenv("EVENT_STORE_SOURCE_RETENTION_MONTHS", "12")),
+    'EVENT_ARCHIVE_DIR': os.getenv("EVENT_ARCHIVE_DIR") or os.path.join(basedir, 'archive', 'eventi')
 })
 
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=30)
 
 # === SESSION SETUP ===
-Session(app)
+from services.session_backend import init_sessions
+init_sessions(app)
 
 # === FERNET SETUP ===
 fernet_key = os.getenv('FERNET_KEY')
@@ -127,17 +208,48 @@ def nl2br_filter(text):
 
 # === EXTENSIONS INITIALIZATION ===
 csrf.init_app(app)
+from services.reporting_db import REPORTING_BIND, init_reporting, reporting_bind
+_reporting_bind = reporting_bind(app.config)
+if _reporting_bind:
+    app.config.setdefault('SQLALCHEMY_BINDS', {})[REPORTING_BIND] = _reporting_bind
 db.init_app(app)
+
+# === PROFILO DATABASE (pragma SQLite, coda di scrittura, sessioni di reporting, registro eventi) ===
+from services.db_profile import init_db_profile
+init_db_profile(app)
+init_reporting(app)
+from services.event_store import init_event_store
+init_event_store(app)
 bcrypt.init_app(app)
 mail.init_app(app)
 
+# === INDICE VISIBILITÀ DOCUMENTI ===
+from services.visibility_index import register_visibility_listeners
+register_visibility_listeners()
+
+# === CACHE IDENTITÀ UTENTE ===
+from services.identity_cache import load_identity, register_identity_listeners
+register_identity_listeners()
+
+# === BLOB STORE (conteggio riferimenti) ===
+from services.blob_store import get_blob_store, register_blob_listeners, store_upload
+register_blob_listeners()
+from services.file_delivery import deliver_file
+from services.resumable_upload import resumable_file
+from services.preview_service import enqueue_preview
+from services.watermark_service import watermark_service
+from services.storage_scanner import file_available
+
 # === SOCKET.IO INITIALIZATION ===
-socketio.init_app(app, cors_allowed_origins="*")
+init_socketio(app)
 
 # === MIDDLEWARE INITIALIZATION ===
 from middleware import AuditMiddleware
 audit_middleware = AuditMiddleware(app)
 
+from services.query_metrics import init_query_metrics
+init_query_metrics(app)
+
 from itsdangerous import URLSafeTimedSerializer
 serializer = URLSafeTimedSerializer(app.secret_key)
 
@@ -152,8 +264,7 @@ from routes.guest_routes import guest_bp
 from routes.qms_routes import qms_bp
 from routes.drive_upload import drive_bp
 from routes.documents import docs_bp
-# from routes.docs_ai import router as docs_ai_router  # FastAPI router temporaneamente disabilitato
-# from routes.synthia_eventi import router as synthia_eventi_bp
+# I router FastAPI (docs_ai, docs_dashboard, docs_reports, synthia_eventi) sono serviti da asgi.py
 # from routes.jack_docs_routes import router as jack_docs_bp
 
 # === REGISTER BLUEPRINTS ===
@@ -175,7 +286,6 @@ app.register_blueprint(visite_mediche_bp, url_prefix="/visite_mediche")
 app.register_blueprint(firme_manuali_bp, url_prefix="/firme_manuali")
 app.register_blueprint(prove_evacuazione_bp, url_prefix="/prove_evacuazione")
 app.register_blueprint(visite_mediche_avanzate_bp, url_prefix="/visite_mediche_avanzate")
-# app.register_blueprint(synthia_eventi_bp, url_prefix="/synthia")
 # app.register_blueprint(jack_docs_bp, url_prefix="/jack")
 app.register_blueprint(quality_bp, url_prefix="/quality")
 app.register_blueprint(ai_monitoring_bp, url_prefix="/admin/ai")
@@ -187,14 +297,15 @@ app.register_blueprint(ai_bp)
 app.register_blueprint(manus_webhook_bp, url_prefix='/webhooks')
 app.register_blueprint(manus_admin_bp, url_prefix='/admin')
 app.register_blueprint(manus_map_bp, url_prefix='/admin')
-# app.register_blueprint(docs_ai_router, url_prefix="/docs/ai")  # FastAPI router temporaneamente disabilitato
+app.register_blueprint(resumable_bp)
 
 # === SCHEDULER SETUP ===
+# Scheduler singleton: i worker competono per il lock e solo il leader esegue i job.
+# Con SCHEDULER_MODE=external i job girano nel processo dedicato scheduler_worker.py.
 try:
     from scheduler import avvia_scheduler
-    with app.app_context():
-        avvia_scheduler(app)
-    app.logger.info("✅ Scheduler APScheduler avviato per reminder automatici")
+    if avvia_scheduler(app):
+        app.logger.info("✅ Scheduler APScheduler in leader election avviato")
 except Exception as e:
     app.logger.error(f"❌ Errore avvio scheduler: {e}")
 
@@ -509,9 +620,264 @@ def test_firme_manuali():
 
 app.cli.add_command(test_firme_manuali)
 
+# === CLI COMMAND PER INVIARE LE EMAIL IN CODA ===
+@click.command("send-queued-emails")
+@click.option("--batch-size", default=200, help="Email per connessione SMTP.")
+@with_appcontext
+def send_queued_emails(batch_size):
+    """Invia le email in coda (una connessione SMTP per batch)."""
+    from services.mail_queue import flush_email_queue, get_queue_stats
+
+    stats = flush_email_queue(batch_size=batch_size)
+    print(f"📬 Inviate: {stats['inviate']} | Errori: {stats['errori']} | Fallite: {stats['fallite']}")
+    print(f"📊 Stato coda: {get_queue_stats()}")
+
+app.cli.add_command(send_queued_emails)
+
+# === CLI COMMAND PER STATO JOB SCHEDULER ===
+@click.command("scheduler-status")
+@with_appcontext
+def scheduler_status():
+    """Mostra ultima/prossima esecuzione e durata dei job schedulati."""
+    from scheduler_leader import get_job_status
+    from models import SchedulerLeaderLock
+
+    lock = SchedulerLeaderLock.query.first()
+    if lock:
+        print(f"👑 Leader (lock db): {lock.holder} - scadenza {lock.expires_at:%d/%m/%Y %H:%M:%S}")
+    for job in get_job_status():
+        stato = "✅" if job['last_status'] == 'success' else "❌" if job['last_status'] == 'error' else "⏳"
+        print(f"{stato} {job['job_id']}: ultima={job['last_run_at']} ({job['last_duration_ms']} ms) "
+              f"prossima={job['next_run_at']} esecuzioni={job['run_count']} errori={job['error_count']}")
+
+app.cli.add_command(scheduler_status)
+
+# === CLI COMMAND PER RICOSTRUZIONE INDICE VISIBILITÀ ===
+@click.command("rebuild-visibility-index")
+@with_appcontext
+def rebuild_visibility_index():
+    """Ricostruisce da zero la tabella document_visibility."""
+    from services.visibility_index import rebuild_all
+
+    count = rebuild_all()
+    print(f"✅ Indice visibilità ricostruito: {count} righe")
+
+app.cli.add_command(rebuild_visibility_index)
+
+# === CLI COMMAND PER CODA UPLOAD GOOGLE DRIVE ===
+@click.command("sync-drive")
+@click.option("--batch-size", default=None, type=int, help="Numero massimo di upload per batch")
+@with_appcontext
+def sync_drive(batch_size):
+    """Esegue gli upload su Google Drive in coda (riprendendo quelli interrotti)."""
+    from services.drive_sync import flush_drive_queue, get_drive_queue_stats
+
+    stats = flush_drive_queue(batch_size=batch_size)
+    print(f"☁️ Caricati: {stats['caricati']} | Errori: {stats['errori']} | Falliti: {stats['falliti']}")
+    print(f"📊 Stato coda: {get_drive_queue_stats()}")
+
+app.cli.add_command(sync_drive)
+
+# === CLI COMMAND PER BLOB STORE ===
+@click.command("migrate-blobs")
+@click.option("--batch-size", default=200, type=int, help="Record per commit")
+@click.option("--remove-legacy", is_flag=True, help="Elimina i file legacy dopo la migrazione")
+@click.option("--dry-run", is_flag=True, help="Conta i file senza spostarli")
+@with_appcontext
+def migrate_blobs(batch_size, remove_legacy, dry_run):
+    """Sposta i file di documenti e versioni dai percorsi legacy al blob store."""
+    from services.blob_store import migrate_legacy_files
+
+    stats = migrate_legacy_files(batch_size=batch_size, remove_legacy=remove_legacy, dry_run=dry_run)
+    print(f"📦 Migrati: {stats['migrati']} | Deduplicati: {stats['deduplicati']} | "
+          f"Mancanti: {stats['mancanti']} | Errori: {stats['errori']}")
+    print(f"💾 Spazio risparmiato: {stats['bytes_risparmiati'] / (1024 * 1024):.1f} MB")
+
+app.cli.add_command(migrate_blobs)
+
+@click.command("gc-blobs")
+@click.option("--grace-hours", default=24, type=int, help="Ore di attesa prima di eliminare un blob non referenziato")
+@click.option("--dry-run", is_flag=True, help="Conta i blob senza eliminarli")
+@with_appcontext
+def gc_blobs_command(grace_hours, dry_run):
+    """Elimina i blob non più referenziati da documenti o versioni."""
+    from services.blob_store import gc_blobs
+
+    stats = gc_blobs(grace_hours=grace_hours, dry_run=dry_run)
+    print(f"🧹 Blob eliminati: {stats['eliminati']} | Liberati: {stats['bytes_liberati'] / (1024 * 1024):.1f} MB | "
+          f"Staging rimossi: {stats['staging_rimossi']}")
+
+app.cli.add_command(gc_blobs_command)
+
+@click.command("warm-previews")
+@click.option("--limit", default=None, type=int, help="Numero massimo di documenti da elaborare")
+@with_appcontext
+def warm_previews(limit):
+    """Genera le preview mancanti dei documenti esistenti (eseguito nel processo corrente)."""
+    from services.preview_service import enqueue_document_preview
+
+    query = Document.query.order_by(Document.created_at.desc())
+    if limit:
+        query = query.limit(limit)
+    app.config['PREVIEW_ASYNC'] = False
+    accodati = 0
+    for doc in query:
+        if enqueue_document_preview(doc) is not None:
+            accodati += 1
+    print(f"🖼️ Preview elaborate per {accodati} documenti")
+
+app.cli.add_command(warm_previews)
+
+@click.command("prune-previews")
+@click.option("--max-bytes", default=None, type=int, help="Budget in byte (default PREVIEW_CACHE_MAX_BYTES)")
+@with_appcontext
+def prune_previews(max_bytes):
+    """Riporta la cache preview entro il budget eliminando le immagini usate meno di recente."""
+    from services.preview_service import get_preview_cache
+
+    stats = get_preview_cache().enforce_budget(max_bytes)
+    print(f"🧹 Preview eliminate: {stats['eliminati']} | Cache: {stats['bytes_dopo'] / (1024 * 1024):.1f} MB")
+
+app.cli.add_command(prune_previews)
+
+@click.command("storage-scan")
+@click.option("--no-hash", is_flag=True, help="Non calcolare l'hash dei file nuovi o modificati")
+@with_appcontext
+def storage_scan(no_hash):
+    """Scansione completa dello storage e aggiornamento del manifest."""
+    from services.storage_scanner import sweep
+
+    stats = sweep(hash_files=False if no_hash else None)
+    print(f"🗂️ File: {stats['file']} | Nuovi: {stats['nuovi']} | Modificati: {stats['modificati']} | "
+          f"Mancanti: {stats['mancanti']} | Ripristinati: {stats['ripristinati']} | {stats['durata_sec']}s")
+
+app.cli.add_command(storage_scan)
+
+@click.command("storage-report")
+@click.option("--limit", default=50, type=int, help="Numero massimo di file per elenco")
+@with_appcontext
+def storage_report(limit):
+    """Elenca i file referenziati mancanti e i file orfani secondo il manifest."""
+    from services.storage_scanner import missing_files, orphaned_files
+
+    mancanti = missing_files(limit=limit)
+    orfani = orphaned_files(limit=limit)
+    print(f"❌ File mancanti: {len(mancanti)}")
+    for item in mancanti:
+        riferimenti = ', '.join(f"{tipo} {ref_id}" for tipo, ref_id in item['riferimenti'])
+        print(f"  {item['path']} ({riferimenti})")
+    print(f"🗑️ File orfani: {len(orfani)}")
+    for item in orfani:
+        print(f"  {item['path']} ({item['size']} byte)")
+
+app.cli.add_command(storage_report)
+
+@click.command("rollup-report")
+@click.option("--rebuild", is_flag=True, help="Ricostruisce tutti i rollup dallo storico")
+@with_appcontext
+def rollup_report(rebuild):
+    """Aggiorna i rollup giornalieri e mensili usati da trend e report."""
+    from services.report_rollup import aggiorna_rollup, ricostruisci_rollup
+
+    stats = ricostruisci_rollup() if rebuild else aggiorna_rollup()
+    print(f"📊 Giorni ricalcolati: {stats['giorni']} | Bucket modificati: {stats['modificate']} | "
+          f"Mesi riaggregati: {stats['mesi']}")
+
+app.cli.add_command(rollup_report)
+
+@click.command("cleanup-sessions")
+@click.option("--all", "tutte", is_flag=True, help="Elimina anche le sessioni filesystem non ancora scadute")
+@with_appcontext
+def cleanup_sessions(tutte):
+    """Elimina i file di sessione filesystem scaduti (o tutti, a migrazione conclusa)."""
+    from services.session_backend import pulisci_sessioni_filesystem
+
+    directory = app.config.get('SESSION_FILE_DIR') or app.config.get('SESSION_LEGACY_DIR')
+    eliminati = pulisci_sessioni_filesystem(directory, 0 if tutte else app.permanent_session_lifetime.total_seconds())
+    print(f"🧹 File di sessione eliminati da {directory}: {eliminati}")
+
+app.cli.add_command(cleanup_sessions)
+
+@click.command("reporting-snapshot")
+@with_appcontext
+def reporting_snapshot():
+    """Aggiorna subito lo snapshot SQLite delle sessioni di reporting."""
+    from services.reporting_db import aggiorna_snapshot_reporting
+
+    if aggiorna_snapshot_reporting(app):
+        print(f"📸 Snapshot aggiornato: {app.config['REPORTING_SNAPSHOT_PATH']}")
+    else:
+        print("⚠️ Snapshot non aggiornato (richiede REPORTING_DATABASE_MODE=snapshot e database SQLite)")
+
+app.cli.add_command(reporting_snapshot)
+
+@click.command("index-advisor")
+@click.option("--log", "log_path", default=None, help="Log JSONL delle metriche query (default QUERY_METRICS_LOG_PATH)")
+@click.option("--file", "sql_file", default=None, help="File SQL con istruzioni separate da ';'")
+@click.option("--tutte", is_flag=True, help="Mostra anche le query senza scansioni complete")
+@with_appcontext
+def index_advisor(log_path, sql_file, tutte):
+    """Riesegue il piano delle query catturate e segnala le scansioni complete."""
+    from services.index_advisor import analizza, fingerprint_dal_log, leggi_file_sql
+
+    if sql_file:
+        fingerprints = leggi_file_sql(sql_file)
+    else:
+        fingerprints = fingerprint_dal_log(log_path or app.config['QUERY_METRICS_LOG_PATH'])
+    if not fingerprints:
+        print("ℹ️ Nessuna query da analizzare (log vuoto o assente)")
+        return
+
+    risultati = analizza(db.engine, fingerprints)
+    con_scansioni = [r for r in risultati if r['scansioni']]
+    for risultato in (risultati if tutte else con_scansioni):
+        print(f"\n[{risultato['occorrenze']}x] {risultato['fingerprint'][:300]}")
+        if risultato['endpoint']:
+            print(f"   endpoint: {', '.join(risultato['endpoint'])}")
+        if 'errore' in risultato:
+            print(f"   ⚠️ piano non disponibile: {risultato['errore']}")
+        for scansione in risultato['scansioni']:
+            print(f"   🔴 scansione completa di {scansione['tabella']}")
+            if scansione['indice_suggerito']:
+                print(f"      💡 {scansione['indice_suggerito']}")
+    print(f"\n✅ {len(risultati)} query analizzate, {len(con_scansioni)} con scansioni complete")
+
+app.cli.add_command(index_advisor)
+
+@click.command("event-archive")
+@with_appcontext
+def event_archive():
+    """Archivia le partizioni del registro eventi fuori finestra e applica la retention."""
+    from services.event_store import applica_retention
+
+    stats = applica_retention(app)
+    print(f"🧹 Righe di log eliminate: {stats['righe_log_eliminate']} | "
+          f"📦 Partizioni archiviate: {stats['archiviate']} ({stats['eventi_archiviati']} eventi) | "
+          f"Segmenti eliminati: {stats['segmenti_eliminati']}")
+
+app.cli.add_command(event_archive)
+
+@click.command("event-report")
+@click.option("--da", "inizio", required=True, type=click.DateTime(formats=["%Y-%m-%d"]), help="Data iniziale")
+@click.option("--a", "fine", default=None, type=click.DateTime(formats=["%Y-%m-%d"]), help="Data finale (default oggi)")
+@click.option("--per", default="fonte", type=click.Choice(["fonte", "azione", "giorno", "mese"]), help="Raggruppamento")
+@click.option("--fonte", default=None, help="Solo eventi di questa fonte (es. download_log)")
+@click.option("--user-id", default=None, type=int, help="Solo eventi di questo utente")
+@click.option("--document-id", default=None, type=int, help="Solo eventi di questo documento")
+@with_appcontext
+def event_report(inizio, fine, per, fonte, user_id, document_id):
+    """Conteggio degli eventi nel periodo, su partizioni live e segmenti archiviati."""
+    from services.event_store import conta_eventi
+
+    fine = (fine or datetime.utcnow()).replace(hour=23, minute=59, second=59)
+    conteggi = conta_eventi(inizio, fine, per=per, fonte=fonte, user_id=user_id, document_id=document_id)
+    for chiave, numero in sorted(conteggi.items(), key=lambda voce: str(voce[0])):
+        print(f"{str(chiave):<40} {numero:>10}")
+    print(f"✅ {sum(conteggi.values())} eventi dal {inizio.date()} al {fine.date()}")
+
+app.cli.add_command(event_report)
+
 import re
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
 
 # === LOGGER ===
 log_dir = os.path.join(basedir, 'logs')
@@ -529,20 +895,7 @@ app.logger.addHandler(file_handler)
 app.logger.setLevel(logging.DEBUG)  # 🔥 QUESTA MANCAVA!
 
 # === Google Drive Setup ===
-drive_service = None
-try:
-    if not app.config.get("TESTING", False):
-        SCOPES = ['https://www.googleapis.com/auth/drive']
-        SERVICE_ACCOUNT_FILE = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
-        if SERVICE_ACCOUNT_FILE:
-            credentials = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-            drive_service = build('drive', 'v3', credentials=credentials)
-        else:
-            app.logger.warning("Variabile GOOGLE_APPLICATION_CREDENTIALS non trovata.")
-    else:
-        app.logger.info("In modalità test: Google Drive disattivato.")
-except Exception as e:
-    app.logger.warning(f"Errore durante l'inizializzazione di Google Drive: {e}")
+# Il client Drive è creato al primo utilizzo da services.drive_sync (uno per processo)
 
 # === Password validator ===
 def is_secure_password(password):
@@ -590,15 +943,18 @@ def load_user(user_id):
     Args:
         user_id (int): L'ID dell'utente.
 
+    Usa la cache di identità: aziende e reparti sono caricati in un'unica
+    query e riusati per IDENTITY_CACHE_TTL_SEC secondi.
+
     Returns:
         User: L'oggetto utente corrispondente.
     """
-    return User.query.get(int(user_id))
+    return load_identity(int(user_id))
 
 # === Helper functions ===
 def send_email(subject, recipients, body, html_body=None):
     """
-    Invia una email tramite Flask-Mail.
+    Accoda una email per l'invio tramite la coda in uscita (services.mail_queue).
 
     Args:
         subject (str): Oggetto della mail.
@@ -608,14 +964,8 @@ def send_email(subject, recipients, body, html_body=None):
     """
     app.logger.info(f"send_email called with recipients={recipients}")
     try:
-        from flask_mail import Message
-        msg = Message(subject=subject, recipients=recipients)
-        msg.body = body
-        if html_body:
-            msg.html = html_body
-        conn = mail.connect()
-        conn.send(msg)
-        conn.close()
+        from services.mail_queue import enqueue_email
+        enqueue_email(subject, recipients, body=body, html=html_body)
     except Exception as e:
         app.logger.error(f"Errore invio email: {e}")
 
@@ -652,85 +1002,6 @@ def notify_download(doc, user_email):
     )
     send_email(subject, [doc.uploader_email, user_email], body)
 
-def get_or_create_folder(name, parent_id=None):
-    """
-    Ottiene o crea una cartella su Google Drive.
-
-    Args:
-        name (str): Nome della cartella.
-        parent_id (str, optional): ID della cartella padre.
-
-    Returns:
-        str: ID della cartella trovata o creata.
-    """
-    query = f"name='{name}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
-    if parent_id:
-        query += f" and '{parent_id}' in parents"
-    results = drive_service.files().list(q=query, spaces='drive', fields='files(id, name)').execute()
-    files = results.get('files', [])
-    if files:
-        return files[0]['id']
-
-    folder_metadata = {
-        'name': name,
-        'mimeType': 'application/vnd.google-apps.folder'
-    }
-    if parent_id:
-        folder_metadata['parents'] = [parent_id]
-    folder = drive_service.files().create(body=folder_metadata, fields='id').execute()
-    return folder.get('id')
-
-def upload_file_to_drive(filepath, filename, folder_id):
-    """
-    Carica un file su Google Drive.
-
-    Args:
-        filepath (str): Percorso locale del file.
-        filename (str): Nome del file su Drive.
-        folder_id (str): ID della cartella Drive.
-
-    Returns:
-        str: ID del file caricato su Drive.
-    """
-    file_metadata = {
-        'name': filename,
-        'parents': [folder_id]
-    }
-    media = MediaFileUpload(filepath, resumable=True)
-    file = drive_service.files().create(body=file_metadata, media_body=media, fields='id').execute()
-    return file.get('id')
-
-def save_file_and_upload_to_drive(file_storage, company_name, department_name):
-    """
-    Salva un file localmente e lo carica su Google Drive.
-
-    Args:
-        file_storage (FileStorage): Il file da salvare.
-        company_name (str): Nome azienda.
-        department_name (str): Nome reparto.
-
-    Returns:
-        tuple: (new_filename, local_path, drive_file_id)
-    """
-    filename = secure_filename(file_storage.filename)
-    ext = os.path.splitext(filename)[1]
-    timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
-    new_filename = f"{company_name}_{department_name}_{current_user.username}_{timestamp}{ext}"
-
-    # Percorso locale
-    folder_path = os.path.join(app.config['UPLOAD_FOLDER'], company_name, department_name)
-    os.makedirs(folder_path, exist_ok=True)
-    local_path = os.path.join(folder_path, new_filename)
-    file_storage.save(local_path)
-
-    # Upload su Drive
-    root_folder_id = os.getenv('DRIVE_ROOT_FOLDER_ID')
-    company_folder_id = get_or_create_folder(company_name, root_folder_id)
-    department_folder_id = get_or_create_folder(department_name, company_folder_id)
-    drive_file_id = upload_file_to_drive(local_path, new_filename, department_folder_id)
-
-    return new_filename, local_path, drive_file_id
-
 # === Routes ===
 
 @app.route('/')
@@ -764,7 +1035,8 @@ def before_request():
     now = datetime.utcnow()
 
     if last_activity:
-        elapsed = (now - last_activity).total_seconds()
+        # Il cookie firmato restituisce datetime UTC con timezone
+        elapsed = (now - last_activity.replace(tzinfo=None)).total_seconds()
         app.logger.info(f"Session last_activity: {last_activity}, elapsed seconds: {elapsed}")
         if elapsed > 1800:  # 30 minuti
             app.logger.info("Session timeout: logging out user.")
@@ -778,7 +1050,7 @@ def before_request():
 @login_required
 def upload_to_drive():
     if request.method == 'POST':
-        file = request.files.get('file')
+        file = request.files.get('file') or resumable_file(request.form.get('upload_id'))
         title = request.form.get('title')
         visibility = request.form.get('visibility')
         password = request.form.get('password') if visibility == 'protetto' else None
@@ -797,19 +1069,17 @@ def upload_to_drive():
         else:
             upload_to_drive = request.form.get('upload_to_drive', 'true') == 'true'
 
+        company_name = current_user.companies[0].name if current_user.companies else 'N/A'
+        department_name = current_user.departments[0].name if current_user.departments else 'N/A'
+        # Contenuto salvato una sola volta nel blob store (deduplicato per SHA-256)
+        ext = os.path.splitext(secure_filename(file.filename))[1]
+        timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
         if upload_to_drive:
-            new_filename, local_path, drive_file_id = save_file_and_upload_to_drive(
-                file, current_user.companies[0].name if current_user.companies else 'N/A', current_user.departments[0].name if current_user.departments else 'N/A'
-            )
+            new_filename = f"{company_name}_{department_name}_{current_user.username}_{timestamp}{ext}"
         else:
-            new_filename = secure_filename(file.filename)
-            ext = os.path.splitext(new_filename)[1]
-            timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
             new_filename = f"{current_user.username}_{timestamp}{ext}"
-            local_path = os.path.join(app.config['UPLOAD_FOLDER'], current_user.username, new_filename)
-            os.makedirs(os.path.dirname(local_path), exist_ok=True)
-            file.save(local_path)
-            drive_file_id = None # No upload to Drive in this case
+        stored = store_upload(file, scan=False)
+        local_path = get_blob_store().path_for(stored.sha256)
 
         doc = Document(
             title=title,
@@ -823,7 +1093,8 @@ def upload_to_drive():
             department_id=current_user.departments[0].id if current_user.departments else None,
             visibility=visibility,
             shared_email=shared_email,
-            drive_file_id=drive_file_id,
+            blob_sha256=stored.sha256,
+            file_size=stored.size,
             created_at=datetime.utcnow()
         )
         try:
@@ -837,7 +1108,13 @@ def upload_to_drive():
             except Exception as e:
                 app.logger.error(f"Errore classificazione AI: {e}")
             
+            # Upload su Drive in background (nessuna chiamata a Drive nella richiesta)
+            if upload_to_drive:
+                from services.drive_sync import enqueue_drive_upload
+                enqueue_drive_upload(doc, local_path, new_filename, [company_name, department_name], commit=False)
+            
             db.session.commit()
+            enqueue_preview(stored.sha256, local_path, file.filename, document_id=doc.id)
             if upload_to_drive:
                 notify_upload(doc)
             flash("✅ Documento caricato con successo", "success")
@@ -1009,8 +1286,8 @@ def download_file(filename):
         return redirect(url_for('index'))
     
     # Verifica che il file esista
-    local_path = os.path.join(app.config['UPLOAD_FOLDER'], doc.company.name, doc.department.name, doc.filename)
-    if not os.path.exists(local_path):
+    local_path = doc.file_path
+    if not file_available(local_path):
         flash("❌ File non trovato sul server", "danger")
         return redirect(url_for('index'))
     
@@ -1055,7 +1332,10 @@ def download_file(filename):
     db.session.add(view_log)
     db.session.commit()
     
-    return send_file(local_path, as_attachment=True)
+    watermarked = watermark_service.watermark_response(doc, current_user, local_path)
+    if watermarked is not None:
+        return watermarked
+    return deliver_file(local_path, download_name=doc.original_filename or doc.filename)
 
 # === Download sicuro per ospiti ===
 @app.route('/guest_secure_download')
@@ -1081,8 +1361,8 @@ def guest_secure_download():
         flash("🚫 Email non autorizzata", "danger")
         return redirect(url_for('guest.guest_access'))
 
-    local_path = os.path.join(app.config['UPLOAD_FOLDER'], doc.company.name, doc.department.name, doc.filename)
-    if not os.path.exists(local_path):
+    local_path = doc.file_path
+    if not file_available(local_path):
         flash("❌ File non trovato sul server", "danger")
         return redirect(url_for('guest.guest_access'))
 
@@ -1095,7 +1375,10 @@ def guest_secure_download():
     db.session.add(log)
     db.session.commit()
 
-    return send_file(local_path, as_attachment=True)
+    watermarked = watermark_service.watermark_response(doc, None, local_path, custom_vars={'username': guest_email, 'email': guest_email})
+    if watermarked is not None:
+        return watermarked
+    return deliver_file(local_path, download_name=doc.original_filename or doc.filename)
 
 # === Registrazione ospite ===
 @app.route('/guest_register', methods=['GET', 'POST'])
@@ -1222,10 +1505,6 @@ def internal_error(error):
     return render_template('errors/500.html'), 500
 
 # === SCHEDULER APSCHEDULER ===
-try:
-    from scheduler_config import start_scheduler
-    scheduler = start_scheduler()
-    app.logger.info("✅ Scheduler APScheduler avviato con successo")
-except Exception as e:
-    app.logger.error(f"❌ Errore nell'avvio del scheduler: {str(e)}")
-    scheduler = None
+# I job di scheduler_config sono registrati dallo scheduler singleton avviato
+# in "SCHEDULER SETUP" (leader election: una sola esecuzione per cluster).
+scheduler = getattr(app, 'scheduler_leader', None)
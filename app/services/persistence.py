@@ -1,8 +1,8 @@
 from app.models.ai_analysis import DocumentoAnalizzato
 from sqlalchemy.orm import Session
 
-def salva_risultato_analisi(result: dict, db: Session):
-    analisi = DocumentoAnalizzato(
+def _documento_analizzato(result: dict) -> DocumentoAnalizzato:
+    return DocumentoAnalizzato(
         filename=result["filename"],
         uploader_email=result["uploader"],
         summary=result.get("summary"),
@@ -11,7 +11,19 @@ def salva_risultato_analisi(result: dict, db: Session):
         signatures=result.get("signatures"),
         lean_check=result.get("lean_check")
     )
+
+def salva_risultato_analisi(result: dict, db: Session):
+    analisi = _documento_analizzato(result)
     db.add(analisi)
     db.commit()
     db.refresh(analisi)
-    return analisi 
\ No newline at end of file
+    return analisi
+
+def salva_risultati_analisi(results: list, db: Session, commit: bool = True) -> list:
+    """Salva più risultati con un solo flush (e un commit) invece di un commit per documento."""
+    analisi = [_documento_analizzato(result) for result in results]
+    db.add_all(analisi)
+    db.flush()
+    if commit:
+        db.commit()
+    return analisi
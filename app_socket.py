@@ -1,6 +1,9 @@
 """
 Socket.IO server per approvazioni e KPI live.
 Gestisce connessioni WebSocket per aggiornamenti in tempo reale.
+
+Con più worker gli emit passano dalla message queue e la presenza è nel
+registro condiviso (vedi services.socket_cluster).
 """
 
 from flask_socketio import SocketIO, emit, join_room, leave_room
@@ -8,8 +11,13 @@ from flask import request, session
 from flask_login import current_user
 import logging
 import json
+import threading
 from datetime import datetime
 
+from services.socket_cluster import (
+    EmitCoalescer, LocalPresence, create_presence, message_queue_url, presence_summary, worker_id
+)
+
 logger = logging.getLogger(__name__)
 
 # Inizializza Socket.IO
@@ -20,8 +28,47 @@ socketio = SocketIO(
     async_mode='threading'
 )
 
-# Store per tracking connessioni
-connected_users = {}
+# Presenza (condivisa tra i worker con la message queue) e connessioni di questo worker
+presence = LocalPresence()
+_local_sids = set()
+_kpi_coalescer = None
+_background_started = set()
+_background_lock = threading.Lock()
+
+
+def init_socketio(app):
+    """
+    Inizializza Socket.IO sull'app: message queue tra i worker, registro
+    presenza e coalescenza KPI (SOCKETIO_KPI_COALESCE_MS, 0 = disattivata).
+    """
+    global presence, _kpi_coalescer
+    queue = message_queue_url(app)
+    socketio.init_app(app, cors_allowed_origins="*", message_queue=queue,
+                      channel=app.config.get('SOCKETIO_CHANNEL', 'synthia-socketio'))
+    presence = create_presence(app, shared=queue is not None)
+
+    interval_ms = int(app.config.get('SOCKETIO_KPI_COALESCE_MS', 0))
+    _kpi_coalescer = EmitCoalescer(_emit_kpi, interval_ms / 1000) if interval_ms > 0 else None
+    logger.info(f"🔌 Socket.IO: message queue {'attiva' if queue else 'assente'}, presenza {presence.backend}")
+
+
+def _start_background(name, target):
+    """Avvia una sola volta per processo il task di background `name`."""
+    with _background_lock:
+        if name in _background_started:
+            return
+        _background_started.add(name)
+    socketio.start_background_task(target)
+
+
+def _heartbeat_loop():
+    """Rinnova il TTL di presenza delle connessioni gestite da questo worker."""
+    while True:
+        socketio.sleep(max(1, presence.ttl_sec // 3))
+        try:
+            presence.heartbeat(list(_local_sids))
+        except Exception as e:
+            logger.error(f"❌ Errore heartbeat presenza Socket.IO: {e}")
 
 @socketio.on('connect')
 def handle_connect():
@@ -33,13 +80,18 @@ def handle_connect():
     user_id = current_user.id
     user_email = current_user.email
     
-    # Salva info connessione
-    connected_users[user_id] = {
+    # Registra la connessione nel registro presenza
+    presence.register(request.sid, {
+        'user_id': user_id,
         'email': user_email,
+        'role': current_user.role,
         'sid': request.sid,
-        'connected_at': datetime.utcnow(),
+        'worker': worker_id(),
+        'connected_at': datetime.utcnow().isoformat(),
         'ip': request.remote_addr
-    }
+    })
+    _local_sids.add(request.sid)
+    _start_background('heartbeat', _heartbeat_loop)
     
     # Unisciti alla stanza personale
     join_room(f"user_{user_id}")
@@ -65,14 +117,12 @@ def handle_connect():
 @socketio.on('disconnect')
 def handle_disconnect():
     """Gestisce disconnessione client."""
+    _local_sids.discard(request.sid)
+    presence.unregister(request.sid)
     if current_user.is_authenticated:
         user_id = current_user.id
         user_email = current_user.email
         
-        # Rimuovi da tracking
-        if user_id in connected_users:
-            del connected_users[user_id]
-        
         logger.info(f"🔌 Client disconnesso: {user_email} (ID: {user_id})")
 
 @socketio.on('join_approval_room')
@@ -119,10 +169,17 @@ def emit_approval_event(event_data: dict):
     except Exception as e:
         logger.error(f"❌ Errore emissione evento approvazione: {e}")
 
+def _emit_kpi(kpi_data: dict):
+    socketio.emit('kpi_update', kpi_data, room='admin_kpi', namespace='/approvals')
+    logger.info(f"📊 KPI update emesso: {kpi_data.get('type', 'unknown')}")
+
 def emit_kpi_update(kpi_data: dict):
     """
     Emette aggiornamento KPI a tutti i client admin.
     
+    Con la coalescenza attiva, aggiornamenti dello stesso tipo nella stessa
+    finestra sono accorpati: viene emesso solo l'ultimo.
+    
     Args:
         kpi_data (dict): Dati KPI aggiornati
     """
@@ -132,9 +189,11 @@ def emit_kpi_update(kpi_data: dict):
             kpi_data['timestamp'] = datetime.utcnow().isoformat()
         
         # Emetti solo agli admin
-        socketio.emit('kpi_update', kpi_data, room='admin_kpi', namespace='/approvals')
-        
-        logger.info(f"📊 KPI update emesso: {kpi_data.get('type', 'unknown')}")
+        if _kpi_coalescer is not None:
+            _kpi_coalescer.submit(kpi_data.get('type', 'kpi'), kpi_data)
+            _start_background('kpi_coalescer', lambda: _kpi_coalescer.run_forever(socketio.sleep))
+        else:
+            _emit_kpi(kpi_data)
         
     except Exception as e:
         logger.error(f"❌ Errore emissione KPI update: {e}")
@@ -183,25 +242,15 @@ def emit_escalation_alert(escalation_data: dict):
 
 def get_connected_users_count() -> dict:
     """
-    Ottiene statistiche utenti connessi.
+    Ottiene statistiche utenti connessi (tutti i worker con il registro condiviso).
     
     Returns:
         dict: Statistiche connessioni
     """
     try:
-        total_connected = len(connected_users)
-        
-        # Raggruppa per ruolo
-        role_counts = {}
-        for user_data in connected_users.values():
-            role = user_data.get('role', 'unknown')
-            role_counts[role] = role_counts.get(role, 0) + 1
-        
-        return {
-            'total_connected': total_connected,
-            'role_counts': role_counts,
-            'timestamp': datetime.utcnow().isoformat()
-        }
+        stats = presence_summary(presence.connections())
+        stats['timestamp'] = datetime.utcnow().isoformat()
+        return stats
         
     except Exception as e:
         logger.error(f"❌ Errore conteggio utenti connessi: {e}")
@@ -221,7 +270,7 @@ def handle_get_connection_info():
             'user_id': current_user.id,
             'user_email': current_user.email,
             'role': current_user.role,
-            'connected_at': connected_users.get(current_user.id, {}).get('connected_at'),
+            'connected_at': (presence.get(request.sid) or {}).get('connected_at'),
             'timestamp': datetime.utcnow().isoformat()
         })
 
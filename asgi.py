@@ -0,0 +1,39 @@
+"""
+Entry point ASGI dei router FastAPI (report, dashboard e AI documenti, eventi Synthia).
+
+Gira accanto a gunicorn (wsgi.py) e condivide con l'app Flask configurazione,
+database e login: nginx instrada verso questo processo solo i percorsi dei
+router qui inclusi.
+
+    uvicorn asgi:app --host 127.0.0.1 --port 5001 --workers 2
+"""
+
+import os
+from contextlib import asynccontextmanager
+
+from fastapi import Depends, FastAPI
+
+# L'import di app.py non deve avviare lo scheduler: i job restano a gunicorn/scheduler_worker.py
+os.environ['SCHEDULER_MODE'] = 'off'
+
+from app import app as flask_app  # noqa: E402
+from routes.docs_ai import router as docs_ai_router  # noqa: E402
+from routes.docs_dashboard import router as docs_dashboard_router  # noqa: E402
+from routes.docs_reports import router as docs_reports_router  # noqa: E402
+from routes.synthia_eventi import router as synthia_eventi_router  # noqa: E402
+from services.ai.gpt_provider import close_async_client  # noqa: E402
+from services.asgi_runtime import init_asgi_runtime, require_roles  # noqa: E402
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    init_asgi_runtime(flask_app)
+    yield
+    await close_async_client()
+
+
+app = FastAPI(title="SYNTHIA DOCS - API asincrone", lifespan=lifespan, docs_url=None, redoc_url=None)
+app.include_router(docs_ai_router)
+app.include_router(docs_dashboard_router)
+app.include_router(docs_reports_router)
+app.include_router(synthia_eventi_router, dependencies=[Depends(require_roles())])
@@ -0,0 +1,146 @@
+"""
+Casi di benchmark sui percorsi caldi.
+
+Ogni caso riceve il contesto (app, client autenticato come admin, dati del
+seed) e restituisce la funzione da cronometrare; se una dipendenza opzionale
+manca solleva `CasoNonDisponibile` e il caso risulta "saltato". Le route sono
+chiamate con il test client: una risposta diversa da 200 è un errore del caso,
+non un tempo.
+"""
+
+from datetime import datetime, timedelta
+from typing import Callable, Dict
+
+from flask import url_for
+
+from extensions import db
+
+CASI: Dict[str, Callable] = {}
+
+
+class CasoNonDisponibile(Exception):
+    """Il caso non può girare in questo ambiente (dipendenza opzionale mancante)."""
+
+
+def caso(nome: str):
+    def registra(func):
+        CASI[nome] = func
+        return func
+    return registra
+
+
+def _url(ctx, endpoint: str, **valori) -> str:
+    with ctx['app'].test_request_context():
+        return url_for(endpoint, **valori)
+
+
+def _richiesta(ctx, metodo: str, url: str, **kwargs):
+    def esegui():
+        response = ctx['client'].open(url, method=metodo, **kwargs)
+        if response.status_code != 200:
+            raise RuntimeError(f"{metodo} {url} -> HTTP {response.status_code}")
+        return len(response.get_data())
+    return esegui
+
+
+@caso('report_firme')
+def report_firme(ctx):
+    return _richiesta(ctx, 'GET', _url(ctx, 'docs.report_firme'))
+
+
+@caso('files_api.get_file_list')
+def file_list(ctx):
+    return _richiesta(ctx, 'GET', _url(ctx, 'files_api.get_file_list', page=1, page_size=50))
+
+
+@caso('files_api.get_file_tree')
+def file_tree(ctx):
+    return _richiesta(ctx, 'GET', _url(ctx, 'files_api.get_file_tree'))
+
+
+@caso('semantic_search.cerca_documenti')
+def cerca_documenti(ctx):
+    try:
+        from services.semantic_search import SemanticSearchService
+    except ImportError as e:
+        raise CasoNonDisponibile(f"sentence-transformers non installato ({e})")
+    from models import Document
+
+    # Modello caricato fuori dal tempo misurato: conta solo la ricerca
+    service = SemanticSearchService()
+    if service.model is None:
+        raise CasoNonDisponibile("modello all-MiniLM-L6-v2 non disponibile")
+    with ctx['app'].app_context():
+        documenti = Document.query.order_by(Document.id).limit(ctx['documenti_ricerca']).all()
+        db.session.expunge_all()
+    return lambda: len(service.cerca_documenti("procedura di sicurezza e dpi in magazzino", documenti))
+
+
+@caso('simulate_batch_policies')
+def simulate_batch_policies(ctx):
+    return _richiesta(ctx, 'POST', _url(ctx, 'admin.simulate_batch_policies'),
+                      data={'policy_ids': ctx['seed']['policy_ids']})
+
+
+@caso('analytics.get_analisi_aggregata_documenti')
+def analisi_aggregata(ctx):
+    from services.document_analytics_service import DocumentAnalyticsService
+
+    def esegui():
+        with ctx['app'].app_context():
+            return len(DocumentAnalyticsService.get_analisi_aggregata_documenti() or [])
+    return esegui
+
+
+@caso('scheduler.genera_reminder')
+def genera_reminder(ctx):
+    from scheduler import genera_reminder as job
+
+    # Il primo giro (riscaldamento) crea i reminder: quelli misurati sono i giri a regime
+    def esegui():
+        with ctx['app'].app_context():
+            job()
+    return esegui
+
+
+@caso('watermark')
+def watermark(ctx):
+    from services.watermark_service import REPORTLAB_AVAILABLE, WatermarkService
+
+    if not REPORTLAB_AVAILABLE:
+        raise CasoNonDisponibile("reportlab non installato")
+    if not ctx['seed']['pdf']:
+        raise CasoNonDisponibile("nessun PDF sintetico (--pdf 0)")
+    service = WatermarkService()
+    pdf_path = ctx['seed']['pdf'][0]
+
+    def esegui():
+        output = service.watermark_file(pdf_path, "User: utente1 | 01/01/2026 10:00 | IP: 10.0.0.1")
+        dimensione = output.seek(0, 2)
+        output.close()
+        return dimensione
+    return esegui
+
+
+@caso('export.download_csv')
+def export_download_csv(ctx):
+    from services.download_export_service import download_export_service
+
+    filtri = {'from': (datetime.utcnow() - timedelta(days=60)).strftime('%Y-%m-%d')}
+
+    def esegui():
+        with ctx['app'].app_context():
+            return sum(len(chunk) for chunk in download_export_service.generate_csv_stream(filtri))
+    return esegui
+
+
+@caso('export.access_requests_csv')
+def export_access_requests_csv(ctx):
+    return _richiesta(ctx, 'GET', _url(ctx, 'admin.export_access_requests'))
+
+
+@caso('export.attestati_zip')
+def export_attestati_zip(ctx):
+    if not ctx['seed']['pdf']:
+        raise CasoNonDisponibile("nessun PDF sintetico (--pdf 0)")
+    return _richiesta(ctx, 'GET', _url(ctx, 'qms.download_attestati_zip', evento_id=ctx['seed']['evento_id']))
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Suite di benchmark dei percorsi caldi di DOCS Mercury.
+
+Crea un database SQLite temporaneo, lo popola con il dataset sintetico di
+benchmarks/seed.py (scala configurabile, PDF inclusi), avvia l'app vera con
+quel database e misura i casi di benchmarks/casi.py: un giro di riscaldamento
+e `--ripetizioni` giri cronometrati per caso, con min/mediana/p95 in ms e
+query SQL per giro. Il risultato è un JSON (commit, parametri, casi) da
+confrontare tra commit: con --confronta l'uscita è 1 se un caso è più lento
+della baseline oltre `--soglia` o esegue più query.
+
+Avvio:
+    python benchmarks/run.py --scala 2 --ripetizioni 5
+    python benchmarks/run.py --output baseline.json
+    python benchmarks/run.py --confronta baseline.json --soglia 0.25
+    python benchmarks/run.py --casi report_firme files_api --scala 5
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+RADICE = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, RADICE)
+
+
+def riassumi(tempi: list) -> dict:
+    """Statistiche in millisecondi di una serie di tempi in secondi."""
+    ordinati = sorted(tempi)
+    return {
+        'ripetizioni': len(ordinati),
+        'min_ms': round(ordinati[0] * 1000, 3),
+        'mediana_ms': round(statistics.median(ordinati) * 1000, 3),
+        'p95_ms': round(ordinati[max(0, int(round(len(ordinati) * 0.95)) - 1)] * 1000, 3),
+        'media_ms': round(statistics.mean(ordinati) * 1000, 3),
+    }
+
+
+def misura_caso(factory, ctx: dict, ripetizioni: int, contatore: dict) -> dict:
+    """Prepara ed esegue un caso: riscaldamento, poi giri cronometrati con conteggio query."""
+    from benchmarks.casi import CasoNonDisponibile
+
+    try:
+        esegui = factory(ctx)
+        esegui()
+        contatore['query'] = 0
+        tempi = []
+        for _ in range(ripetizioni):
+            avvio = time.perf_counter()
+            esegui()
+            tempi.append(time.perf_counter() - avvio)
+    except CasoNonDisponibile as e:
+        return {'stato': 'saltato', 'motivo': str(e)}
+    except Exception as e:
+        return {'stato': 'errore', 'motivo': f"{type(e).__name__}: {e}"}
+    return dict(riassumi(tempi), stato='ok', query=round(contatore['query'] / ripetizioni, 1))
+
+
+def confronta(attuale: dict, baseline: dict, soglia: float) -> list:
+    """Casi più lenti della baseline oltre la soglia (sulla mediana) o con più query per giro."""
+    regressioni = []
+    for nome, dopo in attuale['casi'].items():
+        prima = baseline.get('casi', {}).get(nome)
+        if not prima or prima.get('stato') != 'ok' or dopo.get('stato') != 'ok':
+            continue
+        rapporto = dopo['mediana_ms'] / prima['mediana_ms'] if prima['mediana_ms'] else 1.0
+        if rapporto > 1 + soglia:
+            regressioni.append({'caso': nome, 'metrica': 'mediana_ms', 'prima': prima['mediana_ms'],
+                                'dopo': dopo['mediana_ms'], 'rapporto': round(rapporto, 2)})
+        if dopo['query'] > prima['query']:
+            regressioni.append({'caso': nome, 'metrica': 'query', 'prima': prima['query'], 'dopo': dopo['query'],
+                                'rapporto': round(dopo['query'] / prima['query'], 2) if prima['query'] else None})
+    return regressioni
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RADICE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def crea_app(workdir: str):
+    """App vera su un database SQLite nel workdir; le variabili vanno impostate prima dell'import."""
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ['SCHEDULER_MODE'] = 'external'
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    from app import app
+
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False, MAIL_SUPPRESS_SEND=True,
+                      UPLOAD_FOLDER=os.path.join(workdir, 'uploads'), DB_WRITE_QUEUE_ENABLED=False)
+    return app
+
+
+def esegui(args) -> int:
+    from sqlalchemy import event
+
+    from extensions import db
+
+    with tempfile.TemporaryDirectory() as workdir:
+        app = crea_app(workdir)
+        from benchmarks.casi import CASI
+        from benchmarks.seed import popola
+
+        avvio = time.perf_counter()
+        with app.app_context():
+            db.create_all()
+            seed = popola(scala=args.scala, seed=args.seed, pdf_dir=app.config['UPLOAD_FOLDER'], pdf=args.pdf,
+                          pagine=args.pagine)
+            contatore = {'query': 0}
+
+            def conta(*_):
+                contatore['query'] += 1
+            event.listen(db.engine, 'before_cursor_execute', conta)
+        print(f"🌱 Dataset scala {args.scala} in {time.perf_counter() - avvio:.1f}s: "
+              + ", ".join(f"{nome} {righe}" for nome, righe in seed['righe'].items()))
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(seed['admin_id'])
+            sess['_fresh'] = True
+        ctx = {'app': app, 'client': client, 'seed': seed, 'documenti_ricerca': args.documenti_ricerca}
+
+        selezionati = [nome for nome in CASI if not args.casi or any(filtro in nome for filtro in args.casi)]
+        risultati = {}
+        print(f"{'caso':<44} {'mediana ms':>11} {'p95 ms':>9} {'query':>7}  stato")
+        for nome in selezionati:
+            risultati[nome] = misura_caso(CASI[nome], ctx, args.ripetizioni, contatore)
+            r = risultati[nome]
+            if r['stato'] == 'ok':
+                print(f"{nome:<44} {r['mediana_ms']:>11.2f} {r['p95_ms']:>9.2f} {r['query']:>7}  ok")
+            else:
+                print(f"{nome:<44} {'-':>11} {'-':>9} {'-':>7}  {r['stato']}: {r['motivo']}")
+
+    commit = _commit()
+    report = {
+        'commit': commit,
+        'data': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'ambiente': {'python': platform.python_version(), 'piattaforma': platform.platform()},
+        'parametri': {'scala': args.scala, 'seed': args.seed, 'pdf': args.pdf, 'pagine': args.pagine,
+                      'ripetizioni': args.ripetizioni, 'documenti_ricerca': args.documenti_ricerca},
+        'righe': seed['righe'],
+        'casi': risultati,
+    }
+    output = args.output or os.path.join(RADICE, 'benchmarks', 'results',
+                                         f"bench_{commit or datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"💾 Risultati: {output}")
+
+    if args.confronta:
+        with open(args.confronta, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressioni = confronta(report, baseline, args.soglia)
+        if baseline.get('parametri') != report['parametri']:
+            print("⚠️ Parametri diversi dalla baseline: il confronto è indicativo")
+        for r in regressioni:
+            print(f"❌ {r['caso']}: {r['metrica']} {r['prima']} -> {r['dopo']} (x{r['rapporto']})")
+        if regressioni:
+            return 1
+        print(f"✅ Nessuna regressione rispetto a {baseline.get('commit') or args.confronta}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scala', type=int, default=1, help="Moltiplicatore del dataset (1 = 300 documenti)")
+    parser.add_argument('--seed', type=int, default=42, help="Seed del generatore: stesso dataset a ogni corsa")
+    parser.add_argument('--pdf', type=int, default=10, help="PDF sintetici generati")
+    parser.add_argument('--pagine', type=int, default=20, help="Pagine per PDF")
+    parser.add_argument('--ripetizioni', type=int, default=5, help="Giri cronometrati per caso")
+    parser.add_argument('--documenti-ricerca', type=int, default=200, help="Documenti passati alla ricerca semantica")
+    parser.add_argument('--casi', nargs='*', help="Solo i casi il cui nome contiene uno di questi filtri")
+    parser.add_argument('--output', help="File JSON dei risultati (default benchmarks/results/bench_<commit>.json)")
+    parser.add_argument('--confronta', help="JSON di baseline con cui confrontare i risultati")
+    parser.add_argument('--soglia', type=float, default=0.25, help="Rallentamento tollerato sulla mediana (0.25 = +25%%)")
+    sys.exit(esegui(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
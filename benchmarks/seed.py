@@ -0,0 +1,186 @@
+"""
+Dataset sintetico per i benchmark: aziende, reparti, utenti, documenti, download,
+firme, richieste di accesso, policy, visite mediche, un evento formativo con
+attestati e i PDF a cui puntano documenti e attestati.
+
+Le righe sono generate con un seed fisso (stesso dataset a parità di `scala` e
+`seed`) e inserite con insert multipli ORM, senza passare dagli eventi di flush.
+A `scala=1`: 60 utenti, 300 documenti, 3000 download, 900 firme, 300 richieste.
+"""
+
+import os
+import random
+import zlib
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import insert
+
+from extensions import db
+from models import (
+    AccessRequest, AccessRequestStatus, Company, Department, Document, DownloadLog, EventoFormazione,
+    FirmaDocumento, PartecipazioneFormazione, User, VisitaMedica, user_companies, user_departments,
+)
+from auto_policy import AutoPolicy
+
+# Righe per unità di scala
+PER_SCALA = {
+    'utenti': 60,
+    'documenti': 300,
+    'download': 3000,
+    'firme': 900,
+    'richieste': 300,
+    'visite': 60,
+}
+AZIENDE = ("Mercury Surgelati", "Margarita", "Synthia Lab")
+REPARTI = ("Produzione", "Qualità", "Logistica", "Manutenzione")
+TAG = ('Risorse Umane', 'Policy', 'DPI', 'Regolamento', 'Qualità', None)
+PAROLE = ("sicurezza", "procedura", "qualità", "formazione", "manutenzione", "igiene", "audit", "fornitori",
+          "emergenza", "magazzino", "etichettatura", "tracciabilità", "dpi", "rischio", "controllo")
+
+
+def scrivi_pdf(path: str, pagine: int, titolo: str):
+    """PDF valido con una riga di testo per pagina, scritto a mano (nessuna dipendenza)."""
+    oggetti = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for numero in range(1, pagine + 1):
+        righe = ''.join(f"BT /F1 11 Tf 60 {780 - riga * 18} Td ({titolo} - pagina {numero} - riga {riga + 1}) Tj ET\n"
+                        for riga in range(40))
+        flusso = zlib.compress(righe.encode('latin-1', 'replace'))
+        oggetti.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(flusso) + flusso + b"\nendstream")
+        contenuto = len(oggetti)
+        oggetti.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % contenuto)
+        kids.append(b"%d 0 R" % len(oggetti))
+    oggetti[1] = b"<< /Type /Pages /Kids [" + b" ".join(kids) + b"] /Count %d >>" % pagine
+
+    with open(path, 'wb') as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for numero, corpo in enumerate(oggetti, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n" % numero + corpo + b"\nendobj\n")
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(oggetti) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(oggetti) + 1, xref))
+
+
+def _bulk(model, righe):
+    if righe:
+        db.session.execute(insert(model), righe)
+
+
+def popola(scala: int = 1, seed: int = 42, pdf_dir: str = None, pdf: int = 10, pagine: int = 20) -> dict:
+    """
+    Crea il dataset nel database dell'app corrente (richiede app context e tabelle create).
+
+    Returns:
+        dict: righe create per tabella, id dell'admin, dell'evento formativo e delle policy, PDF scritti.
+    """
+    rnd = random.Random(seed)
+    adesso = datetime.utcnow().replace(microsecond=0)
+    conteggi = {nome: per * scala for nome, per in PER_SCALA.items()}
+
+    percorsi = []
+    if pdf_dir:
+        os.makedirs(pdf_dir, exist_ok=True)
+        for numero in range(pdf):
+            path = os.path.join(pdf_dir, f"manuale_{numero:03d}.pdf")
+            scrivi_pdf(path, pagine, f"Manuale {numero}")
+            percorsi.append(path)
+
+    _bulk(Company, [{'id': numero, 'name': nome} for numero, nome in enumerate(AZIENDE, start=1)])
+    reparti = [(company_id, nome) for company_id in range(1, len(AZIENDE) + 1) for nome in REPARTI]
+    _bulk(Department, [{'id': numero, 'name': nome, 'company_id': company_id}
+                       for numero, (company_id, nome) in enumerate(reparti, start=1)])
+
+    utenti = []
+    for numero in range(1, conteggi['utenti'] + 1):
+        ruolo = 'admin' if numero == 1 or numero % 25 == 0 else 'user'
+        utenti.append({
+            'id': numero, 'username': f"utente{numero}", 'email': f"utente{numero}@bench.local",
+            'password': "pbkdf2:sha256:bench", 'first_name': f"Nome{numero}", 'last_name': f"Cognome{numero}",
+            'role': ruolo, 'can_download': True, 'created_at': adesso - timedelta(days=rnd.randint(0, 700)),
+        })
+    _bulk(User, utenti)
+    reparto_utente = {utente['id']: rnd.randint(1, len(reparti)) for utente in utenti}
+    db.session.execute(insert(user_departments), [{'user_id': u, 'department_id': d} for u, d in reparto_utente.items()])
+    db.session.execute(insert(user_companies), [{'user_id': u, 'company_id': reparti[d - 1][0]}
+                                                for u, d in reparto_utente.items()])
+
+    documenti = []
+    for numero in range(1, conteggi['documenti'] + 1):
+        department_id = rnd.randint(1, len(reparti))
+        user_id = rnd.randint(1, conteggi['utenti'])
+        parole = rnd.sample(PAROLE, 3)
+        creato = adesso - timedelta(days=rnd.randint(0, 365), minutes=rnd.randint(0, 1440))
+        documenti.append({
+            'id': numero, 'title': f"{' '.join(parole).capitalize()} {numero}",
+            'filename': os.path.basename(percorsi[numero % len(percorsi)]) if percorsi else f"doc_{numero}.pdf",
+            'original_filename': f"{'_'.join(parole)}_{numero}.pdf",
+            'description': f"Documento sintetico su {', '.join(parole)}",
+            'user_id': user_id, 'uploader_email': f"utente{user_id}@bench.local",
+            'company_id': reparti[department_id - 1][0], 'department_id': department_id,
+            'visibility': rnd.choice(('pubblico', 'pubblico', 'privato')), 'tag': rnd.choice(TAG),
+            'created_at': creato, 'updated_at': creato,
+            'expiry_date': creato + timedelta(days=rnd.randint(30, 720)) if numero % 3 == 0 else None,
+        })
+    _bulk(Document, documenti)
+
+    _bulk(DownloadLog, [{
+        'user_id': rnd.randint(1, conteggi['utenti']), 'document_id': rnd.randint(1, conteggi['documenti']),
+        'timestamp': adesso - timedelta(minutes=rnd.randint(0, 60 * 24 * 60)),
+        'ip_address': f"10.0.{rnd.randint(0, 20)}.{rnd.randint(1, 254)}", 'user_agent': "bench/1.0",
+        'status': 'blocked' if rnd.random() < 0.05 else 'success', 'source': rnd.choice(('web', 'api')),
+        'filesize': rnd.randint(10_000, 5_000_000),
+    } for _ in range(conteggi['download'])])
+
+    coppie = set()
+    while len(coppie) < conteggi['firme']:
+        coppie.add((rnd.randint(1, conteggi['utenti']), rnd.randint(1, conteggi['documenti'])))
+    _bulk(FirmaDocumento, [{
+        'user_id': user_id, 'document_id': document_id, 'stato': 'firmato',
+        'timestamp': adesso - timedelta(days=rnd.randint(0, 300)), 'ip_address': "10.0.0.1",
+    } for user_id, document_id in sorted(coppie)])
+
+    stati = list(AccessRequestStatus)
+    _bulk(AccessRequest, [{
+        'file_id': rnd.randint(1, conteggi['documenti']), 'requested_by': rnd.randint(1, conteggi['utenti']),
+        'owner_id': 1, 'reason': f"Serve per {rnd.choice(PAROLE)}", 'status': rnd.choice(stati),
+        'created_at': adesso - timedelta(days=rnd.randint(0, 180)),
+    } for _ in range(conteggi['richieste'])])
+
+    condizioni = [
+        ('{"field": "user_role", "operator": "equals", "value": "admin"}', 'approve'),
+        ('{"field": "document_company", "operator": "equals", "value": "Mercury Surgelati"}', 'approve'),
+        ('{"field": "document_department", "operator": "equals", "value": "Qualità"}', 'deny'),
+        ('{"field": "user_company", "operator": "equals", "value": "document_company"}', 'approve'),
+    ]
+    _bulk(AutoPolicy, [{
+        'id': numero, 'name': f"Policy {numero}", 'condition': condizione, 'condition_type': 'json',
+        'action': azione, 'priority': numero, 'active': True, 'created_by': 1,
+        'created_at': adesso, 'updated_at': adesso,
+    } for numero, (condizione, azione) in enumerate(condizioni, start=1)])
+
+    _bulk(VisitaMedica, [{
+        'user_id': rnd.randint(1, conteggi['utenti']), 'ruolo': "Operatore", 'tipo_visita': "Periodica",
+        'data_visita': date.today() - timedelta(days=300), 'esito': "Idoneo",
+        'scadenza': date.today() + timedelta(days=rnd.randint(-60, 90)),
+    } for _ in range(conteggi['visite'])])
+
+    _bulk(EventoFormazione, [{'id': 1, 'titolo': "Formazione sicurezza", 'data_evento': adesso, 'stato': 'completato'}])
+    _bulk(PartecipazioneFormazione, [{
+        'evento_id': 1, 'user_id': user_id, 'stato_partecipazione': 'completato', 'completato': True,
+        'attestato_path': percorsi[user_id % len(percorsi)] if percorsi else None, 'data_completamento': adesso,
+    } for user_id in range(1, min(conteggi['utenti'], 20 * scala) + 1)])
+
+    db.session.commit()
+    return {
+        'righe': dict(conteggi, aziende=len(AZIENDE), reparti=len(reparti), policy=len(condizioni)),
+        'admin_id': 1,
+        'evento_id': 1,
+        'policy_ids': [str(numero) for numero in range(1, len(condizioni) + 1)],
+        'pdf': percorsi,
+    }
@@ -3,8 +3,10 @@ from flask_bcrypt import Bcrypt
 from flask_mail import Mail
 from flask_wtf import CSRFProtect  # Importa CSRFProtect
 
-# Istanza delle estensioni
-db = SQLAlchemy()
+from services.reporting_db import RoutingSession
+
+# Istanza delle estensioni (la sessione instrada i blocchi di reporting sul bind dedicato)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 bcrypt = Bcrypt()
 mail = Mail()
 csrf = CSRFProtect()  # Aggiungi l’istanza CSRFProtect
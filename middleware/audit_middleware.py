@@ -10,6 +10,7 @@ from flask import request, g, current_app
 from flask_login import current_user
 from extensions import db
 from models import SecurityAuditLog
+from services.db_profile import submit_write
 from typing import Optional, Dict, Any
 
 logger = logging.getLogger(__name__)
@@ -162,7 +163,7 @@ def log_request_audit(user_id: Optional[int], ip: str, action: str,
                      object_type: Optional[str], object_id: Optional[int],
                      meta: Dict[str, Any], user_agent: Optional[str]) -> None:
     """
-    Salva l'audit log nel database.
+    Salva l'audit log nel database (tramite la coda di scrittura, se attiva).
     
     Args:
         user_id: ID dell'utente (None per utenti non autenticati)
@@ -174,7 +175,8 @@ def log_request_audit(user_id: Optional[int], ip: str, action: str,
         user_agent: User agent del browser
     """
     try:
-        audit_log = SecurityAuditLog(
+        submit_write(SecurityAuditLog, dict(
+            ts=datetime.utcnow(),
             user_id=user_id,
             ip=ip,
             action=action,
@@ -182,10 +184,7 @@ def log_request_audit(user_id: Optional[int], ip: str, action: str,
             object_id=object_id,
             meta=sanitize_meta_data(meta),
             user_agent=user_agent[:255] if user_agent else None  # Tronca se troppo lungo
-        )
-        
-        db.session.add(audit_log)
-        db.session.commit()
+        ))
         
     except Exception as e:
         logger.error(f"Errore salvataggio audit log: {e}")
@@ -0,0 +1,45 @@
+"""Add outbound email queue table
+
+Revision ID: 003_outbound_emails
+Revises: f4a6e23dd580
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '003_outbound_emails'
+down_revision = 'f4a6e23dd580'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('outbound_emails',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('idempotency_key', sa.String(length=128), nullable=True),
+    sa.Column('subject', sa.String(length=255), nullable=False),
+    sa.Column('sender', sa.String(length=150), nullable=True),
+    sa.Column('recipients', sa.JSON(), nullable=False),
+    sa.Column('body', sa.Text(), nullable=True),
+    sa.Column('html', sa.Text(), nullable=True),
+    sa.Column('template', sa.String(length=255), nullable=True),
+    sa.Column('context', sa.JSON(), nullable=True),
+    sa.Column('attachments', sa.JSON(), nullable=True),
+    sa.Column('stato', sa.String(length=20), nullable=False, server_default='in_coda'),
+    sa.Column('tentativi', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('max_tentativi', sa.Integer(), nullable=False, server_default='5'),
+    sa.Column('prossimo_tentativo', sa.DateTime(), nullable=False),
+    sa.Column('ultimo_errore', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('sent_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('idempotency_key')
+    )
+    op.create_index('idx_outbound_emails_stato_prossimo', 'outbound_emails', ['stato', 'prossimo_tentativo'], unique=False)
+
+
+def downgrade():
+    op.drop_index('idx_outbound_emails_stato_prossimo', table_name='outbound_emails')
+    op.drop_table('outbound_emails')
@@ -0,0 +1,43 @@
+"""Add scheduler leader lock and job status tables
+
+Revision ID: 004_scheduler_leader
+Revises: 003_outbound_emails
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '004_scheduler_leader'
+down_revision = '003_outbound_emails'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('scheduler_leader_lock',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('holder', sa.String(length=128), nullable=False),
+    sa.Column('acquired_at', sa.DateTime(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.create_table('scheduled_job_status',
+    sa.Column('job_id', sa.String(length=100), nullable=False),
+    sa.Column('name', sa.String(length=200), nullable=True),
+    sa.Column('last_run_at', sa.DateTime(), nullable=True),
+    sa.Column('last_duration_ms', sa.Integer(), nullable=True),
+    sa.Column('last_status', sa.String(length=20), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('next_run_at', sa.DateTime(), nullable=True),
+    sa.Column('run_count', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('error_count', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('last_holder', sa.String(length=128), nullable=True),
+    sa.PrimaryKeyConstraint('job_id')
+    )
+
+
+def downgrade():
+    op.drop_table('scheduled_job_status')
+    op.drop_table('scheduler_leader_lock')
@@ -0,0 +1,50 @@
+"""Add precomputed document visibility index
+
+Revision ID: 005_document_visibility
+Revises: 004_scheduler_leader
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '005_document_visibility'
+down_revision = '004_scheduler_leader'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('document_visibility',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('document_id', sa.Integer(), nullable=False),
+    sa.Column('reason', sa.String(length=20), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['document_id'], ['documents.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'document_id', 'reason')
+    )
+    op.create_index('idx_document_visibility_document', 'document_visibility', ['document_id'], unique=False)
+
+    # Popolamento iniziale (equivalente a `flask rebuild-visibility-index`)
+    op.execute("""
+        INSERT INTO document_visibility (user_id, document_id, reason, expires_at)
+        SELECT user_id, id, 'proprietario', NULL FROM documents WHERE user_id IS NOT NULL
+        UNION ALL
+        SELECT user_id, file_id, 'condivisione', MAX(expires_at) FROM document_shares
+            WHERE expires_at > CURRENT_TIMESTAMP GROUP BY user_id, file_id
+        UNION ALL
+        SELECT user_id, document_id, 'autorizzato', NULL FROM authorized_access
+        UNION ALL
+        SELECT uc.user_id, d.id, 'azienda', NULL FROM user_companies uc
+            JOIN documents d ON d.company_id = uc.company_id
+        UNION ALL
+        SELECT ud.user_id, d.id, 'reparto', NULL FROM user_departments ud
+            JOIN documents d ON d.department_id = ud.department_id
+    """)
+
+
+def downgrade():
+    op.drop_index('idx_document_visibility_document', table_name='document_visibility')
+    op.drop_table('document_visibility')
@@ -0,0 +1,52 @@
+"""Add Google Drive folder cache and upload queue
+
+Revision ID: 006_drive_sync
+Revises: 005_document_visibility
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '006_drive_sync'
+down_revision = '005_document_visibility'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('drive_folder_cache',
+    sa.Column('path', sa.String(length=1000), nullable=False),
+    sa.Column('folder_id', sa.String(length=255), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('path')
+    )
+    op.create_table('drive_upload_jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('document_id', sa.Integer(), nullable=False),
+    sa.Column('local_path', sa.String(length=1000), nullable=False),
+    sa.Column('nome_file', sa.String(length=255), nullable=False),
+    sa.Column('subfolders', sa.JSON(), nullable=True),
+    sa.Column('parent_folder_id', sa.String(length=255), nullable=True),
+    sa.Column('stato', sa.String(length=20), nullable=False),
+    sa.Column('tentativi', sa.Integer(), nullable=False),
+    sa.Column('max_tentativi', sa.Integer(), nullable=False),
+    sa.Column('prossimo_tentativo', sa.DateTime(), nullable=False),
+    sa.Column('ultimo_errore', sa.Text(), nullable=True),
+    sa.Column('resumable_uri', sa.String(length=2000), nullable=True),
+    sa.Column('bytes_inviati', sa.BigInteger(), nullable=False),
+    sa.Column('drive_file_id', sa.String(length=255), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.Column('completed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['document_id'], ['documents.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('idx_drive_upload_jobs_stato_prossimo', 'drive_upload_jobs', ['stato', 'prossimo_tentativo'], unique=False)
+
+
+def downgrade():
+    op.drop_index('idx_drive_upload_jobs_stato_prossimo', table_name='drive_upload_jobs')
+    op.drop_table('drive_upload_jobs')
+    op.drop_table('drive_folder_cache')
@@ -0,0 +1,30 @@
+"""Add antivirus known-clean hash cache
+
+Revision ID: 007_antivirus_hash_cache
+Revises: 006_drive_sync
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '007_antivirus_hash_cache'
+down_revision = '006_drive_sync'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('antivirus_hash_cache',
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('signature', sa.String(length=100), nullable=False),
+    sa.Column('engine', sa.String(length=50), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('sha256', 'signature')
+    )
+
+
+def downgrade():
+    op.drop_table('antivirus_hash_cache')
@@ -0,0 +1,51 @@
+"""Add content-addressable blob store references
+
+Revision ID: 008_blob_store
+Revises: 007_antivirus_hash_cache
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '008_blob_store'
+down_revision = '007_antivirus_hash_cache'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('file_blobs',
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=True),
+    sa.Column('mime', sa.String(length=150), nullable=True),
+    sa.Column('ref_count', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('released_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('sha256')
+    )
+    op.create_index('idx_file_blobs_ref_count', 'file_blobs', ['ref_count'])
+
+    # Riferimento al blob da documenti e versioni
+    op.add_column('documents', sa.Column('blob_sha256', sa.String(length=64), nullable=True))
+    op.create_foreign_key('fk_documents_blob_sha256', 'documents', 'file_blobs', ['blob_sha256'], ['sha256'])
+    op.create_index('ix_documents_blob_sha256', 'documents', ['blob_sha256'])
+
+    op.add_column('document_versions', sa.Column('blob_sha256', sa.String(length=64), nullable=True))
+    op.create_foreign_key('fk_document_versions_blob_sha256', 'document_versions', 'file_blobs',
+                          ['blob_sha256'], ['sha256'])
+    op.create_index('ix_document_versions_blob_sha256', 'document_versions', ['blob_sha256'])
+
+
+def downgrade():
+    op.drop_index('ix_document_versions_blob_sha256', 'document_versions')
+    op.drop_constraint('fk_document_versions_blob_sha256', 'document_versions', type_='foreignkey')
+    op.drop_column('document_versions', 'blob_sha256')
+
+    op.drop_index('ix_documents_blob_sha256', 'documents')
+    op.drop_constraint('fk_documents_blob_sha256', 'documents', type_='foreignkey')
+    op.drop_column('documents', 'blob_sha256')
+
+    op.drop_index('idx_file_blobs_ref_count', 'file_blobs')
+    op.drop_table('file_blobs')
@@ -0,0 +1,38 @@
+"""Add storage manifest for background file presence scanning
+
+Revision ID: 009_storage_manifest
+Revises: 008_blob_store
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '009_storage_manifest'
+down_revision = '008_blob_store'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('storage_manifest',
+    sa.Column('path', sa.String(length=1024), nullable=False),
+    sa.Column('root', sa.String(length=512), nullable=True),
+    sa.Column('size', sa.BigInteger(), nullable=True),
+    sa.Column('mtime', sa.Float(), nullable=True),
+    sa.Column('sha256', sa.String(length=64), nullable=True),
+    sa.Column('present', sa.Boolean(), nullable=False, server_default=sa.true()),
+    sa.Column('first_seen_at', sa.DateTime(), nullable=False),
+    sa.Column('checked_at', sa.DateTime(), nullable=False),
+    sa.Column('missing_since', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('path')
+    )
+    op.create_index('idx_storage_manifest_root_present', 'storage_manifest', ['root', 'present'])
+    op.create_index('idx_storage_manifest_sha256', 'storage_manifest', ['sha256'])
+
+
+def downgrade():
+    op.drop_index('idx_storage_manifest_sha256', 'storage_manifest')
+    op.drop_index('idx_storage_manifest_root_present', 'storage_manifest')
+    op.drop_table('storage_manifest')
@@ -0,0 +1,44 @@
+"""Add daily/monthly metric rollup tables for period reports
+
+Revision ID: 010_metric_rollups
+Revises: 009_storage_manifest
+Create Date: 2026-10-19 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '010_metric_rollups'
+down_revision = '009_storage_manifest'
+branch_labels = None
+depends_on = None
+
+
+def _rollup_table(name):
+    op.create_table(name,
+    sa.Column('metrica', sa.String(length=60), nullable=False),
+    sa.Column('periodo', sa.Date(), nullable=False),
+    sa.Column('company_id', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('department_id', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('document_id', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('valore', sa.Integer(), nullable=False, server_default='0'),
+    sa.PrimaryKeyConstraint('metrica', 'periodo', 'company_id', 'department_id', 'document_id')
+    )
+
+
+def upgrade():
+    _rollup_table('metric_rollup_daily')
+    _rollup_table('metric_rollup_monthly')
+    op.create_table('rollup_watermarks',
+    sa.Column('sorgente', sa.String(length=40), nullable=False),
+    sa.Column('last_id', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('refreshed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('sorgente')
+    )
+
+
+def downgrade():
+    op.drop_table('rollup_watermarks')
+    op.drop_table('metric_rollup_monthly')
+    op.drop_table('metric_rollup_daily')
@@ -0,0 +1,40 @@
+"""Add composite indexes for hot filters on log and request tables
+
+Revision ID: 011_hot_filter_indexes
+Revises: 010_metric_rollups
+Create Date: 2026-10-19 21:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '011_hot_filter_indexes'
+down_revision = '010_metric_rollups'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_access_requests_new_requester_file_created', 'access_requests_new', ['requested_by', 'file_id', 'created_at']),
+    ('ix_access_requests_new_status_created', 'access_requests_new', ['status', 'created_at', 'requested_by']),
+    ('ix_download_log_user_timestamp_status', 'download_log', ['user_id', 'timestamp', 'status']),
+    ('ix_download_log_status_timestamp_user', 'download_log', ['status', 'timestamp', 'user_id']),
+    ('ix_firme_documenti_document_timestamp', 'firme_documenti', ['document_id', 'timestamp']),
+    ('ix_firme_documenti_user_document', 'firme_documenti', ['user_id', 'document_id']),
+    ('ix_reminders_tipo_entita_scadenza', 'reminders', ['tipo', 'entita_id', 'scadenza']),
+    ('ix_reminders_stato_prossimo_invio', 'reminders', ['stato', 'prossimo_invio']),
+    ('ix_document_shares_file_user_expires', 'document_shares', ['file_id', 'user_id', 'expires_at']),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False, if_not_exists=True)
+    # Prefisso del nuovo indice (file_id, user_id, expires_at): ridondante
+    op.drop_index('idx_document_shares_file_user', table_name='document_shares', if_exists=True)
+
+
+def downgrade():
+    op.create_index('idx_document_shares_file_user', 'document_shares', ['file_id', 'user_id'],
+                    unique=False, if_not_exists=True)
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
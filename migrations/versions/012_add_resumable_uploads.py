@@ -0,0 +1,43 @@
+"""Add resumable upload sessions
+
+Revision ID: 012_resumable_uploads
+Revises: 011_hot_filter_indexes
+Create Date: 2026-10-19 22:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '012_resumable_uploads'
+down_revision = '011_hot_filter_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('resumable_uploads',
+    sa.Column('id', sa.String(length=32), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('filename', sa.String(length=255), nullable=False),
+    sa.Column('content_type', sa.String(length=100), nullable=True),
+    sa.Column('length', sa.BigInteger(), nullable=False),
+    sa.Column('offset', sa.BigInteger(), nullable=False, server_default='0'),
+    sa.Column('expected_sha256', sa.String(length=64), nullable=True),
+    sa.Column('sha256', sa.String(length=64), nullable=True),
+    sa.Column('mime', sa.String(length=100), nullable=True),
+    sa.Column('stato', sa.String(length=20), nullable=False, server_default='in_corso'),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_resumable_uploads_user_id', 'resumable_uploads', ['user_id'], unique=False)
+    op.create_index('ix_resumable_uploads_expires_at', 'resumable_uploads', ['expires_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_resumable_uploads_expires_at', table_name='resumable_uploads')
+    op.drop_index('ix_resumable_uploads_user_id', table_name='resumable_uploads')
+    op.drop_table('resumable_uploads')
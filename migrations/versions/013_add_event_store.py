@@ -0,0 +1,46 @@
+"""Add first-read bitmaps and event archive segments
+
+Le partizioni mensili del registro eventi (eventi_AAAAMM) sono create a
+runtime da services.event_store alla prima scrittura del mese.
+
+Revision ID: 013_event_store
+Revises: 012_resumable_uploads
+Create Date: 2026-10-20 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '013_event_store'
+down_revision = '012_resumable_uploads'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('first_read_bitmaps',
+    sa.Column('document_id', sa.Integer(), nullable=False),
+    sa.Column('bitmap', sa.LargeBinary(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['document_id'], ['documents.id'], ),
+    sa.PrimaryKeyConstraint('document_id')
+    )
+    op.create_table('event_archive_segments',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('mese', sa.String(length=6), nullable=False),
+    sa.Column('path', sa.String(length=500), nullable=False),
+    sa.Column('righe', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('da', sa.DateTime(), nullable=True),
+    sa.Column('a', sa.DateTime(), nullable=True),
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_event_archive_segments_mese', 'event_archive_segments', ['mese'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_event_archive_segments_mese', table_name='event_archive_segments')
+    op.drop_table('event_archive_segments')
+    op.drop_table('first_read_bitmaps')
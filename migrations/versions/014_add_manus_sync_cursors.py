@@ -0,0 +1,37 @@
+"""Add Manus incremental sync cursors
+
+Revision ID: 014_manus_sync_cursors
+Revises: 013_event_store
+Create Date: 2026-10-20 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '014_manus_sync_cursors'
+down_revision = '013_event_store'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('manus_sync_cursors',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('azienda_id', sa.Integer(), nullable=False),
+    sa.Column('risorsa', sa.String(length=100), nullable=False),
+    sa.Column('cursor', sa.String(length=64), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['azienda_id'], ['companies.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('azienda_id', 'risorsa', name='uq_manus_cursor_azienda_risorsa')
+    )
+    # Lookup dei link per azienda nel prefetch della sincronizzazione
+    op.create_index('ix_manus_manual_link_azienda_id', 'manus_manual_link', ['azienda_id'], unique=False)
+    op.create_index('ix_manus_course_link_azienda_id', 'manus_course_link', ['azienda_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_manus_course_link_azienda_id', table_name='manus_course_link')
+    op.drop_index('ix_manus_manual_link_azienda_id', table_name='manus_manual_link')
+    op.drop_table('manus_sync_cursors')
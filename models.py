@@ -357,6 +357,24 @@ class Document(db.Model):
     prossima_revisione = db.Column(db.Date, nullable=True)  # Data prossima revisione calcolata
     revisione_task_id = db.Column(db.Integer, db.ForeignKey('tasks.id'), nullable=True)  # Task revisione associato
 
+    # === Blob store content-addressable ===
+    # active_history: al flush il conteggio riferimenti dei blob legge il valore precedente anche se scaduto
+    blob_sha256 = db.column_property(
+        db.Column(db.String(64), db.ForeignKey('file_blobs.sha256'), nullable=True, index=True),
+        active_history=True
+    )
+
+    @property
+    def file_path(self):
+        """
+        Percorso locale del file (blob store o percorso legacy).
+        
+        Returns:
+            str: Percorso del file, None se non trovato.
+        """
+        from services.blob_store import resolve_path
+        return resolve_path(self)
+
     # === Metodi per workflow di approvazione multilivello ===
     def inizializza_flusso_approvazione(self):
         """
@@ -820,6 +838,12 @@ class DownloadLog(db.Model):
     source = db.Column(db.String(20), default='web', nullable=False)  # web, api
     filesize = db.Column(db.BigInteger, nullable=True)  # Dimensione file in bytes
 
+    __table_args__ = (
+        # Regole di alert: download dell'utente nella finestra e burst per stato
+        db.Index('ix_download_log_user_timestamp_status', 'user_id', 'timestamp', 'status'),
+        db.Index('ix_download_log_status_timestamp_user', 'status', 'timestamp', 'user_id'),
+    )
+
     user = db.relationship("User", backref="download_logs")
     document = db.relationship("Document", backref="download_logs")
     
@@ -959,6 +983,11 @@ class DocumentVersion(db.Model):
     ai_summary = db.Column(db.Text)  # descrizione AI della versione
     diff_ai = db.Column(db.Text)     # differenze con versione precedente
     is_active = db.Column(db.Boolean, default=False)
+    # active_history: al flush il conteggio riferimenti dei blob legge il valore precedente anche se scaduto
+    blob_sha256 = db.column_property(
+        db.Column(db.String(64), db.ForeignKey('file_blobs.sha256'), nullable=True, index=True),
+        active_history=True
+    )
 
     document = db.relationship("Document", backref="versions")
     
@@ -1882,6 +1911,12 @@ class FirmaDocumento(db.Model):
     stato = db.Column(db.String(20), default='in_attesa')  # firmato, rifiutato, in_attesa
     commento = db.Column(db.Text, nullable=True)
     
+    __table_args__ = (
+        # Report firme: firme per documento in ordine di data e firme per utente
+        db.Index('ix_firme_documenti_document_timestamp', 'document_id', 'timestamp'),
+        db.Index('ix_firme_documenti_user_document', 'user_id', 'document_id'),
+    )
+    
     # Relazioni
     user = db.relationship('User', backref='firme_documenti')
     document = db.relationship('Document', backref='firme_documenti')
@@ -2652,6 +2687,12 @@ class Reminder(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     
+    __table_args__ = (
+        # Deduplica in genera_reminder e invio dei reminder attivi
+        db.Index('ix_reminders_tipo_entita_scadenza', 'tipo', 'entita_id', 'scadenza'),
+        db.Index('ix_reminders_stato_prossimo_invio', 'stato', 'prossimo_invio'),
+    )
+    
     # Relazioni
     created_by_user = db.relationship('User', backref='reminders_creati')
     
@@ -5115,6 +5156,12 @@ class AccessRequestNew(db.Model):
     ip_address = db.Column(db.String(45), nullable=True)  # IP del client
     user_agent = db.Column(db.Text, nullable=True)  # User agent del browser
     
+    __table_args__ = (
+        # Detector: richieste ripetute per (utente, file) e negate nella finestra
+        db.Index('ix_access_requests_new_requester_file_created', 'requested_by', 'file_id', 'created_at'),
+        db.Index('ix_access_requests_new_status_created', 'status', 'created_at', 'requested_by'),
+    )
+    
     # Relazioni
     file = db.relationship('Document', backref='access_requests_new')
     requested_by_user = db.relationship('User', foreign_keys=[requested_by], backref='access_requests_made')
@@ -5325,7 +5372,8 @@ class DocumentShare(db.Model):
     
     # Indici compositi richiesti
     __table_args__ = (
-        db.Index('idx_document_shares_file_user', 'file_id', 'user_id'),
+        # Verifica accesso: file, utente e scadenza dallo stesso indice
+        db.Index('ix_document_shares_file_user_expires', 'file_id', 'user_id', 'expires_at'),
         db.Index('idx_document_shares_expires', 'expires_at'),
     )
     
@@ -5381,7 +5429,7 @@ class ManusManualLink(db.Model):
     __tablename__ = "manus_manual_link"
     
     id = db.Column(db.Integer, primary_key=True)
-    azienda_id = db.Column(db.Integer, db.ForeignKey("companies.id"), nullable=False)
+    azienda_id = db.Column(db.Integer, db.ForeignKey("companies.id"), nullable=False, index=True)
     documento_id = db.Column(db.Integer, db.ForeignKey("documents.id"), nullable=False)
     manus_manual_id = db.Column(db.String(64), nullable=False, index=True)
     manus_version = db.Column(db.String(64), nullable=False)
@@ -5409,7 +5457,7 @@ class ManusCourseLink(db.Model):
     __tablename__ = "manus_course_link"
     
     id = db.Column(db.Integer, primary_key=True)
-    azienda_id = db.Column(db.Integer, db.ForeignKey("companies.id"), nullable=False)
+    azienda_id = db.Column(db.Integer, db.ForeignKey("companies.id"), nullable=False, index=True)
     requisito_id = db.Column(db.Integer, db.ForeignKey("documents.id"), nullable=False)  # Usa documents come requisiti
     manus_course_id = db.Column(db.String(64), nullable=False, index=True)
     last_sync_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
@@ -5522,3 +5570,527 @@ class TrainingCoverageReport(db.Model):
         return f'<TrainingCoverageReport {self.id}: {self.user_id} -> {self.requisito_id} ({self.status})>'
 
 
+
+
+# === MODELLO CODA EMAIL IN USCITA ===
+
+class OutboundEmail(db.Model):
+    """
+    Modello per la coda persistente delle email in uscita.
+    
+    Le email vengono accodate dai request handler e dai job e inviate in batch
+    dal worker `services.mail_queue.process_email_queue`, che riusa una sola
+    connessione SMTP per batch.
+    
+    Attributi:
+        id (int): ID primario.
+        idempotency_key (str): Chiave di deduplica (unica, opzionale).
+        subject (str): Oggetto.
+        sender (str): Mittente (default MAIL_DEFAULT_SENDER).
+        recipients (list): Destinatari.
+        body (str): Corpo testuale.
+        html (str): Corpo HTML.
+        template (str): Template Jinja da renderizzare al momento dell'invio.
+        context (dict): Contesto del template.
+        attachments (list): Allegati (filename, content_type, data base64).
+        stato (str): Stato ('in_coda', 'in_invio', 'inviata', 'fallita').
+        tentativi (int): Numero di tentativi effettuati.
+        max_tentativi (int): Numero massimo di tentativi.
+        prossimo_tentativo (datetime): Data del prossimo tentativo (scadenza della prenotazione se 'in_invio').
+        ultimo_errore (str): Ultimo errore di invio.
+        created_at (datetime): Data accodamento.
+        sent_at (datetime): Data invio.
+    """
+    __tablename__ = 'outbound_emails'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    idempotency_key = db.Column(db.String(128), unique=True, nullable=True)
+    subject = db.Column(db.String(255), nullable=False)
+    sender = db.Column(db.String(150), nullable=True)
+    recipients = db.Column(db.JSON, nullable=False)
+    body = db.Column(db.Text, nullable=True)
+    html = db.Column(db.Text, nullable=True)
+    template = db.Column(db.String(255), nullable=True)
+    context = db.Column(db.JSON, nullable=True)
+    attachments = db.Column(db.JSON, nullable=True)
+    stato = db.Column(db.String(20), default='in_coda', nullable=False)  # in_coda, in_invio, inviata, fallita
+    tentativi = db.Column(db.Integer, default=0, nullable=False)
+    max_tentativi = db.Column(db.Integer, default=5, nullable=False)
+    prossimo_tentativo = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    ultimo_errore = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    sent_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        db.Index('idx_outbound_emails_stato_prossimo', 'stato', 'prossimo_tentativo'),
+    )
+    
+    def __repr__(self):
+        return f'<OutboundEmail {self.id}: {self.subject[:30]} ({self.stato})>'
+    
+    @property
+    def is_pending(self):
+        """Verifica se l'email è ancora da inviare."""
+        return self.stato in ('in_coda', 'in_invio')
+
+
+# === MODELLI SCHEDULER SINGLETON ===
+
+class SchedulerLeaderLock(db.Model):
+    """
+    Lock di leader election per lo scheduler (backend database).
+    
+    Un solo processo del cluster detiene il lock e quindi esegue i job;
+    gli altri restano in standby e subentrano alla scadenza del lease.
+    
+    Attributi:
+        name (str): Nome del lock (PK).
+        holder (str): Identificativo del processo detentore (host:pid:token).
+        acquired_at (datetime): Data acquisizione.
+        expires_at (datetime): Scadenza del lease.
+    """
+    __tablename__ = 'scheduler_leader_lock'
+    
+    name = db.Column(db.String(64), primary_key=True)
+    holder = db.Column(db.String(128), nullable=False)
+    acquired_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f'<SchedulerLeaderLock {self.name}: {self.holder}>'
+
+
+class ScheduledJobStatus(db.Model):
+    """
+    Bookkeeping persistente dei job schedulati.
+    
+    Attributi:
+        job_id (str): ID del job (PK).
+        name (str): Nome descrittivo.
+        last_run_at (datetime): Inizio ultima esecuzione.
+        last_duration_ms (int): Durata ultima esecuzione in millisecondi.
+        last_status (str): Esito ultima esecuzione ('success', 'error').
+        last_error (str): Ultimo errore.
+        next_run_at (datetime): Prossima esecuzione pianificata.
+        run_count (int): Numero di esecuzioni.
+        error_count (int): Numero di esecuzioni in errore.
+        last_holder (str): Processo che ha eseguito l'ultima volta il job.
+    """
+    __tablename__ = 'scheduled_job_status'
+    
+    job_id = db.Column(db.String(100), primary_key=True)
+    name = db.Column(db.String(200), nullable=True)
+    last_run_at = db.Column(db.DateTime, nullable=True)
+    last_duration_ms = db.Column(db.Integer, nullable=True)
+    last_status = db.Column(db.String(20), nullable=True)  # success, error
+    last_error = db.Column(db.Text, nullable=True)
+    next_run_at = db.Column(db.DateTime, nullable=True)
+    run_count = db.Column(db.Integer, default=0, nullable=False)
+    error_count = db.Column(db.Integer, default=0, nullable=False)
+    last_holder = db.Column(db.String(128), nullable=True)
+    
+    def __repr__(self):
+        return f'<ScheduledJobStatus {self.job_id}: {self.last_status}>'
+
+
+# === INDICE DI VISIBILITÀ DOCUMENTI ===
+
+class DocumentVisibility(db.Model):
+    """
+    Indice materializzato della visibilità dei documenti per utente.
+    
+    Ogni riga indica che un utente vede un documento per un certo motivo;
+    l'indice è mantenuto da `services.visibility_index` a ogni modifica di
+    DocumentShare, AuthorizedAccess, appartenenza ad aziende/reparti e
+    spostamento dei documenti.
+    
+    Attributi:
+        user_id (int): ID utente (PK).
+        document_id (int): ID documento (PK).
+        reason (str): Motivo ('proprietario', 'condivisione', 'autorizzato', 'azienda', 'reparto') (PK).
+        expires_at (datetime): Scadenza (solo per le condivisioni temporanee).
+    """
+    __tablename__ = 'document_visibility'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id', ondelete='CASCADE'), primary_key=True)
+    reason = db.Column(db.String(20), primary_key=True)
+    expires_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        db.Index('idx_document_visibility_document', 'document_id'),
+    )
+    
+    def __repr__(self):
+        return f'<DocumentVisibility {self.user_id}:{self.document_id} ({self.reason})>'
+
+
+# === MODELLI SINCRONIZZAZIONE GOOGLE DRIVE ===
+class DriveFolderCache(db.Model):
+    """
+    Cache persistente percorso cartella → ID cartella Google Drive.
+    
+    Evita un `files().list` per ogni livello (azienda/reparto/categoria) a
+    ogni upload; sopravvive ai riavvii ed è condivisa tra i worker.
+    
+    Attributi:
+        path (str): Percorso normalizzato a partire dalla root (PK), es. "<root>/Mercury/Qualità".
+        folder_id (str): ID della cartella su Drive.
+        created_at (datetime): Data di inserimento in cache.
+    """
+    __tablename__ = 'drive_folder_cache'
+    
+    path = db.Column(db.String(1000), primary_key=True)
+    folder_id = db.Column(db.String(255), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<DriveFolderCache {self.path} → {self.folder_id}>'
+
+
+class DriveUploadJob(db.Model):
+    """
+    Coda persistente degli upload su Google Drive.
+    
+    Gli upload sono eseguiti in background da `services.drive_sync` con
+    upload resumable a chunk; `resumable_uri` e `bytes_inviati` permettono
+    di riprendere un upload interrotto anche dopo un riavvio.
+    
+    Attributi:
+        id (int): ID primario.
+        document_id (int): Documento da caricare.
+        local_path (str): Percorso del file locale.
+        nome_file (str): Nome del file su Drive.
+        subfolders (list): Sottocartelle (es. [azienda, reparto, categoria]).
+        parent_folder_id (str): Cartella Drive di destinazione esplicita (alternativa a subfolders).
+        stato (str): Stato ('in_coda', 'in_corso', 'caricato', 'fallito').
+        tentativi (int): Numero di tentativi effettuati.
+        max_tentativi (int): Numero massimo di tentativi.
+        prossimo_tentativo (datetime): Data del prossimo tentativo.
+        ultimo_errore (str): Ultimo errore.
+        resumable_uri (str): URI della sessione di upload resumable.
+        bytes_inviati (int): Byte confermati da Drive.
+        drive_file_id (str): ID del file caricato.
+        created_at (datetime): Data accodamento.
+        updated_at (datetime): Ultimo aggiornamento (heartbeat durante l'upload).
+        completed_at (datetime): Data completamento.
+    """
+    __tablename__ = 'drive_upload_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id', ondelete='CASCADE'), nullable=False)
+    local_path = db.Column(db.String(1000), nullable=False)
+    nome_file = db.Column(db.String(255), nullable=False)
+    subfolders = db.Column(db.JSON, nullable=True)
+    parent_folder_id = db.Column(db.String(255), nullable=True)
+    stato = db.Column(db.String(20), default='in_coda', nullable=False)  # in_coda, in_corso, caricato, fallito
+    tentativi = db.Column(db.Integer, default=0, nullable=False)
+    max_tentativi = db.Column(db.Integer, default=8, nullable=False)
+    prossimo_tentativo = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    ultimo_errore = db.Column(db.Text, nullable=True)
+    resumable_uri = db.Column(db.String(2000), nullable=True)
+    bytes_inviati = db.Column(db.BigInteger, default=0, nullable=False)
+    drive_file_id = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    
+    document = db.relationship('Document', backref=db.backref('drive_upload_jobs', passive_deletes=True))
+    
+    __table_args__ = (
+        db.Index('idx_drive_upload_jobs_stato_prossimo', 'stato', 'prossimo_tentativo'),
+    )
+    
+    def __repr__(self):
+        return f'<DriveUploadJob {self.id} doc={self.document_id} {self.stato}>'
+
+
+# === CACHE VERDETTI ANTIVIRUS PER HASH ===
+class AntivirusHashCache(db.Model):
+    """
+    Hash SHA-256 già verificati puliti per una versione delle signature ClamAV.
+    
+    Un file con lo stesso contenuto non viene riscansionato finché la
+    versione delle signature non cambia.
+    
+    Attributi:
+        sha256 (str): Hash SHA-256 del contenuto (PK).
+        signature (str): Versione signature ClamAV (PK).
+        engine (str): Versione engine che ha eseguito la scansione.
+        size (int): Dimensione del file in byte.
+        created_at (datetime): Data della scansione.
+    """
+    __tablename__ = 'antivirus_hash_cache'
+    
+    sha256 = db.Column(db.String(64), primary_key=True)
+    signature = db.Column(db.String(100), primary_key=True)
+    engine = db.Column(db.String(50), nullable=False)
+    size = db.Column(db.BigInteger, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<AntivirusHashCache {self.sha256[:12]} sig={self.signature}>'
+
+
+# === BLOB STORE CONTENT-ADDRESSABLE ===
+class FileBlob(db.Model):
+    """
+    Contenuto di un file salvato una sola volta nel blob store, indicizzato per SHA-256.
+    
+    Documenti e versioni con lo stesso contenuto condividono lo stesso blob;
+    `ref_count` conta i riferimenti da Document e DocumentVersion ed è
+    aggiornato automaticamente al flush.
+    
+    Attributi:
+        sha256 (str): Hash SHA-256 del contenuto (PK).
+        size (int): Dimensione in byte.
+        mime (str): Tipo MIME rilevato.
+        ref_count (int): Numero di documenti/versioni che usano il blob.
+        created_at (datetime): Data di inserimento.
+        released_at (datetime): Ultima volta in cui il conteggio è sceso (per la pulizia).
+    """
+    __tablename__ = 'file_blobs'
+    
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=True)
+    mime = db.Column(db.String(150), nullable=True)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    released_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        db.Index('idx_file_blobs_ref_count', 'ref_count'),
+    )
+    
+    def __repr__(self):
+        return f'<FileBlob {self.sha256[:12]} refs={self.ref_count}>'
+
+
+# === MANIFEST STORAGE (presenza file) ===
+class StorageManifestEntry(db.Model):
+    """
+    Stato di un file sullo storage, mantenuto dallo scanner in background.
+    
+    Le route che devono sapere se un file esiste (verifiche audit, analisi AI,
+    download) leggono il manifest invece di interrogare il filesystem, che su
+    storage di rete è lento.
+    
+    Attributi:
+        path (str): Percorso assoluto del file (PK).
+        root (str): Directory scansionata che contiene il file (None per file referenziati fuori dalle root).
+        size (int): Dimensione in byte.
+        mtime (float): Ultima modifica (epoch secondi).
+        sha256 (str): Hash SHA-256 del contenuto.
+        present (bool): False se il file non è più presente.
+        first_seen_at (datetime): Prima rilevazione.
+        checked_at (datetime): Ultimo controllo.
+        missing_since (datetime): Da quando il file risulta mancante.
+    """
+    __tablename__ = 'storage_manifest'
+    
+    path = db.Column(db.String(1024), primary_key=True)
+    root = db.Column(db.String(512), nullable=True)
+    size = db.Column(db.BigInteger, nullable=True)
+    mtime = db.Column(db.Float, nullable=True)
+    sha256 = db.Column(db.String(64), nullable=True)
+    present = db.Column(db.Boolean, nullable=False, default=True)
+    first_seen_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    checked_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    missing_since = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        db.Index('idx_storage_manifest_root_present', 'root', 'present'),
+        db.Index('idx_storage_manifest_sha256', 'sha256'),
+    )
+    
+    def __repr__(self):
+        return f'<StorageManifestEntry {self.path} present={self.present}>'
+
+
+class MetricRollupDaily(db.Model):
+    """
+    Contatori giornalieri pre-aggregati per trend e report periodici.
+    
+    Mantenuti dal job incrementale di services.report_rollup: i report su un
+    periodo sommano poche righe invece di contare documenti ed eventi.
+    Le dimensioni non usate da una metrica valgono 0.
+    
+    Attributi:
+        metrica (str): Nome della metrica (es. 'download', 'documenti.in_attesa').
+        periodo (date): Giorno del bucket.
+        company_id (int): Azienda del documento (0 se non applicabile).
+        department_id (int): Reparto del documento (0 se non applicabile).
+        document_id (int): Documento (0 se non applicabile).
+        valore (int): Conteggio.
+    """
+    __tablename__ = 'metric_rollup_daily'
+    
+    metrica = db.Column(db.String(60), primary_key=True)
+    periodo = db.Column(db.Date, primary_key=True)
+    company_id = db.Column(db.Integer, primary_key=True, default=0)
+    department_id = db.Column(db.Integer, primary_key=True, default=0)
+    document_id = db.Column(db.Integer, primary_key=True, default=0)
+    valore = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<MetricRollupDaily {self.metrica} {self.periodo} {self.valore}>'
+
+
+class MetricRollupMonthly(db.Model):
+    """
+    Contatori mensili pre-aggregati, ricavati dai giornalieri.
+    
+    Attributi:
+        metrica (str): Nome della metrica.
+        periodo (date): Primo giorno del mese.
+        company_id (int): Azienda del documento (0 se non applicabile).
+        department_id (int): Reparto del documento (0 se non applicabile).
+        document_id (int): Documento (0 se non applicabile).
+        valore (int): Conteggio.
+    """
+    __tablename__ = 'metric_rollup_monthly'
+    
+    metrica = db.Column(db.String(60), primary_key=True)
+    periodo = db.Column(db.Date, primary_key=True)
+    company_id = db.Column(db.Integer, primary_key=True, default=0)
+    department_id = db.Column(db.Integer, primary_key=True, default=0)
+    document_id = db.Column(db.Integer, primary_key=True, default=0)
+    valore = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<MetricRollupMonthly {self.metrica} {self.periodo} {self.valore}>'
+
+
+class RollupWatermark(db.Model):
+    """
+    Punto di avanzamento del job di rollup per ciascuna sorgente di eventi.
+    
+    Attributi:
+        sorgente (str): Nome della sorgente (download, letture, firme, admin_log, documenti).
+        last_id (int): Ultimo ID evento già aggregato.
+        refreshed_at (datetime): Ultimo aggiornamento dei rollup della sorgente.
+    """
+    __tablename__ = 'rollup_watermarks'
+    
+    sorgente = db.Column(db.String(40), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    refreshed_at = db.Column(db.DateTime, nullable=True)
+    
+    def __repr__(self):
+        return f'<RollupWatermark {self.sorgente} last_id={self.last_id}>'
+
+
+class ResumableUpload(db.Model):
+    """
+    Upload a chunk riprendibile (protocollo tus): stato e avanzamento del file parziale.
+    
+    Attributi:
+        id (str): Identificativo dell'upload (esadecimale, nell'URL).
+        user_id (int): Utente che ha avviato l'upload.
+        filename (str): Nome originale del file.
+        content_type (str): Tipo dichiarato dal client.
+        length (int): Dimensione totale dichiarata in byte.
+        offset (int): Byte ricevuti e scritti nel file parziale.
+        expected_sha256 (str): SHA-256 dichiarato dal client (opzionale, verificato alla chiusura).
+        sha256 (str): SHA-256 del file completo (alla chiusura).
+        mime (str): Tipo MIME rilevato dai primi byte (alla chiusura).
+        stato (str): in_corso, completato, annullato.
+        created_at (datetime): Avvio dell'upload.
+        updated_at (datetime): Ultimo chunk ricevuto.
+        expires_at (datetime): Scadenza oltre la quale l'upload viene eliminato.
+    """
+    __tablename__ = 'resumable_uploads'
+    
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    filename = db.Column(db.String(255), nullable=False)
+    content_type = db.Column(db.String(100), nullable=True)
+    length = db.Column(db.BigInteger, nullable=False)
+    offset = db.Column(db.BigInteger, nullable=False, default=0)
+    expected_sha256 = db.Column(db.String(64), nullable=True)
+    sha256 = db.Column(db.String(64), nullable=True)
+    mime = db.Column(db.String(100), nullable=True)
+    stato = db.Column(db.String(20), nullable=False, default='in_corso')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    @property
+    def is_complete(self):
+        """True se tutti i byte dichiarati sono stati ricevuti."""
+        return self.offset >= self.length
+    
+    def __repr__(self):
+        return f'<ResumableUpload {self.id} {self.offset}/{self.length} {self.stato}>'
+
+
+class FirstReadBitmap(db.Model):
+    """
+    Bitmap delle prime letture di un documento: il bit `user_id` è acceso
+    quando l'utente ha letto il documento almeno una volta.
+    
+    Attributi:
+        document_id (int): Documento.
+        bitmap (bytes): Bit per utente (byte user_id // 8, bit user_id % 8).
+        updated_at (datetime): Ultima prima lettura registrata.
+    """
+    __tablename__ = 'first_read_bitmaps'
+    
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id'), primary_key=True)
+    bitmap = db.Column(db.LargeBinary, nullable=False, default=b'')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<FirstReadBitmap doc={self.document_id} {len(self.bitmap or b"")}B>'
+
+
+class EventArchiveSegment(db.Model):
+    """
+    Segmento JSONL compresso di una partizione mensile del registro eventi archiviata.
+    
+    Attributi:
+        mese (str): Partizione archiviata (AAAAMM).
+        path (str): File .jsonl.gz del segmento.
+        righe (int): Eventi nel segmento.
+        da (datetime): Primo evento del segmento.
+        a (datetime): Ultimo evento del segmento.
+        sha256 (str): SHA-256 del file, per verificarne l'integrità.
+        created_at (datetime): Data di archiviazione.
+    """
+    __tablename__ = 'event_archive_segments'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    mese = db.Column(db.String(6), nullable=False, index=True)
+    path = db.Column(db.String(500), nullable=False)
+    righe = db.Column(db.Integer, nullable=False, default=0)
+    da = db.Column(db.DateTime, nullable=True)
+    a = db.Column(db.DateTime, nullable=True)
+    sha256 = db.Column(db.String(64), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<EventArchiveSegment {self.mese} {self.righe} righe>'
+
+
+class ManusSyncCursor(db.Model):
+    """
+    Cursore incrementale della sincronizzazione Manus per azienda e risorsa.
+    
+    Attributi:
+        azienda_id (int): ID dell'azienda (FK).
+        risorsa (str): Risorsa sincronizzata (es. 'completions:<course_id>').
+        cursor (str): Valore `since` (ISO 8601) per la prossima richiesta.
+        updated_at (datetime): Ultimo avanzamento del cursore.
+    """
+    __tablename__ = "manus_sync_cursors"
+    
+    id = db.Column(db.Integer, primary_key=True)
+    azienda_id = db.Column(db.Integer, db.ForeignKey("companies.id"), nullable=False)
+    risorsa = db.Column(db.String(100), nullable=False)
+    cursor = db.Column(db.String(64), nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (db.UniqueConstraint("azienda_id", "risorsa", name="uq_manus_cursor_azienda_risorsa"),)
+    
+    def __repr__(self):
+        return f'<ManusSyncCursor {self.azienda_id}:{self.risorsa} {self.cursor}>'
@@ -245,6 +245,19 @@ def check_document_access(user_id, file_id):
     Returns:
         tuple: (has_access, reason)
     """
+    from services.visibility_index import get_access_reason, is_enabled
+
+    # Lookup indicizzato sulla tabella di visibilità precalcolata
+    if is_enabled():
+        reason = get_access_reason(user_id, file_id, reasons=('proprietario', 'condivisione'))
+        if reason == 'proprietario':
+            return True, "Proprietario"
+        if reason == 'condivisione':
+            return True, "Accesso temporaneo"
+        if not db.session.query(Document.id).filter_by(id=file_id).first():
+            return False, "Documento non trovato"
+        return False, "Accesso non autorizzato"
+
     # Verifica permessi standard
     document = Document.query.get(file_id)
     if not document:
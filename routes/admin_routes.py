@@ -27,6 +27,7 @@ from flask import make_response
 # from flask_login import roles_required  # Non esiste in flask_login
 from services.alert_detection_service import alert_detector
 from services.download_export_service import download_export_service, rate_limit_export
+from services.reporting_db import reporting_query, reporting_session
 from services.access_request_service import access_request_service
 from services.ai.gpt_provider import GptProvider
 from services.download_alert_service import build_alert_context
@@ -731,11 +732,14 @@ def download_document(document_id):
     db.session.add(log)
     db.session.commit()
 
-    return send_from_directory(
-        current_app.config['UPLOAD_FOLDER'],
-        document.filename,
-        as_attachment=True
-    )
+    from services.file_delivery import deliver_file
+
+    local_path = document.file_path
+    if not local_path or not os.path.exists(local_path):
+        flash("❌ File non trovato sul server", "danger")
+        return redirect(url_for('admin.file_structure'))
+
+    return deliver_file(local_path, download_name=document.original_filename or document.filename)
 
 import traceback
 from sqlalchemy import func
@@ -1461,11 +1465,14 @@ def download_document(document_id):
     db.session.add(log)
     db.session.commit()
 
-    return send_from_directory(
-        current_app.config['UPLOAD_FOLDER'],
-        document.filename,
-        as_attachment=True
-    )
+    from services.file_delivery import deliver_file
+
+    local_path = document.file_path
+    if not local_path or not os.path.exists(local_path):
+        flash("❌ File non trovato sul server", "danger")
+        return redirect(url_for('admin.file_structure'))
+
+    return deliver_file(local_path, download_name=document.original_filename or document.filename)
 
 @admin_bp.route('/statistiche')
 @login_required
@@ -2427,33 +2434,35 @@ def export_log_download():
     if department_id:
         query = query.filter(Document.department_id == department_id)
 
-    query = query.order_by(DownloadLog.timestamp.desc())
-    logs = query.all()
+    # Query e CSV sul database di reporting; il log dell'esportazione resta sul principale
+    with reporting_session():
+        query = query.order_by(DownloadLog.timestamp.desc())
+        logs = query.all()
 
-    # Genera CSV
-    csv_data = StringIO()
-    writer = csv.writer(csv_data, delimiter=';', quoting=csv.QUOTE_MINIMAL)
-    writer.writerow([
-        'Data Download', 'Nome Utente', 'Email', 'Titolo Documento', 'Versione', 'Azienda', 'Reparto', 'IP', 'Nome File'
-    ])
-    for log in logs:
-        user = log.user
-        doc = log.document
-        company = doc.company
-        dept = doc.department
-        # Trova versione più recente <= download
-        versione = DocumentVersion.query.filter_by(document_id=doc.id).filter(DocumentVersion.data_caricamento <= log.timestamp).order_by(DocumentVersion.data_caricamento.desc()).first()
+        # Genera CSV
+        csv_data = StringIO()
+        writer = csv.writer(csv_data, delimiter=';', quoting=csv.QUOTE_MINIMAL)
         writer.writerow([
-            log.timestamp.strftime('%d/%m/%Y %H:%M'),
-            f"{user.first_name or ''} {user.last_name or ''}",
-            user.email,
-            doc.title or doc.original_filename,
-            versione.numero_versione if versione else '',
-            company.name if company else '',
-            dept.name if dept else '',
-            getattr(log, 'ip', ''),
-            doc.filename
+            'Data Download', 'Nome Utente', 'Email', 'Titolo Documento', 'Versione', 'Azienda', 'Reparto', 'IP', 'Nome File'
         ])
+        for log in logs:
+            user = log.user
+            doc = log.document
+            company = doc.company
+            dept = doc.department
+            # Trova versione più recente <= download
+            versione = DocumentVersion.query.filter_by(document_id=doc.id).filter(DocumentVersion.data_caricamento <= log.timestamp).order_by(DocumentVersion.data_caricamento.desc()).first()
+            writer.writerow([
+                log.timestamp.strftime('%d/%m/%Y %H:%M'),
+                f"{user.first_name or ''} {user.last_name or ''}",
+                user.email,
+                doc.title or doc.original_filename,
+                versione.numero_versione if versione else '',
+                company.name if company else '',
+                dept.name if dept else '',
+                getattr(log, 'ip', ''),
+                doc.filename
+            ])
 
     # Logging esportazione
     admin_log = AdminLog(
@@ -10323,8 +10332,8 @@ def export_downloads_csv():
     validated_filters = download_export_service.validate_filters(filters)
     
     # Query per conteggio
-    query = download_export_service.build_query(validated_filters)
-    record_count = query.count()
+    with reporting_session():
+        record_count = download_export_service.build_query(validated_filters).count()
     
     # Log dell'export
     download_export_service.log_export(
@@ -10338,6 +10347,7 @@ def export_downloads_csv():
     filename = f"download_logs_{timestamp}.csv"
     
     # Genera stream CSV con BOM UTF-8
+    @reporting_query
     def generate_csv():
         # BOM UTF-8
         yield b'\xef\xbb\xbf'
@@ -10364,10 +10374,12 @@ def export_all_downloads_csv():
     Export CSV di tutti i log download (ignora filtri).
     """
     # Log dell'export
+    with reporting_session():
+        record_count = DownloadLog.query.count()
     download_export_service.log_export(
         admin_id=current_user.id,
         filters={'all': True},
-        record_count=DownloadLog.query.count()
+        record_count=record_count
     )
     
     # Genera nome file
@@ -10375,6 +10387,7 @@ def export_all_downloads_csv():
     filename = f"all_download_logs_{timestamp}.csv"
     
     # Genera stream CSV
+    @reporting_query
     def generate_csv():
         # BOM UTF-8
         yield b'\xef\xbb\xbf'
@@ -10777,3 +10790,64 @@ def download_alert_ai_explain(alert_id: int):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+
+
+@admin_bp.get("/storage/manifest")
+@login_required
+@admin_required
+def storage_manifest_report():
+    """
+    Stato dello storage dal manifest dello scanner: totali, file mancanti e orfani.
+    
+    Query params:
+        tipo: 'mancanti', 'orfani' o 'tutti' (default tutti)
+        limit: Numero massimo di file per elenco (default 500)
+        
+    Returns:
+        JSON con statistiche ed elenchi
+    """
+    try:
+        from services.storage_scanner import manifest_stats, missing_files, orphaned_files
+        
+        tipo = request.args.get('tipo', 'tutti')
+        limit = request.args.get('limit', 500, type=int)
+        risultato = {'statistiche': manifest_stats()}
+        if tipo in ('mancanti', 'tutti'):
+            risultato['mancanti'] = missing_files(limit=limit)
+        if tipo in ('orfani', 'tutti'):
+            risultato['orfani'] = orphaned_files(limit=limit)
+        
+        return jsonify(risultato), 200
+        
+    except Exception as e:
+        current_app.logger.error(f"Errore report manifest storage: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@admin_bp.get("/query-metrics")
+@login_required
+@admin_required
+def query_metrics_report():
+    """
+    Metriche delle query SQL per endpoint e pattern N+1 segnalati.
+    
+    Query params:
+        format: 'json' per la risposta JSON (default pagina HTML)
+        limit: Righe recenti del log JSONL da analizzare (default 500)
+        
+    Returns:
+        Pagina HTML o JSON con statistiche del processo e del log condiviso
+    """
+    from services.query_metrics import leggi_log, riepilogo_log, stats
+    
+    voci = leggi_log(current_app.config.get('QUERY_METRICS_LOG_PATH'),
+                     limite=request.args.get('limit', 500, type=int))
+    dati = {
+        'processo': stats.snapshot(),
+        'segnalazioni': riepilogo_log(voci),
+        'recenti': list(reversed(voci[-50:])),
+        'soglia_n_plus_one': current_app.config.get('QUERY_METRICS_N_PLUS_ONE_THRESHOLD'),
+    }
+    if request.args.get('format') == 'json':
+        return jsonify(dati), 200
+    return render_template('admin/query_metrics.html', **dati)
@@ -478,18 +478,17 @@ def genera_pdf_documento(documento_id):
 
 def invia_email_documento_firmato(firma, documento):
     """
-    Invia email con il documento firmato in allegato.
+    Accoda l'email con il documento firmato in allegato.
     
     Args:
         firma (FirmaDocumento): La firma approvata
         documento (Document): Il documento firmato
         
     Returns:
-        bool: True se l'invio è riuscito, False altrimenti
+        bool: True se l'email è stata accodata, False altrimenti
     """
     try:
-        from flask_mail import Message
-        from extensions import mail
+        from services.mail_queue import enqueue_email
         from models import LogInvioDocumento
         
         # Genera PDF
@@ -536,23 +535,19 @@ def invia_email_documento_firmato(firma, documento):
         </div>
         """
         
-        # Crea messaggio
-        msg = Message(
+        # Accoda email con PDF allegato (invio asincrono dal worker della coda)
+        enqueue_email(
             subject=subject,
             recipients=destinatari,
-            html=html_body
+            html=html_body,
+            attachments=[(
+                f"documento_firmato_{documento.id}.pdf",
+                "application/pdf",
+                pdf_content.getvalue()
+            )],
+            idempotency_key=f"documento_firmato:{firma.id}"
         )
         
-        # Allega PDF
-        msg.attach(
-            filename=f"documento_firmato_{documento.id}.pdf",
-            content_type="application/pdf",
-            data=pdf_content.getvalue()
-        )
-        
-        # Invia email
-        mail.send(msg)
-        
         # === LOGGING AUTOMATICO SUCCESSO ===
         try:
             # Log per ogni destinatario
@@ -569,13 +564,13 @@ def invia_email_documento_firmato(firma, documento):
             db.session.commit()
             
             # Log file aggiuntivo
-            current_app.logger.info(f"[EMAIL INVIATA] → {', '.join(destinatari)} per documento {documento.title}")
+            current_app.logger.info(f"[EMAIL ACCODATA] → {', '.join(destinatari)} per documento {documento.title}")
             
         except Exception as log_error:
             current_app.logger.error(f"Errore nel logging invio email: {log_error}")
             db.session.rollback()
         
-        current_app.logger.info(f"Email inviata con successo per documento {documento.id} a {destinatari}")
+        current_app.logger.info(f"Email accodata per documento {documento.id} a {destinatari}")
         return True
         
     except Exception as e:
@@ -5,6 +5,11 @@ from datetime import datetime
 from extensions import db
 from models import AccessRequest, Document, DocumentReadLog, AuditLog, DocumentVersion, ApprovazioneDocumento, FirmaDocumento, AIAnalysisLog, Task
 from services.semantic_search import cerca_documenti, indicizza_documento
+from services.blob_store import get_blob_store, resolve_path, store_upload
+from utils.read_tracker import segna_prima_lettura
+from services.file_delivery import deliver_file
+from services.reporting_db import reporting_query
+from services.resumable_upload import resumable_file
 from utils.version_utils import (
     salva_versione_anteriore, 
     attiva_nuova_versione, 
@@ -196,6 +201,9 @@ def firma_documento(doc_id):
         db.session.add(firma)
         db.session.commit()
         
+        # Bitmap delle prime letture in una transazione separata: un errore non annulla la firma
+        segna_prima_lettura(current_user.id, doc_id)
+        
         # Log dell'audit
         audit_log = AuditLog(
             user_id=current_user.id,
@@ -291,16 +299,10 @@ def download_versione(version_id):
                 flash("🚫 Accesso non autorizzato al documento", "danger")
                 return redirect(url_for('index'))
     
-    # Percorso del file
-    import os
-    local_path = os.path.join(
-        app.config['UPLOAD_FOLDER'], 
-        doc.company.name, 
-        doc.department.name, 
-        versione.filename
-    )
+    # Percorso del file (blob store o percorso legacy)
+    local_path = resolve_path(versione)
     
-    if not os.path.exists(local_path):
+    if not local_path or not os.path.exists(local_path):
         flash("❌ File versione non trovato sul server", "danger")
         return redirect(url_for('index'))
     
@@ -309,13 +311,13 @@ def download_versione(version_id):
         user_id=current_user.id,
         document_id=doc.id,
         azione='download_versione',
-        note=f'Download versione {versione.numero_versione} del documento "{doc.title or doc.original_filename}"'
+        note=f'Download versione {versione.version_number} del documento "{doc.title or doc.original_filename}"'
     )
     db.session.add(audit_log)
     db.session.commit()
     
-    from flask import send_file
-    return send_file(local_path, as_attachment=True, download_name=versione.filename)
+    base, ext = os.path.splitext(doc.original_filename or doc.filename)
+    return deliver_file(local_path, download_name=f"{base}_v{versione.version_number}{ext}")
 
 @docs_bp.route("/admin/document/<int:doc_id>/versione/<int:version_id>/pdf")
 @login_required
@@ -764,7 +766,7 @@ def upload_new_version(document_id):
         flash("⛔ Non hai i permessi per caricare versioni di questo documento.", "error")
         return redirect(url_for('docs.view_document', document_id=document_id))
     
-    file = request.files.get('file')
+    file = request.files.get('file') or resumable_file(request.form.get('upload_id'))
     note = request.form.get('note', '')
     
     if not file or file.filename == '':
@@ -781,17 +783,9 @@ def upload_new_version(document_id):
         # Calcola numero versione
         version_number = len(document.versions) + 1
         
-        # Salva file
-        filename = secure_filename(file.filename)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        new_filename = f"{document_id}_v{version_number}_{timestamp}_{filename}"
-        
-        upload_folder = current_app.config.get('UPLOAD_FOLDER', 'uploads')
-        filepath = os.path.join(upload_folder, new_filename)
-        
-        # Crea directory se non esiste
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        file.save(filepath)
+        # Salva file nel blob store (versioni con contenuto identico condividono il blob)
+        stored = store_upload(file, scan=False)
+        filepath = get_blob_store().path_for(stored.sha256)
         
         # BONUS AI: Confronto con versione precedente
         ai_summary = None
@@ -808,6 +802,7 @@ def upload_new_version(document_id):
             document_id=document_id,
             version_number=version_number,
             file_path=filepath,
+            blob_sha256=stored.sha256,
             uploaded_by=current_user.username,
             note=note,
             active=True,
@@ -1749,7 +1744,7 @@ def upload_version(doc_id):
         return redirect(url_for('docs.view_document', document_id=doc_id))
     
     doc = Document.query.get_or_404(doc_id)
-    file = request.files.get("file")
+    file = request.files.get("file") or resumable_file(request.form.get("upload_id"))
     notes = request.form.get("notes", "")
     
     if not file or file.filename == "":
@@ -1757,23 +1752,16 @@ def upload_version(doc_id):
         return redirect(url_for('docs.list_versions', doc_id=doc_id))
     
     try:
-        # Salva file in cartella versioni
-        filename = secure_filename(file.filename)
-        version_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'versions', str(doc_id))
-        os.makedirs(version_dir, exist_ok=True)
-        
-        # Genera nome file univoco
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        version_filename = f"v{len(doc.versions) + 1}_{timestamp}_{filename}"
-        file_path = os.path.join(version_dir, version_filename)
-        
-        file.save(file_path)
+        # Salva file nel blob store (versioni con contenuto identico condividono il blob)
+        stored = store_upload(file, scan=False)
+        file_path = get_blob_store().path_for(stored.sha256)
         
         # Crea nuova versione
         new_version = DocumentVersion(
             document_id=doc.id,
             version_number=len(doc.versions) + 1,
             file_path=file_path,
+            blob_sha256=stored.sha256,
             notes=notes,
             uploaded_by=current_user.username,
             is_active=True
@@ -1915,15 +1903,12 @@ def download_version(doc_id, version_id):
     if version.document_id != doc_id:
         abort(404)
     
-    if not os.path.exists(version.file_path):
+    local_path = resolve_path(version)
+    if not local_path or not os.path.exists(local_path):
         flash("❌ File non trovato.", "error")
         return redirect(url_for('docs.list_versions', doc_id=doc_id))
     
-    return send_file(
-        version.file_path,
-        as_attachment=True,
-        download_name=f"{doc.title}_v{version.version_number}.pdf"
-    ) 
+    return deliver_file(local_path, download_name=f"{doc.title}_v{version.version_number}.pdf")
 
 @docs_bp.route("/api/docs/obeya-map", methods=["GET"])
 @login_required
@@ -2056,6 +2041,7 @@ def registro_audit():
 @docs_bp.route("/docs/audit-log/export")
 @login_required
 @admin_required
+@reporting_query
 def export_audit_log():
     """
     Esporta il registro audit in CSV o PDF.
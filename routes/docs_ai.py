@@ -4,6 +4,7 @@ Integrazione con OpenAI/GPT per analisi intelligente dell'utilizzo documentale.
 """
 
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import func, and_, desc
 from typing import List, Dict, Any
@@ -19,28 +20,25 @@ from models import (
 from extensions import db
 from services.document_analytics_service import DocumentAnalyticsService
 from services.ai_document_analysis_service import AIDocumentAnalysisService
-from decorators import admin_required
+from services.asgi_runtime import require_roles, run_db
+from services.reporting_db import reporting_query
 
 logger = logging.getLogger(__name__)
 
-# Router FastAPI
+# Router FastAPI (servito da asgi.py): query nel threadpool DB, chiamate AI async
 router = APIRouter(prefix="/docs/ai", tags=["AI Documenti"])
 
-
-def get_db():
-    """
-    Dependency per ottenere la sessione del database.
-    """
-    return db.session
+solo_admin = require_roles('admin')
+admin_o_ceo = require_roles('admin', 'ceo')
 
 
 @router.get("/analizza_utilizzo")
-def analizza_utilizzo_documenti(db: Session = Depends(get_db)):
+async def analizza_utilizzo_documenti(utente: dict = Depends(admin_o_ceo)):
     """
     Analizza l'utilizzo dei documenti per reparto tramite AI.
     
     Args:
-        db: Sessione del database
+        utente: Utente autenticato (admin o CEO)
         
     Returns:
         dict: Report AI dell'analisi documenti
@@ -49,98 +47,13 @@ def analizza_utilizzo_documenti(db: Session = Depends(get_db)):
         logger.info("🤖 Avvio analisi AI utilizzo documenti...")
         
         # 1. Raccogli i dati aggregati per reparto e documento
-        risultati = []
-        
-        # Query per ottenere tutti i reparti
-        reparti = db.query(Department).all()
-        
-        for reparto in reparti:
-            # Query per documenti del reparto
-            documenti = (
-                db.query(Document)
-                .filter(Document.department_id == reparto.id)
-                .all()
-            )
-            
-            for doc in documenti:
-                # Conta firme per questo documento
-                firme = (
-                    db.query(func.count(FirmaDocumento.id))
-                    .filter(FirmaDocumento.document_id == doc.id)
-                    .scalar()
-                )
-                
-                # Conta download per questo documento
-                download = (
-                    db.query(func.count(DownloadLog.id))
-                    .filter(DownloadLog.document_id == doc.id)
-                    .scalar()
-                )
-                
-                # Conta letture per questo documento
-                letture = (
-                    db.query(func.count(LetturaPDF.id))
-                    .filter(LetturaPDF.document_id == doc.id)
-                    .scalar()
-                )
-                
-                # Ottieni ultima firma per versione
-                ultima_firma = (
-                    db.query(FirmaDocumento)
-                    .filter(FirmaDocumento.document_id == doc.id)
-                    .order_by(FirmaDocumento.timestamp.desc())
-                    .first()
-                )
-                
-                # Ottieni ultima lettura
-                ultima_lettura = (
-                    db.query(LetturaPDF)
-                    .filter(LetturaPDF.document_id == doc.id)
-                    .order_by(LetturaPDF.timestamp.desc())
-                    .first()
-                )
-                
-                # Calcola anomalie
-                anomalie = []
-                if download > 0 and letture == 0:
-                    anomalie.append("Scaricato ma non letto")
-                if letture > 0 and firme == 0:
-                    anomalie.append("Letto ma non firmato")
-                if download > 0 and letture == 0 and firme == 0:
-                    anomalie.append("Documento ignorato")
-                
-                # Determina stato compliance
-                if firme > 0:
-                    stato_compliance = "Compliant"
-                elif letture > 0:
-                    stato_compliance = "In Attesa Firma"
-                elif download > 0:
-                    stato_compliance = "Scaricato"
-                else:
-                    stato_compliance = "Non Utilizzato"
-                
-                risultati.append({
-                    "reparto": reparto.name,
-                    "documento": doc.title,
-                    "uploader": doc.uploader_email,
-                    "data_creazione": doc.created_at.strftime('%d/%m/%Y') if doc.created_at else "N/A",
-                    "versione_attuale": "1.0",  # Placeholder - da implementare se necessario
-                    "versione_usata": "1.0",    # Placeholder - da implementare se necessario
-                    "firme": firme,
-                    "download": download,
-                    "letture": letture,
-                    "ultima_firma": ultima_firma.timestamp.strftime('%d/%m/%Y %H:%M') if ultima_firma else None,
-                    "ultima_lettura": ultima_lettura.timestamp.strftime('%d/%m/%Y %H:%M') if ultima_lettura else None,
-                    "stato_compliance": stato_compliance,
-                    "anomalie": anomalie,
-                    "anomalie_count": len(anomalie)
-                })
+        risultati = await run_db(_raccogli_utilizzo_documenti)
         
         # 2. Costruisci il prompt per l'AI
         prompt = _costruisci_prompt_ai(risultati)
         
-        # 3. Chiamata al modello AI
-        risposta_ai = _call_ai_model(prompt)
+        # 3. Chiamata al modello AI (async: il worker serve altre richieste nell'attesa)
+        risposta_ai = await _call_ai_model(prompt)
         
         # 4. Prepara la risposta
         response_data = {
@@ -164,6 +77,81 @@ def analizza_utilizzo_documenti(db: Session = Depends(get_db)):
         )
 
 
+def _conteggi_per_documento(db: Session, model) -> Dict[int, tuple]:
+    """Numero di righe e timestamp più recente per documento, in una sola query."""
+    rows = db.query(model.document_id, func.count(model.id), func.max(model.timestamp)).group_by(model.document_id)
+    return {document_id: (count, ultimo) for document_id, count, ultimo in rows}
+
+
+@reporting_query
+def _raccogli_utilizzo_documenti(db: Session) -> List[Dict[str, Any]]:
+    """
+    Dati di utilizzo per reparto e documento (firme, download, letture).
+    
+    Tre query raggruppate invece di cinque query per documento.
+    
+    Args:
+        db: Sessione del database
+        
+    Returns:
+        list: Una voce per documento
+    """
+    firme_per_doc = _conteggi_per_documento(db, FirmaDocumento)
+    download_per_doc = _conteggi_per_documento(db, DownloadLog)
+    letture_per_doc = _conteggi_per_documento(db, LetturaPDF)
+    
+    documenti = (
+        db.query(Document, Department.name)
+        .join(Department, Document.department_id == Department.id)
+        .order_by(Department.id, Document.id)
+        .all()
+    )
+    
+    risultati = []
+    for doc, reparto_nome in documenti:
+        firme, ultima_firma = firme_per_doc.get(doc.id, (0, None))
+        download, _ = download_per_doc.get(doc.id, (0, None))
+        letture, ultima_lettura = letture_per_doc.get(doc.id, (0, None))
+        
+        # Calcola anomalie
+        anomalie = []
+        if download > 0 and letture == 0:
+            anomalie.append("Scaricato ma non letto")
+        if letture > 0 and firme == 0:
+            anomalie.append("Letto ma non firmato")
+        if download > 0 and letture == 0 and firme == 0:
+            anomalie.append("Documento ignorato")
+        
+        # Determina stato compliance
+        if firme > 0:
+            stato_compliance = "Compliant"
+        elif letture > 0:
+            stato_compliance = "In Attesa Firma"
+        elif download > 0:
+            stato_compliance = "Scaricato"
+        else:
+            stato_compliance = "Non Utilizzato"
+        
+        risultati.append({
+            "reparto": reparto_nome,
+            "documento": doc.title,
+            "uploader": doc.uploader_email,
+            "data_creazione": doc.created_at.strftime('%d/%m/%Y') if doc.created_at else "N/A",
+            "versione_attuale": "1.0",  # Placeholder - da implementare se necessario
+            "versione_usata": "1.0",    # Placeholder - da implementare se necessario
+            "firme": firme,
+            "download": download,
+            "letture": letture,
+            "ultima_firma": ultima_firma.strftime('%d/%m/%Y %H:%M') if ultima_firma else None,
+            "ultima_lettura": ultima_lettura.strftime('%d/%m/%Y %H:%M') if ultima_lettura else None,
+            "stato_compliance": stato_compliance,
+            "anomalie": anomalie,
+            "anomalie_count": len(anomalie)
+        })
+    
+    return risultati
+
+
 def _costruisci_prompt_ai(risultati: List[Dict[str, Any]]) -> str:
     """
     Costruisce il prompt per l'AI basato sui dati dei documenti.
@@ -248,9 +236,9 @@ Fornisci un report strutturato, pratico e actionable per l'admin qualità.
     return prompt
 
 
-def _call_ai_model(prompt: str) -> str:
+async def _call_ai_model(prompt: str) -> str:
     """
-    Chiama il modello AI (OpenAI/GPT) per l'analisi.
+    Chiama il modello AI (OpenAI/GPT) per l'analisi con il client async.
     
     Args:
         prompt: Prompt da inviare all'AI
@@ -260,35 +248,20 @@ def _call_ai_model(prompt: str) -> str:
     """
     try:
         # Controlla se OpenAI è configurato
-        openai_api_key = os.getenv('OPENAI_API_KEY')
-        
-        if not openai_api_key:
+        if not os.getenv('OPENAI_API_KEY'):
             logger.warning("⚠️ OpenAI API key non configurata, usando analisi automatica")
             return _analisi_automatica_fallback(prompt)
         
         # Import OpenAI solo se necessario
-        import openai
-        openai.api_key = openai_api_key
-        
-        # Chiamata a OpenAI
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {
-                    "role": "system", 
-                    "content": "Sei un esperto analista di gestione qualità e sicurezza aziendale. Fornisci analisi pratiche e actionable."
-                },
-                {
-                    "role": "user", 
-                    "content": prompt
-                }
-            ],
+        from services.ai.gpt_provider import chat_async
+        
+        return await chat_async(
+            "Sei un esperto analista di gestione qualità e sicurezza aziendale. Fornisci analisi pratiche e actionable.",
+            prompt,
             temperature=0.3,
             max_tokens=1500,
         )
         
-        return response.choices[0].message["content"]
-        
     except ImportError:
         logger.warning("⚠️ OpenAI non installato, usando analisi automatica")
         return _analisi_automatica_fallback(prompt)
@@ -426,19 +399,19 @@ def _calcola_statistiche_rapide(risultati: List[Dict[str, Any]]) -> Dict[str, An
 
 
 @router.get("/statistiche")
-def get_statistiche_ai(db: Session = Depends(get_db)):
+async def get_statistiche_ai(utente: dict = Depends(admin_o_ceo)):
     """
     Ottiene statistiche rapide dell'analisi AI.
     
     Args:
-        db: Sessione del database
+        utente: Utente autenticato (admin o CEO)
         
     Returns:
         dict: Statistiche AI
     """
     try:
         # Usa il servizio AI esistente
-        risultato_ai = AIDocumentAnalysisService.analizza_documenti_con_ai()
+        risultato_ai = await run_db(lambda db: AIDocumentAnalysisService.analizza_documenti_con_ai())
         
         if not risultato_ai['success']:
             raise HTTPException(
@@ -472,19 +445,19 @@ def get_statistiche_ai(db: Session = Depends(get_db)):
 
 
 @router.get("/report")
-def get_report_ai(db: Session = Depends(get_db)):
+async def get_report_ai(utente: dict = Depends(admin_o_ceo)):
     """
     Genera e restituisce il report AI completo.
     
     Args:
-        db: Sessione del database
+        utente: Utente autenticato (admin o CEO)
         
     Returns:
         dict: Report AI completo
     """
     try:
         # Genera il report AI
-        report_ai = AIDocumentAnalysisService.genera_report_ai()
+        report_ai = await run_db(lambda db: AIDocumentAnalysisService.genera_report_ai())
         
         return {
             "success": True,
@@ -501,97 +474,19 @@ def get_report_ai(db: Session = Depends(get_db)):
 
 
 @router.get("/download_report")
-def download_ai_report(format: str = "txt", db: Session = Depends(get_db)):
+async def download_ai_report(format: str = "txt", utente: dict = Depends(admin_o_ceo)):
     """
     Scarica il report AI in formato .txt o .pdf.
     
     Args:
         format: Formato del file (txt o pdf)
-        db: Sessione del database
+        utente: Utente autenticato (admin o CEO)
         
     Returns:
         FileResponse: File del report
     """
     try:
-        import uuid
-        import os
-        from fastapi.responses import FileResponse
-        
-        # Genera il report AI
-        report_ai = AIDocumentAnalysisService.genera_report_ai()
-        
-        # Crea nome file univoco
-        ext = "pdf" if format == "pdf" else "txt"
-        filename = f"report_ai_documenti_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{ext}"
-        filepath = f"/tmp/{filename}"
-        
-        if format == "pdf":
-            # Genera PDF con reportlab
-            try:
-                from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-                from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-                from reportlab.lib.pagesizes import letter
-                from reportlab.lib.units import inch
-                
-                doc = SimpleDocTemplate(filepath, pagesize=letter)
-                styles = getSampleStyleSheet()
-                
-                # Stile personalizzato per il report
-                report_style = ParagraphStyle(
-                    'ReportStyle',
-                    parent=styles['Normal'],
-                    fontSize=10,
-                    spaceAfter=6,
-                    spaceBefore=6
-                )
-                
-                # Stile per i titoli
-                title_style = ParagraphStyle(
-                    'TitleStyle',
-                    parent=styles['Heading1'],
-                    fontSize=14,
-                    spaceAfter=12,
-                    spaceBefore=12,
-                    textColor='#0d6efd'
-                )
-                
-                elements = []
-                
-                # Titolo del report
-                elements.append(Paragraph("🤖 REPORT ANALISI AI DOCUMENTI", title_style))
-                elements.append(Spacer(1, 12))
-                elements.append(Paragraph(f"Generato il: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}", report_style))
-                elements.append(Spacer(1, 12))
-                
-                # Dividi il report in sezioni
-                sections = report_ai.split('\n\n')
-                for section in sections:
-                    if section.strip():
-                        # Controlla se è un titolo (inizia con #)
-                        if section.startswith('#'):
-                            # È un titolo
-                            title = section.replace('#', '').strip()
-                            elements.append(Paragraph(title, title_style))
-                        else:
-                            # È contenuto normale
-                            elements.append(Paragraph(section, report_style))
-                        elements.append(Spacer(1, 6))
-                
-                doc.build(elements)
-                
-            except ImportError:
-                logger.warning("⚠️ ReportLab non installato, generando file di testo")
-                with open(filepath, "w", encoding="utf-8") as f:
-                    f.write(report_ai)
-                # Cambia l'estensione a .txt
-                new_filepath = filepath.replace('.pdf', '.txt')
-                os.rename(filepath, new_filepath)
-                filepath = new_filepath
-                filename = filename.replace('.pdf', '.txt')
-        else:
-            # Genera file di testo
-            with open(filepath, "w", encoding="utf-8") as f:
-                f.write(report_ai)
+        filepath, filename = await run_db(_scrivi_report_ai, format)
         
         # Restituisci il file
         return FileResponse(
@@ -608,30 +503,110 @@ def download_ai_report(format: str = "txt", db: Session = Depends(get_db)):
         )
 
 
+@reporting_query
+def _scrivi_report_ai(db: Session, format: str) -> tuple:
+    """
+    Genera il report AI e lo scrive in /tmp (.txt o .pdf con reportlab).
+    
+    Args:
+        db: Sessione del database
+        format: Formato del file (txt o pdf)
+        
+    Returns:
+        tuple: (percorso, nome file)
+    """
+    # Genera il report AI
+    report_ai = AIDocumentAnalysisService.genera_report_ai()
+    
+    # Crea nome file univoco
+    ext = "pdf" if format == "pdf" else "txt"
+    filename = f"report_ai_documenti_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{ext}"
+    filepath = f"/tmp/{filename}"
+    
+    if format == "pdf":
+        # Genera PDF con reportlab
+        try:
+            from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+            from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+            from reportlab.lib.pagesizes import letter
+            from reportlab.lib.units import inch
+            
+            doc = SimpleDocTemplate(filepath, pagesize=letter)
+            styles = getSampleStyleSheet()
+            
+            # Stile personalizzato per il report
+            report_style = ParagraphStyle(
+                'ReportStyle',
+                parent=styles['Normal'],
+                fontSize=10,
+                spaceAfter=6,
+                spaceBefore=6
+            )
+            
+            # Stile per i titoli
+            title_style = ParagraphStyle(
+                'TitleStyle',
+                parent=styles['Heading1'],
+                fontSize=14,
+                spaceAfter=12,
+                spaceBefore=12,
+                textColor='#0d6efd'
+            )
+            
+            elements = []
+            
+            # Titolo del report
+            elements.append(Paragraph("🤖 REPORT ANALISI AI DOCUMENTI", title_style))
+            elements.append(Spacer(1, 12))
+            elements.append(Paragraph(f"Generato il: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}", report_style))
+            elements.append(Spacer(1, 12))
+            
+            # Dividi il report in sezioni
+            sections = report_ai.split('\n\n')
+            for section in sections:
+                if section.strip():
+                    # Controlla se è un titolo (inizia con #)
+                    if section.startswith('#'):
+                        # È un titolo
+                        title = section.replace('#', '').strip()
+                        elements.append(Paragraph(title, title_style))
+                    else:
+                        # È contenuto normale
+                        elements.append(Paragraph(section, report_style))
+                    elements.append(Spacer(1, 6))
+            
+            doc.build(elements)
+            
+        except ImportError:
+            logger.warning("⚠️ ReportLab non installato, generando file di testo")
+            with open(filepath, "w", encoding="utf-8") as f:
+                f.write(report_ai)
+            # Cambia l'estensione a .txt
+            new_filepath = filepath.replace('.pdf', '.txt')
+            os.rename(filepath, new_filepath)
+            filepath = new_filepath
+            filename = filename.replace('.pdf', '.txt')
+    else:
+        # Genera file di testo
+        with open(filepath, "w", encoding="utf-8") as f:
+            f.write(report_ai)
+    
+    return filepath, filename
+
+
 @router.get("/reparto_stats")
-def reparto_stats(current_user: User = Depends(admin_required)):
+async def reparto_stats(utente: dict = Depends(solo_admin)):
     """
     Statistiche per reparto: firme e download.
     
     Args:
-        current_user (User): Utente autenticato (admin)
+        utente: Utente autenticato (admin)
         
     Returns:
         Dict: Statistiche per reparto nel formato atteso dal frontend
     """
     try:
-        stats = (
-            db.session.query(
-                Department.name,
-                func.count(DocumentSignature.id).label("firme"),
-                func.count(DownloadLog.id).label("download")
-            )
-            .join(User, User.department_id == Department.id)
-            .outerjoin(DocumentSignature, DocumentSignature.signed_by == User.username)
-            .outerjoin(DownloadLog, DownloadLog.user_id == User.id)
-            .group_by(Department.id)
-            .all()
-        )
+        stats = await run_db(_query_reparto_stats)
         
         # Formatta i risultati nel formato atteso dal frontend
         reparto_stats = []
@@ -653,88 +628,121 @@ def reparto_stats(current_user: User = Depends(admin_required)):
         logger.error(f"Errore statistiche reparto: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Errore statistiche reparto: {str(e)}")
 
+
+@reporting_query
+def _query_reparto_stats(db: Session) -> list:
+    """Firme e download per reparto, come tuple (nome, firme, download)."""
+    rows = (
+        db.query(
+            Department.name,
+            func.count(DocumentSignature.id).label("firme"),
+            func.count(DownloadLog.id).label("download")
+        )
+        .join(User, User.department_id == Department.id)
+        .outerjoin(DocumentSignature, DocumentSignature.signed_by == User.username)
+        .outerjoin(DownloadLog, DownloadLog.user_id == User.id)
+        .group_by(Department.id)
+        .all()
+    )
+    return [tuple(r) for r in rows]
+
 @router.get("/analisi_ai")
-def analisi_ai(current_user: User = Depends(admin_required)):
+async def analisi_ai(utente: dict = Depends(solo_admin)):
     """
     Analisi AI avanzata per documenti e utenti.
     
     Args:
-        current_user (User): Utente autenticato (admin)
+        utente: Utente autenticato (admin)
         
     Returns:
         Dict: Analisi AI con vari indicatori
     """
     try:
-        da_30_giorni = datetime.utcnow() - timedelta(days=30)
-
-        # 1. Reparti inattivi (nessun download negli ultimi 30 giorni)
-        reparti_inattivi = (
-            db.session.query(Department.name)
-            .outerjoin(User, User.department_id == Department.id)
-            .outerjoin(DownloadLog, DownloadLog.user_id == User.id)
-            .filter(
-                (DownloadLog.timestamp == None) | 
-                (DownloadLog.timestamp < da_30_giorni)
-            )
-            .group_by(Department.id)
-            .all()
-        )
+        return await run_db(_query_analisi_ai)
+        
+    except Exception as e:
+        logger.error(f"Errore analisi AI: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Errore analisi AI: {str(e)}")
 
-        # 2. Documenti obbligatori mai scaricati
-        documenti_obbligatori = (
-            db.session.query(Document.title)
-            .filter(Document.richiedi_firma == True)
-            .outerjoin(DownloadLog, DownloadLog.document_id == Document.id)
-            .group_by(Document.id)
-            .having(func.count(DownloadLog.id) == 0)
-            .all()
-        )
 
-        # 3. Utenti che scaricano ma non firmano
-        utenti_senza_firma = (
-            db.session.query(User.email)
-            .join(DownloadLog, DownloadLog.user_id == User.id)
-            .outerjoin(DocumentSignature, DocumentSignature.signed_by == User.username)
-            .group_by(User.id)
-            .having(func.count(DocumentSignature.id) == 0)
-            .all()
+@reporting_query
+def _query_analisi_ai(db: Session) -> Dict[str, Any]:
+    """
+    Indicatori dell'analisi AI (reparti inattivi, documenti obbligatori mai
+    scaricati, utenti senza firma, download fuori orario, tipologie poco usate).
+    
+    Args:
+        db: Sessione del database
+        
+    Returns:
+        dict: Indicatori serializzabili
+    """
+    da_30_giorni = datetime.utcnow() - timedelta(days=30)
+
+    # 1. Reparti inattivi (nessun download negli ultimi 30 giorni)
+    reparti_inattivi = (
+        db.query(Department.name)
+        .outerjoin(User, User.department_id == Department.id)
+        .outerjoin(DownloadLog, DownloadLog.user_id == User.id)
+        .filter(
+            (DownloadLog.timestamp == None) | 
+            (DownloadLog.timestamp < da_30_giorni)
         )
-
-        # 4. Download fuori orario lavorativo (7-17)
-        orari_sospetti = (
-            db.session.query(DownloadLog)
-            .filter(
-                func.extract('hour', DownloadLog.timestamp).notin_([7,8,9,10,11,12,13,14,15,16,17])
-            )
-            .all()
+        .group_by(Department.id)
+        .all()
+    )
+
+    # 2. Documenti obbligatori mai scaricati
+    documenti_obbligatori = (
+        db.query(Document.title)
+        .filter(Document.richiedi_firma == True)
+        .outerjoin(DownloadLog, DownloadLog.document_id == Document.id)
+        .group_by(Document.id)
+        .having(func.count(DownloadLog.id) == 0)
+        .all()
+    )
+
+    # 3. Utenti che scaricano ma non firmano
+    utenti_senza_firma = (
+        db.query(User.email)
+        .join(DownloadLog, DownloadLog.user_id == User.id)
+        .outerjoin(DocumentSignature, DocumentSignature.signed_by == User.username)
+        .group_by(User.id)
+        .having(func.count(DocumentSignature.id) == 0)
+        .all()
+    )
+
+    # 4. Download fuori orario lavorativo (7-17)
+    orari_sospetti = (
+        db.query(DownloadLog)
+        .filter(
+            func.extract('hour', DownloadLog.timestamp).notin_([7,8,9,10,11,12,13,14,15,16,17])
         )
-
-        # 5. Tipologie di documento poco usate
-        tipi_poco_usati = (
-            db.session.query(
-                Document.tag, 
-                func.count(DownloadLog.id).label("cnt")
-            )
-            .join(DownloadLog, DownloadLog.document_id == Document.id)
-            .group_by(Document.tag)
-            .order_by("cnt")
-            .limit(3)
-            .all()
+        .all()
+    )
+
+    # 5. Tipologie di documento poco usate
+    tipi_poco_usati = (
+        db.query(
+            Document.tag, 
+            func.count(DownloadLog.id).label("cnt")
         )
-
-        return {
-            "reparti_inattivi": [r[0] for r in reparti_inattivi],
-            "documenti_obbligatori_non_scaricati": [d[0] for d in documenti_obbligatori],
-            "utenti_scaricano_senza_firma": [u[0] for u in utenti_senza_firma],
-            "download_fuori_orario": [
-                f"{d.user.email if d.user else 'N/A'} - {d.timestamp}" 
-                for d in orari_sospetti
-            ],
-            "tipi_poco_usati": [
-                {"tipo": t[0], "count": t[1]} for t in tipi_poco_usati
-            ]
-        }
-        
-    except Exception as e:
-        logger.error(f"Errore analisi AI: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Errore analisi AI: {str(e)}")
+        .join(DownloadLog, DownloadLog.document_id == Document.id)
+        .group_by(Document.tag)
+        .order_by("cnt")
+        .limit(3)
+        .all()
+    )
+
+    return {
+        "reparti_inattivi": [r[0] for r in reparti_inattivi],
+        "documenti_obbligatori_non_scaricati": [d[0] for d in documenti_obbligatori],
+        "utenti_scaricano_senza_firma": [u[0] for u in utenti_senza_firma],
+        "download_fuori_orario": [
+            f"{d.user.email if d.user else 'N/A'} - {d.timestamp}" 
+            for d in orari_sospetti
+        ],
+        "tipi_poco_usati": [
+            {"tipo": t[0], "count": t[1]} for t in tipi_poco_usati
+        ]
+    }
@@ -4,20 +4,28 @@
 from fastapi import APIRouter, HTTPException, Depends, Query
 from fastapi.responses import JSONResponse
 from datetime import datetime, date, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from sqlalchemy.orm import Session
 from sqlalchemy import func, and_, case
-from extensions import db
 from models import Document, User, Company, Department
+from services.asgi_runtime import require_roles, run_db
+from services.reporting_db import reporting_query
+from services.report_rollup import (
+    M_DOC_APPROVATI_AGGIORNAMENTO, M_DOC_SCADENZA_NON_APPROVATI,
+    inizio_mese, serie_mensile, sposta_mesi, totali_cumulati
+)
 
 router = APIRouter()
 
+# Dashboard documentale: solo CEO e admin (sessione di login dell'app Flask)
+admin_o_ceo = require_roles('admin', 'ceo')
+
 @router.get("/api/jack/docs/dashboard/{user_id}")
 async def get_dashboard_data(
     user_id: int,
     period: str = Query("current_month", description="Periodo di analisi"),
     company: Optional[str] = Query(None, description="Filtro azienda"),
-    db: Session = Depends(db)
+    utente: dict = Depends(admin_o_ceo)
 ):
     """
     Restituisce dati aggregati per la dashboard AI documentale di Jack
@@ -26,7 +34,7 @@ async def get_dashboard_data(
         user_id: ID utente
         period: Periodo di analisi (current_month, last_month, current_quarter, last_quarter)
         company: Filtro azienda opzionale
-        db: Sessione database
+        utente: Utente autenticato (admin o CEO)
     
     Returns:
         JSONResponse: Dati dashboard aggregati
@@ -35,8 +43,8 @@ async def get_dashboard_data(
         # Calcola date per il periodo
         start_date, end_date = calculate_period_dates(period)
         
-        # Query dati aggregati
-        dashboard_data = query_dashboard_data(db, start_date, end_date, company)
+        # Query dati aggregati (threadpool DB, il loop resta libero)
+        dashboard_data = await run_db(query_dashboard_data, start_date, end_date, company)
         
         # Genera suggerimento AI
         ai_suggestion = generate_ai_suggestion(dashboard_data)
@@ -116,6 +124,7 @@ def calculate_period_dates(period: str) -> tuple[date, date]:
     
     return start_date, end_date
 
+@reporting_query
 def query_dashboard_data(db: Session, start_date: date, end_date: date, company_filter: Optional[str] = None) -> Dict[str, Any]:
     """
     Query dati aggregati per la dashboard
@@ -137,8 +146,8 @@ def query_dashboard_data(db: Session, start_date: date, end_date: date, company_
     # Documenti in scadenza (prossimi 7 giorni)
     scadenza_settimana = base_query.filter(
         and_(
-            Document.scadenza >= date.today(),
-            Document.scadenza <= date.today() + timedelta(days=7),
+            Document.expiry_date >= date.today(),
+            Document.expiry_date <= date.today() + timedelta(days=7),
             Document.stato_approvazione != 'approvato'
         )
     ).count()
@@ -201,8 +210,8 @@ def query_criticita_per_reparto(db: Session, start_date: date, end_date: date, c
         func.sum(case((Document.is_signed == True, 1), else_=0)).label('firmati'),
         func.sum(case((
             and_(
-                Document.scadenza >= date.today(),
-                Document.scadenza <= date.today() + timedelta(days=30)
+                Document.expiry_date >= date.today(),
+                Document.expiry_date <= date.today() + timedelta(days=30)
             ), 1), else_=0)).label('in_scadenza'),
         func.sum(case((
             and_(
@@ -303,7 +312,7 @@ async def get_reparto_details(
     user_id: int,
     reparto: str,
     period: str = Query("current_month"),
-    db: Session = Depends(db)
+    utente: dict = Depends(admin_o_ceo)
 ):
     """
     Restituisce dettagli criticità per reparto specifico
@@ -312,7 +321,7 @@ async def get_reparto_details(
         user_id: ID utente
         reparto: Nome reparto
         period: Periodo di analisi
-        db: Sessione database
+        utente: Utente autenticato (admin o CEO)
     
     Returns:
         JSONResponse: Dettagli reparto
@@ -320,46 +329,7 @@ async def get_reparto_details(
     try:
         start_date, end_date = calculate_period_dates(period)
         
-        # Query documenti del reparto
-        documents = db.query(Document).join(Department).filter(
-            Department.name == reparto
-        ).all()
-        
-        # Analizza documenti
-        documenti_critici = []
-        for doc in documents:
-            criticità = 0
-            problemi = []
-            
-            # Controlla scadenza
-            if doc.scadenza and doc.scadenza <= date.today() + timedelta(days=30):
-                criticità += 3
-                problemi.append("Scadenza prossima")
-            
-            # Controlla obsoleto
-            if doc.updated_at and doc.updated_at.date() < date.today() - timedelta(days=180):
-                criticità += 2
-                problemi.append("Obsoleto")
-            
-            # Controlla firma
-            if doc.stato_approvazione == 'approvato' and not doc.is_signed:
-                criticità += 2
-                problemi.append("Firma mancante")
-            
-            if criticità > 0:
-                documenti_critici.append({
-                    "id": doc.id,
-                    "titolo": doc.title,
-                    "criticità": criticità,
-                    "problemi": problemi,
-                    "stato": doc.stato_approvazione,
-                    "firmato": doc.is_signed,
-                    "scadenza": doc.scadenza.isoformat() if doc.scadenza else None,
-                    "ultimo_aggiornamento": doc.updated_at.isoformat() if doc.updated_at else None
-                })
-        
-        # Ordina per criticità
-        documenti_critici.sort(key=lambda x: x["criticità"], reverse=True)
+        documenti_critici = await run_db(query_documenti_critici_reparto, reparto)
         
         return JSONResponse(content={
             "reparto": reparto,
@@ -374,12 +344,67 @@ async def get_reparto_details(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Errore dettagli reparto: {str(e)}")
 
+@reporting_query
+def query_documenti_critici_reparto(db: Session, reparto: str) -> List[Dict[str, Any]]:
+    """
+    Documenti del reparto con criticità (scadenza, obsolescenza, firma mancante)
+    
+    Args:
+        db: Sessione database
+        reparto: Nome reparto
+    
+    Returns:
+        list: Documenti critici ordinati per criticità
+    """
+    # Query documenti del reparto
+    documents = db.query(Document).join(Department).filter(
+        Department.name == reparto
+    ).all()
+    
+    # Analizza documenti
+    documenti_critici = []
+    for doc in documents:
+        criticità = 0
+        problemi = []
+        
+        # Controlla scadenza
+        if doc.expiry_date and doc.expiry_date.date() <= date.today() + timedelta(days=30):
+            criticità += 3
+            problemi.append("Scadenza prossima")
+        
+        # Controlla obsoleto
+        if doc.updated_at and doc.updated_at.date() < date.today() - timedelta(days=180):
+            criticità += 2
+            problemi.append("Obsoleto")
+        
+        # Controlla firma
+        if doc.stato_approvazione == 'approvato' and not doc.is_signed:
+            criticità += 2
+            problemi.append("Firma mancante")
+        
+        if criticità > 0:
+            documenti_critici.append({
+                "id": doc.id,
+                "titolo": doc.title,
+                "criticità": criticità,
+                "problemi": problemi,
+                "stato": doc.stato_approvazione,
+                "firmato": doc.is_signed,
+                "scadenza": doc.expiry_date.isoformat() if doc.expiry_date else None,
+                "ultimo_aggiornamento": doc.updated_at.isoformat() if doc.updated_at else None
+            })
+    
+    # Ordina per criticità
+    documenti_critici.sort(key=lambda x: x["criticità"], reverse=True)
+    
+    return documenti_critici
+
 # Endpoint per statistiche trend
 @router.get("/api/jack/docs/dashboard/{user_id}/trend")
 async def get_trend_data(
     user_id: int,
     months: int = Query(6, description="Numero mesi per trend"),
-    db: Session = Depends(db)
+    utente: dict = Depends(admin_o_ceo)
 ):
     """
     Restituisce dati trend per grafici
@@ -387,49 +412,13 @@ async def get_trend_data(
     Args:
         user_id: ID utente
         months: Numero mesi per trend
-        db: Sessione database
+        utente: Utente autenticato (admin o CEO)
     
     Returns:
         JSONResponse: Dati trend
     """
     try:
-        trend_data = []
-        today = date.today()
-        
-        for i in range(months):
-            month_date = today.replace(day=1) - timedelta(days=30*i)
-            start_date = month_date.replace(day=1)
-            
-            if month_date.month == 1:
-                end_date = month_date.replace(year=month_date.year + 1, month=2, day=1)
-            else:
-                end_date = month_date.replace(month=month_date.month + 1, day=1)
-            
-            # Query dati mese
-            scaduti = db.query(Document).filter(
-                and_(
-                    Document.scadenza >= start_date,
-                    Document.scadenza < end_date,
-                    Document.stato_approvazione != 'approvato'
-                )
-            ).count()
-            
-            obsoleti = db.query(Document).filter(
-                and_(
-                    Document.updated_at < start_date - timedelta(days=180),
-                    Document.stato_approvazione == 'approvato'
-                )
-            ).count()
-            
-            trend_data.append({
-                "mese": start_date.strftime("%Y-%m"),
-                "scaduti": scaduti,
-                "obsoleti": obsoleti,
-                "criticità_totale": scaduti * 3 + obsoleti * 2
-            })
-        
-        # Inverti ordine (più recente prima)
-        trend_data.reverse()
+        trend_data = await run_db(query_trend_mensile, months)
         
         return JSONResponse(content={
             "trend": trend_data,
@@ -440,4 +429,38 @@ async def get_trend_data(
         })
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Errore trend: {str(e)}") 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Errore trend: {str(e)}")
+
+@reporting_query
+def query_trend_mensile(db: Session, months: int) -> List[Dict[str, Any]]:
+    """
+    Trend mensile di scadenze e documenti obsoleti dai rollup report
+    
+    Args:
+        db: Sessione database
+        months: Numero mesi per trend
+    
+    Returns:
+        list: Un elemento per mese, in ordine cronologico
+    """
+    trend_data = []
+    ultimo_mese = inizio_mese(date.today())
+    primo_mese = sposta_mesi(ultimo_mese, -(months - 1))
+    
+    # Una sola lettura dei rollup mensili per le scadenze (mesi in ordine cronologico)
+    scaduti_per_mese = serie_mensile(M_DOC_SCADENZA_NON_APPROVATI, primo_mese, ultimo_mese, session=db)
+    # Approvati non aggiornati da oltre 180 giorni rispetto all'inizio di ogni mese, in un'unica lettura
+    soglie = {start_date: start_date - timedelta(days=181) for start_date in scaduti_per_mese}
+    obsoleti_per_soglia = totali_cumulati(M_DOC_APPROVATI_AGGIORNAMENTO, soglie.values(), session=db)
+    
+    for start_date, scaduti in scaduti_per_mese.items():
+        obsoleti = obsoleti_per_soglia[soglie[start_date]]
+        
+        trend_data.append({
+            "mese": start_date.strftime("%Y-%m"),
+            "scaduti": scaduti,
+            "obsoleti": obsoleti,
+            "criticità_totale": scaduti * 3 + obsoleti * 2
+        })
+    
+    return trend_data
@@ -8,21 +8,43 @@ import pdfkit
 import os
 from typing import Optional
 from sqlalchemy.orm import Session
-from extensions import db
 from models import Document, User, Company, Department
-from sqlalchemy import func, and_, case
+from services.asgi_runtime import require_roles, run_db
+from services.reporting_db import reporting_query
+from services.report_rollup import (
+    M_DOC_APPROVATI, M_DOC_APPROVATI_AGGIORNAMENTO, M_DOC_APPROVATI_NON_FIRMATI, M_DOC_CARICATI,
+    M_DOC_FIRMATI, M_DOC_IN_ATTESA, M_DOC_SCADENZA_NON_APPROVATI, M_DOWNLOAD, totale, totali_per
+)
+from collections import namedtuple
 
 router = APIRouter()
 
+# Righe delle tabelle del report (stessi attributi usati da genera_html_report)
+RigaStatistiche = namedtuple('RigaStatistiche', ['name', 'totale_documenti', 'approvati', 'firmati'])
+RigaDownload = namedtuple('RigaDownload', ['title', 'download_count'])
+
+# Opzioni pdfkit (wkhtmltopdf) comuni ai report
+PDF_OPTIONS = {
+    'page-size': 'A4',
+    'margin-top': '0.75in',
+    'margin-right': '0.75in',
+    'margin-bottom': '0.75in',
+    'margin-left': '0.75in',
+    'encoding': "UTF-8",
+    'no-outline': None
+}
+
+admin_o_ceo = require_roles('admin', 'ceo')
+
 @router.get("/api/jack/docs/report_ceo/{year}/{month}")
-def genera_report_ceo_docs(year: int, month: int, db: Session = Depends(db)):
+async def genera_report_ceo_docs(year: int, month: int, utente: dict = Depends(admin_o_ceo)):
     """
     Genera report mensile AI per il CEO con statistiche documentali
     
     Args:
         year: Anno del report
         month: Mese del report (1-12)
-        db: Sessione database
+        utente: Utente autenticato (admin o CEO)
     
     Returns:
         FileResponse: PDF del report
@@ -42,29 +64,10 @@ def genera_report_ceo_docs(year: int, month: int, db: Session = Depends(db)):
         else:
             end_date = date(year, month + 1, 1)
         
-        # 🔍 Query dati reali dal database
-        dati = query_dati_mensili(db, start_date, end_date)
-        
-        # Generazione HTML del report
+        # 🔍 Dati dai rollup, HTML e PDF nel threadpool DB (pdfkit è bloccante)
         mese_nome = datetime(year, month, 1).strftime("%B %Y")
-        html = genera_html_report(dati, mese_nome)
-        
-        # Generazione PDF
         filename = f"report_ceo_docs_{year}_{month:02d}.pdf"
-        output_path = f"/tmp/{filename}"
-        
-        # Configurazione pdfkit
-        options = {
-            'page-size': 'A4',
-            'margin-top': '0.75in',
-            'margin-right': '0.75in',
-            'margin-bottom': '0.75in',
-            'margin-left': '0.75in',
-            'encoding': "UTF-8",
-            'no-outline': None
-        }
-        
-        pdfkit.from_string(html, output_path, options=options)
+        output_path = await run_db(scrivi_report_pdf, start_date, end_date, None, mese_nome, filename)
         
         return FileResponse(
             output_path, 
@@ -75,6 +78,29 @@ def genera_report_ceo_docs(year: int, month: int, db: Session = Depends(db)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Errore generazione report: {str(e)}")
 
+@reporting_query
+def scrivi_report_pdf(db: Session, start_date: date, end_date: date, company_id: Optional[int],
+                      titolo: str, filename: str) -> str:
+    """
+    Dati del report, HTML e PDF in /tmp
+    
+    Args:
+        db: Sessione database
+        start_date: Data inizio (inclusa)
+        end_date: Data fine (esclusa)
+        company_id: ID azienda (opzionale)
+        titolo: Periodo mostrato nel report
+        filename: Nome del file PDF
+    
+    Returns:
+        str: Percorso del PDF generato
+    """
+    dati = query_dati_rollup(db, start_date, end_date, company_id)
+    html = genera_html_report(dati, titolo)
+    output_path = f"/tmp/{filename}"
+    pdfkit.from_string(html, output_path, options=PDF_OPTIONS)
+    return output_path
+
 def query_dati_mensili(db: Session, start_date: date, end_date: date) -> dict:
     """
     Query dati mensili dal database
@@ -87,56 +113,60 @@ def query_dati_mensili(db: Session, start_date: date, end_date: date) -> dict:
     Returns:
         dict: Dati aggregati per il report
     """
-    # Documenti scaduti nel mese
-    documenti_scaduti = db.query(Document).filter(
-        and_(
-            Document.scadenza >= start_date,
-            Document.scadenza < end_date,
-            Document.stato_approvazione != 'approvato'
-        )
-    ).count()
+    return query_dati_rollup(db, start_date, end_date)
+
+def query_dati_rollup(db: Session, start_date: date, end_date: date, company_id: Optional[int] = None) -> dict:
+    """
+    Dati del report letti dai rollup giornalieri/mensili (services.report_rollup)
+    invece di contare i documenti a ogni richiesta.
     
-    # Revisioni mancate (documenti non aggiornati da >6 mesi)
+    Args:
+        db: Sessione database
+        start_date: Data inizio (inclusa)
+        end_date: Data fine (esclusa)
+        company_id: ID azienda (opzionale): statistiche per reparto invece che per azienda
+    
+    Returns:
+        dict: Dati aggregati per il report
+    """
+    fine = end_date - timedelta(days=1)
     sei_mesi_fa = date.today().replace(day=1) - timedelta(days=180)
-    revisioni_mancate = db.query(Document).filter(
-        and_(
-            Document.updated_at < sei_mesi_fa,
-            Document.stato_approvazione == 'approvato'
-        )
-    ).count()
     
-    # Upload senza approvazione
-    upload_senza_approvazione = db.query(Document).filter(
-        and_(
-            Document.created_at >= start_date,
-            Document.created_at < end_date,
-            Document.stato_approvazione == 'in_attesa'
-        )
-    ).count()
+    # Documenti scaduti nel periodo (non approvati)
+    documenti_scaduti = totale(M_DOC_SCADENZA_NON_APPROVATI, start_date, fine,
+                               session=db, company_id=company_id)
+    
+    # Revisioni mancate (approvati non aggiornati da >6 mesi)
+    revisioni_mancate = totale(M_DOC_APPROVATI_AGGIORNAMENTO, fine=sei_mesi_fa - timedelta(days=1),
+                               session=db, company_id=company_id)
+    
+    # Upload senza approvazione nel periodo
+    upload_senza_approvazione = totale(M_DOC_IN_ATTESA, start_date, fine,
+                                       session=db, company_id=company_id)
     
     # Firme mancanti
-    firme_mancanti = db.query(Document).filter(
-        and_(
-            Document.stato_approvazione == 'approvato',
-            Document.is_signed == False
-        )
-    ).count()
+    firme_mancanti = totale(M_DOC_APPROVATI_NON_FIRMATI, session=db, company_id=company_id)
     
-    # Statistiche per azienda
-    stats_per_azienda = db.query(
-        Company.name,
-        func.count(Document.id).label('totale_documenti'),
-        func.sum(case((Document.stato_approvazione == 'approvato', 1), else_=0)).label('approvati'),
-        func.sum(case((Document.is_signed == True, 1), else_=0)).label('firmati')
-    ).join(Document).group_by(Company.name).all()
+    # Statistiche per azienda (o per reparto dell'azienda richiesta)
+    dimensione, modello = ('department_id', Department) if company_id else ('company_id', Company)
+    totali = totali_per([M_DOC_CARICATI, M_DOC_APPROVATI, M_DOC_FIRMATI], dimensione,
+                        session=db, company_id=company_id)
+    nomi = dict(db.query(modello.id, modello.name).filter(modello.id.in_(list(totali))).all()) if totali else {}
+    stats_per_azienda = sorted(
+        (RigaStatistiche(nomi.get(chiave, f"#{chiave}"), valori[M_DOC_CARICATI],
+                         valori[M_DOC_APPROVATI], valori[M_DOC_FIRMATI])
+         for chiave, valori in totali.items()),
+        key=lambda riga: riga.name
+    )
     
-    # Top documenti più scaricati
-    top_downloads = db.query(
-        Document.title,
-        Document.download_count
-    ).filter(Document.download_count > 0).order_by(
-        Document.download_count.desc()
-    ).limit(5).all()
+    # Top documenti più scaricati nel periodo
+    download = totali_per([M_DOWNLOAD], 'document_id', start_date, fine, session=db, company_id=company_id)
+    top = sorted(download.items(), key=lambda item: item[1][M_DOWNLOAD], reverse=True)[:5]
+    titoli = dict(db.query(Document.id, Document.title).filter(
+        Document.id.in_([document_id for document_id, _ in top])
+    ).all()) if top else {}
+    top_downloads = [RigaDownload(titoli.get(document_id, f"Documento {document_id}"), valori[M_DOWNLOAD])
+                     for document_id, valori in top]
     
     return {
         "documenti_scaduti": documenti_scaduti,
@@ -349,11 +379,11 @@ def genera_html_report(dati: dict, mese_nome: str) -> str:
 
 # Endpoint aggiuntivo per report personalizzati
 @router.get("/api/jack/docs/report_custom")
-def genera_report_personalizzato(
+async def genera_report_personalizzato(
     start_date: str,
     end_date: str,
     company_id: Optional[int] = None,
-    db: Session = Depends(db)
+    utente: dict = Depends(admin_o_ceo)
 ):
     """
     Genera report personalizzato per periodo specifico
@@ -362,7 +392,7 @@ def genera_report_personalizzato(
         start_date: Data inizio (YYYY-MM-DD)
         end_date: Data fine (YYYY-MM-DD)
         company_id: ID azienda (opzionale)
-        db: Sessione database
+        utente: Utente autenticato (admin o CEO)
     
     Returns:
         FileResponse: PDF del report personalizzato
@@ -371,28 +401,10 @@ def genera_report_personalizzato(
         start = datetime.strptime(start_date, "%Y-%m-%d").date()
         end = datetime.strptime(end_date, "%Y-%m-%d").date()
         
-        # Query con filtro azienda se specificato
-        if company_id:
-            dati = query_dati_personalizzati(db, start, end, company_id)
-        else:
-            dati = query_dati_mensili(db, start, end)
-        
-        html = genera_html_report(dati, f"Periodo {start_date} - {end_date}")
-        
+        # Con company_id le statistiche sono per reparto dell'azienda
         filename = f"report_custom_{start_date}_{end_date}.pdf"
-        output_path = f"/tmp/{filename}"
-        
-        options = {
-            'page-size': 'A4',
-            'margin-top': '0.75in',
-            'margin-right': '0.75in',
-            'margin-bottom': '0.75in',
-            'margin-left': '0.75in',
-            'encoding': "UTF-8",
-            'no-outline': None
-        }
-        
-        pdfkit.from_string(html, output_path, options=options)
+        output_path = await run_db(scrivi_report_pdf, start, end, company_id,
+                                   f"Periodo {start_date} - {end_date}", filename)
         
         return FileResponse(
             output_path, 
@@ -414,72 +426,6 @@ def query_dati_personalizzati(db: Session, start_date: date, end_date: date, com
         company_id: ID azienda
     
     Returns:
-        dict: Dati aggregati per il report
+        dict: Dati aggregati per il report (stats_per_azienda contiene i reparti)
     """
-    # Filtra per azienda
-    base_query = db.query(Document).filter(Document.company_id == company_id)
-    
-    # Documenti scaduti nel periodo
-    documenti_scaduti = base_query.filter(
-        and_(
-            Document.scadenza >= start_date,
-            Document.scadenza < end_date,
-            Document.stato_approvazione != 'approvato'
-        )
-    ).count()
-    
-    # Revisioni mancate (documenti non aggiornati da >6 mesi)
-    sei_mesi_fa = date.today().replace(day=1) - timedelta(days=180)
-    revisioni_mancate = base_query.filter(
-        and_(
-            Document.updated_at < sei_mesi_fa,
-            Document.stato_approvazione == 'approvato'
-        )
-    ).count()
-    
-    # Upload senza approvazione nel periodo
-    upload_senza_approvazione = base_query.filter(
-        and_(
-            Document.created_at >= start_date,
-            Document.created_at < end_date,
-            Document.stato_approvazione == 'in_attesa'
-        )
-    ).count()
-    
-    # Firme mancanti
-    firme_mancanti = base_query.filter(
-        and_(
-            Document.stato_approvazione == 'approvato',
-            Document.is_signed == False
-        )
-    ).count()
-    
-    # Statistiche per reparto (solo per questa azienda)
-    stats_per_reparto = db.query(
-        Department.name,
-        func.count(Document.id).label('totale_documenti'),
-        func.sum(case((Document.stato_approvazione == 'approvato', 1), else_=0)).label('approvati'),
-        func.sum(case((Document.is_signed == True, 1), else_=0)).label('firmati')
-    ).join(Document).filter(
-        Document.company_id == company_id
-    ).group_by(Department.name).all()
-    
-    # Top documenti più scaricati per questa azienda
-    top_downloads = base_query.filter(
-        Document.download_count > 0
-    ).order_by(
-        Document.download_count.desc()
-    ).limit(5).all()
-    
-    return {
-        "documenti_scaduti": documenti_scaduti,
-        "revisioni_mancate": revisioni_mancate,
-        "upload_senza_approvazione": upload_senza_approvazione,
-        "firme_mancanti": firme_mancanti,
-        "stats_per_azienda": stats_per_reparto,  # In questo caso sono per reparto
-        "top_downloads": top_downloads,
-        "periodo": {
-            "start": start_date,
-            "end": end_date
-        }
-    } 
\ No newline at end of file
+    return query_dati_rollup(db, start_date, end_date, company_id)
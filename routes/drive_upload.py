@@ -1,4 +1,4 @@
-from flask import Blueprint, flash, redirect, url_for, current_app
+from flask import Blueprint, flash, redirect, url_for
 from flask_login import login_required, current_user
 from models import db, Document
 from datetime import datetime
@@ -14,14 +14,17 @@ def trigger_drive_upload(document_id):
     """
     Trigger per l'upload automatico su Google Drive dopo approvazione CEO.
     
+    L'upload viene accodato ed eseguito in background da services.drive_sync;
+    l'avanzamento è riportato in `Document.drive_status_note`.
+    
     Args:
         document_id (int): ID del documento da caricare
         
     Returns:
-        bool: True se upload riuscito
+        bool: True se upload accodato
     """
     try:
-        from utils.drive_utils import upload_to_drive
+        from services.drive_sync import enqueue_drive_upload
         
         # Recupera documento
         doc = Document.query.get(document_id)
@@ -35,33 +38,19 @@ def trigger_drive_upload(document_id):
             return False
         
         # Verifica esistenza file locale
-        local_path = os.path.join(current_app.config["UPLOAD_FOLDER"], doc.filename)
-        if not os.path.exists(local_path):
+        local_path = doc.file_path
+        if not local_path or not os.path.exists(local_path):
             logger.error(f"File locale non trovato: {local_path}")
             return False
         
-        # Prepara struttura cartelle
-        subfolders = []
-        if doc.company and doc.company.name:
-            subfolders.append(doc.company.name)
-        if doc.department and doc.department.name:
-            subfolders.append(doc.department.name)
-        if doc.tag:  # Usa tag come categoria
-            subfolders.append(doc.tag)
-        
-        # Upload su Drive
-        drive_file_id = upload_to_drive(local_path, doc.original_filename or doc.filename, subfolders)
-        
-        # Aggiorna documento
-        doc.drive_file_id = drive_file_id
-        doc.drive_uploaded_at = datetime.utcnow()
-        db.session.commit()
+        # Accoda upload (cartelle azienda/reparto/categoria)
+        job = enqueue_drive_upload(doc, local_path)
         
-        logger.info(f"Documento {document_id} caricato su Drive con ID: {drive_file_id}")
+        logger.info(f"Documento {document_id} accodato per Drive (upload {job.id})")
         return True
         
     except Exception as e:
-        logger.error(f"Errore nell'upload automatico documento {document_id}: {str(e)}")
+        logger.error(f"Errore nell'accodamento upload documento {document_id}: {str(e)}")
         return False
 
 @drive_bp.route("/documenti/<int:id>/reupload_drive", methods=["POST"])
@@ -89,33 +78,19 @@ def reupload_drive(id):
             flash("❌ Documento non ancora approvato dal CEO", "danger")
             return redirect(url_for('docs.view_document', id=doc.id))
         
-        from utils.drive_utils import upload_to_drive
+        from services.drive_sync import enqueue_drive_upload
         
         # Verifica esistenza file locale
-        local_path = os.path.join(current_app.config["UPLOAD_FOLDER"], doc.filename)
-        if not os.path.exists(local_path):
+        local_path = doc.file_path
+        if not local_path or not os.path.exists(local_path):
             flash("❌ File locale non trovato", "danger")
             return redirect(url_for('docs.view_document', id=doc.id))
         
-        # Prepara struttura cartelle
-        subfolders = []
-        if doc.company and doc.company.name:
-            subfolders.append(doc.company.name)
-        if doc.department and doc.department.name:
-            subfolders.append(doc.department.name)
-        if doc.tag:  # Usa tag come categoria
-            subfolders.append(doc.tag)
-        
-        # Upload su Drive
-        drive_file_id = upload_to_drive(local_path, doc.original_filename or doc.filename, subfolders)
-        
-        # Aggiorna documento
-        doc.drive_file_id = drive_file_id
-        doc.drive_uploaded_at = datetime.utcnow()
-        db.session.commit()
+        # Accoda upload su Drive
+        enqueue_drive_upload(doc, local_path)
         
-        flash("✅ Reupload su Google Drive completato", "success")
-        logger.info(f"Reupload Drive completato per documento {id} da user {current_user.id}")
+        flash("⏳ Reupload su Google Drive accodato", "success")
+        logger.info(f"Reupload Drive accodato per documento {id} da user {current_user.id}")
         
     except Exception as e:
         flash("❌ Errore durante il reupload su Drive", "danger")
@@ -221,9 +196,9 @@ def bulk_upload_documents():
                 errori += 1
         
         if successi > 0:
-            flash(f"✅ {successi} documenti caricati con successo su Google Drive", "success")
+            flash(f"✅ {successi} documenti accodati per il caricamento su Google Drive", "success")
         if errori > 0:
-            flash(f"⚠️ {errori} documenti non sono stati caricati a causa di errori", "warning")
+            flash(f"⚠️ {errori} documenti non sono stati accodati a causa di errori", "warning")
             
     except Exception as e:
         logger.error(f"Errore upload in massa: {str(e)}")
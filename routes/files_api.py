@@ -9,15 +9,24 @@ from datetime import datetime
 from typing import Dict, List, Optional, Any
 from pathlib import Path
 
-from flask import Blueprint, request, jsonify, current_app, send_file, abort
+from flask import Blueprint, request, jsonify, current_app, abort
 from flask_login import login_required, current_user
 from sqlalchemy import and_, or_, func, desc
 from sqlalchemy.orm import joinedload
 
 from extensions import db
-from models import Document, Company, Department, User, SecurityAuditLog, Tag
+from models import Document, Company, Department, User, SecurityAuditLog, Tag, FileHash
 from decorators import admin_required
 from utils.audit_utils import log_audit_event
+from services import visibility_index
+from services.identity_cache import get_principal
+from services.file_delivery import deliver_file
+from services.preview_service import (
+    DEFAULT_SIZE, PREVIEW_SIZES, STATO_IN_CODA, STATO_NON_DISPONIBILE, STATO_PRONTA,
+    can_render, enqueue_document_preview, get_preview_cache, preview_kind, preview_status
+)
+
+PREVIEW_RETRY_AFTER_SEC = 2
 
 files_api = Blueprint('files_api', __name__, url_prefix='/api/files')
 
@@ -30,18 +39,21 @@ def get_user_permissions(user: User) -> Dict[str, Any]:
         user: Utente corrente
         
     Returns:
-        Dict con permessi: companies, departments, is_admin
+        Dict con permessi: user_id, companies, departments, is_admin
     """
     if user.role in ['admin', 'superadmin']:
         return {
+            'user_id': user.id,
             'companies': None,  # Tutte le aziende
             'departments': None,  # Tutti i reparti
             'is_admin': True
         }
     
+    principal = get_principal(user)
     return {
-        'companies': [c.id for c in user.companies] if user.companies else [],
-        'departments': [d.id for d in user.departments] if user.departments else [],
+        'user_id': user.id,
+        'companies': list(principal.company_ids),
+        'departments': list(principal.department_ids),
         'is_admin': False
     }
 
@@ -60,6 +72,15 @@ def apply_rbac_filters(query, user_permissions: Dict[str, Any]):
     if user_permissions['is_admin']:
         return query
     
+    has_memberships = user_permissions['companies'] or user_permissions['departments']
+    
+    # Lookup sull'indice di visibilità precalcolato (stessa semantica azienda/reparto)
+    if has_memberships and user_permissions.get('user_id') and visibility_index.is_enabled():
+        visible_ids = visibility_index.visible_document_ids(
+            user_permissions['user_id'], reasons=('azienda', 'reparto')
+        )
+        return query.filter(Document.id.in_(visible_ids))
+    
     # Filtra per aziende e reparti dell'utente
     filters = []
     
@@ -123,9 +144,13 @@ def get_file_tree():
             'total_files': 0
         }
         
+        # Aziende e reparti in due query invece di una per riga
+        companies = {c.id: c for c in Company.query.filter(Company.id.in_({r[0] for r in results})).all()}
+        departments = {d.id: d for d in Department.query.filter(Department.id.in_({r[1] for r in results})).all()}
+        
         for company_id, department_id, file_count in results:
             if company_id not in tree['companies']:
-                company = Company.query.get(company_id)
+                company = companies.get(company_id)
                 if company:
                     tree['companies'][company_id] = {
                         'id': company_id,
@@ -136,7 +161,7 @@ def get_file_tree():
             
             if company_id in tree['companies']:
                 if department_id not in tree['companies'][company_id]['departments']:
-                    department = Department.query.get(department_id)
+                    department = departments.get(department_id)
                     if department:
                         tree['companies'][company_id]['departments'][department_id] = {
                             'id': department_id,
@@ -559,15 +584,27 @@ def get_file_meta(file_id):
 @login_required
 def get_file_preview(file_id):
     """
-    Ottiene preview di un file (PDF, immagine, Office).
+    Ottiene preview di un file (PDF, immagine, Office) dalla cache preview.
+    
+    Query params:
+        size: 'thumb' o 'viewer' (default viewer)
+        page: Numero di pagina (default 1)
     
     Args:
         file_id: ID del file
         
     Returns:
-        File preview o JSON con errore
+        PNG della preview, 202 se la preview è in generazione o JSON con errore
     """
     try:
+        size = request.args.get('size', DEFAULT_SIZE)
+        page = request.args.get('page', 1, type=int)
+        if size not in PREVIEW_SIZES or not page or page < 1:
+            return jsonify({
+                'success': False,
+                'error': 'Parametri size/page non validi'
+            }), 400
+        
         user_permissions = get_user_permissions(current_user)
         
         # Query file con permessi
@@ -589,13 +626,13 @@ def get_file_preview(file_id):
                 'error': 'Nome file non disponibile'
             }), 400
         
-        file_ext = Path(filename).suffix.lower()
         mime_type, _ = mimetypes.guess_type(filename)
+        kind = preview_kind(filename)
         
-        # Percorso file fisico
-        file_path = os.path.join(current_app.config.get('UPLOAD_FOLDER', 'uploads'), file.filename)
+        # Percorso file fisico (blob store o percorso legacy)
+        file_path = file.file_path
         
-        if not os.path.exists(file_path):
+        if not file_path or not os.path.exists(file_path):
             return jsonify({
                 'success': False,
                 'error': 'File fisico non trovato'
@@ -607,86 +644,63 @@ def get_file_preview(file_id):
             'file_preview',
             'document',
             file.id,
-            {'filename': filename, 'mime_type': mime_type}
+            {'filename': filename, 'mime_type': mime_type, 'size': size, 'page': page}
         )
         
-        # Gestione preview per tipo
-        if file_ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp']:
-            # Immagini: serve direttamente con resize
-            return send_file(
-                file_path,
-                mimetype=mime_type,
-                as_attachment=False,
-                cache_timeout=300  # 5 minuti cache
-            )
-        
-        elif file_ext == '.pdf':
-            # PDF: prima pagina come PNG
-            try:
-                from services.preview_service import generate_pdf_preview
-                preview_path = generate_pdf_preview(file_path, file.id)
-                
-                if preview_path and os.path.exists(preview_path):
-                    return send_file(
-                        preview_path,
-                        mimetype='image/png',
-                        as_attachment=False,
-                        cache_timeout=3600  # 1 ora cache
-                    )
-                else:
-                    # Fallback: serve PDF originale
-                    return send_file(
-                        file_path,
-                        mimetype='application/pdf',
-                        as_attachment=False,
-                        cache_timeout=300
-                    )
-            except Exception as e:
-                current_app.logger.error(f"Errore preview PDF {file_id}: {e}")
-                return send_file(
+        def _serve_original():
+            # Immagini e PDF senza preview pronta: il browser visualizza l'originale
+            if kind in ('image', 'pdf') and page == 1:
+                return deliver_file(
                     file_path,
-                    mimetype='application/pdf',
+                    download_name=filename,
+                    mimetype=mime_type,
                     as_attachment=False,
-                    cache_timeout=300
+                    max_age=300  # 5 minuti cache
                 )
-        
-        elif file_ext in ['.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx']:
-            # Office: prova conversione PDF
-            try:
-                from services.preview_service import convert_office_to_pdf, generate_pdf_preview
-                pdf_path = convert_office_to_pdf(file_path, file.id)
-                
-                if pdf_path and os.path.exists(pdf_path):
-                    # Genera preview dal PDF convertito
-                    preview_path = generate_pdf_preview(pdf_path, f"{file.id}_converted")
-                    
-                    if preview_path and os.path.exists(preview_path):
-                        return send_file(
-                            preview_path,
-                            mimetype='image/png',
-                            as_attachment=False,
-                            cache_timeout=3600
-                        )
-                
-                return jsonify({
-                    'success': False,
-                    'error': 'Nessuna preview disponibile per questo tipo di file'
-                }), 404
-                
-            except Exception as e:
-                current_app.logger.error(f"Errore preview Office {file_id}: {e}")
-                return jsonify({
-                    'success': False,
-                    'error': 'Nessuna preview disponibile per questo tipo di file'
-                }), 404
-        
-        else:
-            # Altri tipi: nessuna preview
             return jsonify({
                 'success': False,
                 'error': 'Nessuna preview disponibile per questo tipo di file'
             }), 404
         
+        if kind is None or not can_render(kind):
+            return _serve_original()
+        
+        # Preview in cache per hash del contenuto
+        sha256 = file.blob_sha256
+        if sha256 is None:
+            file_hash = FileHash.query.get(file.id)
+            sha256 = file_hash.value if file_hash else None
+        
+        if sha256:
+            stato, preview_path = preview_status(sha256, size, page)
+            if stato == STATO_PRONTA:
+                response = deliver_file(
+                    preview_path,
+                    download_name=f"preview_{file.id}_{size}_p{page}.png",
+                    mimetype='image/png',
+                    as_attachment=False,
+                    max_age=86400  # contenuto indirizzato per hash: immutabile
+                )
+                meta = get_preview_cache().read_meta(sha256) or {}
+                if meta.get('pagine'):
+                    response.headers['X-Preview-Pages'] = str(meta['pagine'])
+                return response
+            if stato == STATO_NON_DISPONIBILE:
+                return _serve_original()
+        
+        # Non ancora generata: rendering in background, il client riprova
+        enqueue_document_preview(file)
+        if kind == 'image' and page == 1:
+            return _serve_original()
+        response = jsonify({
+            'success': True,
+            'status': STATO_IN_CODA,
+            'retry_after': PREVIEW_RETRY_AFTER_SEC
+        })
+        response.status_code = 202
+        response.headers['Retry-After'] = str(PREVIEW_RETRY_AFTER_SEC)
+        return response
+        
     except Exception as e:
         current_app.logger.error(f"Errore API preview file {file_id}: {e}")
         return jsonify({
@@ -10,9 +10,23 @@ from utils_extra import generate_pdf_copertura_eventi
 import os
 from flask import Response
 from models import User
+from services.storage_scanner import presence_map
 
 qms_bp = Blueprint('qms', __name__)
 
+
+def _presenza_file(partecipazioni):
+    """
+    Presenza di firme e attestati letta dal manifest dello storage (una query, nessuno stat per riga).
+    
+    Returns:
+        dict: percorso -> True se il file è presente (None -> False).
+    """
+    paths = []
+    for partecipazione in partecipazioni:
+        paths.extend([partecipazione.firma_presenza_path, partecipazione.attestato_path])
+    return presence_map(paths)
+
 @qms_bp.route("/admin/qms_ai_insights")
 @login_required
 def qms_ai_insights():
@@ -402,16 +416,17 @@ def verifica_audit_attestati(evento_id):
         
         evento = EventoFormazione.query.get_or_404(evento_id)
         partecipazioni = PartecipazioneFormazione.query.filter_by(evento_id=evento_id).all()
+        presenza = _presenza_file(partecipazioni)
         
         problemi = []
         for partecipazione in partecipazioni:
             user = partecipazione.user
             
             # Verifica firma presenza
-            firma_ok = partecipazione.firma_presenza_path is not None and os.path.exists(partecipazione.firma_presenza_path)
+            firma_ok = presenza[partecipazione.firma_presenza_path]
             
             # Verifica attestato
-            attestato_ok = partecipazione.attestato_path is not None and os.path.exists(partecipazione.attestato_path)
+            attestato_ok = presenza[partecipazione.attestato_path]
             
             if not firma_ok or not attestato_ok:
                 problemi.append({
@@ -471,6 +486,7 @@ def export_verifica_audit(evento_id):
         
         evento = EventoFormazione.query.get_or_404(evento_id)
         partecipazioni = PartecipazioneFormazione.query.filter_by(evento_id=evento_id).all()
+        presenza = _presenza_file(partecipazioni)
         
         # Crea CSV in memoria
         output = StringIO()
@@ -484,8 +500,8 @@ def export_verifica_audit(evento_id):
             user = partecipazione.user
             
             # Verifica file
-            firma_ok = partecipazione.firma_presenza_path is not None and os.path.exists(partecipazione.firma_presenza_path)
-            attestato_ok = partecipazione.attestato_path is not None and os.path.exists(partecipazione.attestato_path)
+            firma_ok = presenza[partecipazione.firma_presenza_path]
+            attestato_ok = presenza[partecipazione.attestato_path]
             
             writer.writerow([
                 user.nome_completo() if hasattr(user, 'nome_completo') else f"{user.first_name} {user.last_name}",
@@ -527,6 +543,7 @@ def export_audit_csv(evento_id):
         
         evento = EventoFormazione.query.get_or_404(evento_id)
         partecipazioni = PartecipazioneFormazione.query.filter_by(evento_id=evento_id).all()
+        presenza = _presenza_file(partecipazioni)
         
         # Crea CSV in memoria
         output = StringIO()
@@ -549,8 +566,8 @@ def export_audit_csv(evento_id):
         problemi = []
         for partecipazione in partecipazioni:
             user = partecipazione.user
-            firma_ok = partecipazione.firma_presenza_path is not None and os.path.exists(partecipazione.firma_presenza_path)
-            attestato_ok = partecipazione.attestato_path is not None and os.path.exists(partecipazione.attestato_path)
+            firma_ok = presenza[partecipazione.firma_presenza_path]
+            attestato_ok = presenza[partecipazione.attestato_path]
             
             if not firma_ok or not attestato_ok:
                 problemi.append({
@@ -618,6 +635,7 @@ def export_audit_pdf(evento_id):
         
         evento = EventoFormazione.query.get_or_404(evento_id)
         partecipazioni = PartecipazioneFormazione.query.filter_by(evento_id=evento_id).all()
+        presenza = _presenza_file(partecipazioni)
         
         # Crea buffer per PDF
         buffer = BytesIO()
@@ -662,8 +680,8 @@ def export_audit_pdf(evento_id):
         
         for partecipazione in partecipazioni:
             user = partecipazione.user
-            firma_ok = partecipazione.firma_presenza_path is not None and os.path.exists(partecipazione.firma_presenza_path)
-            attestato_ok = partecipazione.attestato_path is not None and os.path.exists(partecipazione.attestato_path)
+            firma_ok = presenza[partecipazione.firma_presenza_path]
+            attestato_ok = presenza[partecipazione.attestato_path]
             
             if not firma_ok or not attestato_ok:
                 problemi.append({
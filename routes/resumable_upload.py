@@ -0,0 +1,131 @@
+"""
+Endpoint tus per gli upload a chunk riprendibili (services.resumable_upload).
+
+    OPTIONS /uploads/resumable/                  capacità del server
+    POST    /uploads/resumable/                  crea (Upload-Length, Upload-Metadata)
+    HEAD    /uploads/resumable/<id>              offset da cui riprendere
+    PATCH   /uploads/resumable/<id>              chunk (Upload-Offset, Upload-Checksum)
+    DELETE  /uploads/resumable/<id>              annulla
+    POST    /uploads/resumable/<id>/finalize     hash e MIME del file completo (JSON)
+
+Le richieste con metodi di scrittura inviano il token CSRF nell'header X-CSRFToken.
+"""
+
+from flask import Blueprint, current_app, jsonify, make_response, request, url_for
+from flask_login import current_user, login_required
+
+from services.resumable_upload import (
+    CHECKSUM_ALGORITHMS, TUS_EXTENSIONS, TUS_VERSION, UploadError, annulla_upload, completa_upload,
+    crea_upload, get_upload, max_size, parse_checksum, parse_metadata, scrivi_chunk,
+)
+
+resumable_bp = Blueprint('resumable_upload', __name__, url_prefix='/uploads/resumable')
+
+
+def _tus_response(status: int, headers: dict = None, body=''):
+    response = make_response(body, status)
+    response.headers['Tus-Resumable'] = TUS_VERSION
+    response.headers['Cache-Control'] = 'no-store'
+    for nome, valore in (headers or {}).items():
+        response.headers[nome] = str(valore)
+    return response
+
+
+def _expires(upload) -> str:
+    return upload.expires_at.strftime('%a, %d %b %Y %H:%M:%S GMT')
+
+
+@resumable_bp.errorhandler(UploadError)
+def _upload_error(error):
+    return _tus_response(error.status, body=error.message)
+
+
+@resumable_bp.route('/', methods=['OPTIONS'])
+@login_required
+def opzioni():
+    """Versione, estensioni e limiti del server tus."""
+    return _tus_response(204, {
+        'Tus-Version': TUS_VERSION,
+        'Tus-Extension': TUS_EXTENSIONS,
+        'Tus-Max-Size': max_size(),
+        'Tus-Checksum-Algorithm': ','.join(CHECKSUM_ALGORITHMS),
+    })
+
+
+@resumable_bp.route('/', methods=['POST'])
+@login_required
+def crea():
+    """Crea un upload dalla dimensione dichiarata e dai metadati (filename, filetype, sha256)."""
+    try:
+        length = int(request.headers['Upload-Length'])
+    except (KeyError, ValueError):
+        raise UploadError(400, "Upload-Length mancante o non valido")
+    upload = crea_upload(current_user.id, length, parse_metadata(request.headers.get('Upload-Metadata')))
+    return _tus_response(201, {
+        'Location': url_for('resumable_upload.stato', upload_id=upload.id),
+        'Upload-Offset': upload.offset,
+        'Upload-Expires': _expires(upload),
+    })
+
+
+@resumable_bp.route('/<upload_id>', methods=['HEAD'])
+@login_required
+def stato(upload_id):
+    """Offset raggiunto: il client riprende da qui dopo un'interruzione."""
+    upload = get_upload(upload_id, current_user.id)
+    return _tus_response(200, {
+        'Upload-Offset': upload.offset,
+        'Upload-Length': upload.length,
+        'Upload-Expires': _expires(upload),
+    })
+
+
+@resumable_bp.route('/<upload_id>', methods=['PATCH'])
+@login_required
+def chunk(upload_id):
+    """Aggiunge un chunk; all'ultimo byte l'upload viene completato."""
+    if request.mimetype != 'application/offset+octet-stream':
+        raise UploadError(415, "Content-Type richiesto: application/offset+octet-stream")
+    try:
+        offset = int(request.headers['Upload-Offset'])
+    except (KeyError, ValueError):
+        raise UploadError(400, "Upload-Offset mancante o non valido")
+
+    upload = get_upload(upload_id, current_user.id)
+    checksum = parse_checksum(request.headers.get('Upload-Checksum'))
+    nuovo_offset = scrivi_chunk(upload, request.stream, offset, checksum)
+    if upload.is_complete:
+        completa_upload(upload)
+    return _tus_response(204, {'Upload-Offset': nuovo_offset, 'Upload-Expires': _expires(upload)})
+
+
+@resumable_bp.route('/<upload_id>', methods=['DELETE'])
+@login_required
+def annulla(upload_id):
+    """Annulla l'upload ed elimina il file parziale."""
+    annulla_upload(get_upload(upload_id, current_user.id))
+    return _tus_response(204)
+
+
+@resumable_bp.route('/<upload_id>/finalize', methods=['POST'])
+@login_required
+def finalizza(upload_id):
+    """
+    Chiude l'upload e restituisce l'`upload_id` da inviare al form di upload.
+
+    Returns:
+        JSON con upload_id, filename, dimensione, SHA-256 e MIME
+    """
+    try:
+        upload = completa_upload(get_upload(upload_id, current_user.id))
+    except UploadError as e:
+        return jsonify({'success': False, 'error': e.message}), e.status
+    current_app.logger.info(f"Upload riprendibile {upload.id} pronto per {current_user.email}")
+    return jsonify({
+        'success': True,
+        'upload_id': upload.id,
+        'filename': upload.filename,
+        'size': upload.length,
+        'sha256': upload.sha256,
+        'mime': upload.mime,
+    })
@@ -10,6 +10,8 @@ from extensions import db, mail
 from models import Document, Company, Department
 from forms import UploadForm
 from utils_extra import save_file_and_upload
+from services.drive_sync import enqueue_drive_upload
+from services.resumable_upload import resumable_file
 import bcrypt
 
 upload_bp = Blueprint('upload', __name__, url_prefix='/upload')
@@ -31,7 +33,7 @@ def upload_file():
     print("[DEBUG] ➕ FILES:", request.files)
     print("[DEBUG] 📝 FORM:", request.form)
 
-    file = request.files.get('file')
+    file = request.files.get('file') or resumable_file(request.form.get('upload_id'))
     title = request.form.get('title', '').strip()
     description = request.form.get('description')
     visibility = request.form.get('visibility')
@@ -53,6 +55,17 @@ def upload_file():
         flash("⚠️ Tutti i campi obbligatori devono essere compilati.", "danger")
         return redirect(url_for('upload.upload'))
 
+    # Hash, MIME e scansione antivirus in una sola lettura, condivisi da tutte le combinazioni
+    ingest_result = None
+    try:
+        from services.antivirus_service import antivirus_service
+        file.stream.seek(0)
+        ingest_result = antivirus_service.ingest(file.stream, filename=file.filename)
+    except Exception as e:
+        current_app.logger.error(f"Errore ingest file {file.filename}: {e}")
+    finally:
+        file.stream.seek(0)
+
     try:
         for company_id in target_companies:
             for department_id in target_departments:
@@ -85,8 +98,12 @@ def upload_file():
                     db.session.add(doc)
                     db.session.flush()  # Ottieni l'ID senza commitare
                     
-                    # Processamento sicurezza del file
-                    is_safe, scan_result = antivirus_service.process_uploaded_file(local_path, doc.id)
+                    # Processamento sicurezza del file (senza rileggerlo se l'ingest è già avvenuto)
+                    if ingest_result is not None:
+                        doc.file_size = ingest_result.size
+                        is_safe, scan_result = antivirus_service.record_ingest(doc.id, ingest_result)
+                    else:
+                        is_safe, scan_result = antivirus_service.process_uploaded_file(local_path, doc.id)
                     
                     if not is_safe:
                         # File infetto o errore critico
@@ -171,13 +188,12 @@ def upload_file():
 @upload_bp.route('/', methods=['GET', 'POST'])
 @login_required
 def upload():
-    from app import drive_service  # importa il servizio Drive se serve
     form = UploadForm()
     companies = Company.query.all()
     departments = Department.query.all()
 
     if request.method == 'POST':
-        file = request.files.get('file')
+        file = request.files.get('file') or resumable_file(request.form.get('upload_id'))
         title = request.form.get('title', '').strip()
         description = request.form.get('description')
         visibility = request.form.get('visibility')
@@ -203,12 +219,8 @@ def upload():
         try:
             for company_id in target_companies:
                 for department_id in target_departments:
-                    local_path, drive_file_id = save_file_and_upload(
-                        file,
-                        upload_to_drive=(upload_mode == 'gdrive'),
-                        drive_service=drive_service if upload_mode == 'gdrive' else None,
-                        drive_folder_id=drive_folder_id
-                    )
+                    # Upload su Drive accodato dopo il flush (eseguito in background)
+                    local_path, _ = save_file_and_upload(file)
                     new_filename = os.path.basename(local_path)
                     filepath = local_path
 
@@ -224,13 +236,16 @@ def upload():
                         user_id=current_user.id,
                         company_id=int(company_id),
                         department_id=int(department_id),
-                        created_at=datetime.utcnow(),
-                        drive_file_id=drive_file_id
+                        created_at=datetime.utcnow()
                     )
 
                     db.session.add(doc)
                     db.session.flush()
 
+                    if upload_mode == 'gdrive':
+                        enqueue_drive_upload(doc, local_path, new_filename,
+                                             parent_folder_id=drive_folder_id, commit=False)
+
                     generate_qr_for_doc(doc)
                     notify_upload(doc)
 
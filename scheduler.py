@@ -3,10 +3,9 @@ Scheduler per reminder automatici SYNTHIA DOCS.
 Gestisce l'invio automatico di notifiche per scadenze documentali, visite mediche e checklist.
 """
 
-from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 from flask import current_app
-from flask_mail import Message
 from datetime import datetime, timedelta
 import logging
 
@@ -50,8 +49,9 @@ def invia_reminder_email(reminder, user):
         bool: True se l'invio è riuscito, False altrimenti
     """
     try:
-        from app import mail, db
+        from app import db
         from models import ReminderLog
+        from services.mail_queue import enqueue_email
         
         # Prepara il messaggio
         subject = f"[SYNTHIA DOCS] ⚠️ Scadenza: {reminder.tipo_display}"
@@ -147,16 +147,16 @@ SYNTHIA DOCS - Sistema di Gestione Documentale
 Questo messaggio è stato generato automaticamente.
             """
         
-        # Crea e invia il messaggio
-        msg = Message(
+        # Accoda il messaggio: l'invio avviene in batch dal worker della coda email
+        enqueue_email(
             subject=subject,
             recipients=[user.email],
             body=body,
-            sender=current_app.config.get('MAIL_DEFAULT_SENDER', 'noreply@mercurysurgelati.org')
+            sender=current_app.config.get('MAIL_DEFAULT_SENDER', 'noreply@mercurysurgelati.org'),
+            idempotency_key=f"reminder:{reminder.id}:{user.email}:{datetime.utcnow().date().isoformat()}",
+            commit=False
         )
         
-        mail.send(msg)
-        
         # Aggiorna stato reminder
         reminder.ultimo_invio = datetime.utcnow()
         reminder.stato = 'inviato'
@@ -491,6 +491,254 @@ def monitora_download_sospetti():
         logger.error(f"Errore durante monitoraggio AI download sospetti: {e}")
 
 
+def invia_email_in_coda(app=None):
+    """
+    Invia le email accodate in batch, una connessione SMTP per batch.
+    Viene eseguita dal scheduler ogni minuto.
+    
+    Args:
+        app: Istanza dell'applicazione Flask (default current_app)
+    """
+    try:
+        from services.mail_queue import flush_email_queue
+        
+        app = app or current_app._get_current_object()
+        with app.app_context():
+            stats = flush_email_queue()
+        
+        if stats['inviate'] or stats['errori']:
+            logger.info(f"Coda email: {stats['inviate']} inviate, {stats['errori']} errori, {stats['fallite']} fallite")
+            
+    except Exception as e:
+        logger.error(f"Errore invio email in coda: {e}")
+
+
+def sincronizza_drive_in_coda(app=None):
+    """
+    Esegue gli upload su Google Drive in coda, riprendendo quelli interrotti.
+    Viene eseguita dal scheduler ogni minuto.
+    
+    Args:
+        app: Istanza dell'applicazione Flask (default current_app)
+    """
+    try:
+        from services.drive_sync import flush_drive_queue
+        
+        app = app or current_app._get_current_object()
+        with app.app_context():
+            stats = flush_drive_queue()
+        
+        if stats['caricati'] or stats['errori']:
+            logger.info(f"Coda Drive: {stats['caricati']} caricati, {stats['errori']} errori, {stats['falliti']} falliti")
+            
+    except Exception as e:
+        logger.error(f"Errore sincronizzazione Drive: {e}")
+
+
+def applica_budget_cache_preview(app=None):
+    """
+    Riporta la cache preview entro PREVIEW_CACHE_MAX_BYTES (eviction LRU).
+    Viene eseguita dal scheduler ogni 30 minuti.
+    
+    Args:
+        app: Istanza dell'applicazione Flask (default current_app)
+    """
+    try:
+        from services.preview_service import get_preview_cache
+        
+        app = app or current_app._get_current_object()
+        with app.app_context():
+            get_preview_cache().enforce_budget()
+            
+    except Exception as e:
+        logger.error(f"Errore pulizia cache preview: {e}")
+
+
+def aggiorna_rollup_report(app=None):
+    """
+    Aggiornamento incrementale dei rollup giornalieri/mensili dei report.
+    Viene eseguito dal scheduler ogni REPORT_ROLLUP_INTERVAL_MIN minuti.
+    
+    Args:
+        app: Istanza dell'applicazione Flask (default current_app)
+    """
+    try:
+        from services.report_rollup import aggiorna_rollup
+        
+        app = app or current_app._get_current_object()
+        with app.app_context():
+            aggiorna_rollup()
+            
+    except Exception as e:
+        logger.error(f"Errore aggiornamento rollup report: {e}")
+
+
+def aggiorna_snapshot_report(app=None):
+    """
+    Aggiorna lo snapshot SQLite letto dalle sessioni di reporting.
+    Viene eseguito dal scheduler ogni REPORT_SNAPSHOT_INTERVAL_MIN minuti
+    (solo con REPORTING_DATABASE_MODE=snapshot).
+    
+    Args:
+        app: Istanza dell'applicazione Flask (default current_app)
+    """
+    try:
+        from services.reporting_db import aggiorna_snapshot_reporting
+        
+        app = app or current_app._get_current_object()
+        aggiorna_snapshot_reporting(app)
+            
+    except Exception as e:
+        logger.error(f"Errore aggiornamento snapshot report: {e}")
+
+
+def scansiona_storage(app=None):
+    """
+    Scansione completa dello storage per allineare il manifest dei file.
+    Viene eseguita dal scheduler ogni STORAGE_SCAN_INTERVAL_MIN minuti.
+    
+    Args:
+        app: Istanza dell'applicazione Flask (default current_app)
+    """
+    try:
+        from services.storage_scanner import sweep
+        
+        app = app or current_app._get_current_object()
+        with app.app_context():
+            sweep()
+            
+    except Exception as e:
+        logger.error(f"Errore scansione storage: {e}")
+
+
+def pulisci_sessioni_scadute(app=None):
+    """
+    Elimina i file di sessione filesystem scaduti (anche dopo il passaggio a
+    SESSION_BACKEND cookie/redis, finché restano sessioni da migrare).
+    Viene eseguita dal scheduler ogni ora.
+    
+    Args:
+        app: Istanza dell'applicazione Flask (default current_app)
+    """
+    try:
+        from services.session_backend import pulisci_sessioni_filesystem
+        
+        app = app or current_app._get_current_object()
+        pulisci_sessioni_filesystem(app.config.get('SESSION_FILE_DIR') or app.config.get('SESSION_LEGACY_DIR'),
+                                    app.permanent_session_lifetime.total_seconds())
+            
+    except Exception as e:
+        logger.error(f"Errore pulizia sessioni filesystem: {e}")
+
+
+def pulisci_upload_riprendibili(app=None):
+    """
+    Elimina gli upload a chunk scaduti o annullati e i relativi file parziali.
+    Viene eseguita dal scheduler ogni ora.
+    
+    Args:
+        app: Istanza dell'applicazione Flask (default current_app)
+    """
+    try:
+        from services.resumable_upload import pulisci_upload_scaduti
+        
+        app = app or current_app._get_current_object()
+        with app.app_context():
+            eliminati = pulisci_upload_scaduti(app)
+            if eliminati:
+                logger.info(f"Eliminati {eliminati} upload riprendibili scaduti")
+            
+    except Exception as e:
+        logger.error(f"Errore pulizia upload riprendibili: {e}")
+
+
+def archivia_registro_eventi(app=None):
+    """
+    Archivia le partizioni mensili del registro eventi fuori dalla finestra live
+    ed elimina i segmenti oltre la retention.
+    Viene eseguita dal scheduler ogni notte.
+    
+    Args:
+        app: Istanza dell'applicazione Flask (default current_app)
+    """
+    try:
+        from services.event_store import applica_retention
+        
+        app = app or current_app._get_current_object()
+        if not app.config.get('EVENT_STORE_ENABLED', False):
+            return
+        with app.app_context():
+            stats = applica_retention(app)
+            if stats['archiviate'] or stats['segmenti_eliminati'] or stats['righe_log_eliminate']:
+                logger.info(f"Registro eventi: {stats['archiviate']} partizioni archiviate "
+                            f"({stats['eventi_archiviati']} eventi), {stats['segmenti_eliminati']} segmenti eliminati, "
+                            f"{stats['righe_log_eliminate']} righe di log eliminate")
+            
+    except Exception as e:
+        logger.error(f"Errore archiviazione registro eventi: {e}")
+
+
+def registra_job_storage(scheduler, app):
+    """
+    Registra la scansione periodica dello storage, la pulizia delle sessioni
+    filesystem e degli upload riprendibili scaduti, l'archiviazione del registro
+    eventi, e avvia il watcher inotify nel processo leader (fermato allo shutdown dello scheduler).
+    
+    Args:
+        scheduler: Istanza APScheduler
+        app: Istanza dell'applicazione Flask
+    """
+    from apscheduler.events import EVENT_SCHEDULER_SHUTDOWN
+    from services.storage_scanner import start_storage_watcher, stop_storage_watcher
+    
+    scheduler.add_job(
+        func=scansiona_storage,
+        args=[app],
+        trigger=IntervalTrigger(minutes=app.config.get('STORAGE_SCAN_INTERVAL_MIN', 60)),
+        id='scansione_storage',
+        name='Scansione Storage e Manifest File',
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True
+    )
+    
+    scheduler.add_job(
+        func=pulisci_sessioni_scadute,
+        args=[app],
+        trigger=IntervalTrigger(hours=1),
+        id='pulizia_sessioni',
+        name='Pulizia Sessioni Filesystem Scadute',
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True
+    )
+    
+    scheduler.add_job(
+        func=pulisci_upload_riprendibili,
+        args=[app],
+        trigger=IntervalTrigger(hours=1),
+        id='pulizia_upload_riprendibili',
+        name='Pulizia Upload Riprendibili Scaduti',
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True
+    )
+    
+    scheduler.add_job(
+        func=archivia_registro_eventi,
+        args=[app],
+        trigger=CronTrigger(hour=3, minute=30),
+        id='archiviazione_registro_eventi',
+        name='Archiviazione e Retention Registro Eventi',
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True
+    )
+    
+    if start_storage_watcher(app):
+        scheduler.add_listener(lambda event: stop_storage_watcher(), EVENT_SCHEDULER_SHUTDOWN)
+
+
 def genera_report_ceo_mensile_automatico():
     """
     Genera automaticamente il report PDF mensile del CEO.
@@ -540,123 +788,218 @@ def check_reminder_pdf_automatico():
         logger.error(f"❌ Errore nel controllo automatico reminder PDF: {e}")
 
 
-def avvia_scheduler(app):
+def registra_job_reminder(scheduler, app):
     """
-    Avvia il scheduler APScheduler per i reminder automatici.
+    Registra i job dei reminder automatici sullo scheduler.
     
     Args:
+        scheduler: Istanza APScheduler
         app: Istanza dell'applicazione Flask
     """
-    try:
-        scheduler = BackgroundScheduler()
-        
-        # Aggiungi job per generare reminder ogni giorno alle 6:00
-        scheduler.add_job(
-            func=genera_reminder,
-            trigger=CronTrigger(hour=6, minute=0),
-            id='genera_reminder',
-            name='Generazione Reminder Automatici',
-            replace_existing=True
-        )
-        
-        # Aggiungi job per processare reminder ogni giorno alle 7:00
-        scheduler.add_job(
-            func=processa_reminder,
-            trigger=CronTrigger(hour=7, minute=0),
-            id='processa_reminder',
-            name='Processamento Reminder Automatici',
-            replace_existing=True
-        )
-        
-        # Aggiungi job per pulizia log vecchi (ogni domenica alle 2:00)
-        scheduler.add_job(
-            func=pulisci_log_vecchi,
-            trigger=CronTrigger(day_of_week='sun', hour=2, minute=0),
-            id='pulisci_log',
-            name='Pulizia Log Vecchi',
-            replace_existing=True
-        )
-        
-        # Aggiungi job per controllo visite mediche in scadenza (ogni giorno alle 6:30)
-        scheduler.add_job(
-            func=check_visite_scadenza,
-            trigger=CronTrigger(hour=6, minute=30),
-            id='check_visite_mediche',
-            name='Controllo Visite Mediche in Scadenza',
-            replace_existing=True
-        )
-        
-        # Aggiungi job per reminder documentali (ogni giorno alle 8:00)
-        scheduler.add_job(
-            func=invia_promemoria_documenti,
-            trigger=CronTrigger(hour=8, minute=0),
-            id='reminder_documenti',
-            name='Reminder Documenti in Scadenza',
-            replace_existing=True
-        )
-        
-        # Aggiungi job per pulizia token scaduti (ogni ora)
-        scheduler.add_job(
-            func=cleanup_expired_tokens,
-            trigger=CronTrigger(minute=0),
-            id='cleanup_tokens',
-            name='Pulizia Token Scaduti',
-            replace_existing=True
-        )
-        
-        # Aggiungi job per verifica revisioni programmate (ogni lunedì alle 9:00)
-        scheduler.add_job(
-            func=verifica_revisioni_programmate,
-            trigger=CronTrigger(day_of_week='mon', hour=9, minute=0),
-            id='verifica_revisioni',
-            name='Verifica Revisioni Programmate',
-            replace_existing=True
-        )
-        
-        # Aggiungi job per reminder PDF (ogni giorno alle 8:00)
-        scheduler.add_job(
-            func=check_reminder_pdf_automatico,
-            trigger=CronTrigger(hour=8, minute=0),
-            id='reminder_pdf',
-            name='Controllo Reminder PDF Automatici',
-            replace_existing=True
-        )
-        
-        # Aggiungi job per verifica documenti abbandonati (ogni venerdì alle 10:00)
-        scheduler.add_job(
-            func=verifica_documenti_abbandonati,
-            trigger=CronTrigger(day_of_week='fri', hour=10, minute=0),
-            id='verifica_abbandonati',
-            name='Verifica Documenti Abbandonati',
-            replace_existing=True
-        )
-        
-        # Aggiungi job per monitoraggio AI download sospetti (ogni 10 minuti)
-        scheduler.add_job(
-            func=monitora_download_sospetti,
-            trigger=CronTrigger(minute='*/10'),
-            id='monitora_download_sospetti',
-            name='Monitoraggio AI Download Sospetti',
-            replace_existing=True
-        )
-        
-        # Aggiungi job per report CEO mensile (primo giorno del mese alle 9:00)
+    # Aggiungi job per generare reminder ogni giorno alle 6:00
+    scheduler.add_job(
+        func=genera_reminder,
+        trigger=CronTrigger(hour=6, minute=0),
+        id='genera_reminder',
+        name='Generazione Reminder Automatici',
+        replace_existing=True
+    )
+    
+    # Aggiungi job per processare reminder ogni giorno alle 7:00
+    scheduler.add_job(
+        func=processa_reminder,
+        trigger=CronTrigger(hour=7, minute=0),
+        id='processa_reminder',
+        name='Processamento Reminder Automatici',
+        replace_existing=True
+    )
+    
+    # Aggiungi job per invio email in coda (ogni minuto)
+    scheduler.add_job(
+        func=invia_email_in_coda,
+        args=[app],
+        trigger=CronTrigger(minute='*'),
+        id='invia_email_in_coda',
+        name='Invio Email in Coda',
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True
+    )
+    
+    # Aggiungi job per upload Google Drive in coda (ogni minuto)
+    scheduler.add_job(
+        func=sincronizza_drive_in_coda,
+        args=[app],
+        trigger=CronTrigger(minute='*'),
+        id='sincronizza_drive_in_coda',
+        name='Upload Google Drive in Coda',
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True
+    )
+    
+    # Aggiungi job per budget cache preview (ogni 30 minuti)
+    scheduler.add_job(
+        func=applica_budget_cache_preview,
+        args=[app],
+        trigger=CronTrigger(minute='*/30'),
+        id='budget_cache_preview',
+        name='Budget Cache Preview',
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True
+    )
+    
+    # Aggiungi job per rollup dei report (ogni REPORT_ROLLUP_INTERVAL_MIN minuti)
+    scheduler.add_job(
+        func=aggiorna_rollup_report,
+        args=[app],
+        trigger=IntervalTrigger(minutes=app.config.get('REPORT_ROLLUP_INTERVAL_MIN', 15)),
+        id='rollup_report',
+        name='Rollup Report Giornalieri e Mensili',
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True
+    )
+    
+    # Aggiungi job per snapshot di reporting (solo REPORTING_DATABASE_MODE=snapshot)
+    if app.config.get('REPORTING_DATABASE_MODE') == 'snapshot':
         scheduler.add_job(
-            func=genera_report_ceo_mensile_automatico,
-            trigger=CronTrigger(day=1, hour=9, minute=0),
-            id='report_ceo_mensile',
-            name='Report CEO Mensile Automatico',
-            replace_existing=True
+            func=aggiorna_snapshot_report,
+            args=[app],
+            trigger=IntervalTrigger(minutes=app.config.get('REPORT_SNAPSHOT_INTERVAL_MIN', 15)),
+            id='snapshot_report',
+            name='Snapshot Database di Reporting',
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True
         )
+    
+    # Aggiungi job per pulizia log vecchi (ogni domenica alle 2:00)
+    scheduler.add_job(
+        func=pulisci_log_vecchi,
+        trigger=CronTrigger(day_of_week='sun', hour=2, minute=0),
+        id='pulisci_log',
+        name='Pulizia Log Vecchi',
+        replace_existing=True
+    )
+    
+    # Aggiungi job per controllo visite mediche in scadenza (ogni giorno alle 6:30)
+    scheduler.add_job(
+        func=check_visite_scadenza,
+        trigger=CronTrigger(hour=6, minute=30),
+        id='check_visite_mediche',
+        name='Controllo Visite Mediche in Scadenza',
+        replace_existing=True
+    )
+    
+    # Aggiungi job per reminder documentali (ogni giorno alle 8:00)
+    scheduler.add_job(
+        func=invia_promemoria_documenti,
+        trigger=CronTrigger(hour=8, minute=0),
+        id='reminder_documenti',
+        name='Reminder Documenti in Scadenza',
+        replace_existing=True
+    )
+    
+    # Aggiungi job per pulizia token scaduti (ogni ora)
+    scheduler.add_job(
+        func=cleanup_expired_tokens,
+        trigger=CronTrigger(minute=0),
+        id='cleanup_tokens',
+        name='Pulizia Token Scaduti',
+        replace_existing=True
+    )
+    
+    # Aggiungi job per verifica revisioni programmate (ogni lunedì alle 9:00)
+    scheduler.add_job(
+        func=verifica_revisioni_programmate,
+        trigger=CronTrigger(day_of_week='mon', hour=9, minute=0),
+        id='verifica_revisioni',
+        name='Verifica Revisioni Programmate',
+        replace_existing=True
+    )
+    
+    # Aggiungi job per reminder PDF (ogni giorno alle 8:00)
+    scheduler.add_job(
+        func=check_reminder_pdf_automatico,
+        trigger=CronTrigger(hour=8, minute=0),
+        id='reminder_pdf',
+        name='Controllo Reminder PDF Automatici',
+        replace_existing=True
+    )
+    
+    # Aggiungi job per verifica documenti abbandonati (ogni venerdì alle 10:00)
+    scheduler.add_job(
+        func=verifica_documenti_abbandonati,
+        trigger=CronTrigger(day_of_week='fri', hour=10, minute=0),
+        id='verifica_abbandonati',
+        name='Verifica Documenti Abbandonati',
+        replace_existing=True
+    )
+    
+    # Aggiungi job per monitoraggio AI download sospetti (ogni 10 minuti)
+    scheduler.add_job(
+        func=monitora_download_sospetti,
+        trigger=CronTrigger(minute='*/10'),
+        id='monitora_download_sospetti',
+        name='Monitoraggio AI Download Sospetti',
+        replace_existing=True
+    )
+    
+    # Aggiungi job per report CEO mensile (primo giorno del mese alle 9:00)
+    scheduler.add_job(
+        func=genera_report_ceo_mensile_automatico,
+        trigger=CronTrigger(day=1, hour=9, minute=0),
+        id='report_ceo_mensile',
+        name='Report CEO Mensile Automatico',
+        replace_existing=True
+    )
+
+
+def registra_job_alert(scheduler, app):
+    """
+    Registra i job di detection alert, autotagging e sync Manus (scheduler_config).
+    
+    Args:
+        scheduler: Istanza APScheduler
+        app: Istanza dell'applicazione Flask
+    """
+    from scheduler_config import setup_jobs
+    setup_jobs(scheduler)
+
+
+def avvia_scheduler(app):
+    """
+    Avvia lo scheduler singleton del cluster.
+    
+    Tutti i worker partecipano alla leader election (vedi scheduler_leader):
+    solo il leader esegue i job, così ogni job gira una sola volta anche con
+    più worker gunicorn. Con SCHEDULER_MODE=external i worker web non
+    eseguono job e lo scheduler gira in `scheduler_worker.py`.
+    
+    Args:
+        app: Istanza dell'applicazione Flask
+    
+    Returns:
+        LeaderElectedScheduler: Scheduler avviato, None se disabilitato
+    """
+    try:
+        from scheduler_leader import LeaderElectedScheduler, get_scheduler_mode
         
-        scheduler.start()
-        logger.info("Scheduler APScheduler avviato con successo")
+        mode = get_scheduler_mode(app)
+        if mode != 'embedded':
+            logger.info(f"Scheduler non avviato nel worker web (SCHEDULER_MODE={mode})")
+            return None
         
-        # Salva il riferimento al scheduler nell'app
-        app.scheduler = scheduler
+        leader = LeaderElectedScheduler(app, [registra_job_reminder, registra_job_alert, registra_job_storage]).start()
+        app.scheduler_leader = leader
+        logger.info("Scheduler APScheduler in leader election avviato")
+        return leader
         
     except Exception as e:
         logger.error(f"Errore avvio scheduler: {str(e)}")
+        return None
 
 def pulisci_log_vecchi():
     """
@@ -678,6 +1021,10 @@ def pulisci_log_vecchi():
         
         logger.info(f"Eliminati {log_eliminati} log vecchi")
         
+        # Elimina email già inviate dalla coda in uscita
+        from services.mail_queue import pulisci_email_inviate
+        pulisci_email_inviate(giorni=30)
+        
     except Exception as e:
         logger.error(f"Errore pulizia log: {str(e)}")
 
@@ -689,7 +1036,10 @@ def ferma_scheduler(app):
         app: Istanza dell'applicazione Flask
     """
     try:
-        if hasattr(app, 'scheduler'):
+        if hasattr(app, 'scheduler_leader'):
+            app.scheduler_leader.stop()
+            logger.info("Scheduler APScheduler fermato")
+        elif hasattr(app, 'scheduler'):
             app.scheduler.shutdown()
             logger.info("Scheduler APScheduler fermato")
     except Exception as e:
@@ -9,7 +9,7 @@ from jobs.access_request_detection_job import detect_access_request_anomalies, e
 from services.download_alert_service import run_download_detection
 from services.ai.gpt_provider import GptProvider
 from services.document_service import list_documents_for_autotag, get_document_text, save_tags
-from services.manus_sync import sync_manuals, sync_courses, sync_completions_for_course
+from services.manus_sync import sync_manuals, sync_courses, sync_completions_for_company
 from models import ManusCourseLink
 import logging
 from datetime import datetime
@@ -126,11 +126,6 @@ def setup_jobs(scheduler):
             name='Sync Completamenti Manus',
             replace_existing=True
         )
-            minute=30,
-            id='ai_autotag_recent',
-            name='Autotagging AI Documenti Recenti',
-            replace_existing=True
-        )
         
         logger.info("✅ Job schedulati configurati correttamente")
         
@@ -196,19 +191,20 @@ def job_manus_sync_nightly():
 
 def job_manus_completions_hourly():
     """
-    Job orario per sync completamenti Manus.
+    Job orario per sync completamenti Manus (incrementale per azienda).
     """
     try:
-        course_links = ManusCourseLink.query.all()
+        aziende = [row[0] for row in ManusCourseLink.query.with_entities(ManusCourseLink.azienda_id).distinct()]
         processed, errors = 0, 0
         
-        for link in course_links:
+        for azienda_id in aziende:
             try:
-                sync_completions_for_course(link)
-                processed += 1
+                stats = sync_completions_for_company(azienda_id)
+                processed += stats['corsi']
+                errors += stats['errori']
             except Exception as e:
                 errors += 1
-                log.exception(f"[MANUS-COMPL] link_id={link.id} error={e}")
+                log.exception(f"[MANUS-COMPL] azienda_id={azienda_id} error={e}")
         
         log.info(f"[MANUS-COMPL] done processed={processed} errors={errors}")
         
@@ -217,7 +213,11 @@ def job_manus_completions_hourly():
 
 def start_scheduler():
     """
-    Avvia il scheduler.
+    Avvia il scheduler standalone con jobstore SQLite.
+    
+    Nota: l'applicazione registra questi job tramite `scheduler.avvia_scheduler`
+    (scheduler singleton con leader election); questa funzione resta per
+    l'uso manuale fuori dai worker web.
     """
     try:
         scheduler = create_scheduler()
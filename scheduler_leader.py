@@ -0,0 +1,439 @@
+"""
+Scheduler singleton con leader election per SYNTHIA DOCS.
+
+Ogni worker gunicorn importa `app.py`, quindi senza coordinamento ogni worker
+avvierebbe il proprio BackgroundScheduler ed eseguirebbe N volte gli stessi
+job. Qui i processi competono per un lock (Redis, database o file): solo il
+leader avvia lo scheduler, gli altri restano in standby e subentrano alla
+scadenza del lease.
+
+Modalità (variabile d'ambiente / config SCHEDULER_MODE):
+    - 'embedded' (default): i worker web partecipano alla leader election.
+    - 'external': i worker web non eseguono job; lo scheduler gira nel
+      processo dedicato `python scheduler_worker.py`.
+    - 'off': scheduler disabilitato.
+"""
+
+import atexit
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from sqlalchemy import insert, update, delete, or_
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models import SchedulerLeaderLock, ScheduledJobStatus
+
+logger = logging.getLogger(__name__)
+
+LOCK_NAME = 'synthia-scheduler'
+DEFAULT_LEASE_SEC = 60
+
+
+def _holder_id():
+    """Identificativo univoco del processo corrente (host:pid:token)."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+# === BACKEND DI LOCK ===
+
+# Confronto e rinnovo/rilascio in un unico comando: tra GET e EXPIRE/DEL il lease
+# potrebbe scadere e il lock passare a un altro processo
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisLeaderLock:
+    """Lock di leader election su Redis (SET NX EX + rinnovo/rilascio atomici con script Lua)."""
+
+    backend = 'redis'
+
+    def __init__(self, client, holder, name=LOCK_NAME, lease_sec=DEFAULT_LEASE_SEC):
+        self.client = client
+        self.holder = holder
+        self.key = f"lock:{name}"
+        self.lease_sec = lease_sec
+        self._renew = client.register_script(RENEW_SCRIPT)
+        self._release = client.register_script(RELEASE_SCRIPT)
+
+    def acquire(self):
+        if self.client.set(self.key, self.holder, nx=True, ex=self.lease_sec):
+            return True
+        return self.renew()
+
+    def renew(self):
+        return bool(self._renew(keys=[self.key], args=[self.holder, self.lease_sec]))
+
+    def release(self):
+        self._release(keys=[self.key], args=[self.holder])
+
+
+class DatabaseLeaderLock:
+    """Lock di leader election su tabella `scheduler_leader_lock` con lease."""
+
+    backend = 'db'
+
+    def __init__(self, engine, holder, name=LOCK_NAME, lease_sec=DEFAULT_LEASE_SEC):
+        self.engine = engine
+        self.holder = holder
+        self.name = name
+        self.lease_sec = lease_sec
+
+    def acquire(self):
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.lease_sec)
+        table = SchedulerLeaderLock.__table__
+        try:
+            with self.engine.begin() as conn:
+                result = conn.execute(
+                    update(table)
+                    .where(table.c.name == self.name)
+                    .where(or_(table.c.holder == self.holder, table.c.expires_at < now))
+                    .values(holder=self.holder, acquired_at=now, expires_at=expires_at)
+                )
+                if result.rowcount:
+                    return True
+                exists = conn.execute(table.select().where(table.c.name == self.name)).first()
+                if exists:
+                    return False
+                conn.execute(insert(table).values(
+                    name=self.name, holder=self.holder, acquired_at=now, expires_at=expires_at
+                ))
+                return True
+        except IntegrityError:
+            # Un altro processo ha inserito il lock nello stesso istante
+            return False
+
+    def renew(self):
+        return self.acquire()
+
+    def release(self):
+        table = SchedulerLeaderLock.__table__
+        with self.engine.begin() as conn:
+            conn.execute(delete(table).where(table.c.name == self.name, table.c.holder == self.holder))
+
+
+class FileLeaderLock:
+    """Lock di leader election su file (flock), valido solo per worker sullo stesso host."""
+
+    backend = 'file'
+
+    def __init__(self, path, holder):
+        self.path = path
+        self.holder = holder
+        self._fd = None
+
+    def acquire(self):
+        import fcntl
+
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, self.holder.encode())
+        self._fd = fd
+        return True
+
+    def renew(self):
+        return self._fd is not None
+
+    def release(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def create_leader_lock(app, holder):
+    """
+    Crea il lock in base a SCHEDULER_LOCK_BACKEND ('auto', 'redis', 'db', 'file').
+
+    In modalità 'auto' usa Redis se raggiungibile, altrimenti il database.
+
+    Args:
+        app: Istanza dell'applicazione Flask.
+        holder (str): Identificativo del processo.
+
+    Returns:
+        Oggetto lock con metodi acquire/renew/release.
+    """
+    backend = app.config.get('SCHEDULER_LOCK_BACKEND', os.getenv('SCHEDULER_LOCK_BACKEND', 'auto'))
+    lease_sec = int(app.config.get('SCHEDULER_LEASE_SEC', DEFAULT_LEASE_SEC))
+
+    if backend in ('auto', 'redis'):
+        try:
+            from infra.redis_client import get_redis_client, MockRedisClient
+
+            with app.app_context():
+                client = get_redis_client()
+            # Il mock Redis è locale al processo: non è un lock di cluster
+            if not isinstance(client, MockRedisClient):
+                return RedisLeaderLock(client, holder, lease_sec=lease_sec)
+        except Exception as e:
+            logger.warning(f"⚠️ Redis non disponibile per leader election: {e}")
+        if backend == 'redis':
+            raise RuntimeError("SCHEDULER_LOCK_BACKEND=redis ma Redis non è raggiungibile")
+
+    if backend == 'file':
+        path = app.config.get('SCHEDULER_LOCK_FILE', os.path.join(app.instance_path, 'scheduler.lock'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return FileLeaderLock(path, holder)
+
+    with app.app_context():
+        SchedulerLeaderLock.__table__.create(bind=db.engine, checkfirst=True)
+        return DatabaseLeaderLock(db.engine, holder, lease_sec=lease_sec)
+
+
+# === BOOKKEEPING DEI JOB ===
+
+def _save_job_status(job_id, **values):
+    """Aggiorna (o crea) la riga di bookkeeping di un job."""
+    status = db.session.get(ScheduledJobStatus, job_id)
+    if status is None:
+        status = ScheduledJobStatus(job_id=job_id, run_count=0, error_count=0)
+        db.session.add(status)
+    for key, value in values.items():
+        setattr(status, key, value)
+    return status
+
+
+def run_tracked_job(app, scheduler_ref, job_id, func, args, **kwargs):
+    """
+    Esegue un job nel contesto applicativo registrando durata ed esito.
+
+    Args:
+        app: Istanza dell'applicazione Flask.
+        scheduler_ref (LeaderElectedScheduler): Scheduler proprietario.
+        job_id (str): ID del job.
+        func (callable): Funzione originale del job.
+        args (tuple): Argomenti posizionali originali.
+    """
+    with app.app_context():
+        started_at = datetime.utcnow()
+        start = time.monotonic()
+        error = None
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            error = e
+            logger.exception(f"❌ Job {job_id} fallito: {e}")
+        duration_ms = int((time.monotonic() - start) * 1000)
+
+        try:
+            db.session.rollback()
+            status = _save_job_status(
+                job_id,
+                last_run_at=started_at,
+                last_duration_ms=duration_ms,
+                last_status='error' if error else 'success',
+                last_error=str(error)[:2000] if error else None,
+                next_run_at=scheduler_ref.next_run_time(job_id),
+                last_holder=scheduler_ref.holder
+            )
+            status.run_count = (status.run_count or 0) + 1
+            if error:
+                status.error_count = (status.error_count or 0) + 1
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"❌ Errore bookkeeping job {job_id}: {e}")
+
+
+# === SCHEDULER CON LEADER ELECTION ===
+
+class LeaderElectedScheduler:
+    """
+    Scheduler APScheduler avviato solo dal processo leader del cluster.
+
+    Un thread di heartbeat tenta di acquisire/rinnovare il lock ogni
+    `lease_sec / 3` secondi; se il lease viene perso lo scheduler viene
+    fermato e un altro processo subentra.
+    """
+
+    def __init__(self, app, registrars, lock=None):
+        """
+        Args:
+            app: Istanza dell'applicazione Flask.
+            registrars (list): Funzioni `registrar(scheduler, app)` che aggiungono i job.
+            lock: Lock di leader election (default `create_leader_lock`).
+        """
+        self.app = app
+        self.registrars = registrars
+        self.holder = _holder_id()
+        self.lock = lock or create_leader_lock(app, self.holder)
+        self.lease_sec = int(app.config.get('SCHEDULER_LEASE_SEC', DEFAULT_LEASE_SEC))
+        self.scheduler = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def is_leader(self):
+        return self.scheduler is not None and self.scheduler.running
+
+    def next_run_time(self, job_id):
+        """Prossima esecuzione del job (naive UTC) o None."""
+        if not self.scheduler:
+            return None
+        job = self.scheduler.get_job(job_id)
+        if not job or not job.next_run_time:
+            return None
+        return job.next_run_time.astimezone(timezone.utc).replace(tzinfo=None)
+
+    def _build_scheduler(self):
+        """Crea lo scheduler, registra i job e li avvolge con il bookkeeping."""
+        scheduler = BackgroundScheduler(
+            timezone=self.app.config.get('SCHEDULER_TIMEZONE', 'Europe/Rome'),
+            job_defaults={'coalesce': True, 'max_instances': 1, 'misfire_grace_time': 300}
+        )
+        for registrar in self.registrars:
+            try:
+                registrar(scheduler, self.app)
+            except Exception as e:
+                logger.error(f"❌ Errore registrazione job ({getattr(registrar, '__name__', registrar)}): {e}")
+
+        for job in scheduler.get_jobs():
+            job.modify(
+                func=run_tracked_job,
+                args=(self.app, self, job.id, job.func, tuple(job.args)),
+                kwargs=dict(job.kwargs)
+            )
+        return scheduler
+
+    def _recover_missed_runs(self):
+        """
+        Anticipa a subito i job la cui esecuzione pianificata è caduta
+        durante un cambio di leader (una sola esecuzione, coalesced).
+        """
+        now = datetime.utcnow()
+        with self.app.app_context():
+            missed = {
+                s.job_id for s in ScheduledJobStatus.query.filter(
+                    ScheduledJobStatus.next_run_at.isnot(None),
+                    ScheduledJobStatus.next_run_at < now - timedelta(seconds=self.lease_sec)
+                ).all()
+            }
+        for job_id in missed:
+            job = self.scheduler.get_job(job_id)
+            if job:
+                job.modify(next_run_time=datetime.now(self.scheduler.timezone))
+                logger.info(f"⏩ Job {job_id} recuperato dopo cambio leader")
+
+    def _record_next_runs(self):
+        with self.app.app_context():
+            for job in self.scheduler.get_jobs():
+                _save_job_status(job.id, name=job.name, next_run_at=self.next_run_time(job.id))
+            db.session.commit()
+
+    def _become_leader(self):
+        self.scheduler = self._build_scheduler()
+        self.scheduler.start()
+        try:
+            self._recover_missed_runs()
+            self._record_next_runs()
+        except Exception as e:
+            logger.error(f"❌ Errore bookkeeping avvio scheduler: {e}")
+        self.app.scheduler = self.scheduler
+        logger.info(f"👑 Scheduler leader: {self.holder} (lock {self.lock.backend}, {len(self.scheduler.get_jobs())} job)")
+
+    def _step_down(self):
+        if self.scheduler:
+            try:
+                self.scheduler.shutdown(wait=False)
+            except Exception:
+                pass
+        self.scheduler = None
+        logger.warning(f"⚠️ Lease scheduler perso da {self.holder}: standby")
+
+    def tick(self):
+        """Un ciclo di heartbeat: acquisisce, rinnova o rilascia la leadership."""
+        try:
+            if self.is_leader:
+                if not self.lock.renew():
+                    self._step_down()
+            elif self.lock.acquire():
+                self._become_leader()
+        except Exception as e:
+            logger.error(f"❌ Errore leader election scheduler: {e}")
+            if self.is_leader:
+                self._step_down()
+
+    def _run(self):
+        interval = max(1, self.lease_sec // 3)
+        while not self._stop.is_set():
+            self.tick()
+            self._stop.wait(interval)
+
+    def start(self):
+        """Avvia il thread di heartbeat (non bloccante)."""
+        self._thread = threading.Thread(target=self._run, name='scheduler-leader', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        return self
+
+    def run_forever(self):
+        """Esegue il heartbeat nel thread corrente (processo scheduler dedicato)."""
+        atexit.register(self.stop)
+        self._run()
+
+    def stop(self):
+        """Ferma lo scheduler e rilascia il lock."""
+        self._stop.set()
+        if self.scheduler:
+            try:
+                self.scheduler.shutdown(wait=False)
+            except Exception:
+                pass
+            self.scheduler = None
+        try:
+            self.lock.release()
+        except Exception:
+            pass
+
+
+def get_scheduler_mode(app):
+    """Restituisce la modalità scheduler configurata ('embedded', 'external', 'off')."""
+    return app.config.get('SCHEDULER_MODE', os.getenv('SCHEDULER_MODE', 'embedded'))
+
+
+def get_job_status():
+    """
+    Restituisce il bookkeeping di tutti i job.
+
+    Returns:
+        list[dict]: Stato dei job ordinato per job_id.
+    """
+    return [
+        {
+            'job_id': s.job_id,
+            'name': s.name,
+            'last_run_at': s.last_run_at.isoformat() if s.last_run_at else None,
+            'last_duration_ms': s.last_duration_ms,
+            'last_status': s.last_status,
+            'last_error': s.last_error,
+            'next_run_at': s.next_run_at.isoformat() if s.next_run_at else None,
+            'run_count': s.run_count,
+            'error_count': s.error_count,
+            'last_holder': s.last_holder,
+        }
+        for s in ScheduledJobStatus.query.order_by(ScheduledJobStatus.job_id).all()
+    ]
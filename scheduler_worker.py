@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Processo scheduler dedicato di SYNTHIA DOCS.
+
+Da usare con SCHEDULER_MODE=external nei worker web, così l'esecuzione dei
+job esce completamente da gunicorn:
+
+    SCHEDULER_MODE=external gunicorn app:app ...
+    python scheduler_worker.py
+
+Più istanze possono girare in parallelo (es. due host): la leader election
+garantisce che i job vengano eseguiti una sola volta.
+"""
+
+import logging
+import os
+
+# L'import di app.py non deve avviare lo scheduler embedded
+os.environ['SCHEDULER_MODE'] = 'off'
+
+from app import app  # noqa: E402
+from scheduler import registra_job_reminder, registra_job_alert, registra_job_storage  # noqa: E402
+from scheduler_leader import LeaderElectedScheduler  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    leader = LeaderElectedScheduler(app, [registra_job_reminder, registra_job_alert, registra_job_storage])
+    app.scheduler_leader = leader
+    logger.info(f"🚀 Scheduler dedicato avviato ({leader.holder}, lock {leader.lock.backend})")
+    try:
+        leader.run_forever()
+    except KeyboardInterrupt:
+        leader.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,62 +1,209 @@
 import asyncio
+import csv
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
 from app.models import Document, DocumentoAnalizzato
 from app.models.analisi_lean import AnalisiLean
 from app.services.pdf_ai import extract_text_from_pdf, generate_summary, classify_document
 from app.services.lean_checker import check_lean_principles
-from app.services.persistence import salva_risultato_analisi
+from app.services.persistence import salva_risultati_analisi
 from app.services.obeya_sync import sync_with_focusme_ai
 from app.services.notifiche_ai import invia_notifica_ai
 from sqlalchemy.orm import Session
-from datetime import datetime
-import csv
 
-async def analizza_documenti_non_analizzati(db: Session, from_date=None, to_date=None):
-    # Recupera documenti non ancora analizzati AI
-    query = db.query(Document).filter(Document.ai_analyzed == False)
+# Documenti in lavorazione contemporaneamente e documenti per commit/checkpoint
+CONCORRENZA = int(os.getenv("ANALISI_BATCH_CONCORRENZA", "8"))
+DIMENSIONE_BATCH = int(os.getenv("ANALISI_BATCH_DIMENSIONE", "50"))
+PROCESSI = int(os.getenv("ANALISI_BATCH_PROCESSI", str(os.cpu_count() or 2)))
+CHECKPOINT_PATH = os.getenv("ANALISI_BATCH_CHECKPOINT", "batch_report.checkpoint.json")
+
+# Pool di processi condiviso dalle corse del batch (la route CEO lo avvia a ogni richiesta)
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _pool_processi(processi: int) -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=processi)
+        return _pool
+
+
+def _scarta_pool(pool):
+    # Un worker terminato rompe il pool: la prossima richiesta ne crea uno nuovo
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def _analizza_file(filepath: str) -> dict:
+    # Eseguita nel pool di processi: estrazione testo, riassunto, classificazione e check Lean
+    testo = asyncio.run(extract_text_from_pdf(filepath))
+    if not testo:
+        return {"testo": False}
+    return {
+        "testo": True,
+        "summary": generate_summary(testo),
+        "classification": classify_document(testo),
+        "lean_check": check_lean_principles(testo),
+    }
+
+
+def _leggi_checkpoint(path: str, from_date, to_date):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        stato = json.load(f)
+    # Un checkpoint di un'altra finestra di date non è riprendibile
+    if stato.get("from_date") != from_date or stato.get("to_date") != to_date:
+        return None
+    return stato
+
+
+def _scrivi_checkpoint(path: str, stato: dict):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(stato, f)
+    os.replace(tmp, path)
+
+
+def _prossimo_batch(db: Session, dopo_id: int, from_date, to_date, limite: int):
+    query = db.query(Document).filter(Document.ai_analyzed == False, Document.id > dopo_id)
     if from_date:
         query = query.filter(Document.created_at >= from_date)
     if to_date:
         query = query.filter(Document.created_at <= to_date)
-    documenti = query.all()
-    report = []
-    for doc in documenti:
-        try:
-            testo = await extract_text_from_pdf(doc.filepath)
-            if not testo:
-                await invia_notifica_ai(doc.uploader_email, f"[AI][ERR] Documento ID {doc.id} – errore: Testo mancante o file corrotto", "Errore Analisi AI")
-                print(f"[AI][ERR] Documento ID {doc.id} – errore: Testo mancante o file corrotto")
-                report.append([doc.id, doc.filename, 'errore testo', ''])
-                continue
-            summary = generate_summary(testo)
-            classification = classify_document(testo)
-            lean = check_lean_principles(testo)
-            result = {
-                "filename": doc.filename,
-                "uploader": doc.uploader_email,
-                "summary": summary,
-                "classification": classification,
+    return query.order_by(Document.id).limit(limite).all()
+
+
+async def _notifica_errore(doc_id: int, email: str, errore):
+    await invia_notifica_ai(email, f"[AI][ERR] Documento ID {doc_id} – errore: {errore}", "Errore Analisi AI")
+    print(f"[AI][ERR] Documento ID {doc_id} – errore: {errore}")
+
+
+async def _elabora_batch(db: Session, documenti, pool, semaforo, writer):
+    loop = asyncio.get_running_loop()
+    # Attributi letti una volta: dopo commit/rollback gli oggetti scadono e ricaricarli costerebbe una query ciascuno
+    info = [(doc.id, doc.filename, doc.uploader_email) for doc in documenti]
+
+    async def analizza(doc):
+        async with semaforo:
+            try:
+                return await loop.run_in_executor(pool, _analizza_file, doc.filepath)
+            except BrokenProcessPool as e:
+                _scarta_pool(pool)
+                return {"errore": str(e)}
+            except Exception as e:
+                return {"errore": str(e)}
+
+    esiti = await asyncio.gather(*(analizza(doc) for doc in documenti))
+
+    righe, notifiche, analizzati, risultati = {}, [], [], []
+    for doc, (doc_id, filename, email), esito in zip(documenti, info, esiti):
+        if "errore" in esito:
+            notifiche.append(_notifica_errore(doc_id, email, esito["errore"]))
+            righe[doc_id] = [doc_id, filename, 'errore', esito["errore"]]
+        elif not esito["testo"]:
+            notifiche.append(_notifica_errore(doc_id, email, "Testo mancante o file corrotto"))
+            righe[doc_id] = [doc_id, filename, 'errore testo', '']
+        else:
+            analizzati.append((doc, doc_id, filename, email))
+            risultati.append({
+                "filename": filename,
+                "uploader": email,
+                "summary": esito["summary"],
+                "classification": esito["classification"],
                 "dates": {},
                 "signatures": {},
-                "lean_check": lean
-            }
-            documento_ai = salva_risultato_analisi(result, db)
-            await sync_with_focusme_ai(documento_ai)
-            if not documento_ai.synced:
-                await invia_notifica_ai(doc.uploader_email, f"[AI][SYNC FAIL] Documento ID {doc.id} non sincronizzato con Obeya", "Sync Obeya Fallito")
-            doc.ai_analyzed = True
+                "lean_check": esito["lean_check"]
+            })
+
+    async def sincronizza(documento_ai):
+        async with semaforo:
+            try:
+                await sync_with_focusme_ai(documento_ai)
+            except Exception as e:
+                print(f"[AI][ERR] Sync Obeya documento {documento_ai.id}: {e}")
+
+    # Prima il commit delle analisi: la sync Obeya parte solo per risultati confermati
+    documenti_ai = []
+    try:
+        if risultati:
+            documenti_ai = salva_risultati_analisi(risultati, db, commit=False)
+            for doc, _, _, _ in analizzati:
+                doc.ai_analyzed = True
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        documenti_ai = []
+        for doc, doc_id, filename, email in analizzati:
+            notifiche.append(_notifica_errore(doc_id, email, e))
+            righe[doc_id] = [doc_id, filename, 'errore', str(e)]
+
+    if documenti_ai:
+        await asyncio.gather(*(sincronizza(documento_ai) for documento_ai in documenti_ai))
+        sincronizzati = [documento_ai.synced for documento_ai in documenti_ai]
+        # Flag synced in un secondo commit: se fallisce le analisi restano salvate
+        try:
             db.commit()
-            print(f"[AI][OK] Documento ID {doc.id} analizzato e sincronizzato")
-            report.append([doc.id, doc.filename, 'ok', 'sincronizzato'])
         except Exception as e:
-            await invia_notifica_ai(doc.uploader_email, f"[AI][ERR] Documento ID {doc.id} – errore: {e}", "Errore Analisi AI")
-            print(f"[AI][ERR] Documento ID {doc.id} – errore: {e}")
-            report.append([doc.id, doc.filename, 'errore', str(e)])
-    # Salva report CSV
-    now = datetime.now().strftime('%Y%m%d_%H%M%S')
-    report_path = f"batch_report_{now}.csv"
-    with open(report_path, 'w', newline='') as f:
+            db.rollback()
+            print(f"[AI][ERR] Stato sync Obeya non salvato: {e}")
+        for (doc, doc_id, filename, email), synced in zip(analizzati, sincronizzati):
+            if not synced:
+                notifiche.append(invia_notifica_ai(email, f"[AI][SYNC FAIL] Documento ID {doc_id} non sincronizzato con Obeya", "Sync Obeya Fallito"))
+                righe[doc_id] = [doc_id, filename, 'ok', 'sync fallita']
+            else:
+                print(f"[AI][OK] Documento ID {doc_id} analizzato e sincronizzato")
+                righe[doc_id] = [doc_id, filename, 'ok', 'sincronizzato']
+
+    # Notifiche del batch inviate insieme
+    for esito in await asyncio.gather(*notifiche, return_exceptions=True):
+        if isinstance(esito, Exception):
+            print(f"[AI][ERR] Notifica non inviata: {esito}")
+
+    writer.writerows(righe[doc_id] for doc_id, _, _ in info)
+
+
+async def analizza_documenti_non_analizzati(db: Session, from_date=None, to_date=None, concorrenza: int = CONCORRENZA,
+                                            dimensione_batch: int = DIMENSIONE_BATCH, processi: int = PROCESSI,
+                                            checkpoint_path: str = CHECKPOINT_PATH, pool=None):
+    # Ripresa di una corsa interrotta: stesso report, documenti dopo l'ultimo id confermato
+    stato = _leggi_checkpoint(checkpoint_path, from_date, to_date)
+    if stato:
+        print(f"[AI][RESUME] Ripresa da documento ID > {stato['ultimo_id']} su {stato['report']}")
+    else:
+        now = datetime.now().strftime('%Y%m%d_%H%M%S')
+        stato = {"report": f"batch_report_{now}.csv", "ultimo_id": 0, "from_date": from_date, "to_date": to_date}
+    report_path = stato["report"]
+
+    semaforo = asyncio.Semaphore(concorrenza)
+    nuovo_report = not os.path.exists(report_path)
+    # Il report CSV è scritto riga per riga a ogni batch, non accumulato in memoria
+    with open(report_path, 'a', newline='') as f:
         writer = csv.writer(f)
-        writer.writerow(['ID', 'Nome', 'Stato AI', 'Esito Sync'])
-        writer.writerows(report)
+        if nuovo_report:
+            writer.writerow(['ID', 'Nome', 'Stato AI', 'Esito Sync'])
+        while True:
+            documenti = _prossimo_batch(db, stato["ultimo_id"], from_date, to_date, dimensione_batch)
+            if not documenti:
+                break
+            ultimo_id = documenti[-1].id
+            # Pool del modulo ripreso a ogni batch: sostituito se un worker lo ha rotto
+            await _elabora_batch(db, documenti, pool or _pool_processi(processi), semaforo, writer)
+            # Prima le righe su disco, poi il checkpoint: una ripresa non perde righe del report
+            f.flush()
+            stato["ultimo_id"] = ultimo_id
+            _scrivi_checkpoint(checkpoint_path, stato)
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
     print(f"[AI][REPORT] Report batch salvato in {report_path}")
-    return report_path 
\ No newline at end of file
+    return report_path
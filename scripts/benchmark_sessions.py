@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark dell'I/O di sessione per backend (services.session_backend).
+
+Per ogni backend simula N richieste di un utente autenticato: apertura della
+sessione dal cookie, aggiornamento di `last_activity` (come before_request di
+app.py) e salvataggio. Riporta latenza media/p95 per richiesta e dimensione
+del cookie; per il filesystem anche il numero di file creati.
+
+Avvio:
+    python scripts/benchmark_sessions.py --requests 2000 --users 200
+    python scripts/benchmark_sessions.py --redis-url redis://localhost:6379/2
+
+Il backend redis è misurato solo se --redis-url è raggiungibile.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask, request  # noqa: E402
+
+from services.session_backend import init_sessions  # noqa: E402
+
+PAYLOAD = {
+    '_user_id': '42',
+    '_fresh': True,
+    '_id': 'f' * 128,
+    'csrf_token': 'c' * 40,
+}
+
+
+def crea_app(backend: str, legacy_dir: str, redis_url: str = None) -> Flask:
+    app = Flask(f"bench_{backend}")
+    app.config.update(SECRET_KEY='benchmark', SESSION_BACKEND=backend, SESSION_LEGACY_DIR=legacy_dir,
+                      REDIS_URL=redis_url, PERMANENT_SESSION_LIFETIME=timedelta(minutes=30))
+    init_sessions(app)
+    return app
+
+
+def richiesta(app: Flask, cookie: str):
+    """Apre, aggiorna e salva la sessione; restituisce il cookie di risposta."""
+    headers = {'Cookie': f"{app.config['SESSION_COOKIE_NAME']}={cookie}"} if cookie else {}
+    with app.test_request_context('/', headers=headers):
+        interface = app.session_interface
+        sess = interface.open_session(app, request)
+        if not sess:
+            sess.update(PAYLOAD)
+        sess.permanent = True
+        sess['last_activity'] = datetime.utcnow()
+        sess.modified = True
+        response = app.response_class()
+        interface.save_session(app, sess, response)
+        valore = response.headers.get('Set-Cookie', '')
+        return valore.split(';', 1)[0].split('=', 1)[1] if valore else cookie
+
+
+def misura(app: Flask, requests: int, users: int) -> dict:
+    cookies = [None] * users
+    tempi = []
+    for numero in range(requests):
+        utente = numero % users
+        started = time.perf_counter()
+        cookies[utente] = richiesta(app, cookies[utente])
+        tempi.append(time.perf_counter() - started)
+    tempi.sort()
+    return {
+        'media_us': statistics.mean(tempi) * 1e6,
+        'p95_us': tempi[int(len(tempi) * 0.95) - 1] * 1e6,
+        'cookie_bytes': max(len(c or '') for c in cookies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--redis-url', default=None)
+    args = parser.parse_args()
+
+    backends = ['filesystem', 'cookie'] + (['redis'] if args.redis_url else [])
+    print(f"{'backend':<12} {'media µs':>10} {'p95 µs':>10} {'cookie B':>9} {'file':>6}")
+    for backend in backends:
+        with tempfile.TemporaryDirectory() as directory:
+            try:
+                app = crea_app(backend, directory, args.redis_url)
+                risultato = misura(app, args.requests, args.users)
+            except Exception as e:
+                print(f"{backend:<12} non disponibile: {e}")
+                continue
+            file = len(os.listdir(directory)) if backend == 'filesystem' else 0
+            print(f"{backend:<12} {risultato['media_us']:>10.1f} {risultato['p95_us']:>10.1f} "
+                  f"{risultato['cookie_bytes']:>9} {file:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Benchmark del fan-out Socket.IO tra più worker (message queue + presenza condivisa).
+
+Apre N client (default 1000) verso il server, autenticati con il cookie di
+sessione, e pubblica eventi `approval_event` sulla message queue da un
+emettitore esterno (come farebbe scheduler_worker.py o un altro worker).
+Per ogni evento misura la latenza emit -> ricezione su tutti i client e
+riporta p50/p95/max e gli eventi persi.
+
+Avvio (gunicorn con più worker e SOCKETIO_MESSAGE_QUEUE attiva):
+    python scripts/benchmark_socketio_fanout.py --cookie "session=..." --clients 1000 --events 20
+
+Richiede python-socketio[asyncio_client] (aiohttp) e redis.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import socketio
+
+NAMESPACE = '/approvals'
+
+
+async def apri_client(url: str, cookie: str, latenze: dict):
+    client = socketio.AsyncClient(reconnection=False)
+
+    @client.on('approval_event', namespace=NAMESPACE)
+    async def on_event(data):
+        if data.get('type') == 'benchmark':
+            latenze.setdefault(data['seq'], []).append(time.time() - data['sent_at'])
+
+    await client.connect(url, headers={'Cookie': cookie}, namespaces=['/', NAMESPACE],
+                         transports=['websocket'])
+    return client
+
+
+async def main_async(args):
+    latenze = {}
+    started = time.perf_counter()
+    client_aperti = []
+    for inizio in range(0, args.clients, args.batch):
+        blocco = range(inizio, min(inizio + args.batch, args.clients))
+        risultati = await asyncio.gather(*(apri_client(args.url, args.cookie, latenze) for _ in blocco),
+                                         return_exceptions=True)
+        client_aperti += [c for c in risultati if not isinstance(c, Exception)]
+    print(f"🔌 {len(client_aperti)}/{args.clients} client connessi in {time.perf_counter() - started:.1f}s")
+
+    emettitore = socketio.RedisManager(args.queue, write_only=True, channel=args.channel)
+    for seq in range(args.events):
+        emettitore.emit('approval_event', {'type': 'benchmark', 'seq': seq, 'sent_at': time.time()},
+                        namespace=NAMESPACE)
+        await asyncio.sleep(args.interval)
+    await asyncio.sleep(args.drain)
+
+    tutte = sorted(valore for valori in latenze.values() for valore in valori)
+    attese = len(client_aperti) * args.events
+    if tutte:
+        print(f"📨 ricezioni {len(tutte)}/{attese} (perse {attese - len(tutte)})")
+        print(f"⏱️ latenza p50 {statistics.median(tutte) * 1000:.1f} ms, "
+              f"p95 {tutte[max(0, int(len(tutte) * 0.95) - 1)] * 1000:.1f} ms, max {tutte[-1] * 1000:.1f} ms")
+    else:
+        print("⚠️ Nessun evento ricevuto: controllare SOCKETIO_MESSAGE_QUEUE e il canale")
+
+    await asyncio.gather(*(c.disconnect() for c in client_aperti), return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default="http://127.0.0.1:5000")
+    parser.add_argument('--cookie', required=True, help="Cookie di sessione (es. 'session=...')")
+    parser.add_argument('--queue', default="redis://localhost:6379/2", help="Message queue (SOCKETIO_MESSAGE_QUEUE)")
+    parser.add_argument('--channel', default="synthia-socketio", help="Canale (SOCKETIO_CHANNEL)")
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--batch', type=int, default=100, help="Connessioni aperte in parallelo")
+    parser.add_argument('--events', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=0.5)
+    parser.add_argument('--drain', type=float, default=3.0, help="Attesa finale per le ricezioni (s)")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Benchmark di concorrenza SQLite: letture e scritture al secondo per profilo.
+
+Su un database temporaneo (file) lancia thread lettori e scrittori per
+`--seconds` secondi e confronta:
+- baseline: nessun pragma (rollback journal), un commit per scrittura;
+- wal: pragma di services.db_profile, un commit per scrittura;
+- wal+coda: pragma e scritture tramite SerialWriter (batch).
+
+Le scritture sono righe di audit (security_audit_log), come quelle del
+middleware a ogni richiesta, seguite da `--think-ms` di lavoro simulato.
+Con --processes > 1 ogni profilo gira in più processi sullo stesso file,
+come i worker gunicorn.
+
+Avvio:
+    python scripts/benchmark_sqlite.py --readers 8 --writers 8 --seconds 10 --processes 2
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask  # noqa: E402
+from sqlalchemy import func, insert, select  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+from extensions import db  # noqa: E402
+from models import SecurityAuditLog  # noqa: E402
+from services.db_profile import SerialWriter, init_db_profile  # noqa: E402
+
+TABELLA = SecurityAuditLog.__table__
+
+PROFILI = {
+    'baseline': {'SQLITE_PRAGMAS_ENABLED': False, 'coda': False},
+    'wal': {'SQLITE_PRAGMAS_ENABLED': True, 'coda': False},
+    'wal+coda': {'SQLITE_PRAGMAS_ENABLED': True, 'coda': True},
+}
+
+
+def crea_app(path: str, profilo: dict) -> Flask:
+    app = Flask("bench_sqlite")
+    app.config.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{path}", SQLALCHEMY_TRACK_MODIFICATIONS=False,
+                      SQLITE_PRAGMAS_ENABLED=profilo['SQLITE_PRAGMAS_ENABLED'], DB_WRITE_QUEUE_ENABLED=False)
+    db.init_app(app)
+    init_db_profile(app)
+    return app
+
+
+def _lettore(app, stop, contatori):
+    with app.app_context():
+        while not stop.is_set():
+            try:
+                db.session.execute(select(func.count()).select_from(TABELLA).where(TABELLA.c.user_id == 1)).scalar()
+                db.session.execute(select(TABELLA).order_by(TABELLA.c.id.desc()).limit(20)).all()
+                db.session.rollback()
+                contatori['letture'] += 1
+            except OperationalError:
+                db.session.rollback()
+                contatori['locked'] += 1
+
+
+def _scrittore(app, stop, contatori, writer, think_sec):
+    with app.app_context():
+        numero = 0
+        while not stop.is_set():
+            numero += 1
+            valori = {'user_id': 1, 'ip': '10.0.0.1', 'action': f"POST bench_{numero}", 'meta': {'n': numero}}
+            try:
+                if writer is not None:
+                    writer.submit(SecurityAuditLog, valori)
+                else:
+                    db.session.execute(insert(TABELLA).values(**valori))
+                    db.session.commit()
+                contatori['scritture'] += 1
+            except OperationalError:
+                db.session.rollback()
+                contatori['locked'] += 1
+            # Resto della richiesta (template, risposta)
+            time.sleep(think_sec)
+
+
+def esegui_processo(path, nome, readers, writers, seconds, think_ms, risultati):
+    profilo = PROFILI[nome]
+    app = crea_app(path, profilo)
+    writer = SerialWriter(app) if profilo['coda'] else None
+    contatori = {'letture': 0, 'scritture': 0, 'locked': 0}
+    stop = threading.Event()
+    threads = [threading.Thread(target=_lettore, args=(app, stop, contatori)) for _ in range(readers)]
+    threads += [threading.Thread(target=_scrittore, args=(app, stop, contatori, writer, think_ms / 1000))
+                for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    if writer is not None:
+        writer.flush()
+        writer.stop()
+        contatori['locked'] += writer.errori
+    risultati.put(contatori)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--processes', type=int, default=2)
+    parser.add_argument('--think-ms', type=float, default=2, help="Lavoro simulato per richiesta di scrittura")
+    args = parser.parse_args()
+
+    print(f"{'profilo':<10} {'letture/s':>10} {'scritture/s':>12} {'locked':>8} {'righe':>8}")
+    for nome in PROFILI:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bench.db")
+            app = crea_app(path, PROFILI[nome])
+            with app.app_context():
+                TABELLA.create(bind=db.engine)
+                db.engine.dispose()
+
+            risultati = multiprocessing.Queue()
+            processi = [multiprocessing.Process(target=esegui_processo,
+                                                args=(path, nome, args.readers, args.writers, args.seconds,
+                                                      args.think_ms, risultati))
+                        for _ in range(args.processes)]
+            for processo in processi:
+                processo.start()
+            totali = {'letture': 0, 'scritture': 0, 'locked': 0}
+            for _ in processi:
+                for chiave, valore in risultati.get().items():
+                    totali[chiave] += valore
+            for processo in processi:
+                processo.join()
+
+            with app.app_context():
+                righe = db.session.execute(select(func.count()).select_from(TABELLA)).scalar()
+            print(f"{nome:<10} {totali['letture'] / args.seconds:>10.0f} {totali['scritture'] / args.seconds:>12.0f} "
+                  f"{totali['locked']:>8} {righe:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark dei motori di watermark (services.watermark_service): pikepdf e PyPDF2.
+
+Genera un PDF sintetico (default 300 pagine A4, alcune ruotate) e misura per
+ogni motore disponibile:
+- download "a freddo" (overlay da generare) e "a caldo" (overlay in cache);
+- picco di memoria Python (tracemalloc: esclude le allocazioni native di qpdf);
+- dimensione del PDF risultante.
+
+Avvio:
+    python scripts/benchmark_watermark.py --pages 300 --runs 3
+
+Richiede reportlab e almeno uno tra PyPDF2 e pikepdf.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.watermark_service import (  # noqa: E402
+    ENGINE_PIKEPDF, ENGINE_PYPDF2, PIKEPDF_AVAILABLE, PYPDF2_AVAILABLE, REPORTLAB_AVAILABLE, WatermarkService
+)
+
+TESTO = "User: mario.rossi | 01/01/2025 10:00 | IP: 10.0.0.1"
+
+
+def crea_pdf_sintetico(path: str, pages: int, rotated_every: int = 25):
+    """PDF con testo su ogni pagina; una pagina ogni `rotated_every` ha /Rotate 90."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    can = canvas.Canvas(path, pagesize=A4)
+    for number in range(1, pages + 1):
+        if rotated_every and number % rotated_every == 0:
+            can.setPageRotation(90)
+        can.setFont("Helvetica", 11)
+        for line in range(40):
+            can.drawString(60, 780 - line * 18, f"Manuale qualità - pagina {number} - riga {line + 1}")
+        can.showPage()
+    can.save()
+
+
+def misura(service: WatermarkService, pdf_path: str, engine: str) -> dict:
+    tracemalloc.start()
+    started = time.perf_counter()
+    output = service.watermark_file(pdf_path, TESTO, engine=engine)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    output.seek(0, os.SEEK_END)
+    size = output.tell()
+    output.close()
+    return {'secondi': elapsed, 'picco_mb': peak / (1024 * 1024), 'output_mb': size / (1024 * 1024)}
+
+
+def esegui(pages: int, runs: int) -> int:
+    if not REPORTLAB_AVAILABLE:
+        print("❌ reportlab non installato: impossibile generare overlay e PDF di prova")
+        return 1
+
+    engines = [name for name, ok in ((ENGINE_PIKEPDF, PIKEPDF_AVAILABLE), (ENGINE_PYPDF2, PYPDF2_AVAILABLE)) if ok]
+    if not engines:
+        print("❌ Nessun motore disponibile (pip install pikepdf PyPDF2)")
+        return 1
+
+    with tempfile.TemporaryDirectory() as workdir:
+        pdf_path = os.path.join(workdir, 'manuale.pdf')
+        crea_pdf_sintetico(pdf_path, pages)
+        print(f"📄 PDF sintetico: {pages} pagine, {os.path.getsize(pdf_path) / (1024 * 1024):.1f} MB")
+        print(f"{'motore':<10} {'freddo s':>9} {'caldo s':>9} {'picco MB':>9} {'output MB':>10} {'overlay':>8}")
+
+        for engine in engines:
+            service = WatermarkService()
+            freddo = misura(service, pdf_path, engine)
+            caldi = [misura(service, pdf_path, engine) for _ in range(runs)]
+            print(f"{engine:<10} {freddo['secondi']:>9.3f} "
+                  f"{statistics.median(r['secondi'] for r in caldi):>9.3f} "
+                  f"{max(r['picco_mb'] for r in caldi + [freddo]):>9.1f} "
+                  f"{freddo['output_mb']:>10.2f} {service.overlays.misses:>8}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=300, help="Pagine del PDF sintetico")
+    parser.add_argument('--runs', type=int, default=3, help="Ripetizioni a cache calda per motore")
+    args = parser.parse_args()
+    sys.exit(esegui(args.pages, args.runs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Server clamd locale (fake) per sviluppo e test della pipeline di ingest.
+
+Implementa il sottoinsieme del protocollo clamd usato da `services.clamd_client`:
+comandi `z` terminati da \\0, sessioni IDSESSION/END, PING, VERSION e INSTREAM.
+Un file è considerato infetto se contiene la stringa di test EICAR.
+
+Avvio:
+    python scripts/fake_clamd.py --port 3310
+
+Poi configurare l'app con CLAMAV_HOST=127.0.0.1, CLAMAV_PORT=3310 e
+CLAMAV_SOCKET= (vuoto, per non usare il socket Unix locale).
+"""
+
+import argparse
+import socketserver
+import struct
+import threading
+
+# Composta a runtime perché il sorgente stesso non venga segnalato dagli antivirus
+EICAR = b'X5O!P%@AP[4\\PZX54(P^)7CC)7}$' + b'EICAR-STANDARD-ANTIVIRUS-TEST-FILE!$H+H*'
+EICAR_NAME = 'Win.Test.EICAR_HDB-1'
+
+
+class FakeClamdState:
+    """Contatori del clamd fake."""
+
+    def __init__(self, engine='ClamAV 1.0.0', signature='27000'):
+        self.engine = engine
+        self.signature = signature
+        self.connections = 0
+        self.version_calls = 0
+        self.ping_calls = 0
+        self.scans = 0
+        self.bytes_ricevuti = 0
+        self.stream_max_length = 25 * 1024 * 1024
+        self.lock = threading.Lock()
+
+
+class FakeClamdHandler(socketserver.BaseRequestHandler):
+    """Gestisce una connessione clamd (anche in modalità IDSESSION)."""
+
+    def setup(self):
+        self.buffer = b''
+        with self.state.lock:
+            self.state.connections += 1
+
+    @property
+    def state(self) -> FakeClamdState:
+        return self.server.state
+
+    def _read(self, size):
+        while len(self.buffer) < size:
+            data = self.request.recv(65536)
+            if not data:
+                raise ConnectionError
+            self.buffer += data
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def _read_command(self):
+        while b'\0' not in self.buffer:
+            data = self.request.recv(4096)
+            if not data:
+                raise ConnectionError
+            self.buffer += data
+        command, self.buffer = self.buffer.split(b'\0', 1)
+        return command.lstrip(b'z').decode()
+
+    def _instream(self):
+        content = bytearray()
+        while True:
+            (length,) = struct.unpack('!L', self._read(4))
+            if length == 0:
+                break
+            content += self._read(length)
+            if len(content) > self.state.stream_max_length:
+                return 'INSTREAM size limit exceeded. ERROR', False
+        with self.state.lock:
+            self.state.scans += 1
+            self.state.bytes_ricevuti += len(content)
+        if EICAR in content:
+            return f'stream: {EICAR_NAME} FOUND', True
+        return 'stream: OK', True
+
+    def handle(self):
+        session = False
+        request_id = 0
+        try:
+            while True:
+                command = self._read_command()
+                if command == 'IDSESSION':
+                    session = True
+                    continue
+                if command == 'END':
+                    return
+
+                request_id += 1
+                keep_open = True
+                if command == 'PING':
+                    with self.state.lock:
+                        self.state.ping_calls += 1
+                    reply = 'PONG'
+                elif command == 'VERSION':
+                    with self.state.lock:
+                        self.state.version_calls += 1
+                    reply = f'{self.state.engine}/{self.state.signature}/Mon Jan  1 00:00:00 2024'
+                elif command == 'INSTREAM':
+                    reply, keep_open = self._instream()
+                else:
+                    reply = 'UNKNOWN COMMAND'
+
+                prefix = f'{request_id}: ' if session else ''
+                self.request.sendall(f'{prefix}{reply}'.encode() + b'\0')
+                if not session or not keep_open:
+                    return
+        except (ConnectionError, OSError):
+            return
+
+
+class FakeClamdServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def start_fake_clamd(host='127.0.0.1', port=0, **state_kwargs):
+    """
+    Avvia il clamd fake in un thread.
+
+    Args:
+        host (str): Indirizzo di ascolto.
+        port (int): Porta (0 = porta libera).
+        **state_kwargs: Versione engine/signature iniziali.
+
+    Returns:
+        FakeClamdServer: Server avviato (`server.state`, `server.port`, `server.shutdown()`).
+    """
+    server = FakeClamdServer((host, port), FakeClamdHandler)
+    server.state = FakeClamdState(**state_kwargs)
+    server.port = server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="clamd fake per sviluppo")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3310)
+    args = parser.parse_args()
+
+    server = start_fake_clamd(args.host, args.port)
+    print(f"🛡️ clamd fake in ascolto: CLAMAV_HOST={args.host} CLAMAV_PORT={server.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
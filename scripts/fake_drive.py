@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Endpoint Google Drive v3 locale (fake) per sviluppo e test della sincronizzazione.
+
+Espone il documento di discovery di Drive v3 (incluso in google-api-python-client)
+riscritto sull'indirizzo locale e implementa in memoria le chiamate usate da
+`services.drive_sync`: ricerca/creazione cartelle, upload resumable a chunk,
+lettura ed eliminazione file.
+
+Avvio:
+    python scripts/fake_drive.py --port 8765
+
+Poi configurare l'app con
+GOOGLE_DRIVE_DISCOVERY_URL=http://localhost:8765/discovery/v1/apis/drive/v3/rest
+e GOOGLE_DRIVE_ROOT_FOLDER_ID=root.
+"""
+
+import argparse
+import json
+import os
+import re
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import googleapiclient
+
+DISCOVERY_PATH = '/discovery/v1/apis/drive/v3/rest'
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+
+
+class FakeDriveState:
+    """Stato in memoria del Drive fake."""
+
+    def __init__(self):
+        self.files = {}
+        self.sessions = {}
+        self.bytes_ricevuti = 0
+        self.list_calls = 0
+        self.fail_puts = 0  # numero di PUT successive che rispondono 503
+        self.lock = threading.Lock()
+
+    def children(self, parent_id, name=None):
+        return [f for f in self.files.values()
+                if parent_id in f.get('parents', []) and (name is None or f['name'] == name)]
+
+
+def _load_discovery(base_url):
+    path = os.path.join(os.path.dirname(googleapiclient.__file__),
+                        'discovery_cache', 'documents', 'drive.v3.json')
+    with open(path) as f:
+        doc = json.load(f)
+    doc['rootUrl'] = f"{base_url}/"
+    doc['baseUrl'] = f"{base_url}/drive/v3/"
+    doc['batchPath'] = 'batch/drive/v3'
+    return json.dumps(doc).encode()
+
+
+class FakeDriveHandler(BaseHTTPRequestHandler):
+    """Handler HTTP delle API Drive simulate."""
+
+    server_version = 'FakeDrive/1.0'
+
+    def log_message(self, format, *args):  # noqa: A002 - firma di BaseHTTPRequestHandler
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    @property
+    def state(self) -> FakeDriveState:
+        return self.server.state
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_empty(self, status, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    # --- GET ---
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == DISCOVERY_PATH:
+            body = self.server.discovery
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif url.path == '/drive/v3/files':
+            self._list_files(parse_qs(url.query).get('q', [''])[0])
+        elif url.path.startswith('/drive/v3/files/'):
+            file_id = url.path.rsplit('/', 1)[1]
+            meta = self.state.files.get(file_id)
+            if meta is None:
+                self._send_json(404, {'error': {'code': 404, 'message': 'File not found'}})
+            else:
+                self._send_json(200, {k: v for k, v in meta.items() if k != 'content'})
+        else:
+            self._send_empty(404)
+
+    def _list_files(self, query):
+        with self.state.lock:
+            self.state.list_calls += 1
+            match = re.search(r"'(.+?)' in parents and name='((?:[^'\\]|\\.)*)'", query)
+            if match:
+                name = re.sub(r"\\(.)", r"\1", match.group(2))
+                found = self.state.children(match.group(1), name)
+            else:
+                found = list(self.state.files.values())[:1]
+        self._send_json(200, {'files': [{'id': f['id'], 'name': f['name']} for f in found]})
+
+    # --- POST ---
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        metadata = json.loads(self._read_body() or b'{}')
+
+        if url.path == '/drive/v3/files':
+            with self.state.lock:
+                file_id = uuid.uuid4().hex[:12]
+                self.state.files[file_id] = dict(metadata, id=file_id)
+            self._send_json(200, {'id': file_id})
+        elif url.path == '/upload/drive/v3/files' and params.get('uploadType') == ['resumable']:
+            parent_ids = metadata.get('parents', [])
+            if any(p not in self.state.files and p != self.server.root_id for p in parent_ids):
+                self._send_json(404, {'error': {'code': 404, 'message': 'Parent not found'}})
+                return
+            session_id = uuid.uuid4().hex
+            self.state.sessions[session_id] = {'metadata': metadata, 'data': bytearray()}
+            self._send_json(200, {}, headers={'Location': f"{self.server.base_url}/upload/session/{session_id}"})
+        else:
+            self._send_empty(404)
+
+    # --- PUT (chunk upload resumable) ---
+
+    def do_PUT(self):
+        url = urlparse(self.path)
+        session_id = url.path.rsplit('/', 1)[1]
+        data = self._read_body()
+        session = self.state.sessions.get(session_id)
+        if not url.path.startswith('/upload/session/') or session is None:
+            self._send_json(404, {'error': {'code': 404, 'message': 'Upload session not found'}})
+            return
+
+        with self.state.lock:
+            if self.state.fail_puts > 0 and data:
+                self.state.fail_puts -= 1
+                self._send_json(503, {'error': {'code': 503, 'message': 'Backend error'}})
+                return
+
+            content_range = self.headers.get('Content-Range', '')
+            match = re.match(r'bytes (\d+)-(\d+)/(\d+|\*)', content_range)
+            if match and data:
+                start = int(match.group(1))
+                del session['data'][start:]
+                session['data'].extend(data)
+                self.state.bytes_ricevuti += len(data)
+            total = content_range.rsplit('/', 1)[-1]
+            received = len(session['data'])
+
+            if total != '*' and received == int(total):
+                file_id = uuid.uuid4().hex[:12]
+                self.state.files[file_id] = dict(session['metadata'], id=file_id, size=str(received),
+                                                 content=bytes(session['data']))
+                del self.state.sessions[session_id]
+                self._send_json(200, {'id': file_id})
+                return
+
+        headers = {'Range': f"bytes=0-{received - 1}"} if received else {}
+        self._send_empty(308, headers=headers)
+
+    # --- DELETE ---
+
+    def do_DELETE(self):
+        file_id = urlparse(self.path).path.rsplit('/', 1)[1]
+        if self.state.files.pop(file_id, None) is None:
+            self._send_json(404, {'error': {'code': 404, 'message': 'File not found'}})
+        else:
+            self._send_empty(204)
+
+
+def start_fake_drive(host='127.0.0.1', port=0, root_id='root', verbose=False):
+    """
+    Avvia il Drive fake in un thread.
+
+    Args:
+        host (str): Indirizzo di ascolto.
+        port (int): Porta (0 = porta libera).
+        root_id (str): ID della cartella root.
+        verbose (bool): Log delle richieste su stderr.
+
+    Returns:
+        ThreadingHTTPServer: Server avviato (`server.state`, `server.discovery_url`, `server.shutdown()`).
+    """
+    server = ThreadingHTTPServer((host, port), FakeDriveHandler)
+    server.daemon_threads = True
+    server.state = FakeDriveState()
+    server.root_id = root_id
+    server.verbose = verbose
+    server.base_url = f"http://{host}:{server.server_address[1]}"
+    server.discovery_url = f"{server.base_url}{DISCOVERY_PATH}"
+    server.discovery = _load_discovery(server.base_url)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Google Drive v3 fake per sviluppo")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    server = start_fake_drive(args.host, args.port, verbose=True)
+    print(f"☁️ Drive fake in ascolto: GOOGLE_DRIVE_DISCOVERY_URL={server.discovery_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Load test degli endpoint serviti da asgi.py (uvicorn) rispetto agli endpoint Flask (gunicorn).
+
+Invia richieste concorrenti autenticate con il cookie di sessione di un admin
+e riporta per ogni endpoint latenza p50/p95, throughput ed errori. Con
+--ai-endpoint si include anche un endpoint che chiama OpenAI: è il caso in cui
+gli handler async liberano il processo mentre attendono la risposta.
+
+Avvio:
+    python scripts/loadtest_asgi.py --cookie "session=..." --concurrency 50 --requests 500
+
+Richiede httpx.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+ENDPOINT_ASGI = [
+    "/api/jack/docs/dashboard/0/trend?months=12",
+    "/docs/ai/reparto_stats",
+    "/docs/ai/statistiche",
+]
+ENDPOINT_FLASK = [
+    "/api/approvals/stats/trends",
+]
+ENDPOINT_AI = "/docs/ai/analizza_utilizzo"
+
+
+async def _worker(client: httpx.AsyncClient, path: str, coda: asyncio.Queue, latenze: list, errori: list):
+    while True:
+        try:
+            coda.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        started = time.perf_counter()
+        try:
+            response = await client.get(path)
+            if response.status_code >= 400:
+                errori.append(response.status_code)
+        except httpx.HTTPError as e:
+            errori.append(type(e).__name__)
+        latenze.append(time.perf_counter() - started)
+
+
+async def misura(base_url: str, path: str, cookie: str, concurrency: int, requests: int, timeout: float) -> dict:
+    coda: asyncio.Queue = asyncio.Queue()
+    for _ in range(requests):
+        coda.put_nowait(None)
+    latenze, errori = [], []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, headers={'Cookie': cookie}, limits=limits,
+                                 timeout=timeout) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(_worker(client, path, coda, latenze, errori) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    latenze.sort()
+    return {
+        'p50_ms': statistics.median(latenze) * 1000,
+        'p95_ms': latenze[max(0, int(len(latenze) * 0.95) - 1)] * 1000,
+        'rps': len(latenze) / elapsed,
+        'errori': len(errori),
+    }
+
+
+async def main_async(args):
+    casi = [(args.asgi_url, path) for path in ENDPOINT_ASGI]
+    casi += [(args.flask_url, path) for path in ENDPOINT_FLASK]
+    if args.ai_endpoint:
+        casi.append((args.asgi_url, ENDPOINT_AI))
+
+    print(f"{'endpoint':<48} {'p50 ms':>9} {'p95 ms':>9} {'req/s':>8} {'errori':>7}")
+    for base_url, path in casi:
+        richieste = min(args.requests, args.concurrency * 2) if path == ENDPOINT_AI else args.requests
+        risultato = await misura(base_url, path, args.cookie, args.concurrency, richieste, args.timeout)
+        print(f"{path:<48} {risultato['p50_ms']:>9.1f} {risultato['p95_ms']:>9.1f} "
+              f"{risultato['rps']:>8.1f} {risultato['errori']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--asgi-url', default="http://127.0.0.1:5001")
+    parser.add_argument('--flask-url', default="http://127.0.0.1:5000")
+    parser.add_argument('--cookie', required=True, help="Cookie di sessione di un admin (es. 'session=...')")
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--ai-endpoint', action='store_true', help="Include l'analisi AI (chiamate OpenAI reali)")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,16 @@ Script di migrazione dati da DOCS standard a DOCS Mercury.
 
 Trasferisce utenti e guest dal modulo DOCS standard al modulo DOCS Mercury (IP 138.68.80.169).
 
+L'origine è letta a batch con un cursore lato server; per ogni batch l'esistenza
+in destinazione è verificata con una sola query IN e utenti/guest e attività AI
+sono inseriti con insert multipli e un commit. Dopo ogni commit l'ultimo id di
+origine viene salvato nel checkpoint, così una migrazione interrotta riprende da lì.
+
 Uso:
-    python scripts/migrazione_docs_mercury.py --dry-run
+    python scripts/migrazione_docs_mercury.py --dry-run --report logs/diff_mercury.jsonl
     python scripts/migrazione_docs_mercury.py
-    python scripts/migrazione_docs_mercury.py --overwrite
+    python scripts/migrazione_docs_mercury.py --overwrite --batch-size 1000
+    python scripts/migrazione_docs_mercury.py --reset-checkpoint
 
 Variabili ambiente richieste:
     SOURCE_DB_URL: URL database origine (DOCS standard)
@@ -18,12 +24,12 @@ import os
 import sys
 import argparse
 import logging
+import time
 from datetime import datetime
-from typing import Dict, List, Optional, Tuple
-from sqlalchemy import create_engine, text, inspect
+from typing import Dict, Iterator, List, Optional, Tuple
+from sqlalchemy import bindparam, create_engine, text, inspect
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.exc import SQLAlchemyError
-import hashlib
 import json
 
 # Aggiungi il path del progetto
@@ -50,6 +56,10 @@ def setup_logging():
 
 logger = setup_logging()
 
+LOG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'logs')
+CHECKPOINT_FILE = os.path.join(LOG_DIR, 'migrazione_docs_mercury.checkpoint.json')
+DIFF_REPORT_FILE = os.path.join(LOG_DIR, 'migrazione_docs_mercury_diff.jsonl')
+
 class DatabaseConnector:
     """Gestisce le connessioni ai database."""
     
@@ -94,12 +104,163 @@ class DatabaseConnector:
             self.dest_session.close()
         logger.info("🔒 Connessioni database chiuse")
 
+USERS_QUERY = """
+    SELECT
+        id, username, email, password, first_name, last_name,
+        role, company_id, department_id, created_at, last_login,
+        is_active, access_expiration
+    FROM users
+    WHERE (company_id IN (
+        SELECT id FROM companies WHERE name LIKE '%Mercury%'
+    ) OR id IN (
+        SELECT user_id FROM user_companies uc
+        JOIN companies c ON uc.company_id = c.id
+        WHERE c.name LIKE '%Mercury%'
+    ))
+    AND id > :dopo
+    ORDER BY id
+"""
+
+GUESTS_QUERY = """
+    SELECT
+        id, email, password_hash, registered_at, is_active,
+        access_expiration, last_login
+    FROM guest_users
+    WHERE (id IN (
+        SELECT DISTINCT guest_user_id FROM guest_activities ga
+        JOIN documents d ON ga.document_id = d.id
+        JOIN companies c ON d.company_id = c.id
+        WHERE c.name LIKE '%Mercury%'
+    ) OR id IN (
+        SELECT DISTINCT guest_user_id FROM guest_comments gc
+        JOIN documents d ON gc.document_id = d.id
+        JOIN companies c ON d.company_id = c.id
+        WHERE c.name LIKE '%Mercury%'
+    ))
+    AND id > :dopo
+    ORDER BY id
+"""
+
+
+def _dati_utente(row: Dict) -> Dict:
+    email = row['email']
+    return {
+        'username': row.get('username', email.split('@')[0]),
+        'email': email,
+        'password': row.get('password', ''),
+        'first_name': row.get('first_name', ''),
+        'last_name': row.get('last_name', ''),
+        'role': row.get('role', 'user'),
+        'can_download': True,
+        'created_at': row.get('created_at', datetime.utcnow()),
+        'access_expiration': row.get('access_expiration')
+    }
+
+
+def _dati_guest(row: Dict) -> Dict:
+    return {
+        'email': row['email'],
+        'password_hash': row.get('password_hash', ''),
+        'registered_at': row.get('registered_at', datetime.utcnow())
+    }
+
+
+# Fasi della migrazione: query di origine, tabella di destinazione e campi confrontati per l'overwrite
+ENTITA = {
+    'users': {
+        'etichetta': 'utente',
+        'query': USERS_QUERY,
+        'tabella': 'users',
+        'fk_ai': 'user_id',
+        'dati': _dati_utente,
+        'campi_update': ('username', 'first_name', 'last_name', 'role', 'can_download', 'access_expiration'),
+        'insert': """
+            INSERT INTO users (username, email, password, first_name, last_name,
+                             role, can_download, created_at, access_expiration)
+            VALUES (:username, :email, :password, :first_name, :last_name,
+                   :role, :can_download, :created_at, :access_expiration)
+        """,
+        'update': """
+            UPDATE users SET
+                username = :username,
+                first_name = :first_name,
+                last_name = :last_name,
+                role = :role,
+                can_download = :can_download,
+                access_expiration = :access_expiration
+            WHERE email = :email
+        """,
+    },
+    'guests': {
+        'etichetta': 'guest',
+        'query': GUESTS_QUERY,
+        'tabella': 'guest_users',
+        'fk_ai': 'guest_id',
+        'dati': _dati_guest,
+        'campi_update': ('password_hash', 'registered_at'),
+        'insert': """
+            INSERT INTO guest_users (email, password_hash, registered_at)
+            VALUES (:email, :password_hash, :registered_at)
+        """,
+        'update': """
+            UPDATE guest_users SET
+                password_hash = :password_hash,
+                registered_at = :registered_at
+            WHERE email = :email
+        """,
+    },
+}
+
+
+def _normalizza(valore):
+    """Rende confrontabili valori letti da driver diversi (datetime vs stringa SQLite, bool vs 0/1)."""
+    if isinstance(valore, datetime):
+        return valore.isoformat(sep=' ')
+    if isinstance(valore, bool):
+        return int(valore)
+    return valore
+
+
+class Checkpoint:
+    """Ultimo id di origine confermato per fase, salvato su file JSON dopo ogni batch."""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.stato = {}
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.stato = json.load(f)
+
+    def get(self, fase: str) -> int:
+        return int(self.stato.get(fase, 0))
+
+    def set(self, fase: str, ultimo_id: int):
+        self.stato[fase] = ultimo_id
+        if not self.path:
+            return
+        # Scrittura atomica: un'interruzione non lascia un checkpoint troncato
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.stato, f)
+        os.replace(tmp, self.path)
+
+    def reset(self):
+        self.stato = {}
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
 class DataMigrator:
-    """Gestisce la migrazione dei dati."""
-    
-    def __init__(self, source_session: Session, dest_session: Session):
+    """Gestisce la migrazione dei dati a batch."""
+
+    def __init__(self, source_session: Session, dest_session: Session, batch_size: int = 500,
+                 checkpoint: Optional[Checkpoint] = None, report_path: Optional[str] = None):
         self.source_session = source_session
         self.dest_session = dest_session
+        self.batch_size = batch_size
+        self.checkpoint = checkpoint or Checkpoint(None)
+        self.report_path = report_path
+        self._report = None
         self.stats = {
             'users_imported': 0,
             'users_skipped': 0,
@@ -107,9 +268,10 @@ class DataMigrator:
             'guests_imported': 0,
             'guests_skipped': 0,
             'guests_updated': 0,
+            'throughput': {},
             'errors': []
         }
-    
+
     def get_table_info(self, session: Session, table_name: str) -> Optional[Dict]:
         """Ottiene informazioni sulla struttura di una tabella."""
         try:
@@ -124,330 +286,153 @@ class DataMigrator:
         except Exception as e:
             logger.error(f"Errore ottenimento info tabella {table_name}: {e}")
             return None
-    
-    def check_user_exists(self, email: str) -> bool:
-        """Verifica se un utente esiste già nel database destinazione."""
-        try:
-            result = self.dest_session.execute(
-                text("SELECT id FROM users WHERE email = :email"),
-                {'email': email}
-            )
-            return result.fetchone() is not None
-        except Exception as e:
-            logger.error(f"Errore verifica utente {email}: {e}")
-            return False
-    
-    def check_guest_exists(self, email: str) -> bool:
-        """Verifica se un guest esiste già nel database destinazione."""
-        try:
-            result = self.dest_session.execute(
-                text("SELECT id FROM guest_users WHERE email = :email"),
-                {'email': email}
-            )
-            return result.fetchone() is not None
-        except Exception as e:
-            logger.error(f"Errore verifica guest {email}: {e}")
-            return False
-    
-    def get_mercury_users(self) -> List[Dict]:
-        """Recupera gli utenti Mercury dal database origine."""
-        try:
-            # Query per utenti Mercury (azienda o modulo)
-            query = """
-                SELECT 
-                    id, username, email, password, first_name, last_name,
-                    role, company_id, department_id, created_at, last_login,
-                    is_active, access_expiration
-                FROM users 
-                WHERE company_id IN (
-                    SELECT id FROM companies WHERE name LIKE '%Mercury%'
-                ) OR id IN (
-                    SELECT user_id FROM user_companies uc 
-                    JOIN companies c ON uc.company_id = c.id 
-                    WHERE c.name LIKE '%Mercury%'
-                )
-            """
-            
-            result = self.source_session.execute(text(query))
-            users = []
-            
-            for row in result.fetchall():
-                user_dict = dict(row._mapping)
-                users.append(user_dict)
-            
-            logger.info(f"📊 Trovati {len(users)} utenti Mercury nel database origine")
-            return users
-            
-        except Exception as e:
-            logger.error(f"Errore recupero utenti Mercury: {e}")
-            return []
-    
-    def get_mercury_guests(self) -> List[Dict]:
-        """Recupera i guest Mercury dal database origine."""
-        try:
-            # Query per guest Mercury
-            query = """
-                SELECT 
-                    id, email, password_hash, registered_at, is_active,
-                    access_expiration, last_login
-                FROM guest_users 
-                WHERE id IN (
-                    SELECT DISTINCT guest_user_id FROM guest_activities ga
-                    JOIN documents d ON ga.document_id = d.id
-                    JOIN companies c ON d.company_id = c.id
-                    WHERE c.name LIKE '%Mercury%'
-                ) OR id IN (
-                    SELECT DISTINCT guest_user_id FROM guest_comments gc
-                    JOIN documents d ON gc.document_id = d.id
-                    JOIN companies c ON d.company_id = c.id
-                    WHERE c.name LIKE '%Mercury%'
-                )
-            """
-            
-            result = self.source_session.execute(text(query))
-            guests = []
-            
-            for row in result.fetchall():
-                guest_dict = dict(row._mapping)
-                guests.append(guest_dict)
-            
-            logger.info(f"📊 Trovati {len(guests)} guest Mercury nel database origine")
-            return guests
-            
-        except Exception as e:
-            logger.error(f"Errore recupero guest Mercury: {e}")
-            return []
-    
-    def migrate_user(self, user_data: Dict, dry_run: bool = False, overwrite: bool = False) -> bool:
-        """Migra un singolo utente."""
-        try:
-            email = user_data.get('email')
+
+    def stream_rows(self, query: str, dopo: int = 0) -> Iterator[List[Dict]]:
+        """Legge l'origine con un cursore lato server, un batch di righe alla volta."""
+        result = self.source_session.execute(
+            text(query), {'dopo': dopo},
+            execution_options={'stream_results': True, 'yield_per': self.batch_size}
+        )
+        for partition in result.mappings().partitions(self.batch_size):
+            yield [dict(row) for row in partition]
+
+    def existing_rows(self, spec: Dict, emails: List[str]) -> Dict[str, Dict]:
+        """Righe di destinazione già presenti per le email del batch, con una sola query IN."""
+        if not emails:
+            return {}
+        colonne = ', '.join(('id', 'email') + spec['campi_update'])
+        query = text(f"SELECT {colonne} FROM {spec['tabella']} WHERE email IN :emails").bindparams(
+            bindparam('emails', expanding=True))
+        result = self.dest_session.execute(query, {'emails': emails})
+        return {row['email']: dict(row) for row in result.mappings()}
+
+    def _scrivi_report(self, voce: Dict):
+        if not self.report_path:
+            return
+        if self._report is None:
+            self._report = open(self.report_path, 'w', encoding='utf-8')
+        self._report.write(json.dumps(voce, default=str, ensure_ascii=False) + '\n')
+
+    def _pianifica_batch(self, fase: str, rows: List[Dict], visti: set, overwrite: bool) -> Tuple[List, List, Dict]:
+        """Confronta il batch con la destinazione: righe da inserire, da aggiornare (con id) e conteggi."""
+        spec = ENTITA[fase]
+        conteggi = {'nuovi': 0, 'aggiornati': 0, 'saltati': 0}
+        candidati = []
+        for row in rows:
+            email = row.get('email')
             if not email:
-                logger.warning(f"⚠️ Utente senza email, skip: {user_data.get('username', 'N/A')}")
-                return False
-            
-            # Verifica se esiste già
-            exists = self.check_user_exists(email)
-            
-            if exists and not overwrite:
-                logger.info(f"⏭️ Utente già esistente, skip: {email}")
-                self.stats['users_skipped'] += 1
-                return False
-            
-            if dry_run:
-                logger.info(f"🔍 DRY RUN - Migrerebbe utente: {email}")
-                self.stats['users_imported'] += 1
-                return True
-            
-            # Prepara dati per inserimento
-            insert_data = {
-                'username': user_data.get('username', email.split('@')[0]),
-                'email': email,
-                'password': user_data.get('password', ''),
-                'first_name': user_data.get('first_name', ''),
-                'last_name': user_data.get('last_name', ''),
-                'role': user_data.get('role', 'user'),
-                'can_download': True,
-                'created_at': user_data.get('created_at', datetime.utcnow()),
-                'access_expiration': user_data.get('access_expiration')
+                logger.warning(f"⚠️ {spec['etichetta'].capitalize()} senza email, skip: ID {row.get('id', 'N/A')}")
+                conteggi['saltati'] += 1
+            elif email in visti:
+                conteggi['saltati'] += 1
+            else:
+                visti.add(email)
+                candidati.append(spec['dati'](row))
+
+        esistenti = self.existing_rows(spec, [dati['email'] for dati in candidati])
+        nuovi, aggiornati = [], []
+        for dati in candidati:
+            attuale = esistenti.get(dati['email'])
+            if attuale is None:
+                nuovi.append(dati)
+                self._scrivi_report({'tipo': spec['etichetta'], 'email': dati['email'], 'azione': 'nuovo'})
+                continue
+            differenze = {
+                campo: [attuale[campo], dati[campo]] for campo in spec['campi_update']
+                if _normalizza(attuale[campo]) != _normalizza(dati[campo])
             }
-            
-            if exists and overwrite:
-                # Aggiorna utente esistente
-                update_query = """
-                    UPDATE users SET 
-                        username = :username,
-                        first_name = :first_name,
-                        last_name = :last_name,
-                        role = :role,
-                        can_download = :can_download,
-                        access_expiration = :access_expiration
-                    WHERE email = :email
-                """
-                self.dest_session.execute(text(update_query), insert_data)
-                logger.info(f"🔄 Aggiornato utente: {email}")
-                self.stats['users_updated'] += 1
+            if overwrite and differenze:
+                aggiornati.append((attuale['id'], dati))
+                azione = 'aggiorna'
             else:
-                # Inserisce nuovo utente
-                insert_query = """
-                    INSERT INTO users (username, email, password, first_name, last_name, 
-                                     role, can_download, created_at, access_expiration)
-                    VALUES (:username, :email, :password, :first_name, :last_name,
-                           :role, :can_download, :created_at, :access_expiration)
-                """
-                self.dest_session.execute(text(insert_query), insert_data)
-                logger.info(f"✅ Migrato utente: {email}")
-                self.stats['users_imported'] += 1
-            
-            # Registra attività AI post-migrazione
-            if not dry_run:
-                self._registra_attivita_ai_utente(user_data.get('id'), email)
-            
-            return True
-            
-        except Exception as e:
-            error_msg = f"Errore migrazione utente {email}: {e}"
-            logger.error(error_msg)
-            self.stats['errors'].append(error_msg)
-            return False
-    
-    def _registra_attivita_ai_utente(self, user_id: int, email: str):
-        """Registra attività AI per un utente migrato."""
-        try:
-            # Recupera ID utente dal database destinazione
-            result = self.dest_session.execute(
-                text("SELECT id FROM users WHERE email = :email"),
-                {'email': email}
-            )
-            dest_user_id = result.fetchone()
-            
-            if dest_user_id:
-                # Inserisce record attività AI
-                insert_query = """
-                    INSERT INTO attivita_ai (user_id, stato_iniziale, note, created_at, updated_at)
-                    VALUES (:user_id, 'nuovo_import', :note, :created_at, :updated_at)
-                """
-                
-                note = f"Utente migrato da DOCS standard in data {datetime.utcnow().strftime('%Y-%m-%d')}"
-                
-                self.dest_session.execute(text(insert_query), {
-                    'user_id': dest_user_id[0],
-                    'note': note,
-                    'created_at': datetime.utcnow(),
-                    'updated_at': datetime.utcnow()
-                })
-                
-                logger.info(f"🤖 Registrata attività AI per utente: {email}")
-                
-        except Exception as e:
-            logger.error(f"Errore registrazione attività AI utente {email}: {e}")
-    
-    def _registra_attivita_ai_guest(self, guest_id: int, email: str):
-        """Registra attività AI per un guest migrato."""
-        try:
-            # Recupera ID guest dal database destinazione
-            result = self.dest_session.execute(
-                text("SELECT id FROM guest_users WHERE email = :email"),
-                {'email': email}
+                conteggi['saltati'] += 1
+                azione = 'salta' if differenze else 'invariato'
+            self._scrivi_report({'tipo': spec['etichetta'], 'email': dati['email'], 'azione': azione,
+                                 'differenze': differenze})
+        conteggi['nuovi'] = len(nuovi)
+        conteggi['aggiornati'] = len(aggiornati)
+        return nuovi, aggiornati, conteggi
+
+    def _scrivi_batch(self, fase: str, nuovi: List[Dict], aggiornati: List[Tuple[int, Dict]]):
+        """Insert e update multipli del batch, più un'attività AI per ogni riga migrata."""
+        spec = ENTITA[fase]
+        if nuovi:
+            self.dest_session.execute(text(spec['insert']), nuovi)
+        if aggiornati:
+            self.dest_session.execute(text(spec['update']), [dati for _, dati in aggiornati])
+
+        # Id assegnati ai nuovi record: una query per batch invece di una per riga
+        dest_ids = [dest_id for dest_id, _ in aggiornati]
+        if nuovi:
+            query = text(f"SELECT id FROM {spec['tabella']} WHERE email IN :emails").bindparams(
+                bindparam('emails', expanding=True))
+            dest_ids += self.dest_session.execute(query, {'emails': [dati['email'] for dati in nuovi]}).scalars().all()
+        if dest_ids:
+            adesso = datetime.utcnow()
+            note = f"{spec['etichetta'].capitalize()} migrato da DOCS standard in data {adesso.strftime('%Y-%m-%d')}"
+            self.dest_session.execute(
+                text(f"""
+                    INSERT INTO attivita_ai ({spec['fk_ai']}, stato_iniziale, note, created_at, updated_at)
+                    VALUES (:dest_id, 'nuovo_import', :note, :created_at, :updated_at)
+                """),
+                [{'dest_id': dest_id, 'note': note, 'created_at': adesso, 'updated_at': adesso}
+                 for dest_id in dest_ids]
             )
-            dest_guest_id = result.fetchone()
-            
-            if dest_guest_id:
-                # Inserisce record attività AI
-                insert_query = """
-                    INSERT INTO attivita_ai (guest_id, stato_iniziale, note, created_at, updated_at)
-                    VALUES (:guest_id, 'nuovo_import', :note, :created_at, :updated_at)
-                """
-                
-                note = f"Guest migrato da DOCS standard in data {datetime.utcnow().strftime('%Y-%m-%d')}"
-                
-                self.dest_session.execute(text(insert_query), {
-                    'guest_id': dest_guest_id[0],
-                    'note': note,
-                    'created_at': datetime.utcnow(),
-                    'updated_at': datetime.utcnow()
-                })
-                
-                logger.info(f"🤖 Registrata attività AI per guest: {email}")
-                
-        except Exception as e:
-            logger.error(f"Errore registrazione attività AI guest {email}: {e}")
-    
-    def migrate_guest(self, guest_data: Dict, dry_run: bool = False, overwrite: bool = False) -> bool:
-        """Migra un singolo guest."""
+
+    def migrate(self, fase: str, dry_run: bool = False, overwrite: bool = False) -> bool:
+        """Migra una fase ('users' o 'guests') a batch, riprendendo dall'ultimo checkpoint."""
+        spec = ENTITA[fase]
+        dopo = self.checkpoint.get(fase)
+        logger.info(f"🚀 Inizio migrazione {fase} (batch {self.batch_size}, da id > {dopo})...")
+
+        visti = set()
+        righe = 0
+        avvio = time.perf_counter()
         try:
-            email = guest_data.get('email')
-            if not email:
-                logger.warning(f"⚠️ Guest senza email, skip: ID {guest_data.get('id', 'N/A')}")
-                return False
-            
-            # Verifica se esiste già
-            exists = self.check_guest_exists(email)
-            
-            if exists and not overwrite:
-                logger.info(f"⏭️ Guest già esistente, skip: {email}")
-                self.stats['guests_skipped'] += 1
-                return False
-            
-            if dry_run:
-                logger.info(f"🔍 DRY RUN - Migrerebbe guest: {email}")
-                self.stats['guests_imported'] += 1
-                return True
-            
-            # Prepara dati per inserimento
-            insert_data = {
-                'email': email,
-                'password_hash': guest_data.get('password_hash', ''),
-                'registered_at': guest_data.get('registered_at', datetime.utcnow())
-            }
-            
-            if exists and overwrite:
-                # Aggiorna guest esistente
-                update_query = """
-                    UPDATE guest_users SET 
-                        password_hash = :password_hash,
-                        registered_at = :registered_at
-                    WHERE email = :email
-                """
-                self.dest_session.execute(text(update_query), insert_data)
-                logger.info(f"🔄 Aggiornato guest: {email}")
-                self.stats['guests_updated'] += 1
-            else:
-                # Inserisce nuovo guest
-                insert_query = """
-                    INSERT INTO guest_users (email, password_hash, registered_at)
-                    VALUES (:email, :password_hash, :registered_at)
-                """
-                self.dest_session.execute(text(insert_query), insert_data)
-                logger.info(f"✅ Migrato guest: {email}")
-                self.stats['guests_imported'] += 1
-            
-            # Registra attività AI post-migrazione
-            if not dry_run:
-                self._registra_attivita_ai_guest(guest_data.get('id'), email)
-            
-            return True
-            
+            for rows in self.stream_rows(spec['query'], dopo):
+                nuovi, aggiornati, conteggi = self._pianifica_batch(fase, rows, visti, overwrite)
+                if not dry_run:
+                    self._scrivi_batch(fase, nuovi, aggiornati)
+                    self.dest_session.commit()
+                    self.checkpoint.set(fase, rows[-1]['id'])
+
+                self.stats[f'{fase}_imported'] += conteggi['nuovi']
+                self.stats[f'{fase}_updated'] += conteggi['aggiornati']
+                self.stats[f'{fase}_skipped'] += conteggi['saltati']
+                righe += len(rows)
+                durata = time.perf_counter() - avvio
+                logger.info(f"📦 {fase}: {righe} righe ({righe / durata:.0f} righe/s) - ultimo id {rows[-1]['id']}")
         except Exception as e:
-            error_msg = f"Errore migrazione guest {email}: {e}"
+            self.dest_session.rollback()
+            error_msg = f"Errore migrazione {fase} dopo {righe} righe (ripresa da id > {self.checkpoint.get(fase)}): {e}"
             logger.error(error_msg)
             self.stats['errors'].append(error_msg)
             return False
-    
+        finally:
+            durata = time.perf_counter() - avvio
+            self.stats['throughput'][fase] = {'righe': righe, 'secondi': round(durata, 3),
+                                              'righe_al_secondo': round(righe / durata, 1) if durata else 0.0}
+
+        if righe == 0:
+            logger.warning(f"⚠️ Nessun {spec['etichetta']} Mercury da migrare")
+        logger.info(f"✅ Migrazione {fase} completata: {righe} righe lette")
+        return True
+
     def migrate_users(self, dry_run: bool = False, overwrite: bool = False) -> bool:
         """Migra tutti gli utenti Mercury."""
-        logger.info("🚀 Inizio migrazione utenti...")
-        
-        users = self.get_mercury_users()
-        if not users:
-            logger.warning("⚠️ Nessun utente Mercury trovato")
-            return True
-        
-        success_count = 0
-        for user in users:
-            if self.migrate_user(user, dry_run, overwrite):
-                success_count += 1
-        
-        logger.info(f"✅ Migrazione utenti completata: {success_count}/{len(users)}")
-        return success_count == len(users)
-    
+        return self.migrate('users', dry_run, overwrite)
+
     def migrate_guests(self, dry_run: bool = False, overwrite: bool = False) -> bool:
         """Migra tutti i guest Mercury."""
-        logger.info("🚀 Inizio migrazione guest...")
-        
-        guests = self.get_mercury_guests()
-        if not guests:
-            logger.warning("⚠️ Nessun guest Mercury trovato")
-            return True
-        
-        success_count = 0
-        for guest in guests:
-            if self.migrate_guest(guest, dry_run, overwrite):
-                success_count += 1
-        
-        logger.info(f"✅ Migrazione guest completata: {success_count}/{len(guests)}")
-        return success_count == len(guests)
-    
+        return self.migrate('guests', dry_run, overwrite)
+
+    def close_report(self):
+        """Chiude il report delle differenze, se aperto."""
+        if self._report is not None:
+            self._report.close()
+            self._report = None
+            logger.info(f"📝 Report differenze: {self.report_path}")
+
     def print_stats(self):
         """Stampa le statistiche della migrazione."""
         logger.info("📊 STATISTICHE MIGRAZIONE")
@@ -458,12 +443,15 @@ class DataMigrator:
         logger.info(f"👤 Guest importati: {self.stats['guests_imported']}")
         logger.info(f"⏭️ Guest saltati: {self.stats['guests_skipped']}")
         logger.info(f"🔄 Guest aggiornati: {self.stats['guests_updated']}")
-        
+        for fase, misura in self.stats['throughput'].items():
+            logger.info(f"⚡ {fase}: {misura['righe']} righe in {misura['secondi']}s "
+                        f"({misura['righe_al_secondo']} righe/s)")
+
         if self.stats['errors']:
             logger.error("❌ ERRORI:")
             for error in self.stats['errors']:
                 logger.error(f"   - {error}")
-        
+
         logger.info("=" * 50)
 
 def validate_environment():
@@ -494,6 +482,7 @@ Esempi:
   python scripts/migrazione_docs_mercury.py --dry-run
   python scripts/migrazione_docs_mercury.py
   python scripts/migrazione_docs_mercury.py --overwrite
+  python scripts/migrazione_docs_mercury.py --batch-size 1000 --reset-checkpoint
         """
     )
     
@@ -509,6 +498,30 @@ Esempi:
         help='Aggiorna anche i record già esistenti'
     )
     
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=500,
+        help='Righe per batch (lettura, verifica esistenza e insert)'
+    )
+    
+    parser.add_argument(
+        '--checkpoint',
+        default=CHECKPOINT_FILE,
+        help='File JSON con l\'ultimo id migrato per fase'
+    )
+    
+    parser.add_argument(
+        '--reset-checkpoint',
+        action='store_true',
+        help='Ignora il checkpoint e riparte dall\'inizio'
+    )
+    
+    parser.add_argument(
+        '--report',
+        help='Report JSONL delle differenze per record (default con --dry-run: logs/migrazione_docs_mercury_diff.jsonl)'
+    )
+    
     parser.add_argument(
         '--verbose',
         action='store_true',
@@ -536,6 +549,7 @@ Esempi:
     logger.info(f"📥 Destinazione: {dest_url}")
     logger.info(f"🔍 Dry run: {args.dry_run}")
     logger.info(f"🔄 Overwrite: {args.overwrite}")
+    logger.info(f"📦 Batch: {args.batch_size}")
     logger.info("=" * 60)
     
     # Connessione database
@@ -544,9 +558,15 @@ Esempi:
         logger.error("❌ Impossibile stabilire connessioni database")
         sys.exit(1)
     
+    migrator = None
     try:
         # Inizializza migratore
-        migrator = DataMigrator(connector.source_session, connector.dest_session)
+        checkpoint = Checkpoint(args.checkpoint)
+        if args.reset_checkpoint:
+            checkpoint.reset()
+        report_path = args.report or (DIFF_REPORT_FILE if args.dry_run else None)
+        migrator = DataMigrator(connector.source_session, connector.dest_session,
+                                batch_size=args.batch_size, checkpoint=checkpoint, report_path=report_path)
         
         # Migrazione utenti
         users_success = migrator.migrate_users(args.dry_run, args.overwrite)
@@ -570,6 +590,8 @@ Esempi:
         return 1
     
     finally:
+        if migrator is not None:
+            migrator.close_report()
         connector.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+SMTP sink locale per testare la coda email senza inviare posta reale.
+
+Avvio:
+    python scripts/smtp_sink.py --port 1025
+
+Poi configurare l'app con MAIL_SERVER=localhost, MAIL_PORT=1025,
+MAIL_USE_TLS=False e lanciare `flask send-queued-emails`.
+Richiede il pacchetto opzionale `aiosmtpd`.
+"""
+
+import argparse
+import time
+from email import message_from_bytes
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:  # pragma: no cover - dipendenza opzionale
+    Controller = None
+
+
+class SinkHandler:
+    """Handler aiosmtpd che conserva in memoria i messaggi ricevuti."""
+
+    def __init__(self, verbose=True):
+        self.messages = []
+        self.verbose = verbose
+
+    async def handle_DATA(self, server, session, envelope):
+        msg = message_from_bytes(envelope.content)
+        self.messages.append({
+            'from': envelope.mail_from,
+            'to': list(envelope.rcpt_tos),
+            'subject': msg.get('Subject'),
+            'session': id(session)
+        })
+        if self.verbose:
+            print(f"📨 {envelope.mail_from} → {', '.join(envelope.rcpt_tos)}: {msg.get('Subject')}")
+        return '250 Message accepted for delivery'
+
+
+def start_sink(host='127.0.0.1', port=1025, verbose=True):
+    """
+    Avvia il sink SMTP in un thread in background.
+
+    Args:
+        host (str): Indirizzo di ascolto.
+        port (int): Porta di ascolto.
+        verbose (bool): Stampa i messaggi ricevuti.
+
+    Returns:
+        tuple: (controller, handler) - chiamare controller.stop() per fermarlo.
+    """
+    if Controller is None:
+        raise RuntimeError("aiosmtpd non installato: pip install aiosmtpd")
+    handler = SinkHandler(verbose=verbose)
+    controller = Controller(handler, hostname=host, port=port)
+    controller.start()
+    return controller, handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SMTP sink locale per test della coda email")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1025)
+    args = parser.parse_args()
+
+    controller, handler = start_sink(args.host, args.port)
+    print(f"✅ SMTP sink in ascolto su {args.host}:{args.port} (CTRL+C per uscire)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        controller.stop()
+        print(f"\n📊 Messaggi ricevuti: {len(handler.messages)} "
+              f"in {len({m['session'] for m in handler.messages})} sessioni SMTP")
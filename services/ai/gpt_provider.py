@@ -3,12 +3,13 @@ import json
 import time
 import random
 from typing import Any, Dict, Optional
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
 _DEFAULT_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "30"))
 DEFAULT_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 
 _CLIENT = None
+_ASYNC_CLIENT = None
 
 def _client():
     """Ritorna il client OpenAI riutilizzabile."""
@@ -17,6 +18,44 @@ def _client():
         _CLIENT = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
     return _CLIENT
 
+def _async_client():
+    """Ritorna il client OpenAI async riutilizzabile (app ASGI, httpx async con retry interni)."""
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is None:
+        _ASYNC_CLIENT = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), timeout=_DEFAULT_TIMEOUT, max_retries=2)
+    return _ASYNC_CLIENT
+
+async def close_async_client():
+    """Chiude le connessioni del client async (shutdown dell'app ASGI)."""
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is not None:
+        await _ASYNC_CLIENT.close()
+        _ASYNC_CLIENT = None
+
+async def chat_async(system: str, prompt: str, model: Optional[str] = None,
+                     temperature: float = 0.3, max_tokens: int = 1500) -> str:
+    """
+    Chat completion senza bloccare il loop dell'evento.
+    
+    Args:
+        system (str): Istruzioni di sistema
+        prompt (str): Messaggio utente
+        model (str): Modello (default OPENAI_MODEL)
+        
+    Returns:
+        str: Testo della risposta
+    """
+    resp = await _async_client().chat.completions.create(
+        model=model or DEFAULT_MODEL,
+        messages=[
+            {"role": "system", "content": system},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=temperature,
+        max_tokens=max_tokens,
+    )
+    return resp.choices[0].message.content
+
 def _with_retry(fn, max_attempts=3):
     """Esegue una funzione con retry e backoff progressivo."""
     for attempt in range(1, max_attempts + 2):  # 5 tentativi soft
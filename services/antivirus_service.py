@@ -4,22 +4,45 @@ Gestisce scansioni ClamAV e calcolo hash SHA-256.
 """
 
 import hashlib
+import io
 import logging
 import os
-import socket
-import tempfile
 from datetime import datetime
-from typing import Dict, Any, Optional, Tuple
-from pathlib import Path
+from typing import Dict, Any, Optional, Tuple, BinaryIO
 
-import pyclamd
-from flask import current_app
+from sqlalchemy.orm import Session
 from extensions import db
-from models import FileHash, AntivirusScan, AntivirusVerdict
+from models import FileHash, AntivirusScan, AntivirusVerdict, AntivirusHashCache
+from services.clamd_client import ClamdClient, ClamdError
+from services.ingest import IngestResult, get_chunk_size, ingest_stream
 
 logger = logging.getLogger(__name__)
 
 
+def _error_result(details: str, engine: str = 'unknown', signature: str = 'unknown') -> Dict[str, Any]:
+    return {
+        'verdict': 'error',
+        'details': details,
+        'engine': engine,
+        'signature': signature
+    }
+
+
+class _ScanFeed:
+    """Inoltra i chunk alla sessione INSTREAM; un errore di rete non interrompe la lettura."""
+
+    def __init__(self, session):
+        self.session = session
+        self.error = None
+
+    def send(self, chunk: bytes):
+        if self.error is None:
+            try:
+                self.session.send(chunk)
+            except OSError as e:
+                self.error = e
+
+
 class AntivirusService:
     """
     Servizio per gestione antivirus e hash dei file.
@@ -27,35 +50,15 @@ class AntivirusService:
     
     def __init__(self):
         """Inizializza il servizio antivirus."""
-        self.clamav_host = os.getenv('CLAMAV_HOST', 'localhost')
-        self.clamav_port = int(os.getenv('CLAMAV_PORT', 3310))
         self.strict_mode = os.getenv('STRICT_UPLOAD_SECURITY', 'False').lower() == 'true'
-        self._connection = None
+        self._client = None
     
-    def _get_clamav_connection(self) -> Optional[pyclamd.ClamdAgnostic]:
-        """
-        Ottiene una connessione a ClamAV.
-        
-        Returns:
-            Optional[pyclamd.ClamdAgnostic]: Connessione ClamAV o None se fallita
-        """
-        try:
-            # Prima prova connessione socket Unix (più veloce)
-            if os.path.exists('/var/run/clamav/clamd.ctl'):
-                cd = pyclamd.ClamdUnixSocket('/var/run/clamav/clamd.ctl')
-                if cd.ping():
-                    return cd
-            
-            # Fallback a connessione TCP
-            cd = pyclamd.ClamdNetworkSocket(host=self.clamav_host, port=self.clamav_port)
-            if cd.ping():
-                return cd
-                
-            return None
-            
-        except Exception as e:
-            logger.warning(f"Impossibile connettersi a ClamAV: {e}")
-            return None
+    @property
+    def client(self) -> ClamdClient:
+        """Client clamd con connessioni persistenti (creato al primo uso)."""
+        if self._client is None:
+            self._client = ClamdClient.from_env()
+        return self._client
     
     def calculate_sha256(self, file_path: str) -> str:
         """
@@ -71,11 +74,12 @@ class AntivirusService:
             IOError: Se il file non può essere letto
         """
         sha256_hash = hashlib.sha256()
+        chunk_size = get_chunk_size()
         
         try:
             with open(file_path, "rb") as f:
                 # Leggi il file a blocchi per gestire file grandi
-                for byte_block in iter(lambda: f.read(4096), b""):
+                for byte_block in iter(lambda: f.read(chunk_size), b""):
                     sha256_hash.update(byte_block)
             
             return sha256_hash.hexdigest()
@@ -84,6 +88,104 @@ class AntivirusService:
             logger.error(f"Errore calcolo hash per {file_path}: {e}")
             raise
     
+    def _is_known_clean(self, sha256: str, signature: str) -> bool:
+        try:
+            return db.session.get(AntivirusHashCache, (sha256, signature)) is not None
+        except Exception as e:
+            logger.warning(f"Cache hash antivirus non disponibile: {e}")
+            return False
+    
+    def _remember_clean(self, result: IngestResult):
+        # Sessione separata: non committa le modifiche in sospeso del chiamante
+        try:
+            with Session(db.engine) as session:
+                session.merge(AntivirusHashCache(
+                    sha256=result.sha256,
+                    signature=result.scan['signature'],
+                    engine=result.scan['engine'],
+                    size=result.size
+                ))
+                session.commit()
+        except Exception as e:
+            logger.warning(f"Impossibile salvare hash pulito {result.sha256[:12]}: {e}")
+    
+    def ingest(self, stream: BinaryIO, dest_path: Optional[str] = None,
+               filename: Optional[str] = None) -> IngestResult:
+        """
+        Legge lo stream una sola volta calcolando hash, dimensione, MIME e verdetto antivirus.
+        
+        I chunk sono inviati a clamd (INSTREAM) durante la lettura. Se l'hash
+        risulta già pulito per la versione signature corrente, lo stream viene
+        interrotto senza far eseguire la scansione.
+        
+        Args:
+            stream: Stream binario da leggere
+            dest_path: Percorso su cui salvare il contenuto (opzionale)
+            filename: Nome originale del file (per il MIME)
+            
+        Returns:
+            IngestResult: Hash, dimensione, MIME e risultato scansione in `scan`
+        """
+        feed = None
+        engine = signature = 'unknown'
+        try:
+            engine, signature = self.client.version()
+            feed = _ScanFeed(self.client.instream())
+        except ClamdError as e:
+            logger.warning(f"ClamAV non disponibile: {e}")
+        
+        try:
+            result = ingest_stream(stream, dest_path=dest_path, filename=filename, scanner=feed)
+        except Exception:
+            if feed:
+                feed.session.abort()
+            raise
+        
+        if feed is None:
+            result.scan = _error_result('ClamAV service unavailable')
+            return result
+        
+        if self._is_known_clean(result.sha256, signature):
+            feed.session.abort()
+            result.scan = {
+                'verdict': 'clean',
+                'details': 'No threats detected (hash already scanned)',
+                'engine': engine,
+                'signature': signature,
+                'cached': True
+            }
+            return result
+        
+        if feed.error is not None:
+            feed.session.abort()
+            logger.error(f"Errore invio stream a ClamAV: {feed.error}")
+            result.scan = _error_result(f'Scan error: {feed.error}', engine, signature)
+            return result
+        
+        try:
+            verdict, threat_name = feed.session.finish()
+        except ClamdError as e:
+            logger.error(f"Errore scansione ClamAV: {e}")
+            result.scan = _error_result(f'Scan error: {str(e)}', engine, signature)
+            return result
+        
+        if verdict == 'infected':
+            result.scan = {
+                'verdict': 'infected',
+                'details': f'Threat detected: {threat_name}',
+                'engine': engine,
+                'signature': signature
+            }
+        else:
+            result.scan = {
+                'verdict': 'clean',
+                'details': 'No threats detected',
+                'engine': engine,
+                'signature': signature
+            }
+            self._remember_clean(result)
+        return result
+    
     def scan_file_content(self, file_content: bytes) -> Dict[str, Any]:
         """
         Scansiona il contenuto di un file con ClamAV.
@@ -98,60 +200,11 @@ class AntivirusService:
                   - engine: versione engine
                   - signature: versione signature
         """
-        try:
-            cd = self._get_clamav_connection()
-            
-            if not cd:
-                logger.warning("ClamAV non disponibile")
-                return {
-                    'verdict': 'error',
-                    'details': 'ClamAV service unavailable',
-                    'engine': 'unknown',
-                    'signature': 'unknown'
-                }
-            
-            # Ottieni informazioni versione
-            try:
-                version_info = cd.version()
-                engine_version = version_info.split('/')[0] if version_info else 'unknown'
-                signature_version = version_info.split('/')[1] if '/' in version_info else 'unknown'
-            except:
-                engine_version = 'unknown'
-                signature_version = 'unknown'
-            
-            # Scansiona il contenuto
-            scan_result = cd.scan_stream(file_content)
-            
-            if scan_result is None:
-                # File pulito
-                return {
-                    'verdict': 'clean',
-                    'details': 'No threats detected',
-                    'engine': engine_version,
-                    'signature': signature_version
-                }
-            else:
-                # File infetto
-                threat_name = scan_result.get('stream', 'Unknown threat')
-                return {
-                    'verdict': 'infected',
-                    'details': f'Threat detected: {threat_name}',
-                    'engine': engine_version,
-                    'signature': signature_version
-                }
-                
-        except Exception as e:
-            logger.error(f"Errore scansione ClamAV: {e}")
-            return {
-                'verdict': 'error',
-                'details': f'Scan error: {str(e)}',
-                'engine': 'unknown',
-                'signature': 'unknown'
-            }
+        return self.ingest(io.BytesIO(file_content)).scan
     
     def scan_file_path(self, file_path: str) -> Dict[str, Any]:
         """
-        Scansiona un file dal percorso con ClamAV.
+        Scansiona un file dal percorso con ClamAV (lettura in streaming).
         
         Args:
             file_path: Percorso del file
@@ -161,32 +214,28 @@ class AntivirusService:
         """
         try:
             with open(file_path, 'rb') as f:
-                file_content = f.read()
-            
-            return self.scan_file_content(file_content)
+                return self.ingest(f, filename=os.path.basename(file_path)).scan
             
         except IOError as e:
             logger.error(f"Errore lettura file {file_path}: {e}")
-            return {
-                'verdict': 'error',
-                'details': f'File read error: {str(e)}',
-                'engine': 'unknown',
-                'signature': 'unknown'
-            }
+            return _error_result(f'File read error: {str(e)}')
     
-    def save_file_hash(self, file_id: int, file_path: str) -> bool:
+    def save_file_hash(self, file_id: int, file_path: Optional[str] = None,
+                       hash_value: Optional[str] = None) -> bool:
         """
         Calcola e salva l'hash SHA-256 di un file nel database.
         
         Args:
             file_id: ID del file nel database
-            file_path: Percorso del file
+            file_path: Percorso del file (letto solo se hash_value non è fornito)
+            hash_value: Hash già calcolato durante l'ingest
             
         Returns:
             bool: True se salvato con successo
         """
         try:
-            hash_value = self.calculate_sha256(file_path)
+            if hash_value is None:
+                hash_value = self.calculate_sha256(file_path)
             
             # Controlla se esiste già un hash per questo file
             existing_hash = FileHash.query.filter_by(file_id=file_id).first()
@@ -245,9 +294,52 @@ class AntivirusService:
             db.session.rollback()
             return False
     
+    def record_ingest(self, file_id: int, result: IngestResult) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Salva hash e verdetto di un ingest già eseguito, senza rileggere il file.
+        
+        Più documenti creati dallo stesso upload condividono un solo ingest.
+        
+        Args:
+            file_id: ID del file nel database
+            result: Risultato di `ingest`
+            
+        Returns:
+            Tuple[bool, Dict]: (success, scan_result)
+                success: True se il file è sicuro e può essere conservato
+                scan_result: Dettagli della scansione (con 'sha256', 'size', 'mime')
+        """
+        scan_result = dict(result.scan or _error_result('Scan not performed'),
+                           sha256=result.sha256, size=result.size, mime=result.mime)
+        
+        # 1. Salva hash SHA-256
+        if not self.save_file_hash(file_id, hash_value=result.sha256):
+            logger.warning(f"Impossibile salvare hash per file {file_id}")
+        
+        # 2. Salva risultato scansione
+        if not self.save_antivirus_scan(file_id, scan_result):
+            logger.warning(f"Impossibile salvare risultato scansione per file {file_id}")
+        
+        # 3. Determina se il file è sicuro
+        if scan_result['verdict'] == 'infected':
+            logger.warning(f"File {file_id} infetto: {scan_result['details']}")
+            return False, scan_result
+        
+        elif scan_result['verdict'] == 'error':
+            if self.strict_mode:
+                logger.warning(f"Modalità strict: rifiuto file {file_id} per errore scansione")
+                return False, scan_result
+            else:
+                logger.warning(f"Errore scansione file {file_id}, ma modalità permissiva attiva")
+                return True, scan_result
+        
+        else:  # clean
+            logger.info(f"File {file_id} scansionato e risultato pulito")
+            return True, scan_result
+    
     def process_uploaded_file(self, file_path: str, file_id: int) -> Tuple[bool, Dict[str, Any]]:
         """
-        Processa un file appena caricato: calcola hash e scansiona con antivirus.
+        Processa un file appena caricato: hash e scansione antivirus in una sola lettura.
         
         Args:
             file_path: Percorso del file caricato
@@ -259,44 +351,13 @@ class AntivirusService:
                 scan_result: Dettagli della scansione
         """
         try:
-            # 1. Calcola e salva hash SHA-256
-            hash_saved = self.save_file_hash(file_id, file_path)
-            if not hash_saved:
-                logger.warning(f"Impossibile salvare hash per file {file_id}")
-            
-            # 2. Scansiona con antivirus
-            scan_result = self.scan_file_path(file_path)
-            
-            # 3. Salva risultato scansione
-            scan_saved = self.save_antivirus_scan(file_id, scan_result)
-            if not scan_saved:
-                logger.warning(f"Impossibile salvare risultato scansione per file {file_id}")
-            
-            # 4. Determina se il file è sicuro
-            if scan_result['verdict'] == 'infected':
-                logger.warning(f"File {file_id} infetto: {scan_result['details']}")
-                return False, scan_result
-            
-            elif scan_result['verdict'] == 'error':
-                if self.strict_mode:
-                    logger.warning(f"Modalità strict: rifiuto file {file_id} per errore scansione")
-                    return False, scan_result
-                else:
-                    logger.warning(f"Errore scansione file {file_id}, ma modalità permissiva attiva")
-                    return True, scan_result
-            
-            else:  # clean
-                logger.info(f"File {file_id} scansionato e risultato pulito")
-                return True, scan_result
+            with open(file_path, 'rb') as f:
+                result = self.ingest(f, filename=os.path.basename(file_path))
+            return self.record_ingest(file_id, result)
             
         except Exception as e:
             logger.error(f"Errore processamento file {file_id}: {e}")
-            error_result = {
-                'verdict': 'error',
-                'details': f'Processing error: {str(e)}',
-                'engine': 'unknown',
-                'signature': 'unknown'
-            }
+            error_result = _error_result(f'Processing error: {str(e)}')
             
             if self.strict_mode:
                 return False, error_result
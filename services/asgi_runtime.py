@@ -0,0 +1,108 @@
+"""
+Supporto per l'app ASGI (asgi.py): database e autenticazione nei router FastAPI.
+
+Modelli e servizi usano la sessione sincrona di Flask-SQLAlchemy (`db.session`,
+legata all'app context Flask), quindi gli handler async non la toccano mai dal
+loop: `run_db` esegue la funzione in un threadpool limitato a ASGI_DB_THREADS
+(da tenere entro il pool di connessioni del database) dentro un app context e
+chiude la sessione alla fine. Il loop resta libero per le chiamate async
+(OpenAI, httpx) e per le altre richieste.
+
+`require_roles` riusa il login dell'app Flask: il cookie di sessione della
+richiesta viene aperto da Flask-Session e l'utente caricato da Flask-Login,
+come in una richiesta Flask.
+"""
+
+import functools
+import logging
+from typing import Any, Callable, Optional
+
+import anyio
+from fastapi import HTTPException, Request
+
+from extensions import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_THREADS = 8
+
+_flask_app = None
+_limiter: Optional[anyio.CapacityLimiter] = None
+
+
+def init_asgi_runtime(flask_app):
+    """Collega l'app Flask (configurazione, database, login) al runtime ASGI."""
+    global _flask_app, _limiter
+    _flask_app = flask_app
+    _limiter = None
+    logger.info(f"⚡ Runtime ASGI: {db_threads()} thread per le sessioni database")
+
+
+def get_flask_app():
+    if _flask_app is None:
+        raise RuntimeError("Runtime ASGI non inizializzato (avviare con `uvicorn asgi:app`)")
+    return _flask_app
+
+
+def db_threads() -> int:
+    return int(get_flask_app().config.get('ASGI_DB_THREADS', DEFAULT_DB_THREADS))
+
+
+def _get_limiter() -> anyio.CapacityLimiter:
+    # Creato nel loop dell'evento (anyio non permette limiter fuori dal loop)
+    global _limiter
+    if _limiter is None:
+        _limiter = anyio.CapacityLimiter(db_threads())
+    return _limiter
+
+
+def _in_app_context(func: Callable, args, kwargs):
+    with get_flask_app().app_context():
+        try:
+            return func(db.session, *args, **kwargs)
+        finally:
+            db.session.remove()
+
+
+async def run_db(func: Callable, *args, **kwargs) -> Any:
+    """
+    Esegue `func(session, *args, **kwargs)` nel threadpool del database.
+
+    Args:
+        func: Funzione sincrona che riceve la sessione SQLAlchemy come primo argomento
+
+    Returns:
+        Il valore restituito da `func`
+    """
+    return await anyio.to_thread.run_sync(
+        functools.partial(_in_app_context, func, args, kwargs),
+        limiter=_get_limiter()
+    )
+
+
+def _utente_da_cookie(session, cookie: str) -> Optional[dict]:
+    from flask_login import current_user
+
+    with get_flask_app().test_request_context('/', headers={'Cookie': cookie}):
+        if not current_user.is_authenticated:
+            return None
+        return {'id': current_user.id, 'email': current_user.email, 'role': current_user.role}
+
+
+def require_roles(*roles: str):
+    """
+    Dependency FastAPI: utente autenticato con la sessione Flask e, se indicati,
+    con uno dei ruoli richiesti.
+
+    Returns:
+        Callable: Dependency che restituisce {'id', 'email', 'role'}
+    """
+    async def dependency(request: Request) -> dict:
+        cookie = request.headers.get('cookie')
+        utente = await run_db(_utente_da_cookie, cookie) if cookie else None
+        if utente is None:
+            raise HTTPException(status_code=401, detail="Autenticazione richiesta")
+        if roles and utente['role'] not in roles:
+            raise HTTPException(status_code=403, detail="Accesso non autorizzato")
+        return utente
+    return dependency
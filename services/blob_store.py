@@ -0,0 +1,435 @@
+"""
+Blob store content-addressable per i file dei documenti.
+
+Ogni contenuto è salvato una sola volta in `BLOB_STORE_ROOT/ab/cd/<sha256>`,
+con scrittura atomica (staging + rename). Document e DocumentVersion
+referenziano il blob tramite `blob_sha256`; il conteggio riferimenti in
+`FileBlob.ref_count` è aggiornato dai listener di sessione e i blob non più
+referenziati vengono rimossi da `gc_blobs`.
+
+`resolve_path` è l'unico punto di risoluzione del percorso di un documento o
+di una versione, con fallback sui percorsi legacy per i file non ancora migrati.
+"""
+
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import attributes
+from werkzeug.utils import secure_filename
+
+from extensions import db
+from models import Document, DocumentVersion, FileBlob, FileHash
+from services.ingest import IngestResult, ingest_stream
+
+logger = logging.getLogger(__name__)
+
+STAGING_DIR = 'tmp'
+_listeners_registered = False
+_stores = {}
+
+
+class BlobStore:
+    """
+    Archivio file indicizzato per SHA-256 con directory a due livelli.
+
+    Args:
+        root (str): Directory radice del blob store.
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+
+    def path_for(self, sha256: str) -> str:
+        """Percorso del blob: root/ab/cd/<sha256>."""
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def exists(self, sha256: str) -> bool:
+        return os.path.exists(self.path_for(sha256))
+
+    def staging_path(self) -> str:
+        """Nuovo percorso temporaneo nello stesso filesystem del blob store."""
+        staging = os.path.join(self.root, STAGING_DIR)
+        os.makedirs(staging, exist_ok=True)
+        return os.path.join(staging, f"{uuid.uuid4().hex}.part")
+
+    def commit(self, staged_path: str, sha256: str) -> bool:
+        """
+        Sposta atomicamente un file in staging nella sua posizione definitiva.
+
+        Args:
+            staged_path: File temporaneo scritto in `staging_path()`.
+            sha256: Hash del contenuto.
+
+        Returns:
+            bool: True se il blob è nuovo, False se esisteva già (staging eliminato).
+        """
+        target = self.path_for(sha256)
+        if os.path.exists(target):
+            os.unlink(staged_path)
+            return False
+
+        with open(staged_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.chmod(staged_path, 0o444)  # i blob sono immutabili
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(staged_path, target)
+        return True
+
+    def put_stream(self, stream: BinaryIO, filename: Optional[str] = None) -> Tuple[IngestResult, bool]:
+        """
+        Salva uno stream nel blob store (lettura unica con hash e MIME).
+
+        Returns:
+            tuple: (IngestResult, True se il blob è nuovo)
+        """
+        staged = self.staging_path()
+        try:
+            result = ingest_stream(stream, dest_path=staged, filename=filename)
+        except Exception:
+            if os.path.exists(staged):
+                os.unlink(staged)
+            raise
+        return result, self.commit(staged, result.sha256)
+
+    def put_file(self, path: str, sha256: Optional[str] = None) -> Tuple[IngestResult, bool]:
+        """
+        Importa un file esistente nel blob store.
+
+        Se `sha256` è noto e il blob esiste già il file non viene letto.
+
+        Args:
+            path: File da importare.
+            sha256: Hash già calcolato (es. da FileHash).
+
+        Returns:
+            tuple: (IngestResult, True se il blob è nuovo); MIME vuoto se il file non è stato letto.
+        """
+        if sha256 and self.exists(sha256):
+            return IngestResult(sha256=sha256, size=os.path.getsize(path), mime=''), False
+
+        with open(path, 'rb') as f:
+            return self.put_stream(f, filename=os.path.basename(path))
+
+    def delete(self, sha256: str) -> bool:
+        try:
+            os.unlink(self.path_for(sha256))
+            return True
+        except FileNotFoundError:
+            return False
+
+
+def get_blob_store(app=None) -> BlobStore:
+    """
+    Restituisce il blob store configurato (BLOB_STORE_ROOT, default UPLOAD_FOLDER/blobs).
+    """
+    app = app or current_app
+    root = app.config.get('BLOB_STORE_ROOT') or os.path.join(app.config.get('UPLOAD_FOLDER', 'uploads'), 'blobs')
+    store = _stores.get(root)
+    if store is None:
+        store = _stores[root] = BlobStore(root)
+    return store
+
+
+def _find_blob(session, sha256: str) -> Optional[FileBlob]:
+    # I blob pending non sono ancora nell'identity map
+    for obj in session.new:
+        if isinstance(obj, FileBlob) and obj.sha256 == sha256:
+            return obj
+    return session.get(FileBlob, sha256)
+
+
+def ensure_blob(result: IngestResult) -> FileBlob:
+    """Crea (se manca) la riga FileBlob per un contenuto salvato nel blob store."""
+    with db.session.no_autoflush:
+        blob = _find_blob(db.session, result.sha256)
+    if blob is None:
+        blob = FileBlob(sha256=result.sha256, size=result.size, mime=result.mime or None, ref_count=0)
+        db.session.add(blob)
+    elif blob.mime is None and result.mime:
+        blob.mime = result.mime
+    return blob
+
+
+def store_upload(file_storage, scan: bool = True) -> IngestResult:
+    """
+    Salva un file caricato nel blob store con scansione antivirus nella stessa lettura.
+
+    Un file infetto (o con errore di scansione in modalità strict) non entra
+    nel blob store: il risultato va comunque controllato in `result.scan`.
+
+    Args:
+        file_storage: FileStorage di Werkzeug.
+        scan: Se False salta l'antivirus (es. file generati internamente).
+
+    Returns:
+        IngestResult: Hash, dimensione, MIME e verdetto antivirus.
+    """
+    store = get_blob_store()
+    staged = store.staging_path()
+    file_storage.stream.seek(0)
+    try:
+        if scan:
+            from services.antivirus_service import antivirus_service
+            result = antivirus_service.ingest(file_storage.stream, dest_path=staged, filename=file_storage.filename)
+        else:
+            result = ingest_stream(file_storage.stream, dest_path=staged, filename=file_storage.filename)
+    except Exception:
+        if os.path.exists(staged):
+            os.unlink(staged)
+        raise
+    finally:
+        file_storage.stream.seek(0)
+
+    verdict = result.scan.get('verdict')
+    if verdict == 'infected' or (verdict == 'error' and _strict_mode()):
+        os.unlink(staged)
+        return result
+
+    store.commit(staged, result.sha256)
+    ensure_blob(result)
+    return result
+
+
+def _strict_mode() -> bool:
+    return os.getenv('STRICT_UPLOAD_SECURITY', 'False').lower() == 'true'
+
+
+# === Risoluzione percorsi ===
+
+def _legacy_document_paths(doc: Document):
+    base = current_app.config.get('UPLOAD_FOLDER', 'uploads')
+    filename = doc.filename
+    if not filename:
+        return
+    if doc.company and doc.department:
+        yield os.path.join(base, doc.company.name, doc.department.name, filename)
+        yield os.path.join(base, secure_filename(doc.company.name), secure_filename(doc.department.name), filename)
+    yield os.path.join(base, 'temp', filename)
+    if doc.uploader is not None and doc.uploader.username:
+        yield os.path.join(base, doc.uploader.username, filename)
+    yield os.path.join(base, filename)
+
+
+def legacy_candidates(obj) -> List[str]:
+    """
+    Percorsi pre-blob store possibili per un documento o una versione (senza accessi al filesystem).
+    """
+    if isinstance(obj, DocumentVersion):
+        if not obj.file_path:
+            return []
+        candidates = [obj.file_path]
+        if not os.path.isabs(obj.file_path):
+            candidates.append(os.path.join(current_app.config.get('UPLOAD_FOLDER', 'uploads'), obj.file_path))
+        return candidates
+    return list(_legacy_document_paths(obj))
+
+
+def legacy_path(obj) -> Optional[str]:
+    """
+    Percorso pre-blob store di un documento o di una versione, se il file esiste.
+    """
+    for path in legacy_candidates(obj):
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def resolve_path(obj) -> Optional[str]:
+    """
+    Percorso locale del file di un Document o DocumentVersion.
+
+    Per i file nel blob store il percorso è calcolato dall'hash, senza accessi
+    al filesystem; per i file non migrati si provano i percorsi legacy.
+
+    Returns:
+        str: Percorso del file, None se non trovato.
+    """
+    if obj.blob_sha256:
+        return get_blob_store().path_for(obj.blob_sha256)
+    return legacy_path(obj)
+
+
+# === Conteggio riferimenti ===
+
+def _collect_ref_deltas(session) -> Dict[str, int]:
+    deltas: Dict[str, int] = {}
+
+    def _add(sha256, delta):
+        if sha256:
+            deltas[sha256] = deltas.get(sha256, 0) + delta
+
+    for obj in session.new:
+        if isinstance(obj, (Document, DocumentVersion)):
+            _add(obj.blob_sha256, 1)
+    for obj in session.deleted:
+        if isinstance(obj, (Document, DocumentVersion)):
+            # Valore già salvato su DB (l'attributo può essere scaduto dopo un commit)
+            history = attributes.get_history(obj, 'blob_sha256')
+            _add(history.deleted[0] if history.deleted else obj.blob_sha256, -1)
+    for obj in session.dirty:
+        if isinstance(obj, (Document, DocumentVersion)) and obj not in session.deleted:
+            history = attributes.get_history(obj, 'blob_sha256')
+            if history.has_changes():
+                _add((history.deleted or [None])[0], -1)
+                _add((history.added or [None])[0], 1)
+    return {sha256: delta for sha256, delta in deltas.items() if delta}
+
+
+def _before_flush(session, flush_context, instances):
+    with session.no_autoflush:
+        deltas = _collect_ref_deltas(session)
+        for sha256, delta in deltas.items():
+            blob = _find_blob(session, sha256)
+            if blob is None:
+                blob = FileBlob(sha256=sha256, ref_count=0)
+                session.add(blob)
+            if blob in session.new:
+                blob.ref_count = (blob.ref_count or 0) + delta
+            else:
+                # Aggiornamento atomico lato DB (più worker possono referenziare lo stesso blob)
+                blob.ref_count = FileBlob.ref_count + delta
+            if delta < 0:
+                blob.released_at = datetime.utcnow()
+
+
+def register_blob_listeners(session=None):
+    """
+    Registra il listener che aggiorna `FileBlob.ref_count` al flush.
+
+    Args:
+        session: Sessione/scoped session su cui registrare (default: db.session).
+    """
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    event.listen(session or db.session, 'before_flush', _before_flush)
+    _listeners_registered = True
+
+
+# === Manutenzione ===
+
+def gc_blobs(grace_hours: int = 24, dry_run: bool = False) -> Dict[str, int]:
+    """
+    Elimina i blob non più referenziati e i file di staging abbandonati.
+
+    Args:
+        grace_hours: Ore di attesa dopo l'ultimo rilascio prima dell'eliminazione.
+        dry_run: Se True conta soltanto.
+
+    Returns:
+        dict: Statistiche (eliminati, bytes_liberati, staging_rimossi).
+    """
+    store = get_blob_store()
+    cutoff = datetime.utcnow() - timedelta(hours=grace_hours)
+    stats = {'eliminati': 0, 'bytes_liberati': 0, 'staging_rimossi': 0}
+
+    orphans = FileBlob.query.filter(
+        FileBlob.ref_count <= 0,
+        db.func.coalesce(FileBlob.released_at, FileBlob.created_at) < cutoff
+    ).all()
+    for blob in orphans:
+        stats['eliminati'] += 1
+        stats['bytes_liberati'] += blob.size or 0
+        if not dry_run:
+            store.delete(blob.sha256)
+            db.session.delete(blob)
+    if not dry_run:
+        db.session.commit()
+
+    staging = os.path.join(store.root, STAGING_DIR)
+    if os.path.isdir(staging):
+        for entry in os.scandir(staging):
+            if datetime.utcfromtimestamp(entry.stat().st_mtime) < cutoff:
+                stats['staging_rimossi'] += 1
+                if not dry_run:
+                    os.unlink(entry.path)
+
+    logger.info(f"🧹 GC blob store: {stats}")
+    return stats
+
+
+def migrate_legacy_files(batch_size: int = 200, remove_legacy: bool = False,
+                         dry_run: bool = False) -> Dict[str, int]:
+    """
+    Sposta nel blob store i file di documenti e versioni salvati nei percorsi legacy.
+
+    Per i documenti con hash già registrato in FileHash il file viene letto
+    solo se il blob non esiste ancora. I duplicati occupano un solo blob.
+
+    Args:
+        batch_size: Record per commit.
+        remove_legacy: Se True elimina i file legacy dopo il commit.
+        dry_run: Se True non modifica né file né database.
+
+    Returns:
+        dict: Statistiche (migrati, deduplicati, mancanti, errori, bytes_risparmiati).
+    """
+    store = get_blob_store()
+    stats = {'migrati': 0, 'deduplicati': 0, 'mancanti': 0, 'errori': 0, 'bytes_risparmiati': 0}
+    migrated_paths, failed_paths = set(), set()
+
+    for model in (Document, DocumentVersion):
+        last_id = 0
+        while True:
+            batch = (model.query
+                     .filter(model.blob_sha256.is_(None), model.id > last_id)
+                     .order_by(model.id)
+                     .limit(batch_size)
+                     .all())
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            for obj in batch:
+                path = legacy_path(obj)
+                if path is None:
+                    stats['mancanti'] += 1
+                    continue
+                if dry_run:
+                    stats['migrati'] += 1
+                    continue
+                try:
+                    known_hash = None
+                    if isinstance(obj, Document):
+                        file_hash = db.session.get(FileHash, obj.id)
+                        if file_hash and file_hash.algo.upper() == 'SHA256':
+                            known_hash = file_hash.value
+                    result, created = store.put_file(path, sha256=known_hash)
+
+                    with db.session.begin_nested():
+                        ensure_blob(result)
+                        obj.blob_sha256 = result.sha256
+                        if isinstance(obj, DocumentVersion):
+                            obj.file_path = store.path_for(result.sha256)
+                        elif known_hash is None:
+                            db.session.add(FileHash(file_id=obj.id, algo='SHA256', value=result.sha256))
+
+                    if created:
+                        stats['migrati'] += 1
+                    else:
+                        stats['deduplicati'] += 1
+                        stats['bytes_risparmiati'] += result.size
+                    migrated_paths.add(path)
+                except Exception as e:
+                    stats['errori'] += 1
+                    failed_paths.add(path)
+                    logger.error(f"Errore migrazione {model.__name__} {obj.id} ({path}): {e}")
+
+            if not dry_run:
+                db.session.commit()
+
+    # I file legacy si eliminano solo a migrazione completata (più record possono condividerli)
+    if remove_legacy and not dry_run:
+        for path in migrated_paths - failed_paths:
+            try:
+                os.unlink(path)
+            except OSError as e:
+                logger.warning(f"Impossibile eliminare file legacy {path}: {e}")
+
+    logger.info(f"📦 Migrazione blob store: {stats}")
+    return stats
@@ -12,6 +12,10 @@ from flask_mail import Message
 from extensions import db, mail
 from models import LogInvioPDF, NotificaCEO, AlertAI, AuditLog, AdminLog, User, Document, GuestActivity, AlertReportCEO
 from sqlalchemy import func, and_, or_
+from services.report_rollup import (
+    ADMIN_LOG_CLASSI, M_ADMIN_LOG_TOTALE, classi_admin_log, filtro_admin_log, metrica_admin_log, totale
+)
+from services.reporting_db import reporting_query
 import json
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak
@@ -29,6 +33,12 @@ class CEOMonthlyReportGenerator:
     Generatore di report PDF mensili per il CEO.
     """
     
+    AUDIT_EVENT_TYPES = {
+        'permessi': 'Modifica Permessi',
+        'documenti': 'Gestione Documenti',
+        'utenti': 'Gestione Utenti',
+    }
+    
     def __init__(self, month=None, year=None):
         """
         Inizializza il generatore di report.
@@ -62,6 +72,7 @@ class CEOMonthlyReportGenerator:
             9: 'Settembre', 10: 'Ottobre', 11: 'Novembre', 12: 'Dicembre'
         }
         
+    @reporting_query
     def get_sensitive_pdf_sends(self):
         """
         Recupera gli invii PDF sensibili del mese.
@@ -130,6 +141,7 @@ class CEOMonthlyReportGenerator:
             logger.error(f"❌ Errore recupero invii PDF sensibili: {e}")
             return []
     
+    @reporting_query
     def get_critical_pdf_sends(self):
         """
         Recupera gli invii PDF critici del mese (criteri più stringenti).
@@ -252,6 +264,7 @@ class CEOMonthlyReportGenerator:
             logger.error(f"❌ Errore verifica alert report: {e}")
             return None
     
+    @reporting_query
     def get_active_ai_alerts(self):
         """
         Recupera gli alert AI attivi del mese.
@@ -275,6 +288,24 @@ class CEOMonthlyReportGenerator:
             logger.error(f"❌ Errore recupero alert AI: {e}")
             return []
     
+    @reporting_query
+    def get_audit_summary(self):
+        """
+        Conteggi mensili degli eventi AdminLog per classe, dai rollup report.
+        
+        Returns:
+            dict: {classe: numero eventi} più 'totale'
+        """
+        try:
+            inizio, fine = self.start_date.date(), self.end_date.date()
+            riepilogo = {classe: totale(metrica_admin_log(classe), inizio, fine) for classe in ADMIN_LOG_CLASSI}
+            riepilogo['totale'] = totale(M_ADMIN_LOG_TOTALE, inizio, fine)
+            return riepilogo
+        except Exception as e:
+            logger.error(f"❌ Errore riepilogo audit: {e}")
+            return {}
+    
+    @reporting_query
     def get_audit_trail_events(self):
         """
         Recupera gli eventi di audit trail del mese.
@@ -286,45 +317,25 @@ class CEOMonthlyReportGenerator:
             # Eventi di audit trail
             audit_events = []
             
-            # 1. Modifiche permessi (AdminLog)
-            permission_mods = AdminLog.query.filter(
-                and_(
-                    AdminLog.timestamp >= self.start_date,
-                    AdminLog.timestamp <= self.end_date,
-                    AdminLog.action.like('%permission%')
-                )
-            ).all()
-            
-            for log in permission_mods:
-                audit_events.append({
-                    'timestamp': log.timestamp,
-                    'event_type': 'Modifica Permessi',
-                    'user': log.performed_by,
-                    'action': log.action,
-                    'user_role': 'Admin'
-                })
-            
-            # 2. Creazione/eliminazione documenti
-            doc_events = AdminLog.query.filter(
+            # 1-2-4. Permessi, documenti e utenti/guest (AdminLog): una sola scansione
+            # del mese, classificata con le stesse regole dei rollup report
+            admin_logs = AdminLog.query.filter(
                 and_(
                     AdminLog.timestamp >= self.start_date,
                     AdminLog.timestamp <= self.end_date,
-                    or_(
-                        AdminLog.action.like('%create%'),
-                        AdminLog.action.like('%delete%'),
-                        AdminLog.action.like('%upload%')
-                    )
+                    filtro_admin_log(*ADMIN_LOG_CLASSI)
                 )
             ).all()
             
-            for log in doc_events:
-                audit_events.append({
-                    'timestamp': log.timestamp,
-                    'event_type': 'Gestione Documenti',
-                    'user': log.performed_by,
-                    'action': log.action,
-                    'user_role': 'Admin'
-                })
+            for log in admin_logs:
+                for classe in classi_admin_log(log.action):
+                    audit_events.append({
+                        'timestamp': log.timestamp,
+                        'event_type': self.AUDIT_EVENT_TYPES[classe],
+                        'user': log.performed_by,
+                        'action': log.action,
+                        'user_role': 'Admin'
+                    })
             
             # 3. Download massivi
             mass_downloads = GuestActivity.query.filter(
@@ -347,28 +358,6 @@ class CEOMonthlyReportGenerator:
                     'user_role': user.role if user else 'Guest'
                 })
             
-            # 4. Modifiche utenti/guest
-            user_mods = AdminLog.query.filter(
-                and_(
-                    AdminLog.timestamp >= self.start_date,
-                    AdminLog.timestamp <= self.end_date,
-                    or_(
-                        AdminLog.action.like('%user%'),
-                        AdminLog.action.like('%guest%'),
-                        AdminLog.action.like('%role%')
-                    )
-                )
-            ).all()
-            
-            for log in user_mods:
-                audit_events.append({
-                    'timestamp': log.timestamp,
-                    'event_type': 'Gestione Utenti',
-                    'user': log.performed_by,
-                    'action': log.action,
-                    'user_role': 'Admin'
-                })
-            
             # Ordina per timestamp
             audit_events.sort(key=lambda x: x['timestamp'], reverse=True)
             
@@ -378,6 +367,7 @@ class CEOMonthlyReportGenerator:
             logger.error(f"❌ Errore recupero audit trail: {e}")
             return []
     
+    @reporting_query
     def generate_pdf_report(self):
         """
         Genera il report PDF mensile.
@@ -486,6 +476,13 @@ class CEOMonthlyReportGenerator:
             
             # Sezione 3: Audit Trail Events
             story.append(Paragraph("🔍 Eventi Audit Trail", subtitle_style))
+            audit_summary = self.get_audit_summary()
+            if audit_summary:
+                story.append(Paragraph(
+                    f"Eventi amministrativi nel mese: {audit_summary['totale']} "
+                    f"(permessi {audit_summary['permessi']}, documenti {audit_summary['documenti']}, "
+                    f"utenti/guest {audit_summary['utenti']})", normal_style))
+                story.append(Spacer(1, 10))
             if audit_events:
                 # Tabella eventi audit
                 table_data = [['Data/Ora', 'Tipo Evento', 'Utente', 'Azione', 'Ruolo']]
@@ -6,9 +6,9 @@ Gestisce la creazione e l'invio di notifiche quando vengono inviati PDF sensibil
 import os
 from datetime import datetime, timedelta
 from flask import current_app
-from flask_mail import Message
-from extensions import db, mail
+from extensions import db
 from models import NotificaCEO, LogInvioPDF, User, AlertAI
+from services.mail_queue import enqueue_email
 from sqlalchemy import and_
 
 
@@ -155,15 +155,14 @@ def invia_email_notifica_ceo(notifica):
         </html>
         """
         
-        # Invia email
-        msg = Message(
+        # Accoda email (invio asincrono dal worker della coda)
+        enqueue_email(
             subject=subject,
             recipients=[ceo_email],
-            html=html_body
+            html=html_body,
+            idempotency_key=f"notifica_ceo:{notifica.id}" if notifica.id else None
         )
-        
-        mail.send(msg)
-        current_app.logger.info(f"✅ Email notifica CEO inviata a {ceo_email}")
+        current_app.logger.info(f"✅ Email notifica CEO accodata per {ceo_email}")
         return True
         
     except Exception as e:
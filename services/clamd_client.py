@@ -0,0 +1,259 @@
+"""
+Client ClamAV (clamd) con connessioni persistenti e scansione in streaming.
+
+Implementa direttamente il protocollo clamd (comandi `z...\\0`):
+- connessioni in modalità IDSESSION riusate da un pool, senza riconnessione
+  e `PING` a ogni scansione;
+- versione engine/signature in cache con TTL (un solo `VERSION` ogni N secondi);
+- sessioni `INSTREAM` alimentate a chunk mentre il file viene letto.
+"""
+
+import logging
+import os
+import queue
+import re
+import socket
+import struct
+import threading
+import time
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = '/var/run/clamav/clamd.ctl'
+DEFAULT_TIMEOUT = 60
+DEFAULT_POOL_SIZE = 4
+DEFAULT_VERSION_TTL_SEC = 300
+MAX_IDLE_SEC = 20  # inferiore a IdleTimeout di clamd (default 30s)
+
+_SESSION_PREFIX = re.compile(rb'^\d+: ')
+
+
+class ClamdError(Exception):
+    """Errore di comunicazione con clamd."""
+
+
+class _Connection:
+    """Connessione clamd in modalità IDSESSION."""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self._buffer = b''
+        self.last_used = time.monotonic()
+        self.send(b'zIDSESSION\0')
+
+    def send(self, data: bytes):
+        self.sock.sendall(data)
+
+    def command(self, name: str) -> str:
+        self.send(b'z' + name.encode() + b'\0')
+        return self.read_reply()
+
+    def read_reply(self) -> str:
+        while b'\0' not in self._buffer:
+            data = self.sock.recv(4096)
+            if not data:
+                raise ClamdError("Connessione clamd chiusa")
+            self._buffer += data
+        reply, self._buffer = self._buffer.split(b'\0', 1)
+        return _SESSION_PREFIX.sub(b'', reply).decode(errors='replace').strip()
+
+    def close(self, graceful: bool = True):
+        if graceful:
+            try:
+                self.send(b'zEND\0')
+            except OSError:
+                pass
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class InstreamSession:
+    """
+    Sessione INSTREAM: i chunk vengono inviati a clamd man mano che il file è letto.
+
+    La scansione vera e propria avviene alla chiusura (`finish`); `abort` chiude
+    la connessione senza farla eseguire (es. hash già noto come pulito).
+    """
+
+    def __init__(self, client: 'ClamdClient', conn: _Connection):
+        self._client = client
+        self._conn = conn
+        self._conn.send(b'zINSTREAM\0')
+        self.bytes_sent = 0
+
+    def send(self, chunk: bytes):
+        if chunk:
+            self._conn.send(struct.pack('!L', len(chunk)) + chunk)
+            self.bytes_sent += len(chunk)
+
+    def finish(self) -> Tuple[str, Optional[str]]:
+        """
+        Chiude lo stream e restituisce il verdetto.
+
+        Returns:
+            tuple: ('clean' | 'infected', nome minaccia o None)
+
+        Raises:
+            ClamdError: Errore clamd (es. limite StreamMaxLength superato).
+        """
+        try:
+            self._conn.send(struct.pack('!L', 0))
+            reply = self._conn.read_reply()
+        except (OSError, ClamdError) as e:
+            self._client._discard(self._conn)
+            raise ClamdError(f"Scansione INSTREAM fallita: {e}")
+
+        if reply.endswith('ERROR'):
+            # clamd chiude la sessione dopo un errore INSTREAM
+            self._client._discard(self._conn)
+            raise ClamdError(reply)
+
+        self._client._release(self._conn)
+        if reply.endswith('FOUND'):
+            return 'infected', reply[len('stream: '):-len(' FOUND')] if reply.startswith('stream: ') else reply
+        return 'clean', None
+
+    def abort(self):
+        """Interrompe lo stream senza scansione (la connessione non viene riusata)."""
+        self._client._discard(self._conn)
+
+
+class ClamdClient:
+    """
+    Client clamd con pool di connessioni persistenti.
+
+    Args:
+        unix_socket (str, optional): Socket Unix di clamd (usato se esiste).
+        host (str): Host TCP di clamd.
+        port (int): Porta TCP di clamd.
+        timeout (float): Timeout socket in secondi.
+        pool_size (int): Connessioni inattive mantenute aperte.
+        version_ttl (int): Secondi di validità della versione in cache.
+    """
+
+    def __init__(self, unix_socket: Optional[str] = DEFAULT_SOCKET, host: str = 'localhost', port: int = 3310,
+                 timeout: float = DEFAULT_TIMEOUT, pool_size: int = DEFAULT_POOL_SIZE,
+                 version_ttl: int = DEFAULT_VERSION_TTL_SEC):
+        self.unix_socket = unix_socket
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.version_ttl = version_ttl
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._version = None
+        self._version_expires = 0.0
+        self._version_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'ClamdClient':
+        """Crea il client dalle variabili d'ambiente CLAMAV_*."""
+        return cls(
+            unix_socket=os.getenv('CLAMAV_SOCKET', DEFAULT_SOCKET),
+            host=os.getenv('CLAMAV_HOST', 'localhost'),
+            port=int(os.getenv('CLAMAV_PORT', 3310)),
+            timeout=float(os.getenv('CLAMAV_TIMEOUT', DEFAULT_TIMEOUT)),
+            pool_size=int(os.getenv('CLAMAV_POOL_SIZE', DEFAULT_POOL_SIZE)),
+            version_ttl=int(os.getenv('CLAMAV_VERSION_TTL_SEC', DEFAULT_VERSION_TTL_SEC))
+        )
+
+    # --- Pool ---
+
+    def _connect(self) -> _Connection:
+        try:
+            if self.unix_socket and os.path.exists(self.unix_socket):
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.settimeout(self.timeout)
+                sock.connect(self.unix_socket)
+            else:
+                sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            return _Connection(sock)
+        except OSError as e:
+            raise ClamdError(f"Impossibile connettersi a clamd: {e}")
+
+    def _acquire(self) -> _Connection:
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if time.monotonic() - conn.last_used < MAX_IDLE_SEC:
+                return conn
+            # Sessione probabilmente già chiusa da clamd per inattività
+            conn.close()
+
+    def _release(self, conn: _Connection):
+        conn.last_used = time.monotonic()
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def _discard(self, conn: _Connection):
+        # Connessione in stato incerto (errore o INSTREAM interrotto): chiusura senza END
+        conn.close(graceful=False)
+
+    def _command(self, name: str) -> str:
+        """Esegue un comando su una connessione del pool (una riconnessione se la connessione è scaduta)."""
+        for attempt in range(2):
+            conn = self._acquire()
+            try:
+                reply = conn.command(name)
+                self._release(conn)
+                return reply
+            except (OSError, ClamdError) as e:
+                self._discard(conn)
+                if attempt:
+                    raise ClamdError(f"Comando clamd {name} fallito: {e}")
+
+    def close(self):
+        """Chiude tutte le connessioni inattive del pool."""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    # --- Comandi ---
+
+    def ping(self) -> bool:
+        try:
+            return self._command('PING') == 'PONG'
+        except ClamdError:
+            return False
+
+    def version(self, force: bool = False) -> Tuple[str, str]:
+        """
+        Restituisce (engine, signature), in cache per `version_ttl` secondi.
+
+        Returns:
+            tuple: Es. ('ClamAV 1.0.2', '27012').
+        """
+        with self._version_lock:
+            if force or self._version is None or time.monotonic() >= self._version_expires:
+                parts = self._command('VERSION').split('/')
+                engine = parts[0]
+                signature = parts[1] if len(parts) > 1 else 'unknown'
+                self._version = (engine, signature)
+                self._version_expires = time.monotonic() + self.version_ttl
+            return self._version
+
+    def instream(self) -> InstreamSession:
+        """
+        Apre una sessione INSTREAM su una connessione del pool.
+
+        Returns:
+            InstreamSession: Sessione da alimentare con `send` e chiudere con `finish`.
+        """
+        conn = self._acquire()
+        try:
+            return InstreamSession(self, conn)
+        except OSError:
+            # Connessione del pool chiusa lato server: una nuova connessione
+            self._discard(conn)
+            try:
+                return InstreamSession(self, self._connect())
+            except OSError as e:
+                raise ClamdError(f"Impossibile avviare INSTREAM: {e}")
@@ -0,0 +1,233 @@
+"""
+Profilo del database per SQLite in produzione.
+
+Pragma per connessione (evento `connect` di SQLAlchemy):
+- journal_mode=WAL: le letture non bloccano la scrittura e viceversa;
+- busy_timeout: attesa del lock invece di "database is locked" immediato;
+- synchronous=NORMAL: sicuro con WAL, un fsync per checkpoint invece che per commit;
+- mmap_size e cache_size: letture dalla memoria mappata e cache pagine più ampia.
+
+Scritture a raffica (audit di ogni richiesta) passano da `submit_write`: un
+solo thread writer per processo le inserisce in batch, una transazione per
+batch, invece di un commit per richiesta in concorrenza con gli handler.
+Con database diversi da SQLite i pragma non vengono applicati; la coda
+resta utile per ridurre i commit.
+"""
+
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import event, insert
+
+from extensions import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH = 200
+DEFAULT_FLUSH_MS = 200
+DEFAULT_QUEUE_SIZE = 10000
+
+
+def sqlite_pragmas(config) -> dict:
+    """Pragma da applicare a ogni connessione SQLite, dalla configurazione."""
+    return {
+        'journal_mode': config.get('SQLITE_JOURNAL_MODE', 'WAL'),
+        'busy_timeout': int(config.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+        'synchronous': config.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'mmap_size': int(config.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        # Valore negativo = KiB invece di pagine
+        'cache_size': -int(config.get('SQLITE_CACHE_SIZE_KB', 64 * 1024)),
+    }
+
+
+def _in_memory(engine) -> bool:
+    return engine.url.database in (None, '', ':memory:')
+
+
+def install_sqlite_pragmas(engine, pragmas: dict):
+    """Registra i pragma sull'evento `connect` dell'engine (solo SQLite)."""
+    if engine.dialect.name != 'sqlite':
+        return False
+    pragmas = dict(pragmas)
+    if _in_memory(engine):
+        # WAL non è supportato dai database in memoria
+        pragmas.pop('journal_mode', None)
+
+    @event.listens_for(engine, 'connect')
+    def _applica_pragma(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for nome, valore in pragmas.items():
+                cursor.execute(f"PRAGMA {nome}={valore}")
+        finally:
+            cursor.close()
+
+    return True
+
+
+def init_db_profile(app):
+    """
+    Applica il profilo all'engine principale dell'app (il bind di reporting
+    ha la propria configurazione, vedi services.reporting_db).
+
+    Args:
+        app: Istanza dell'applicazione Flask (dopo db.init_app)
+    """
+    global _writer
+    if app.config.get('SQLITE_PRAGMAS_ENABLED', True):
+        pragmas = sqlite_pragmas(app.config)
+        with app.app_context():
+            engine = db.engine
+        if install_sqlite_pragmas(engine, pragmas):
+            logger.info(f"🗄️ Profilo SQLite su {engine.url.database}: "
+                        + ", ".join(f"{k}={v}" for k, v in pragmas.items()))
+
+    if app.config.get('DB_WRITE_QUEUE_ENABLED', False):
+        _writer = SerialWriter(
+            app,
+            max_batch=int(app.config.get('DB_WRITE_QUEUE_BATCH', DEFAULT_BATCH)),
+            flush_ms=int(app.config.get('DB_WRITE_QUEUE_FLUSH_MS', DEFAULT_FLUSH_MS)),
+        )
+        atexit.register(_writer.stop)
+
+
+# === CODA DI SCRITTURA ===
+
+class SerialWriter:
+    """
+    Writer unico per processo: raccoglie le righe da inserire e le scrive in
+    batch (fino a `max_batch` righe o ogni `flush_ms`), una transazione per batch.
+    """
+
+    def __init__(self, app, max_batch=DEFAULT_BATCH, flush_ms=DEFAULT_FLUSH_MS, max_queue=DEFAULT_QUEUE_SIZE):
+        self.app = app
+        self.max_batch = max_batch
+        self.flush_sec = flush_ms / 1000
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stopping = False
+        self.scritte = 0
+        self.batch = 0
+        self.errori = 0
+
+    def _ensure_thread(self):
+        # Thread avviato nel processo che scrive (dopo l'eventuale fork di gunicorn)
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="db-serial-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, model, values: dict):
+        """Accoda l'inserimento di una riga (modello o tabella Core); se la coda è piena scrive subito."""
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait((model, values))
+        except queue.Full:
+            logger.warning("⚠️ Coda di scrittura piena: inserimento sincrono")
+            self._write([(model, values)])
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            items = [item]
+            scadenza = time.monotonic() + self.flush_sec
+            while len(items) < self.max_batch:
+                try:
+                    prossimo = self._queue.get(timeout=max(0, scadenza - time.monotonic()))
+                except queue.Empty:
+                    break
+                if prossimo is None:
+                    # Stop: scrive il batch corrente e termina
+                    self._write(items)
+                    for _ in range(len(items) + 1):
+                        self._queue.task_done()
+                    return
+                items.append(prossimo)
+            self._write(items)
+            for _ in items:
+                self._queue.task_done()
+
+    def _write(self, items):
+        per_modello = {}
+        for model, values in items:
+            per_modello.setdefault(model, []).append(values)
+        with self.app.app_context():
+            try:
+                for model, rows in per_modello.items():
+                    # Insert Core sulla tabella: executemany, default di colonna applicati
+                    db.session.execute(insert(getattr(model, '__table__', model)), rows)
+                db.session.commit()
+                self.scritte += len(items)
+                self.batch += 1
+            except Exception as e:
+                db.session.rollback()
+                self.errori += len(items)
+                logger.error(f"❌ Errore scrittura batch ({len(items)} righe): {e}")
+                return
+            finally:
+                db.session.remove()
+            self._write_eventi(per_modello)
+
+    def _write_eventi(self, per_modello):
+        # Registro eventi dopo il commit delle righe di log, in una transazione propria:
+        # un errore sulle partizioni non deve far perdere il batch di audit
+        from services.event_store import eventi_per_righe
+
+        try:
+            for tabella, eventi in eventi_per_righe(per_modello).items():
+                db.session.execute(insert(tabella), eventi)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"❌ Errore scrittura eventi del batch: {e}")
+        finally:
+            db.session.remove()
+
+    def flush(self):
+        """Attende che tutte le righe accodate siano scritte."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def stop(self):
+        if self._stopping:
+            return
+        self._stopping = True
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            self._queue.put(None)
+            self._thread.join(timeout=10)
+
+
+_writer: Optional[SerialWriter] = None
+
+
+def get_writer() -> Optional[SerialWriter]:
+    return _writer
+
+
+def submit_write(model, values: dict):
+    """
+    Inserisce una riga tramite la coda di scrittura, o subito se la coda è
+    disattivata (DB_WRITE_QUEUE_ENABLED=false).
+
+    Args:
+        model: Modello SQLAlchemy
+        values (dict): Valori delle colonne
+    """
+    if _writer is not None:
+        _writer.submit(model, values)
+        return
+    db.session.add(model(**values))
+    db.session.commit()
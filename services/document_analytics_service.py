@@ -10,6 +10,8 @@ from models import (
     FirmaDocumento, DownloadLog, DocumentReadLog
 )
 from extensions import db
+from services.report_rollup import M_DOWNLOAD, M_FIRME, M_LETTURE, totali_per
+from services.reporting_db import reporting_query
 import logging
 
 logger = logging.getLogger(__name__)
@@ -18,9 +20,11 @@ logger = logging.getLogger(__name__)
 class DocumentAnalyticsService:
     """
     Servizio per l'analisi aggregata dei documenti e reparti.
+    Tutte le letture usano le sessioni di reporting (services.reporting_db).
     """
     
     @staticmethod
+    @reporting_query
     def get_analisi_aggregata_documenti():
         """
         Ottiene l'analisi aggregata completa di tutti i documenti per reparto.
@@ -133,6 +137,7 @@ class DocumentAnalyticsService:
             return []
     
     @staticmethod
+    @reporting_query
     def get_analisi_per_reparto():
         """
         Ottiene l'analisi aggregata per reparto.
@@ -206,6 +211,7 @@ class DocumentAnalyticsService:
             return {}
     
     @staticmethod
+    @reporting_query
     def get_statistiche_generali():
         """
         Ottiene statistiche generali dell'analisi.
@@ -283,6 +289,7 @@ class DocumentAnalyticsService:
             }
     
     @staticmethod
+    @reporting_query
     def get_documenti_con_anomalie():
         """
         Ottiene solo i documenti che presentano anomalie.
@@ -309,10 +316,14 @@ class DocumentAnalyticsService:
             return []
     
     @staticmethod
+    @reporting_query
     def get_analisi_periodo(inizio, fine):
         """
         Ottiene l'analisi per un periodo specifico.
         
+        Download, letture e firme sono letti dai rollup giornalieri
+        (services.report_rollup): il periodo è considerato a giorni interi.
+        
         Args:
             inizio (datetime): Data inizio periodo
             fine (datetime): Data fine periodo
@@ -321,46 +332,42 @@ class DocumentAnalyticsService:
             list: Analisi per il periodo specificato
         """
         try:
-            # Query con filtro temporale
-            result = (
+            giorno_inizio = inizio.date() if isinstance(inizio, datetime) else inizio
+            giorno_fine = fine.date() if isinstance(fine, datetime) else fine
+            conteggi = totali_per([M_DOWNLOAD, M_LETTURE, M_FIRME], 'document_id', giorno_inizio, giorno_fine)
+            
+            # Ultima firma del periodo: una sola query raggruppata
+            ultime_firme = dict(
+                db.session.query(FirmaDocumento.document_id, func.max(FirmaDocumento.timestamp))
+                .filter(FirmaDocumento.timestamp.between(inizio, fine))
+                .group_by(FirmaDocumento.document_id)
+                .all()
+            )
+            
+            documenti = (
                 db.session.query(
                     Document.id.label("document_id"),
                     Document.title.label("documento_nome"),
-                    Department.name.label("reparto_nome"),
-                    func.count(DownloadLog.id.distinct()).label("n_download"),
-                    func.count(LetturaPDF.id.distinct()).label("n_letture"),
-                    func.count(FirmaDocumento.id.distinct()).label("n_firme"),
-                    func.max(FirmaDocumento.timestamp).label("ultima_firma")
+                    Department.name.label("reparto_nome")
                 )
                 .join(User, Document.user_id == User.id)
                 .join(Department, Document.department_id == Department.id)
-                .outerjoin(DownloadLog, and_(
-                    DownloadLog.document_id == Document.id,
-                    DownloadLog.timestamp.between(inizio, fine)
-                ))
-                .outerjoin(LetturaPDF, and_(
-                    LetturaPDF.document_id == Document.id,
-                    LetturaPDF.timestamp.between(inizio, fine)
-                ))
-                .outerjoin(FirmaDocumento, and_(
-                    FirmaDocumento.document_id == Document.id,
-                    FirmaDocumento.timestamp.between(inizio, fine)
-                ))
-                .group_by(Document.id, Document.title, Department.name)
                 .all()
             )
             
             # Converti risultati
             analisi_periodo = []
-            for row in result:
+            for row in documenti:
+                valori = conteggi.get(row.document_id, {})
+                ultima_firma = ultime_firme.get(row.document_id)
                 analisi_item = {
                     "document_id": row.document_id,
                     "documento": row.documento_nome,
                     "reparto": row.reparto_nome,
-                    "download": row.n_download,
-                    "letture": row.n_letture,
-                    "firme": row.n_firme,
-                    "ultima_firma": row.ultima_firma.strftime('%d/%m/%Y %H:%M') if row.ultima_firma else None,
+                    "download": valori.get(M_DOWNLOAD, 0),
+                    "letture": valori.get(M_LETTURE, 0),
+                    "firme": valori.get(M_FIRME, 0),
+                    "ultima_firma": ultima_firma.strftime('%d/%m/%Y %H:%M') if ultima_firma else None,
                     "periodo_inizio": inizio.strftime('%d/%m/%Y'),
                     "periodo_fine": fine.strftime('%d/%m/%Y')
                 }
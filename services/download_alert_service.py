@@ -7,8 +7,7 @@ import logging
 from datetime import datetime, timedelta
 from sqlalchemy import and_, func
 from models import DownloadLog, DownloadAlert, User, db, DownloadAlertSeverity, DownloadAlertStatus
-from extensions import mail
-from flask_mail import Message
+from services.mail_queue import enqueue_email
 from flask import url_for
 
 logger = logging.getLogger(__name__)
@@ -400,14 +399,13 @@ def send_critical_alert_email(alert: DownloadAlert):
         Questo è un alert automatico del sistema di sicurezza.
         """
         
-        msg = Message(
+        enqueue_email(
             subject=subject,
             recipients=recipients,
-            body=body
+            body=body,
+            idempotency_key=f"download_alert:{alert.id}"
         )
-        
-        mail.send(msg)
-        logger.info(f"📧 Email critica inviata per alert {alert.id}")
+        logger.info(f"📧 Email critica accodata per alert {alert.id}")
         
     except Exception as e:
         logger.error(f"❌ Errore invio email critica: {str(e)}")
@@ -0,0 +1,492 @@
+"""
+Sincronizzazione documenti con Google Drive.
+
+- Client Drive unico per processo (il servizio `build('drive', 'v3')` non viene
+  ricostruito a ogni chiamata).
+- Cache persistente percorso → ID cartella (`drive_folder_cache`): la struttura
+  azienda/reparto/categoria non richiede più un `files().list` per livello.
+- Coda persistente degli upload (`drive_upload_jobs`) processata in background,
+  con upload resumable a chunk, retry con backoff e ripresa dopo un riavvio.
+
+Lo stato di ogni upload è riportato in `Document.drive_status_note`.
+Con `GOOGLE_DRIVE_DISCOVERY_URL` il client punta a un endpoint Drive locale
+(sviluppo e test) senza credenziali.
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+from flask import current_app
+from google.oauth2 import service_account
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload, build_http
+from sqlalchemy import and_, or_
+
+from extensions import db
+from models import Document, DriveFolderCache, DriveUploadJob
+
+logger = logging.getLogger(__name__)
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+SCOPES = ['https://www.googleapis.com/auth/drive']
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024  # multiplo di 256 KB richiesto da Drive
+DEFAULT_BATCH_SIZE = 5
+BACKOFF_BASE_SEC = 60
+BACKOFF_MAX_SEC = 3600
+STALE_AFTER_SEC = 900  # upload "in_corso" senza heartbeat da 15 minuti: worker morto
+
+_client = None
+_client_lock = threading.Lock()
+
+
+# === CLIENT DRIVE ===
+
+def build_drive_service(app=None):
+    """
+    Costruisce il servizio Google Drive v3 dalla configurazione.
+
+    Args:
+        app: Istanza Flask (default current_app).
+
+    Returns:
+        googleapiclient.discovery.Resource: Servizio Drive.
+    """
+    config = (app or current_app).config
+    discovery_url = config.get('GOOGLE_DRIVE_DISCOVERY_URL')
+    if discovery_url:
+        # Endpoint Drive locale (fake) per sviluppo e test: nessuna credenziale
+        return build('drive', 'v3', http=build_http(), discoveryServiceUrl=discovery_url,
+                     static_discovery=False, cache_discovery=False)
+
+    credentials_path = (config.get('GOOGLE_DRIVE_SERVICE_ACCOUNT_JSON')
+                        or os.getenv('GOOGLE_DRIVE_SERVICE_ACCOUNT_JSON')
+                        or os.getenv('GOOGLE_APPLICATION_CREDENTIALS'))
+    if not credentials_path or not os.path.exists(credentials_path):
+        raise FileNotFoundError(f"File credenziali Google Drive non trovato: {credentials_path}")
+
+    creds = service_account.Credentials.from_service_account_file(credentials_path, scopes=SCOPES)
+    return build('drive', 'v3', credentials=creds, cache_discovery=False)
+
+
+class DriveSyncClient:
+    """
+    Client Drive di lunga durata con cache delle cartelle e upload resumable.
+
+    Il servizio googleapiclient non è thread-safe: le chiamate sono serializzate
+    da un lock interno.
+    """
+
+    def __init__(self, service, root_folder_id: str, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.service = service
+        self.root_folder_id = root_folder_id
+        self.chunk_size = chunk_size
+        self._folders = {}
+        self._lock = threading.RLock()
+
+    # --- Cartelle ---
+
+    def resolve_folder(self, subfolders: Optional[List[str]]) -> str:
+        """
+        Restituisce l'ID della cartella per il percorso indicato, creandola se manca.
+
+        Args:
+            subfolders (list): Sottocartelle a partire dalla root (es. [azienda, reparto]).
+
+        Returns:
+            str: ID della cartella foglia.
+        """
+        parent_id = self.root_folder_id
+        path = self.root_folder_id
+        for name in subfolders or []:
+            if not name:
+                continue
+            path = f"{path}/{name}"
+            parent_id = self._cached_folder(path) or self._find_or_create(name, parent_id, path)
+        return parent_id
+
+    def _cached_folder(self, path: str) -> Optional[str]:
+        folder_id = self._folders.get(path)
+        if folder_id is None:
+            entry = db.session.get(DriveFolderCache, path)
+            if entry:
+                folder_id = self._folders[path] = entry.folder_id
+        return folder_id
+
+    def _find_or_create(self, name: str, parent_id: str, path: str) -> str:
+        escaped = name.replace('\\', '\\\\').replace("'", "\\'")
+        query = f"'{parent_id}' in parents and name='{escaped}' and mimeType='{FOLDER_MIME}' and trashed=false"
+        with self._lock:
+            files = self.service.files().list(q=query, fields='files(id)', pageSize=1).execute().get('files', [])
+            if files:
+                folder_id = files[0]['id']
+            else:
+                metadata = {'name': name, 'mimeType': FOLDER_MIME, 'parents': [parent_id]}
+                folder_id = self.service.files().create(body=metadata, fields='id').execute()['id']
+                logger.info(f"📁 Cartella Drive '{name}' creata con ID: {folder_id}")
+
+        db.session.merge(DriveFolderCache(path=path, folder_id=folder_id))
+        db.session.flush()
+        self._folders[path] = folder_id
+        return folder_id
+
+    def forget_folders(self, subfolders: Optional[List[str]] = None):
+        """
+        Rimuove dalla cache il ramo di primo livello del percorso (es. cartella cancellata su Drive).
+
+        Non sapendo quale livello sia stato cancellato, invalida tutto il ramo.
+
+        Args:
+            subfolders (list, optional): Percorso da invalidare; None svuota tutta la cache.
+        """
+        prefix = self.root_folder_id
+        for name in (subfolders or [])[:1]:
+            prefix = f"{prefix}/{name}"
+        self._folders = {p: f for p, f in self._folders.items() if not p.startswith(prefix)}
+        DriveFolderCache.query.filter(DriveFolderCache.path.startswith(prefix)).delete(synchronize_session=False)
+
+    # --- Upload ---
+
+    @staticmethod
+    def _stato_sessione(request, size: int):
+        """
+        Interroga una sessione resumable con un PUT vuoto (`Content-Range: bytes */size`).
+
+        Returns:
+            tuple: (byte confermati, risposta finale se l'upload era già completo).
+
+        Raises:
+            HttpError: Sessione scaduta (404/410) o altro errore di Drive.
+        """
+        resp, content = request.http.request(request.resumable_uri, 'PUT', headers={
+            'Content-Range': f'bytes */{size}', 'Content-Length': '0'
+        })
+        if resp.status in (200, 201):
+            return size, request.postproc(resp, content)
+        if resp.status == 308:
+            intervallo = resp.get('range')
+            return (int(intervallo.rsplit('-', 1)[1]) + 1 if intervallo else 0), None
+        raise HttpError(resp, content, uri=request.resumable_uri)
+
+    def upload_file(self, local_path: str, nome_file: str, subfolders: Optional[List[str]] = None,
+                    parent_folder_id: Optional[str] = None, resumable_uri: Optional[str] = None,
+                    on_progress: Optional[Callable[[str, int], None]] = None) -> str:
+        """
+        Carica un file con upload resumable a chunk.
+
+        Args:
+            local_path (str): Percorso del file locale.
+            nome_file (str): Nome del file su Drive.
+            subfolders (list, optional): Sottocartelle di destinazione.
+            parent_folder_id (str, optional): Cartella di destinazione esplicita.
+            resumable_uri (str, optional): Sessione di upload da riprendere.
+            on_progress (callable, optional): Callback (resumable_uri, bytes_confermati) dopo ogni chunk.
+
+        Returns:
+            str: ID del file caricato.
+        """
+        parent_id = parent_folder_id or self.resolve_folder(subfolders)
+        media = MediaFileUpload(local_path, resumable=True, chunksize=self.chunk_size)
+
+        with self._lock:
+            request = self.service.files().create(
+                body={'name': nome_file, 'parents': [parent_id]},
+                media_body=media,
+                fields='id'
+            )
+            response = None
+            if resumable_uri:
+                # Prima di inviare chiede a Drive quanti byte ha già ricevuto
+                request.resumable_uri = resumable_uri
+                request.resumable_progress, response = self._stato_sessione(request, media.size())
+
+            while response is None:
+                status, response = request.next_chunk()
+                if response is None and on_progress:
+                    on_progress(request.resumable_uri, request.resumable_progress)
+
+        logger.info(f"☁️ File '{nome_file}' caricato su Drive con ID: {response['id']}")
+        return response['id']
+
+    def delete_file(self, file_id: str):
+        with self._lock:
+            self.service.files().delete(fileId=file_id).execute()
+
+    def get_file(self, file_id: str, fields: str = 'id,name,size,createdTime,modifiedTime,webViewLink') -> dict:
+        with self._lock:
+            return self.service.files().get(fileId=file_id, fields=fields).execute()
+
+    def check_connection(self) -> bool:
+        with self._lock:
+            self.service.files().list(pageSize=1, fields='files(id)').execute()
+        return True
+
+
+def get_drive_client(app=None) -> DriveSyncClient:
+    """
+    Restituisce il client Drive del processo, creandolo al primo utilizzo.
+
+    Args:
+        app: Istanza Flask (default current_app).
+
+    Returns:
+        DriveSyncClient: Client condiviso.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            app = app or current_app
+            root_folder_id = (app.config.get('GOOGLE_DRIVE_ROOT_FOLDER_ID')
+                              or os.getenv('GOOGLE_DRIVE_ROOT_FOLDER_ID')
+                              or os.getenv('DRIVE_ROOT_FOLDER_ID'))
+            if not root_folder_id:
+                raise ValueError("GOOGLE_DRIVE_ROOT_FOLDER_ID non configurato")
+            _client = DriveSyncClient(
+                build_drive_service(app),
+                root_folder_id,
+                chunk_size=app.config.get('DRIVE_UPLOAD_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+            )
+            logger.info("✅ Client Google Drive inizializzato")
+        return _client
+
+
+def reset_drive_client():
+    """Scarta il client corrente (cambio configurazione o credenziali)."""
+    global _client
+    with _client_lock:
+        _client = None
+
+
+# === CODA UPLOAD ===
+
+def document_subfolders(doc: Document) -> List[str]:
+    """Percorso Drive del documento: azienda / reparto / categoria (tag)."""
+    subfolders = []
+    if doc.company and doc.company.name:
+        subfolders.append(doc.company.name)
+    if doc.department and doc.department.name:
+        subfolders.append(doc.department.name)
+    if doc.tag:
+        subfolders.append(doc.tag)
+    return subfolders
+
+
+def _set_status_note(doc: Optional[Document], note: str):
+    if doc is not None:
+        doc.drive_status_note = note[:255]
+
+
+def enqueue_drive_upload(document: Document, local_path: str, nome_file: Optional[str] = None,
+                         subfolders: Optional[List[str]] = None, parent_folder_id: Optional[str] = None,
+                         max_tentativi: int = 8, commit: bool = True) -> DriveUploadJob:
+    """
+    Accoda l'upload su Drive di un documento (nessuna chiamata a Drive nella richiesta).
+
+    Se per il documento esiste già un upload attivo viene restituito quello.
+
+    Args:
+        document (Document): Documento da caricare (già con ID).
+        local_path (str): Percorso del file locale.
+        nome_file (str, optional): Nome su Drive (default original_filename o filename).
+        subfolders (list, optional): Sottocartelle (default azienda/reparto/categoria del documento).
+        parent_folder_id (str, optional): Cartella di destinazione esplicita.
+        max_tentativi (int): Numero massimo di tentativi.
+        commit (bool): Se True esegue il commit, altrimenti solo flush.
+
+    Returns:
+        DriveUploadJob: Upload accodato.
+    """
+    existing = DriveUploadJob.query.filter(
+        DriveUploadJob.document_id == document.id,
+        DriveUploadJob.stato.in_(['in_coda', 'in_corso'])
+    ).first()
+    if existing:
+        return existing
+
+    job = DriveUploadJob(
+        document_id=document.id,
+        local_path=local_path,
+        nome_file=nome_file or document.original_filename or document.filename,
+        subfolders=subfolders if subfolders is not None else document_subfolders(document),
+        parent_folder_id=parent_folder_id,
+        max_tentativi=max_tentativi,
+        prossimo_tentativo=datetime.utcnow()
+    )
+    db.session.add(job)
+    _set_status_note(document, "⏳ In coda per Google Drive")
+
+    if commit:
+        db.session.commit()
+    else:
+        db.session.flush()
+    return job
+
+
+def _schedule_retry(job: DriveUploadJob, error: Exception, now: datetime, definitivo: bool = False):
+    """Registra un tentativo fallito e pianifica il successivo con backoff."""
+    job.tentativi += 1
+    job.ultimo_errore = str(error)[:2000]
+    if definitivo or job.tentativi >= job.max_tentativi:
+        job.stato = 'fallito'
+        _set_status_note(job.document, f"❌ Upload Drive fallito: {error}")
+        logger.error(f"❌ Upload Drive {job.id} fallito definitivamente: {error}")
+    else:
+        delay = min(BACKOFF_BASE_SEC * (2 ** (job.tentativi - 1)), BACKOFF_MAX_SEC)
+        job.stato = 'in_coda'
+        job.prossimo_tentativo = now + timedelta(seconds=delay)
+        _set_status_note(job.document, f"⚠️ Upload Drive: nuovo tentativo tra {delay}s")
+        logger.warning(f"⚠️ Upload Drive {job.id} ritentato tra {delay}s: {error}")
+
+
+def _pronti(now: datetime):
+    """Condizione degli upload prenotabili: in coda e scaduti, o in corso senza heartbeat."""
+    stale = now - timedelta(seconds=STALE_AFTER_SEC)
+    return or_(
+        and_(DriveUploadJob.stato == 'in_coda', DriveUploadJob.prossimo_tentativo <= now),
+        and_(DriveUploadJob.stato == 'in_corso', DriveUploadJob.updated_at < stale)
+    )
+
+
+def _candidati(batch_size: int, now: datetime) -> List[int]:
+    return [row.id for row in db.session.query(DriveUploadJob.id).filter(_pronti(now)).order_by(
+        DriveUploadJob.prossimo_tentativo, DriveUploadJob.id).limit(batch_size)]
+
+
+def _claim_jobs(batch_size: int, now: datetime) -> List[DriveUploadJob]:
+    """
+    Prenota gli upload pronti (o rimasti orfani in corso) marcandoli in corso.
+
+    Ogni upload è prenotato con un UPDATE condizionato: se un altro worker
+    (job dello scheduler o `flask sync-drive`) l'ha già preso o ha appena
+    aggiornato l'heartbeat, l'UPDATE non modifica righe e l'upload viene saltato.
+    """
+    prenotati = [
+        job_id for job_id in _candidati(batch_size, now)
+        if DriveUploadJob.query.filter(DriveUploadJob.id == job_id, _pronti(now)).update(
+            {'stato': 'in_corso', 'updated_at': now}, synchronize_session=False)
+    ]
+    db.session.commit()
+
+    if not prenotati:
+        return []
+    return DriveUploadJob.query.filter(DriveUploadJob.id.in_(prenotati)).order_by(
+        DriveUploadJob.prossimo_tentativo, DriveUploadJob.id).all()
+
+
+def _upload_job(client: DriveSyncClient, job: DriveUploadJob):
+    """Esegue un singolo upload salvando l'avanzamento dopo ogni chunk."""
+    doc = job.document
+    size = os.path.getsize(job.local_path)
+
+    def _progress(resumable_uri, bytes_inviati):
+        job.resumable_uri = resumable_uri
+        job.bytes_inviati = bytes_inviati
+        job.updated_at = datetime.utcnow()
+        percentuale = int(bytes_inviati * 100 / size) if size else 0
+        _set_status_note(doc, f"⏫ Upload Drive in corso ({percentuale}%)")
+        db.session.commit()
+
+    file_id = client.upload_file(
+        job.local_path, job.nome_file,
+        subfolders=job.subfolders,
+        parent_folder_id=job.parent_folder_id,
+        resumable_uri=job.resumable_uri,
+        on_progress=_progress
+    )
+
+    now = datetime.utcnow()
+    job.stato = 'caricato'
+    job.drive_file_id = file_id
+    job.bytes_inviati = size
+    job.completed_at = now
+    job.ultimo_errore = None
+    if doc is not None:
+        doc.drive_file_id = file_id
+        doc.drive_uploaded_at = now
+        _set_status_note(doc, f"✅ Caricato su Drive il {now.strftime('%d/%m/%Y %H:%M')}")
+
+
+def process_drive_queue(batch_size: Optional[int] = None, client: Optional[DriveSyncClient] = None) -> dict:
+    """
+    Esegue un batch di upload in coda.
+
+    Args:
+        batch_size (int, optional): Numero massimo di upload per batch.
+        client (DriveSyncClient, optional): Client Drive (default quello del processo).
+
+    Returns:
+        dict: Statistiche del batch (caricati, errori, falliti).
+    """
+    batch_size = batch_size or current_app.config.get('DRIVE_QUEUE_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    stats = {'caricati': 0, 'errori': 0, 'falliti': 0}
+
+    jobs = _claim_jobs(batch_size, datetime.utcnow())
+    if not jobs:
+        return stats
+
+    client = client or get_drive_client()
+    for job in jobs:
+        now = datetime.utcnow()
+        try:
+            if not os.path.exists(job.local_path):
+                _schedule_retry(job, FileNotFoundError(f"File locale non trovato: {job.local_path}"), now, definitivo=True)
+            else:
+                _upload_job(client, job)
+                stats['caricati'] += 1
+        except HttpError as e:
+            if e.resp.status in (404, 410):
+                if job.resumable_uri:
+                    # Sessione resumable scaduta: si riparte da zero
+                    job.resumable_uri = None
+                    job.bytes_inviati = 0
+                elif not job.parent_folder_id:
+                    # Cartella cancellata su Drive: la cache non è più valida
+                    client.forget_folders(job.subfolders)
+            _schedule_retry(job, e, now)
+            stats['errori'] += 1
+        except Exception as e:
+            _schedule_retry(job, e, now)
+            stats['errori'] += 1
+        if job.stato == 'fallito':
+            stats['falliti'] += 1
+        db.session.commit()
+
+    logger.info(f"☁️ Batch Drive: {stats['caricati']} caricati, {stats['errori']} errori, {stats['falliti']} falliti")
+    return stats
+
+
+def flush_drive_queue(batch_size: Optional[int] = None, max_batches: int = 20,
+                      client: Optional[DriveSyncClient] = None) -> dict:
+    """
+    Svuota la coda processando batch successivi finché ci sono upload pronti.
+
+    Args:
+        batch_size (int, optional): Numero massimo di upload per batch.
+        max_batches (int): Numero massimo di batch per esecuzione.
+        client (DriveSyncClient, optional): Client Drive.
+
+    Returns:
+        dict: Statistiche cumulative.
+    """
+    totale = {'caricati': 0, 'errori': 0, 'falliti': 0}
+    for _ in range(max_batches):
+        stats = process_drive_queue(batch_size, client=client)
+        for key in totale:
+            totale[key] += stats[key]
+        if stats['caricati'] == 0 and stats['errori'] == 0:
+            break
+    return totale
+
+
+def get_drive_queue_stats() -> dict:
+    """
+    Restituisce il numero di upload per stato.
+
+    Returns:
+        dict: Conteggi per stato.
+    """
+    rows = db.session.query(DriveUploadJob.stato, db.func.count(DriveUploadJob.id)).group_by(DriveUploadJob.stato).all()
+    return {stato: count for stato, count in rows}
@@ -0,0 +1,723 @@
+"""
+Registro eventi unificato: append-only, partizionato per mese, con archivio compresso.
+
+Un unico formato per l'attività oggi sparsa tra le tabelle di log (audit
+documenti e di sicurezza, download, letture, guest, admin, AI): `fonte`
+(tabella o modulo d'origine), `azione`, utente, documento, IP e `dati` JSON.
+
+Scrittura:
+- `registra_evento()` per il codice nuovo;
+- le righe inserite nelle tabelle di log esistenti (EVENT_STORE_CAPTURE) sono
+  replicate nel registro dopo il commit, senza toccare i punti di chiamata;
+- gli eventi passano dalla coda di scrittura (services.db_profile): un insert
+  multiplo per partizione e una transazione per batch, non un commit per evento.
+
+Partizioni: una tabella `eventi_AAAAMM` per mese, creata alla prima scrittura.
+Su PostgreSQL sono partizioni di `eventi` (PARTITION BY RANGE); su SQLite la
+vista `eventi` le unisce (UNION ALL) ed è ricreata a ogni partizione aggiunta
+o archiviata.
+
+Retention: le partizioni oltre EVENT_STORE_LIVE_MONTHS sono esportate in un
+segmento JSONL gzip (EVENT_ARCHIVE_DIR) ed eliminate; i segmenti oltre
+EVENT_STORE_RETENTION_MONTHS vengono cancellati. Le righe delle tabelle di log
+catturate oltre EVENT_STORE_SOURCE_RETENTION_MONTHS sono eliminate, perché
+ne resta la copia nel registro (le letture no: servono al bitmap). `leggi_eventi` e
+`conta_eventi` leggono partizioni e segmenti come un'unica sequenza.
+
+Prime letture: un bitmap per documento (bit = user_id) sostituisce la ricerca
+in DocumentReadLog a ogni lettura.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from datetime import date, datetime
+from typing import Iterator, Optional
+
+from flask import current_app, has_app_context
+from sqlalchemy import (BigInteger, Column, DateTime, Index, Integer, MetaData, String, Table, Text, event, insert,
+                        inspect, select)
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import DocumentReadLog, EventArchiveSegment, FirstReadBitmap
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CAPTURE = (
+    'document_audit_logs', 'security_audit_log', 'download_log', 'document_read_logs',
+    'guest_activities', 'admin_log', 'ai_analysis_logs', 'document_activity_log',
+)
+PREFISSO = 'eventi_'
+_RE_PARTIZIONE = re.compile(r'^eventi_(\d{6})$')
+_CAMPI_TS = ('timestamp', 'ts', 'created_at')
+_CAMPI_AZIONE = ('evento', 'action', 'action_type', 'status')
+_CAMPI_IP = ('ip_address', 'ip')
+# Letture sempre conservate: il bitmap delle prime letture si ricostruisce da document_read_logs
+_FONTI_CONSERVATE = {'document_read_logs'}
+_MAX_BITMAP_CACHE = 4096
+EXPORT_BATCH = 5000
+
+_metadata = MetaData()
+_tabelle = {}
+_partizioni = set()
+_lock = threading.Lock()
+_bitmap_cache = OrderedDict()
+_bitmap_lock = threading.Lock()
+_listeners_installed = False
+
+
+# === CONFIGURAZIONE ===
+
+def abilitato(app=None) -> bool:
+    app = app or (current_app if has_app_context() else None)
+    return bool(app and app.config.get('EVENT_STORE_ENABLED', False))
+
+
+def _fonti_catturate(app=None) -> set:
+    app = app or current_app
+    valore = app.config.get('EVENT_STORE_CAPTURE')
+    if valore is None:
+        return set(DEFAULT_CAPTURE)
+    if isinstance(valore, str):
+        valore = valore.split(',')
+    return {v.strip() for v in valore if v.strip()}
+
+
+def archive_dir(app=None) -> str:
+    app = app or current_app
+    return app.config.get('EVENT_ARCHIVE_DIR') or os.path.join(app.root_path, 'archive', 'eventi')
+
+
+# === PARTIZIONI ===
+
+def mese_di(ts: datetime) -> str:
+    return ts.strftime('%Y%m')
+
+
+def _mese_successivo(mese: str) -> str:
+    anno, numero = int(mese[:4]), int(mese[4:])
+    return f"{anno + numero // 12}{numero % 12 + 1:02d}"
+
+
+def _sposta_mesi(giorno: date, mesi: int) -> str:
+    indice = giorno.year * 12 + giorno.month - 1 - mesi
+    return f"{indice // 12}{indice % 12 + 1:02d}"
+
+
+def tabella_partizione(mese: str) -> Table:
+    """Definizione Core della partizione `eventi_<mese>` (non la crea)."""
+    nome = f"{PREFISSO}{mese}"
+    with _lock:
+        tabella = _tabelle.get(nome)
+        if tabella is None:
+            tabella = Table(
+                nome, _metadata,
+                Column('id', BigInteger().with_variant(Integer, 'sqlite'), primary_key=True, autoincrement=True),
+                Column('ts', DateTime, nullable=False),
+                Column('fonte', String(50), nullable=False),
+                Column('azione', String(255), nullable=True),
+                Column('user_id', Integer, nullable=True),
+                Column('document_id', Integer, nullable=True),
+                Column('ip', String(45), nullable=True),
+                Column('dati', Text, nullable=True),
+                Index(f"ix_{nome}_ts", 'ts'),
+                Index(f"ix_{nome}_fonte_ts", 'fonte', 'ts'),
+                Index(f"ix_{nome}_document_id", 'document_id'),
+                Index(f"ix_{nome}_user_id", 'user_id'),
+            )
+            _tabelle[nome] = tabella
+    return tabella
+
+
+def partizioni_live(engine=None) -> list:
+    """Mesi (AAAAMM) con una partizione nel database, in ordine."""
+    engine = engine or db.engine
+    mesi = []
+    for nome in inspect(engine).get_table_names():
+        trovato = _RE_PARTIZIONE.match(nome)
+        if trovato:
+            mesi.append(trovato.group(1))
+    return sorted(mesi)
+
+
+def _aggiorna_vista_sqlite(conn):
+    mesi = sorted(
+        _RE_PARTIZIONE.match(nome).group(1)
+        for nome in inspect(conn).get_table_names() if _RE_PARTIZIONE.match(nome)
+    )
+    conn.exec_driver_sql("DROP VIEW IF EXISTS eventi")
+    if mesi:
+        conn.exec_driver_sql("CREATE VIEW eventi AS " + " UNION ALL ".join(
+            f"SELECT * FROM {PREFISSO}{mese}" for mese in mesi))
+
+
+def _crea_partizione(tabella: Table, engine):
+    # Controllo e creazione non sono atomici: se un altro worker crea la partizione
+    # (o la vista SQLite) nel frattempo, il suo "already exists" non è un errore
+    try:
+        with engine.begin() as conn:
+            esisteva = inspect(conn).has_table(tabella.name)
+            tabella.create(conn, checkfirst=True)
+            if not esisteva and conn.dialect.name == 'sqlite':
+                _aggiorna_vista_sqlite(conn)
+    except (OperationalError, ProgrammingError) as e:
+        if 'already exists' not in str(e).lower():
+            raise
+        logger.debug(f"Partizione {tabella.name} creata da un altro worker")
+
+
+def assicura_partizione(mese: str, engine=None) -> Table:
+    """Crea la partizione del mese se non esiste ancora (una volta per processo)."""
+    tabella = tabella_partizione(mese)
+    if mese in _partizioni:
+        return tabella
+    engine = engine or db.engine
+    if engine.dialect.name == 'postgresql':
+        with engine.begin() as conn:
+            conn.exec_driver_sql(
+                "CREATE TABLE IF NOT EXISTS eventi (id BIGSERIAL, ts TIMESTAMP NOT NULL, fonte VARCHAR(50) NOT NULL, "
+                "azione VARCHAR(255), user_id INTEGER, document_id INTEGER, ip VARCHAR(45), dati TEXT, "
+                "PRIMARY KEY (id, ts)) PARTITION BY RANGE (ts)"
+            )
+            for colonne in ('ts', 'fonte, ts', 'document_id', 'user_id'):
+                conn.exec_driver_sql(
+                    f"CREATE INDEX IF NOT EXISTS ix_eventi_{colonne.replace(', ', '_')} ON eventi ({colonne})")
+            inizio, fine = mese, _mese_successivo(mese)
+            conn.exec_driver_sql(
+                f"CREATE TABLE IF NOT EXISTS {tabella.name} PARTITION OF eventi FOR VALUES "
+                f"FROM ('{inizio[:4]}-{inizio[4:]}-01') TO ('{fine[:4]}-{fine[4:]}-01')"
+            )
+    else:
+        _crea_partizione(tabella, engine)
+    _partizioni.add(mese)
+    return tabella
+
+
+def _elimina_partizione(mese: str, engine):
+    nome = f"{PREFISSO}{mese}"
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"DROP TABLE IF EXISTS {nome}")
+        if conn.dialect.name == 'sqlite':
+            _aggiorna_vista_sqlite(conn)
+    _partizioni.discard(mese)
+
+
+# === SCRITTURA ===
+
+def _json(valore) -> Optional[str]:
+    return json.dumps(valore, ensure_ascii=False, default=str) if valore else None
+
+
+def _naive(ts) -> datetime:
+    if ts is None:
+        return datetime.utcnow()
+    return ts.replace(tzinfo=None) if ts.tzinfo else ts
+
+
+def evento_da_riga(fonte: str, valori: dict) -> dict:
+    """Evento del registro da una riga di una tabella di log esistente."""
+    usati = {'id', 'user_id', 'document_id'}
+
+    def _primo(campi):
+        for campo in campi:
+            if valori.get(campo) is not None:
+                usati.add(campo)
+                return valori[campo]
+        return None
+
+    ts, azione, ip = _primo(_CAMPI_TS), _primo(_CAMPI_AZIONE), _primo(_CAMPI_IP)
+    document_id = valori.get('document_id')
+    if document_id is None and valori.get('object_type') == 'document':
+        document_id = valori.get('object_id')
+
+    dati = {k: v for k, v in valori.items() if k not in usati and v is not None}
+    if valori.get('id') is not None:
+        dati['rif_id'] = valori['id']
+    return {
+        'ts': _naive(ts),
+        'fonte': fonte,
+        'azione': str(azione)[:255] if azione is not None else None,
+        'user_id': valori.get('user_id'),
+        'document_id': document_id,
+        'ip': ip[:45] if ip else None,
+        'dati': _json(dati),
+    }
+
+
+def _per_partizione(eventi, engine=None) -> dict:
+    gruppi = {}
+    for evento in eventi:
+        gruppi.setdefault(mese_di(evento['ts']), []).append(evento)
+    return {assicura_partizione(mese, engine): righe for mese, righe in gruppi.items()}
+
+
+def scrivi_eventi(eventi: list):
+    """Inserisce gli eventi: tramite la coda di scrittura se attiva, altrimenti in una transazione."""
+    if not eventi:
+        return
+    from services.db_profile import get_writer
+
+    writer = get_writer()
+    for tabella, righe in _per_partizione(eventi).items():
+        if writer is not None:
+            for riga in righe:
+                writer.submit(tabella, riga)
+        else:
+            with db.engine.begin() as conn:
+                conn.execute(insert(tabella), righe)
+
+
+def registra_evento(fonte: str, azione: str = None, user_id: int = None, document_id: int = None,
+                    ip: str = None, ts: datetime = None, **dati):
+    """
+    Registra un evento nel registro unificato.
+
+    Args:
+        fonte (str): Modulo o tabella d'origine (es. 'manus_sync').
+        azione (str): Azione eseguita.
+        user_id (int): Utente (opzionale).
+        document_id (int): Documento (opzionale).
+        ip (str): Indirizzo IP (opzionale).
+        ts (datetime): Istante dell'evento (default adesso, UTC).
+        **dati: Dettagli serializzati in JSON.
+    """
+    if not abilitato():
+        return
+    try:
+        scrivi_eventi([{
+            'ts': _naive(ts), 'fonte': fonte[:50], 'azione': azione[:255] if azione else None,
+            'user_id': user_id, 'document_id': document_id, 'ip': ip[:45] if ip else None, 'dati': _json(dati),
+        }])
+    except Exception as e:
+        logger.error(f"❌ Errore registrazione evento {fonte}/{azione}: {e}")
+
+
+def eventi_per_righe(per_modello: dict, engine=None) -> dict:
+    """
+    Eventi da aggiungere al batch della coda di scrittura per le righe di log
+    catturate (chiamata da SerialWriter nello stesso batch).
+
+    Args:
+        per_modello (dict): modello o tabella -> righe da inserire
+
+    Returns:
+        dict: tabella partizione -> eventi
+    """
+    if not abilitato():
+        return {}
+    fonti = _fonti_catturate()
+    eventi = []
+    for model, righe in per_modello.items():
+        fonte = getattr(model, '__tablename__', None)
+        if fonte in fonti:
+            eventi.extend(evento_da_riga(fonte, riga) for riga in righe)
+    return _per_partizione(eventi, engine)
+
+
+def _valori_istanza(obj) -> dict:
+    return {attr.columns[0].name: getattr(obj, attr.key) for attr in inspect(obj).mapper.column_attrs}
+
+
+def _dopo_flush(session, flush_context):
+    if not abilitato():
+        return
+    fonti = _fonti_catturate()
+    nuovi = [obj for obj in session.new if getattr(obj, '__tablename__', None) in fonti]
+    if nuovi:
+        session.info.setdefault('eventi_registro', []).extend(
+            evento_da_riga(obj.__tablename__, _valori_istanza(obj)) for obj in nuovi)
+
+
+def _dopo_commit(session):
+    eventi = session.info.pop('eventi_registro', None)
+    if not eventi:
+        return
+    try:
+        scrivi_eventi(eventi)
+    except Exception as e:
+        # Il commit delle righe di log è già avvenuto: l'errore non risale alla richiesta
+        logger.error(f"❌ Errore replica di {len(eventi)} eventi nel registro: {e}")
+
+
+def _dopo_rollback(session):
+    session.info.pop('eventi_registro', None)
+
+
+def install_listeners():
+    """Replica nel registro le righe inserite nelle tabelle di log catturate (idempotente)."""
+    global _listeners_installed
+    if _listeners_installed:
+        return
+    event.listen(Session, 'after_flush', _dopo_flush)
+    event.listen(Session, 'after_commit', _dopo_commit)
+    event.listen(Session, 'after_rollback', _dopo_rollback)
+    _listeners_installed = True
+
+
+def init_event_store(app):
+    """
+    Attiva la cattura delle tabelle di log se EVENT_STORE_ENABLED.
+
+    Args:
+        app: Istanza dell'applicazione Flask
+    """
+    if not app.config.get('EVENT_STORE_ENABLED', False):
+        return
+    install_listeners()
+    logger.info(f"🗃️ Registro eventi attivo: {', '.join(sorted(_fonti_catturate(app)))}")
+
+
+# === PRIME LETTURE ===
+
+def _bit(bitmap, user_id: int) -> bool:
+    indice = user_id >> 3
+    return bitmap is not None and indice < len(bitmap) and bool(bitmap[indice] & (1 << (user_id & 7)))
+
+
+def _accendi(bitmap: bytearray, user_id: int):
+    indice = user_id >> 3
+    if indice >= len(bitmap):
+        bitmap.extend(b'\x00' * (indice + 1 - len(bitmap)))
+    bitmap[indice] |= 1 << (user_id & 7)
+
+
+def _ricorda_bitmap(document_id: int, bitmap: bytearray):
+    with _bitmap_lock:
+        _bitmap_cache[document_id] = bitmap
+        _bitmap_cache.move_to_end(document_id)
+        while len(_bitmap_cache) > _MAX_BITMAP_CACHE:
+            _bitmap_cache.popitem(last=False)
+
+
+def _bitmap_in_cache(document_id: int):
+    with _bitmap_lock:
+        bitmap = _bitmap_cache.get(document_id)
+        if bitmap is not None:
+            _bitmap_cache.move_to_end(document_id)
+        return bitmap
+
+
+def dimentica_bitmap(document_id: int):
+    """Scarta il bitmap in cache (es. dopo il rollback di una lettura non salvata)."""
+    with _bitmap_lock:
+        _bitmap_cache.pop(document_id, None)
+
+
+def _bitmap_da_log(document_id: int) -> bytearray:
+    # Documento senza bitmap: costruito una volta dalle letture già registrate
+    bitmap = bytearray()
+    for (user_id,) in db.session.query(DocumentReadLog.user_id).filter_by(document_id=document_id).distinct():
+        _accendi(bitmap, user_id)
+    return bitmap
+
+
+def _carica_bitmap(document_id: int) -> bytearray:
+    riga = FirstReadBitmap.query.filter_by(document_id=document_id).first()
+    if riga is not None:
+        return bytearray(riga.bitmap or b'')
+    return _bitmap_da_log(document_id)
+
+
+def _crea_riga_bitmap(document_id: int) -> bool:
+    """
+    Crea la riga del bitmap se manca, senza errori tra prime letture concorrenti.
+
+    Su SQLite l'istruzione di scrittura prende anche il lock del database fino
+    al commit: le letture successive della transazione vedono l'ultimo bitmap.
+
+    Returns:
+        bool: True se la riga è stata creata da questa transazione
+    """
+    tabella = FirstReadBitmap.__table__
+    valori = {'document_id': document_id, 'bitmap': b'', 'updated_at': datetime.utcnow()}
+    dialetto = db.session.get_bind().dialect.name
+    if dialetto in ('postgresql', 'sqlite'):
+        if dialetto == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as insert_dialetto
+        else:
+            from sqlalchemy.dialects.sqlite import insert as insert_dialetto
+        stmt = insert_dialetto(tabella).values(**valori).on_conflict_do_nothing(index_elements=['document_id'])
+        return db.session.execute(stmt).rowcount == 1
+
+    if db.session.query(tabella.c.document_id).filter_by(document_id=document_id).first() is not None:
+        return False
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(tabella).values(**valori))
+        return True
+    except IntegrityError:
+        return False
+
+
+def ha_letto(user_id: int, document_id: int) -> bool:
+    """True se l'utente ha già letto il documento (bitmap, senza scansione dei log)."""
+    if _bit(_bitmap_in_cache(document_id), user_id):
+        return True
+    bitmap = _carica_bitmap(document_id)
+    _ricorda_bitmap(document_id, bitmap)
+    return _bit(bitmap, user_id)
+
+
+def segna_lettura(user_id: int, document_id: int) -> bool:
+    """
+    Registra la lettura nel bitmap del documento (nella sessione corrente,
+    senza commit).
+
+    La riga è bloccata fino al commit (FOR UPDATE su PostgreSQL, lock di
+    scrittura su SQLite): letture concorrenti dello stesso documento non
+    perdono bit.
+
+    Returns:
+        bool: True se è la prima lettura dell'utente
+    """
+    # I bit accesi non si spengono: in cache basta cercare quelli presenti
+    if _bit(_bitmap_in_cache(document_id), user_id):
+        return False
+    creata = _crea_riga_bitmap(document_id)
+    riga = FirstReadBitmap.query.filter_by(document_id=document_id).with_for_update().populate_existing().one()
+    bitmap = _bitmap_da_log(document_id) if creata else bytearray(riga.bitmap or b'')
+    prima = not _bit(bitmap, user_id)
+    if prima:
+        _accendi(bitmap, user_id)
+    if prima or creata:
+        riga.bitmap = bytes(bitmap)
+        riga.updated_at = datetime.utcnow()
+    _ricorda_bitmap(document_id, bitmap)
+    return prima
+
+
+def invalida_bitmap(document_id: int):
+    """
+    Elimina il bitmap del documento (nella sessione corrente, senza commit):
+    alla lettura successiva viene ricostruito dai log di lettura.
+    """
+    dimentica_bitmap(document_id)
+    FirstReadBitmap.query.filter_by(document_id=document_id).delete(synchronize_session=False)
+
+
+# === ARCHIVIO E RETENTION ===
+
+def _riga_json(riga) -> dict:
+    voce = dict(riga._mapping)
+    voce['ts'] = voce['ts'].isoformat()
+    voce['dati'] = json.loads(voce['dati']) if voce.get('dati') else {}
+    return voce
+
+
+def archivia_partizione(mese: str, app=None) -> Optional[EventArchiveSegment]:
+    """
+    Esporta la partizione in un segmento JSONL gzip e la elimina dal database.
+
+    Returns:
+        EventArchiveSegment | None: Segmento creato (None se la partizione era vuota)
+    """
+    app = app or current_app
+    engine = db.engine
+    tabella = tabella_partizione(mese)
+    directory = archive_dir(app)
+    os.makedirs(directory, exist_ok=True)
+    parte = EventArchiveSegment.query.filter_by(mese=mese).count()
+    path = os.path.join(directory, f"{PREFISSO}{mese}{f'.{parte}' if parte else ''}.jsonl.gz")
+    tmp = f"{path}.tmp"
+
+    righe, primo, ultimo = 0, None, None
+    with engine.connect() as conn, gzip.open(tmp, 'wt', encoding='utf-8') as f:
+        risultato = conn.execution_options(stream_results=True).execute(
+            select(tabella).order_by(tabella.c.ts, tabella.c.id))
+        for batch in risultato.partitions(EXPORT_BATCH):
+            for riga in batch:
+                f.write(json.dumps(_riga_json(riga), ensure_ascii=False, default=str) + "\n")
+                primo = primo or riga.ts
+                ultimo = riga.ts
+                righe += 1
+
+    segmento = None
+    if righe:
+        with open(tmp, 'rb') as f:
+            os.fsync(f.fileno())
+        sha256 = hashlib.sha256()
+        with open(tmp, 'rb') as f:
+            for blocco in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(blocco)
+        os.replace(tmp, path)
+        segmento = EventArchiveSegment(mese=mese, path=path, righe=righe, da=primo, a=ultimo,
+                                       sha256=sha256.hexdigest())
+        db.session.add(segmento)
+        db.session.commit()
+    else:
+        os.remove(tmp)
+
+    # Partizione eliminata solo dopo che il segmento è registrato
+    _elimina_partizione(mese, engine)
+    logger.info(f"📦 Partizione {mese} archiviata: {righe} eventi in {path if righe else '-'}")
+    return segmento
+
+
+def _primo_evento() -> Optional[datetime]:
+    """Istante del primo evento nel registro (segmenti archiviati o partizione live più vecchia)."""
+    primo = db.session.query(db.func.min(EventArchiveSegment.da)).scalar()
+    if primo is not None:
+        return primo
+    with db.engine.connect() as conn:
+        for mese in partizioni_live():
+            primo = conn.execute(select(db.func.min(tabella_partizione(mese).c.ts))).scalar()
+            if primo is not None:
+                return primo
+    return None
+
+
+def pota_log_catturati(app=None, oggi: date = None) -> int:
+    """
+    Elimina dalle tabelle di log catturate le righe più vecchie di
+    EVENT_STORE_SOURCE_RETENTION_MONTHS (0 = conservate), che restano nel registro.
+
+    Sono eliminate solo le righe successive al primo evento registrato: quelle
+    precedenti all'attivazione del registro non ne hanno una copia. La finestra
+    non supera EVENT_STORE_RETENTION_MONTHS, così le righe escono dalle tabelle
+    di log prima che il loro segmento scada.
+
+    Returns:
+        int: Righe eliminate
+    """
+    app = app or current_app
+    oggi = oggi or datetime.utcnow().date()
+    mesi = int(app.config.get('EVENT_STORE_SOURCE_RETENTION_MONTHS', 0))
+    retention = int(app.config.get('EVENT_STORE_RETENTION_MONTHS', 24))
+    if retention > 0:
+        mesi = min(mesi, retention)
+    primo = _primo_evento() if mesi > 0 else None
+    if primo is None:
+        return 0
+
+    limite = _sposta_mesi(oggi, mesi - 1)
+    limite = datetime(int(limite[:4]), int(limite[4:]), 1)
+    eliminate = 0
+    for fonte in sorted(_fonti_catturate(app) - _FONTI_CONSERVATE):
+        tabella = db.metadata.tables.get(fonte)
+        colonna = next((tabella.c[campo] for campo in _CAMPI_TS if tabella is not None and campo in tabella.c), None)
+        if colonna is None:
+            continue
+        eliminate += db.session.execute(
+            tabella.delete().where(colonna >= primo, colonna < limite)).rowcount
+    db.session.commit()
+    if eliminate:
+        logger.info(f"🧹 {eliminate} righe di log oltre la retention eliminate (conservate nel registro eventi)")
+    return eliminate
+
+
+def applica_retention(app=None, oggi: date = None) -> dict:
+    """
+    Elimina le righe di log già registrate oltre EVENT_STORE_SOURCE_RETENTION_MONTHS,
+    archivia le partizioni oltre EVENT_STORE_LIVE_MONTHS ed elimina i segmenti
+    oltre EVENT_STORE_RETENTION_MONTHS (0 = conservati per sempre).
+
+    Returns:
+        dict: {'righe_log_eliminate', 'archiviate', 'eventi_archiviati', 'segmenti_eliminati'}
+    """
+    app = app or current_app
+    oggi = oggi or datetime.utcnow().date()
+    live = int(app.config.get('EVENT_STORE_LIVE_MONTHS', 3))
+    retention = int(app.config.get('EVENT_STORE_RETENTION_MONTHS', 24))
+    # Prima delle tabelle di log: i segmenti ancora presenti delimitano le righe registrate
+    stats = {'righe_log_eliminate': pota_log_catturati(app, oggi), 'archiviate': 0, 'eventi_archiviati': 0,
+             'segmenti_eliminati': 0}
+
+    # Il mese corrente è sempre live
+    primo_live = _sposta_mesi(oggi, max(live - 1, 0))
+    for mese in partizioni_live():
+        if mese < primo_live:
+            segmento = archivia_partizione(mese, app)
+            stats['archiviate'] += 1
+            stats['eventi_archiviati'] += segmento.righe if segmento else 0
+
+    if retention > 0:
+        limite = _sposta_mesi(oggi, retention - 1)
+        for segmento in EventArchiveSegment.query.filter(EventArchiveSegment.mese < limite).all():
+            try:
+                os.remove(segmento.path)
+            except FileNotFoundError:
+                pass
+            db.session.delete(segmento)
+            stats['segmenti_eliminati'] += 1
+        db.session.commit()
+    return stats
+
+
+# === LETTURA ===
+
+def _mesi(da: datetime, a: datetime) -> list:
+    mesi, mese = [], mese_di(da)
+    while mese <= mese_di(a):
+        mesi.append(mese)
+        mese = _mese_successivo(mese)
+    return mesi
+
+
+def _corrisponde(voce: dict, da, a, fonte, azione, user_id, document_id) -> bool:
+    return (da <= voce['ts'] <= a
+            and (fonte is None or voce['fonte'] == fonte)
+            and (azione is None or voce['azione'] == azione)
+            and (user_id is None or voce['user_id'] == user_id)
+            and (document_id is None or voce['document_id'] == document_id))
+
+
+def leggi_eventi(da: datetime, a: datetime, fonte: str = None, azione: str = None,
+                 user_id: int = None, document_id: int = None) -> Iterator[dict]:
+    """
+    Eventi nell'intervallo da partizioni live e segmenti archiviati, mese per mese.
+
+    Yields:
+        dict: ts, fonte, azione, user_id, document_id, ip, dati (dict)
+    """
+    engine = db.engine
+    live = set(partizioni_live(engine))
+    segmenti = {}
+    for segmento in EventArchiveSegment.query.filter(EventArchiveSegment.mese.between(mese_di(da), mese_di(a))):
+        segmenti.setdefault(segmento.mese, []).append(segmento.path)
+
+    for mese in _mesi(da, a):
+        for path in segmenti.get(mese, []):
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for linea in f:
+                    voce = json.loads(linea)
+                    voce['ts'] = datetime.fromisoformat(voce['ts'])
+                    if _corrisponde(voce, da, a, fonte, azione, user_id, document_id):
+                        yield voce
+        if mese not in live:
+            continue
+        tabella = tabella_partizione(mese)
+        query = select(tabella).where(tabella.c.ts.between(da, a))
+        for colonna, valore in (('fonte', fonte), ('azione', azione), ('user_id', user_id),
+                                ('document_id', document_id)):
+            if valore is not None:
+                query = query.where(tabella.c[colonna] == valore)
+        with engine.connect() as conn:
+            risultato = conn.execution_options(stream_results=True).execute(query.order_by(tabella.c.ts))
+            for batch in risultato.partitions(EXPORT_BATCH):
+                for riga in batch:
+                    voce = dict(riga._mapping)
+                    voce['dati'] = json.loads(voce['dati']) if voce.get('dati') else {}
+                    yield voce
+
+
+def conta_eventi(da: datetime, a: datetime, per: str = 'fonte', **filtri) -> Counter:
+    """
+    Conteggio degli eventi nell'intervallo raggruppati per `fonte`, `azione`,
+    `giorno` o `mese`, su dati live e archiviati.
+    """
+    chiavi = {
+        'fonte': lambda voce: voce['fonte'],
+        'azione': lambda voce: voce['azione'],
+        'giorno': lambda voce: voce['ts'].date().isoformat(),
+        'mese': lambda voce: mese_di(voce['ts']),
+    }
+    if per not in chiavi:
+        raise ValueError(f"Raggruppamento non supportato: {per}")
+    return Counter(chiavi[per](voce) for voce in leggi_eventi(da, a, **filtri))
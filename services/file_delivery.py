@@ -0,0 +1,125 @@
+"""
+Consegna dei file scaricati: via nginx (X-Accel-Redirect) o dal worker Python.
+
+Le route eseguono i controlli di accesso e scrivono i log, poi chiamano
+`deliver_file`. Con il backend `x-accel` il worker risponde subito con i soli
+header e nginx trasferisce il file (gestendo Range, ETag e If-None-Match);
+con il backend `python` il file è servito da `send_file` con risposte
+condizionali e parziali (Range/ETag/If-None-Match).
+"""
+
+import logging
+import mimetypes
+import os
+import re
+import unicodedata
+from typing import List, Optional, Tuple
+from urllib.parse import quote
+
+from flask import Response, current_app, send_file
+
+logger = logging.getLogger(__name__)
+
+BACKEND_PYTHON = 'python'
+BACKEND_X_ACCEL = 'x-accel'
+
+_SHA256_NAME = re.compile(r'^[0-9a-f]{64}$')
+
+
+def parse_accel_mappings(value: Optional[str]) -> List[Tuple[str, str]]:
+    """
+    Interpreta X_ACCEL_MAPPINGS: "directory=location interna" separati da virgola.
+
+    Esempio: "/var/www/uploads=/protected/uploads,/var/www/reports=/protected/reports"
+
+    Returns:
+        list: Coppie (directory assoluta, prefisso location), dalla directory più lunga.
+    """
+    mappings = []
+    for item in (value or '').split(','):
+        if '=' not in item:
+            continue
+        directory, location = (part.strip() for part in item.split('=', 1))
+        if directory and location:
+            mappings.append((os.path.abspath(directory), '/' + location.strip('/')))
+    return sorted(mappings, key=lambda m: len(m[0]), reverse=True)
+
+
+def accel_location(path: str, mappings: List[Tuple[str, str]]) -> Optional[str]:
+    """Location interna nginx per un file, None se fuori dalle directory mappate."""
+    path = os.path.abspath(path)
+    for directory, location in mappings:
+        if path.startswith(directory + os.sep):
+            relative = os.path.relpath(path, directory).replace(os.sep, '/')
+            return f"{location}/{quote(relative)}"
+    return None
+
+
+def file_etag(path: str, stat: Optional[os.stat_result] = None) -> str:
+    """
+    ETag del file: l'hash per i blob content-addressable, altrimenti mtime/dimensione.
+    """
+    name = os.path.basename(path)
+    if _SHA256_NAME.match(name):
+        return name
+    stat = stat or os.stat(path)
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+def _content_disposition(as_attachment: bool, download_name: Optional[str]) -> str:
+    disposition = 'attachment' if as_attachment else 'inline'
+    if not download_name:
+        return disposition
+    simple = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+    simple = simple.replace('\\', '\\\\').replace('"', '\\"')
+    value = f'{disposition}; filename="{simple}"'
+    if simple != download_name:
+        value += f"; filename*=UTF-8''{quote(download_name, safe='')}"
+    return value
+
+
+def deliver_file(path: str, download_name: Optional[str] = None, as_attachment: bool = True,
+                 mimetype: Optional[str] = None, max_age: Optional[int] = None) -> Response:
+    """
+    Restituisce la risposta per scaricare un file già autorizzato.
+
+    Args:
+        path: Percorso locale del file.
+        download_name: Nome proposto al browser (default: nome del file).
+        as_attachment: True per download, False per visualizzazione inline.
+        mimetype: Tipo MIME (default: dedotto da download_name o dal percorso).
+        max_age: Secondi di cache lato client (Cache-Control privato).
+
+    Returns:
+        Response: Risposta X-Accel-Redirect o file servito dal worker.
+    """
+    download_name = download_name or os.path.basename(path)
+    mimetype = mimetype or mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    backend = current_app.config.get('FILE_DELIVERY_BACKEND', BACKEND_PYTHON)
+
+    if backend == BACKEND_X_ACCEL:
+        mappings = parse_accel_mappings(current_app.config.get('X_ACCEL_MAPPINGS'))
+        location = accel_location(path, mappings)
+        if location:
+            response = Response(status=200, mimetype=mimetype)
+            response.headers['X-Accel-Redirect'] = location
+            response.headers['Content-Disposition'] = _content_disposition(as_attachment, download_name)
+            response.cache_control.private = True
+            if max_age is not None:
+                response.cache_control.max_age = max_age
+            else:
+                response.cache_control.no_cache = True
+            return response
+        logger.warning(f"File fuori dalle directory X_ACCEL_MAPPINGS, servito dal worker: {path}")
+
+    response = send_file(
+        path,
+        mimetype=mimetype,
+        as_attachment=as_attachment,
+        download_name=download_name,
+        conditional=True,
+        etag=file_etag(path),
+        max_age=max_age
+    )
+    response.cache_control.private = True
+    return response
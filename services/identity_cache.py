@@ -0,0 +1,204 @@
+"""
+Cache dell'identità utente (principal) condivisa tra le richieste.
+
+`load_user` carica l'utente con aziende e reparti in una sola query (eager
+join) e ne conserva una copia detached per un TTL breve: le richieste
+successive riagganciano la copia alla sessione con `merge(load=False)`,
+senza SQL. Il principal compatto (ruolo, ID aziende/reparti, flag) è usato
+dai filtri RBAC al posto delle relazioni lazy.
+
+La cache è locale al processo: le modifiche a utenti e appartenenze la
+invalidano al commit, negli altri worker la scadenza è limitata dal TTL.
+"""
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, joinedload
+
+from extensions import db
+from models import Company, Department, User
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SEC = 30
+MAX_ENTRIES = 10000
+
+_cache = {}
+_lock = threading.Lock()
+_listeners_registered = False
+
+
+@dataclass(frozen=True)
+class UserPrincipal:
+    """
+    Identità compatta dell'utente autenticato.
+
+    Attributi:
+        id (int): ID utente.
+        role (str): Ruolo ('user', 'guest', 'admin', 'superadmin', 'ceo').
+        company_ids (tuple): ID delle aziende dell'utente.
+        department_ids (tuple): ID dei reparti dell'utente.
+        can_download (bool): Permesso di download.
+    """
+    id: int
+    role: str
+    company_ids: Tuple[int, ...]
+    department_ids: Tuple[int, ...]
+    can_download: bool = False
+
+    @property
+    def is_admin(self) -> bool:
+        return self.role == 'admin'
+
+    @property
+    def is_ceo(self) -> bool:
+        return self.role == 'ceo'
+
+    @property
+    def is_guest(self) -> bool:
+        return self.role == 'guest'
+
+    @classmethod
+    def from_user(cls, user: User) -> 'UserPrincipal':
+        """Costruisce il principal da un utente con relazioni già caricate."""
+        return cls(
+            id=user.id,
+            role=user.role,
+            company_ids=tuple(c.id for c in user.companies),
+            department_ids=tuple(d.id for d in user.departments),
+            can_download=bool(user.can_download)
+        )
+
+
+def _ttl() -> int:
+    if not has_app_context():
+        return 0
+    return current_app.config.get('IDENTITY_CACHE_TTL_SEC', DEFAULT_TTL_SEC)
+
+
+def _load_snapshot(user_id: int) -> Optional[User]:
+    """Carica l'utente con aziende e reparti in una query, in una sessione separata (copia detached)."""
+    with Session(db.engine) as session:
+        user = session.query(User).options(
+            joinedload(User.companies),
+            joinedload(User.departments)
+        ).filter(User.id == user_id).first()
+        session.expunge_all()
+    return user
+
+
+def load_identity(user_id: int) -> Optional[User]:
+    """
+    Restituisce l'utente per Flask-Login usando la cache di identità.
+
+    Args:
+        user_id (int): ID utente dalla sessione.
+
+    Returns:
+        User: Utente collegato a `db.session` (con principal in `_principal`) o None.
+    """
+    ttl = _ttl()
+    if ttl <= 0:
+        user = db.session.get(User, user_id)
+        if user is not None:
+            user._principal = UserPrincipal.from_user(user)
+        return user
+
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(user_id)
+    if entry is None or entry[0] <= now:
+        snapshot = _load_snapshot(user_id)
+        if snapshot is None:
+            return None
+        entry = (now + ttl, snapshot, UserPrincipal.from_user(snapshot))
+        with _lock:
+            if len(_cache) >= MAX_ENTRIES:
+                _cache.clear()
+            _cache[user_id] = entry
+
+    user = db.session.merge(entry[1], load=False)
+    user._principal = entry[2]
+    return user
+
+
+def get_principal(user) -> Optional[UserPrincipal]:
+    """
+    Restituisce il principal dell'utente (calcolandolo se non presente).
+
+    Args:
+        user: Utente (tipicamente current_user).
+
+    Returns:
+        UserPrincipal: Principal o None per utenti anonimi.
+    """
+    if user is None or not getattr(user, 'is_authenticated', False):
+        return None
+    principal = getattr(user, '_principal', None)
+    if principal is None or principal.id != user.id:
+        principal = UserPrincipal.from_user(user)
+        user._principal = principal
+    return principal
+
+
+def invalidate_identity(user_id: Optional[int] = None):
+    """
+    Invalida la cache di identità di un utente (o di tutti).
+
+    Args:
+        user_id (int, optional): ID utente; None svuota l'intera cache.
+    """
+    with _lock:
+        if user_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(user_id, None)
+
+
+# === INVALIDAZIONE AUTOMATICA ===
+
+def _membership_user_ids(obj):
+    history = inspect(obj).attrs['users'].history
+    return {u.id for u in list(history.added) + list(history.deleted) if getattr(u, 'id', None)}
+
+
+def _before_flush(session, flush_context, instances):
+    """Raccoglie gli utenti modificati in questo flush."""
+    changed = session.info.setdefault('identity_dirty', set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            changed.add(obj.id)
+        elif isinstance(obj, (Company, Department)):
+            changed.update(_membership_user_ids(obj))
+
+
+def _after_commit(session):
+    for user_id in session.info.pop('identity_dirty', ()):
+        invalidate_identity(user_id)
+
+
+def _after_rollback(session):
+    session.info.pop('identity_dirty', None)
+
+
+def register_identity_listeners(session=None):
+    """
+    Registra gli eventi di sessione che invalidano la cache al commit (idempotente).
+
+    Args:
+        session: Sessione o scoped_session (default db.session).
+    """
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    session = session or db.session
+    event.listen(session, 'before_flush', _before_flush)
+    event.listen(session, 'after_commit', _after_commit)
+    event.listen(session, 'after_rollback', _after_rollback)
+    _listeners_registered = True
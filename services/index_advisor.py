@@ -0,0 +1,177 @@
+"""
+Index advisor: riesegue il piano delle query catturate e segnala le scansioni complete.
+
+Le fingerprint arrivano dal log JSONL delle metriche query (services.query_metrics:
+N+1 e istruzioni ripetute delle richieste segnalate) o da un file SQL. Per
+ognuna viene chiesto il piano al database:
+- SQLite: `EXPLAIN QUERY PLAN`, scansione completa = `SCAN <tabella>` senza indice;
+- PostgreSQL 16+: `EXPLAIN (GENERIC_PLAN, FORMAT JSON)`, nodi `Seq Scan`.
+
+Per le tabelle scansionate propone un indice con le colonne filtrate nella
+query (prima le uguaglianze, poi gli intervalli).
+"""
+
+import logging
+import re
+
+from services.query_metrics import leggi_log
+
+logger = logging.getLogger(__name__)
+
+_RE_CONDIZIONE = re.compile(
+    r"\b(\w+)\.(\w+)\s*(=|!=|<>|>=|<=|>|<|\bIN\b|\bLIKE\b|\bIS\b|\bBETWEEN\b)", re.IGNORECASE
+)
+_RE_ALIAS = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+AS)?\s+(\w+)", re.IGNORECASE)
+_PAROLE_CHIAVE = {'WHERE', 'JOIN', 'LEFT', 'INNER', 'OUTER', 'ON', 'GROUP', 'ORDER', 'LIMIT', 'UNION', 'CROSS'}
+_SQLITE_CON_INDICE = ('USING INDEX', 'USING COVERING INDEX', 'USING INTEGER PRIMARY KEY', 'USING PRIMARY KEY')
+
+
+def fingerprint_dal_log(path: str, limite: int = 5000) -> dict:
+    """
+    Fingerprint catturate nel log JSONL con occorrenze ed endpoint.
+
+    Returns:
+        dict: fingerprint -> {'occorrenze', 'endpoint'}
+    """
+    risultato = {}
+    for voce in leggi_log(path, limite=limite):
+        for gruppo in ('n_plus_one', 'ripetute'):
+            for item in voce.get(gruppo, []):
+                dati = risultato.setdefault(item['fingerprint'], {'occorrenze': 0, 'endpoint': set()})
+                dati['occorrenze'] += item.get('count', 1)
+                dati['endpoint'].add(voce.get('endpoint'))
+    return risultato
+
+
+def _eseguibile(fingerprint: str) -> str:
+    # Le liste IN normalizzate tornano a un solo parametro
+    return fingerprint.replace("(?...)", "(?)")
+
+
+def _piano_sqlite(conn, sql: str) -> list:
+    parametri = tuple([None] * sql.count('?'))
+    righe = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", parametri).all()
+    return [riga[-1] for riga in righe]
+
+
+def _scansioni_sqlite(piano: list) -> list:
+    tabelle = []
+    for dettaglio in piano:
+        if not dettaglio.startswith('SCAN ') or any(marca in dettaglio for marca in _SQLITE_CON_INDICE):
+            continue
+        nome = dettaglio[5:].split(' ')[0]
+        if nome not in ('CONSTANT', '(subquery') and not nome.startswith('('):
+            tabelle.append(nome)
+    return tabelle
+
+
+def _piano_postgres(conn, sql: str) -> list:
+    numero = 0
+
+    def _segnaposto(_):
+        nonlocal numero
+        numero += 1
+        return f"${numero}"
+
+    sql = re.sub(r"\?", _segnaposto, sql)
+    return conn.exec_driver_sql(f"EXPLAIN (GENERIC_PLAN, FORMAT JSON) {sql}").scalar()
+
+
+def _scansioni_postgres(piano) -> list:
+    tabelle = []
+
+    def _visita(nodo):
+        if nodo.get('Node Type') == 'Seq Scan':
+            tabelle.append(nodo.get('Alias') or nodo.get('Relation Name'))
+        for figlio in nodo.get('Plans', []):
+            _visita(figlio)
+
+    for radice in piano or []:
+        _visita(radice.get('Plan', {}))
+    return tabelle
+
+
+def colonne_filtrate(sql: str, tabella: str) -> list:
+    """Colonne della tabella (o del suo alias) nelle condizioni: uguaglianze, poi intervalli."""
+    nomi = {tabella}
+    for nome, alias in _RE_ALIAS.findall(sql):
+        if alias.upper() not in _PAROLE_CHIAVE and tabella in (nome, alias):
+            nomi.update((nome, alias))
+    uguaglianze, intervalli = [], []
+    for nome, colonna, operatore in _RE_CONDIZIONE.findall(sql):
+        if nome not in nomi:
+            continue
+        destinazione = uguaglianze if operatore.upper() in ('=', 'IN', 'IS') else intervalli
+        if colonna not in uguaglianze and colonna not in intervalli:
+            destinazione.append(colonna)
+    return uguaglianze + intervalli
+
+
+def _tabella_reale(sql: str, nome: str) -> str:
+    for tabella, alias in _RE_ALIAS.findall(sql):
+        if alias == nome and alias.upper() not in _PAROLE_CHIAVE:
+            return tabella
+    return nome
+
+
+def analizza(engine, fingerprints: dict) -> list:
+    """
+    Piano di esecuzione di ogni fingerprint e scansioni complete trovate.
+
+    Args:
+        engine: Engine SQLAlchemy del database da analizzare
+        fingerprints (dict): fingerprint -> {'occorrenze', 'endpoint'}
+
+    Returns:
+        list: Risultati con scansioni e indici suggeriti, dalle query più frequenti
+    """
+    dialetto = engine.dialect.name
+    if dialetto not in ('sqlite', 'postgresql'):
+        raise RuntimeError(f"Index advisor non disponibile per {dialetto}")
+
+    risultati = []
+    with engine.connect() as conn:
+        for fingerprint, dati in fingerprints.items():
+            if not fingerprint.upper().startswith(('SELECT', 'WITH', 'UPDATE', 'DELETE')):
+                continue
+            sql = _eseguibile(fingerprint)
+            voce = {
+                'fingerprint': fingerprint,
+                'occorrenze': dati.get('occorrenze', 0),
+                'endpoint': sorted(e for e in dati.get('endpoint', ()) if e),
+                'scansioni': [],
+            }
+            try:
+                if dialetto == 'sqlite':
+                    tabelle = _scansioni_sqlite(_piano_sqlite(conn, sql))
+                else:
+                    tabelle = _scansioni_postgres(_piano_postgres(conn, sql))
+            except Exception as e:
+                # Fingerprint troncata o con sintassi non riproducibile
+                conn.rollback()
+                voce['errore'] = str(e).splitlines()[0]
+                risultati.append(voce)
+                continue
+            for nome in tabelle:
+                tabella = _tabella_reale(sql, nome)
+                colonne = colonne_filtrate(sql, nome)
+                voce['scansioni'].append({
+                    'tabella': tabella,
+                    'colonne': colonne,
+                    'indice_suggerito': (
+                        f"CREATE INDEX ix_{tabella}_{'_'.join(colonne)} ON {tabella} ({', '.join(colonne)})"
+                        if colonne else None
+                    ),
+                })
+            risultati.append(voce)
+    return sorted(risultati, key=lambda voce: (not voce['scansioni'], -voce['occorrenze']))
+
+
+def leggi_file_sql(path: str) -> dict:
+    """Istruzioni SQL separate da ';' (una fingerprint per istruzione)."""
+    with open(path, encoding='utf-8') as f:
+        istruzioni = [parte.strip() for parte in f.read().split(';')]
+    return {
+        re.sub(r"\s+", " ", istruzione): {'occorrenze': 1, 'endpoint': set()}
+        for istruzione in istruzioni if istruzione
+    }
@@ -0,0 +1,143 @@
+"""
+Pipeline di ingest in singola lettura per i file caricati.
+
+Il file viene letto una sola volta a chunk grandi e ogni chunk alimenta
+contemporaneamente: hash SHA-256, conteggio dimensione, rilevamento MIME
+(sui primi byte), eventuale copia su disco e lo stream INSTREAM di clamd.
+"""
+
+import hashlib
+import mimetypes
+import os
+from dataclasses import dataclass, field
+from typing import BinaryIO, Optional
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024  # 1 MB
+SNIFF_BYTES = 512
+
+# Firme (magic number) dei formati gestiti dall'archivio documentale
+_MAGIC_SIGNATURES = (
+    (b'%PDF-', 'application/pdf'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'II*\x00', 'image/tiff'),
+    (b'MM\x00*', 'image/tiff'),
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'application/x-ole-storage'),  # doc/xls/ppt legacy
+    (b'{\\rtf', 'application/rtf'),
+    (b'\x1f\x8b', 'application/gzip'),
+    (b'Rar!', 'application/vnd.rar'),
+    (b'7z\xbc\xaf\x27\x1c', 'application/x-7z-compressed'),
+    (b'MZ', 'application/x-msdownload'),
+    (b'\x7fELF', 'application/x-executable'),
+)
+_OOXML_PREFIXES = {
+    'word/': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'xl/': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'ppt/': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+}
+
+
+def get_chunk_size() -> int:
+    """Dimensione chunk di lettura (INGEST_CHUNK_SIZE, default 1 MB)."""
+    return int(os.getenv('INGEST_CHUNK_SIZE', DEFAULT_CHUNK_SIZE))
+
+
+def sniff_mime(head: bytes, filename: Optional[str] = None) -> str:
+    """
+    Rileva il tipo MIME dai primi byte del file.
+
+    Args:
+        head: Primi byte del contenuto (almeno SNIFF_BYTES se disponibili).
+        filename: Nome file, usato come fallback sull'estensione.
+
+    Returns:
+        str: Tipo MIME rilevato ('application/octet-stream' se sconosciuto).
+    """
+    guessed = mimetypes.guess_type(filename)[0] if filename else None
+
+    if head.startswith(b'PK\x03\x04'):
+        # Archivio ZIP: i documenti OOXML hanno il primo entry in word/, xl/ o ppt/
+        name_len = int.from_bytes(head[26:28], 'little') if len(head) >= 30 else 0
+        entry = head[30:30 + name_len].decode('latin-1')
+        for prefix, mime in _OOXML_PREFIXES.items():
+            if entry.startswith(prefix):
+                return mime
+        if guessed and guessed.startswith('application/vnd.openxmlformats'):
+            return guessed
+        return 'application/zip'
+
+    for signature, mime in _MAGIC_SIGNATURES:
+        if head.startswith(signature):
+            if mime == 'application/x-ole-storage' and guessed:
+                return guessed
+            return mime
+
+    if guessed:
+        return guessed
+    if head and b'\0' not in head:
+        try:
+            head.decode('utf-8')
+            return 'text/plain'
+        except UnicodeDecodeError:
+            pass
+    return 'application/octet-stream'
+
+
+@dataclass
+class IngestResult:
+    """
+    Risultato della lettura in singola passata di un file.
+
+    Attributi:
+        sha256 (str): Hash SHA-256 esadecimale.
+        size (int): Dimensione in byte.
+        mime (str): Tipo MIME rilevato dai primi byte.
+        scan (dict): Risultato antivirus (verdict/details/engine/signature/cached).
+    """
+    sha256: str
+    size: int
+    mime: str
+    scan: dict = field(default_factory=dict)
+
+
+def ingest_stream(stream: BinaryIO, dest_path: Optional[str] = None, filename: Optional[str] = None,
+                  scanner=None, chunk_size: Optional[int] = None) -> IngestResult:
+    """
+    Legge lo stream una sola volta alimentando hash, dimensione, MIME e scanner.
+
+    Args:
+        stream: Stream binario da leggere (file aperto, FileStorage.stream, BytesIO).
+        dest_path: Se indicato, il contenuto viene scritto anche su questo file.
+        filename: Nome originale (fallback per il MIME).
+        scanner: Oggetto con metodo `send(chunk)` (es. sessione INSTREAM clamd).
+        chunk_size: Dimensione chunk (default INGEST_CHUNK_SIZE).
+
+    Returns:
+        IngestResult: Hash, dimensione e MIME (scan vuoto: lo compila il chiamante).
+    """
+    chunk_size = chunk_size or get_chunk_size()
+    sha256 = hashlib.sha256()
+    size = 0
+    head = b''
+    out = open(dest_path, 'wb') if dest_path else None
+
+    try:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            if len(head) < SNIFF_BYTES:
+                head += chunk[:SNIFF_BYTES - len(head)]
+            sha256.update(chunk)
+            size += len(chunk)
+            if out:
+                out.write(chunk)
+            if scanner is not None:
+                scanner.send(chunk)
+    finally:
+        if out:
+            out.close()
+
+    return IngestResult(sha256=sha256.hexdigest(), size=size, mime=sniff_mime(head, filename))
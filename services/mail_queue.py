@@ -0,0 +1,289 @@
+"""
+Coda persistente per le email in uscita.
+
+Gli handler HTTP e i job accodano le email con `enqueue_email` e ritornano
+subito; il worker `process_email_queue` prenota un batch (stato 'in_invio')
+e lo invia riusando una sola connessione SMTP (`mail.connect()`), con commit
+dopo ogni messaggio, retry a backoff esponenziale e deduplica tramite chiave
+di idempotenza.
+"""
+
+import base64
+import logging
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+from flask import current_app, render_template
+from flask_mail import Message
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db, mail
+from models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+# Backoff tra i tentativi: 60s, 120s, 240s, ... fino a 1h
+BACKOFF_BASE_SEC = 60
+BACKOFF_MAX_SEC = 3600
+DEFAULT_BATCH_SIZE = 200
+# Oltre questo tempo una email prenotata e non inviata torna in coda
+CLAIM_TIMEOUT_SEC = 900
+
+
+def enqueue_email(subject: str, recipients: Iterable[str], body: Optional[str] = None,
+                  html: Optional[str] = None, template: Optional[str] = None,
+                  context: Optional[dict] = None, sender: Optional[str] = None,
+                  attachments: Optional[list] = None, idempotency_key: Optional[str] = None,
+                  max_tentativi: int = 5, commit: bool = True) -> Optional[OutboundEmail]:
+    """
+    Accoda una email per l'invio asincrono.
+
+    Args:
+        subject (str): Oggetto della mail.
+        recipients (Iterable[str]): Destinatari.
+        body (str, optional): Corpo testuale.
+        html (str, optional): Corpo HTML.
+        template (str, optional): Template HTML renderizzato dal worker.
+        context (dict, optional): Contesto del template (deve essere serializzabile JSON).
+        sender (str, optional): Mittente, default MAIL_DEFAULT_SENDER.
+        attachments (list, optional): Tuple (filename, content_type, data bytes).
+        idempotency_key (str, optional): Chiave di deduplica.
+        max_tentativi (int): Numero massimo di tentativi di invio.
+        commit (bool): Se True esegue il commit della sessione.
+
+    Returns:
+        OutboundEmail: Email accodata (o quella già esistente con la stessa chiave),
+        None se non ci sono destinatari.
+    """
+    recipients = [r for r in (recipients or []) if r]
+    if not recipients:
+        logger.warning(f"⚠️ Email '{subject}' senza destinatari, non accodata")
+        return None
+
+    if idempotency_key:
+        existing = OutboundEmail.query.filter_by(idempotency_key=idempotency_key).first()
+        if existing:
+            logger.info(f"🔄 Email già accodata per chiave {idempotency_key}")
+            return existing
+
+    email = OutboundEmail(
+        idempotency_key=idempotency_key,
+        subject=subject,
+        sender=sender,
+        recipients=recipients,
+        body=body,
+        html=html,
+        template=template,
+        context=context,
+        attachments=[
+            {
+                'filename': filename,
+                'content_type': content_type,
+                'data': base64.b64encode(data).decode('ascii')
+            }
+            for filename, content_type, data in (attachments or [])
+        ] or None,
+        max_tentativi=max_tentativi,
+        prossimo_tentativo=datetime.utcnow()
+    )
+    db.session.add(email)
+
+    if commit:
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Un altro worker ha accodato la stessa chiave nel frattempo
+            db.session.rollback()
+            return OutboundEmail.query.filter_by(idempotency_key=idempotency_key).first()
+
+    logger.info(f"📨 Email accodata: '{subject}' → {', '.join(recipients)}")
+    return email
+
+
+def build_message(email: OutboundEmail) -> Message:
+    """
+    Costruisce il messaggio Flask-Mail da una email in coda.
+
+    Il template, se presente, viene renderizzato qui (fuori dal request path).
+
+    Args:
+        email (OutboundEmail): Email in coda.
+
+    Returns:
+        Message: Messaggio pronto per l'invio.
+    """
+    html = email.html
+    if email.template:
+        html = render_template(email.template, **(email.context or {}))
+
+    msg = Message(
+        subject=email.subject,
+        recipients=list(email.recipients),
+        body=email.body,
+        html=html,
+        sender=email.sender or current_app.config.get('MAIL_DEFAULT_SENDER')
+    )
+    for att in email.attachments or []:
+        msg.attach(
+            filename=att['filename'],
+            content_type=att['content_type'],
+            data=base64.b64decode(att['data'])
+        )
+    return msg
+
+
+def _schedule_retry(email: OutboundEmail, error: Exception, now: datetime):
+    """Registra un tentativo fallito e pianifica il successivo con backoff."""
+    email.tentativi += 1
+    email.ultimo_errore = str(error)[:2000]
+    if email.tentativi >= email.max_tentativi:
+        email.stato = 'fallita'
+        logger.error(f"❌ Email {email.id} fallita definitivamente: {error}")
+    else:
+        delay = min(BACKOFF_BASE_SEC * (2 ** (email.tentativi - 1)), BACKOFF_MAX_SEC)
+        email.stato = 'in_coda'
+        email.prossimo_tentativo = now + timedelta(seconds=delay)
+        logger.warning(f"⚠️ Email {email.id} ritentata tra {delay}s: {error}")
+
+
+def _claim_batch(batch_size: int, now: datetime) -> list:
+    """
+    Prenota un batch di email passandole da 'in_coda' a 'in_invio'.
+
+    Ogni riga è prenotata con un UPDATE condizionato sullo stato: se un altro
+    worker (job dello scheduler o `flask send-queued-emails`) l'ha già presa,
+    l'UPDATE non modifica righe e l'email viene saltata. Le email prenotate
+    da un worker terminato senza rilasciarle tornano in coda alla scadenza
+    della prenotazione.
+    """
+    claim_timeout = current_app.config.get('MAIL_QUEUE_CLAIM_TIMEOUT_SEC', CLAIM_TIMEOUT_SEC)
+
+    scadute = OutboundEmail.query.filter(
+        OutboundEmail.stato == 'in_invio',
+        OutboundEmail.prossimo_tentativo <= now
+    ).update({'stato': 'in_coda'}, synchronize_session=False)
+    if scadute:
+        logger.warning(f"⚠️ {scadute} email con prenotazione scaduta rimesse in coda")
+
+    candidate = [row.id for row in db.session.query(OutboundEmail.id).filter(
+        OutboundEmail.stato == 'in_coda',
+        OutboundEmail.prossimo_tentativo <= now
+    ).order_by(OutboundEmail.prossimo_tentativo, OutboundEmail.id).limit(batch_size)]
+
+    scadenza = now + timedelta(seconds=claim_timeout)
+    prenotate = [
+        email_id for email_id in candidate
+        if OutboundEmail.query.filter(
+            OutboundEmail.id == email_id,
+            OutboundEmail.stato == 'in_coda'
+        ).update({'stato': 'in_invio', 'prossimo_tentativo': scadenza}, synchronize_session=False)
+    ]
+    db.session.commit()
+
+    if not prenotate:
+        return []
+    return OutboundEmail.query.filter(OutboundEmail.id.in_(prenotate)).order_by(OutboundEmail.id).all()
+
+
+def process_email_queue(batch_size: Optional[int] = None) -> dict:
+    """
+    Invia un batch di email in coda usando una sola connessione SMTP.
+
+    Le email sono prima prenotate (stato 'in_invio'), poi inviate con un
+    commit dopo ogni messaggio: worker concorrenti non inviano la stessa
+    email e un crash a metà batch non reinvia i messaggi già consegnati.
+
+    Args:
+        batch_size (int, optional): Numero massimo di email per batch.
+
+    Returns:
+        dict: Statistiche del batch (inviate, errori, fallite).
+    """
+    batch_size = batch_size or current_app.config.get('MAIL_QUEUE_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    now = datetime.utcnow()
+    stats = {'inviate': 0, 'errori': 0, 'fallite': 0}
+
+    emails = _claim_batch(batch_size, now)
+    if not emails:
+        return stats
+
+    try:
+        with mail.connect() as conn:
+            for email in emails:
+                try:
+                    conn.send(build_message(email))
+                    email.stato = 'inviata'
+                    email.tentativi += 1
+                    email.sent_at = datetime.utcnow()
+                    email.ultimo_errore = None
+                    stats['inviate'] += 1
+                except Exception as e:
+                    _schedule_retry(email, e, now)
+                    stats['errori'] += 1
+                db.session.commit()
+    except Exception as e:
+        # Connessione SMTP non disponibile: le email non ancora inviate tornano in coda
+        logger.error(f"❌ Connessione SMTP fallita: {e}")
+        db.session.rollback()
+        for email in emails:
+            if email.stato == 'in_invio':
+                _schedule_retry(email, e, now)
+                stats['errori'] += 1
+        db.session.commit()
+
+    stats['fallite'] = sum(1 for email in emails if email.stato == 'fallita')
+
+    logger.info(f"📬 Batch email: {stats['inviate']} inviate, {stats['errori']} errori, {stats['fallite']} fallite")
+    return stats
+
+
+def flush_email_queue(batch_size: Optional[int] = None, max_batches: int = 50) -> dict:
+    """
+    Svuota la coda processando batch successivi finché ci sono email pronte.
+
+    Args:
+        batch_size (int, optional): Numero massimo di email per batch.
+        max_batches (int): Numero massimo di batch per esecuzione.
+
+    Returns:
+        dict: Statistiche cumulative.
+    """
+    totale = {'inviate': 0, 'errori': 0, 'fallite': 0}
+    for _ in range(max_batches):
+        stats = process_email_queue(batch_size)
+        for key in totale:
+            totale[key] += stats[key]
+        if stats['inviate'] == 0 and stats['errori'] == 0:
+            break
+    return totale
+
+
+def pulisci_email_inviate(giorni: int = 30) -> int:
+    """
+    Elimina le email inviate più vecchie del periodo indicato.
+
+    Args:
+        giorni (int): Giorni di conservazione.
+
+    Returns:
+        int: Numero di email eliminate.
+    """
+    data_limite = datetime.utcnow() - timedelta(days=giorni)
+    eliminate = OutboundEmail.query.filter(
+        OutboundEmail.stato == 'inviata',
+        OutboundEmail.sent_at < data_limite
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    logger.info(f"🧹 Eliminate {eliminate} email inviate dalla coda")
+    return eliminate
+
+
+def get_queue_stats() -> dict:
+    """
+    Restituisce il numero di email per stato.
+
+    Returns:
+        dict: Conteggi per stato.
+    """
+    rows = db.session.query(OutboundEmail.stato, db.func.count(OutboundEmail.id)).group_by(OutboundEmail.stato).all()
+    return {stato: count for stato, count in rows}
@@ -1,11 +1,24 @@
 """
 Client per l'API Manus Core.
 Gestisce le chiamate HTTP con retry e gestione errori.
+
+I retry (errori di connessione, 429 e 5xx, con backoff e Retry-After) sono
+gestiti dall'adapter HTTP della sessione, con un pool di connessioni pari al
+numero di richieste concorrenti (MANUS_MAX_WORKERS).
+
+Elenchi paginati: se la risposta è un dict con `items` e `pages` (o `total`),
+le pagine successive alla prima vengono scaricate in parallelo; con
+`next_cursor` vengono seguite in sequenza; una lista è già l'elenco completo.
 """
 
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
-import time
 from flask import current_app
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
 
 logger = logging.getLogger(__name__)
@@ -21,12 +34,27 @@ class ManusClient:
         """Inizializza il client con configurazione da app config."""
         self.base = current_app.config["MANUS_BASE_URL"].rstrip("/")
         self.key = current_app.config["MANUS_API_KEY"]
+        self.timeout = current_app.config.get("MANUS_TIMEOUT", 20)
+        self.page_size = current_app.config.get("MANUS_PAGE_SIZE", 100)
+        self.max_workers = max(1, current_app.config.get("MANUS_MAX_WORKERS", 4))
         self.s = requests.Session()
         self.s.headers.update({
             "Authorization": f"Bearer {self.key}", 
             "Accept": "application/json",
             "Content-Type": "application/json"
         })
+        retry = Retry(
+            total=3,
+            backoff_factor=0.8,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset({"GET", "POST"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+        self.s.mount("http://", adapter)
+        self.s.mount("https://", adapter)
+        # Limite alle richieste in volo anche con map() annidati (es. pagine dentro corsi)
+        self._slots = threading.BoundedSemaphore(self.max_workers)
 
     def _get(self, path, params=None):
         """
@@ -42,22 +70,12 @@ class ManusClient:
         Raises:
             requests.HTTPError: Se la richiesta fallisce dopo i retry
         """
-        for i in range(3):
-            try:
-                r = self.s.get(
-                    f"{self.base}{path}", 
-                    params=params, 
-                    timeout=20
-                )
-                if r.status_code < 500:
-                    break
-                time.sleep(0.8 * (2 ** i))
-            except requests.RequestException as e:
-                if i == 2:  # Ultimo tentativo
-                    logger.error(f"Errore nella richiesta GET {path}: {e}")
-                    raise
-                time.sleep(0.8 * (2 ** i))
-        
+        try:
+            with self._slots:
+                r = self.s.get(f"{self.base}{path}", params=params, timeout=self.timeout)
+        except requests.RequestException as e:
+            logger.error(f"Errore nella richiesta GET {path}: {e}")
+            raise
         r.raise_for_status()
         return r.json()
 
@@ -75,25 +93,64 @@ class ManusClient:
         Raises:
             requests.HTTPError: Se la richiesta fallisce dopo i retry
         """
-        for i in range(3):
-            try:
-                r = self.s.post(
-                    f"{self.base}{path}", 
-                    json=data, 
-                    timeout=20
-                )
-                if r.status_code < 500:
-                    break
-                time.sleep(0.8 * (2 ** i))
-            except requests.RequestException as e:
-                if i == 2:  # Ultimo tentativo
-                    logger.error(f"Errore nella richiesta POST {path}: {e}")
-                    raise
-                time.sleep(0.8 * (2 ** i))
-        
+        try:
+            with self._slots:
+                r = self.s.post(f"{self.base}{path}", json=data, timeout=self.timeout)
+        except requests.RequestException as e:
+            logger.error(f"Errore nella richiesta POST {path}: {e}")
+            raise
         r.raise_for_status()
         return r.json()
 
+    def _get_all(self, path, params=None):
+        """
+        Scarica tutte le pagine di un elenco.
+        
+        Args:
+            path (str): Path dell'endpoint
+            params (dict): Parametri query string
+            
+        Returns:
+            tuple: (elementi, ultima risposta come dict)
+        """
+        params = dict(params or {})
+        first = self._get(path, {**params, "page": 1, "per_page": self.page_size})
+        if isinstance(first, list):
+            return first, {}
+        items = list(first.get("items", []))
+        
+        pages = first.get("pages")
+        if pages is None and first.get("total") is not None:
+            pages = math.ceil(first["total"] / (first.get("per_page") or self.page_size))
+        if pages and pages > 1:
+            altre = self.map(
+                lambda page: self._get(path, {**params, "page": page, "per_page": self.page_size}).get("items", []),
+                range(2, pages + 1),
+            )
+            for pagina in altre:
+                items.extend(pagina)
+            return items, first
+        
+        last = first
+        while last.get("next_cursor"):
+            last = self._get(path, {**params, "cursor": last["next_cursor"], "per_page": self.page_size})
+            items.extend(last.get("items", []))
+        return items, last
+
+    def map(self, func, args):
+        """
+        Esegue `func` su ogni argomento con al massimo MANUS_MAX_WORKERS
+        richieste in parallelo.
+        
+        Returns:
+            list: Risultati nell'ordine degli argomenti (la prima eccezione viene rilanciata)
+        """
+        args = list(args)
+        if len(args) <= 1 or self.max_workers == 1:
+            return [func(arg) for arg in args]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(args)), thread_name_prefix="manus") as pool:
+            return list(pool.map(func, args))
+
     # === METODI PER MANUALI ===
     
     def list_manuals(self, azienda_ref: str):
@@ -106,7 +163,7 @@ class ManusClient:
         Returns:
             list: Lista dei manuali
         """
-        return self._get("/manuals", {"org": azienda_ref})
+        return self._get_all("/manuals", {"org": azienda_ref})[0]
 
     def get_manual(self, manual_id: str):
         """
@@ -132,7 +189,7 @@ class ManusClient:
         Returns:
             list: Lista dei corsi
         """
-        return self._get("/courses", {"org": azienda_ref})
+        return self._get_all("/courses", {"org": azienda_ref})[0]
 
     def get_course(self, course_id: str):
         """
@@ -155,10 +212,12 @@ class ManusClient:
             since_iso (str): Data ISO da cui filtrare (opzionale)
             
         Returns:
-            dict: Lista dei completamenti
+            dict: `items` con tutti i completamenti (tutte le pagine) e
+                `next_since` se restituito dal server
         """
         params = {"since": since_iso} if since_iso else None
-        return self._get(f"/courses/{course_id}/completions", params)
+        items, last = self._get_all(f"/courses/{course_id}/completions", params)
+        return {"items": items, "next_since": last.get("next_since")}
 
     # === METODI PER UTENTI ===
     
@@ -184,7 +243,7 @@ class ManusClient:
         Returns:
             list: Lista degli utenti
         """
-        return self._get("/users", {"org": azienda_ref})
+        return self._get_all("/users", {"org": azienda_ref})[0]
 
     # === METODI PER WEBHOOK ===
     
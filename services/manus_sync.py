@@ -1,279 +1,460 @@
 """
 Service per la sincronizzazione con Manus Core.
 Gestisce manuali, corsi e completamenti.
+
+Ogni sincronizzazione è un confronto tra elenco remoto e stato locale:
+- lo stato locale dell'azienda (link, documenti, completamenti, mapping
+  utenti) è caricato con una query per tabella, non una per elemento remoto;
+- gli elenchi remoti sono scaricati in parallelo (MANUS_MAX_WORKERS), pagine
+  comprese (services.manus_client);
+- i completamenti sono chiesti con `since` dal cursore salvato per azienda e
+  corso (ManusSyncCursor), quindi solo le novità dall'ultima sincronizzazione;
+- inserimenti e aggiornamenti sono applicati in blocco, un commit per
+  sincronizzazione. I documenti nuovi passano dalla sessione ORM (un solo
+  flush) per mantenere indice di visibilità e conteggio blob.
 """
 
-from datetime import datetime, timezone
-from models import db, Document, Company, ManusManualLink, ManusCourseLink, TrainingCompletionManus
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func, insert, update
+from models import (db, Document, ManusManualLink, ManusCourseLink, ManusSyncCursor, ManusUserMapping,
+                    TrainingCompletionManus, User)
 from services.manus_client import ManusClient
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Sovrapposizione del cursore: i completamenti registrati in ritardo rientrano
+# nella richiesta successiva (l'applicazione è idempotente)
+CURSOR_OVERLAP = timedelta(minutes=5)
+
 def _utcnow():
     """Restituisce datetime UTC senza timezone info."""
     return datetime.now(timezone.utc).replace(tzinfo=None)
 
-def sync_manuals(azienda_id: int, azienda_ref: str):
+def _parse_iso(valore: str):
+    """Data ISO 8601 (anche con 'Z') in datetime UTC senza timezone info."""
+    parsed = datetime.fromisoformat(valore.replace("Z", "+00:00"))
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def _documento_manus(azienda_id: int, **campi) -> Document:
+    """Documento segnaposto per un manuale o corso Manus senza corrispondente locale."""
+    return Document(
+        company_id=azienda_id,
+        user_id=1,  # Admin user
+        uploader_email="admin@example.com",
+        department_id=1,  # Default department
+        visibility='privato',
+        downloadable=True,
+        **campi
+    )
+
+def sync_manuals(azienda_id: int, azienda_ref: str, client: ManusClient = None, manuals: list = None):
     """
     Sincronizza i manuali da Manus per un'azienda.
-    
+
     Args:
         azienda_id (int): ID dell'azienda nel sistema locale
         azienda_ref (str): Riferimento azienda in Manus
+        client (ManusClient): Client da riusare (opzionale)
+        manuals (list): Elenco remoto già scaricato (opzionale)
+
+    Returns:
+        dict: Documenti e link creati, link aggiornati
     """
     try:
-        mc = ManusClient()
-        manuals = mc.list_manuals(azienda_ref)
-        
+        if manuals is None:
+            manuals = (client or ManusClient()).list_manuals(azienda_ref)
         logger.info(f"🔄 Sync manuali per azienda {azienda_id} ({azienda_ref}): {len(manuals)} manuali trovati")
-        
+
+        remoti = {}
         for m in manuals:
-            try:
-                title = m.get("title") or f"Manual {m['id']}"
-                version = str(m.get("version") or "1")
-                
-                # Cerca documento esistente per titolo
-                doc = (Document.query
-                       .filter_by(company_id=azienda_id, title=title)
-                       .first())
-                
-                if not doc:
-                    # Crea nuovo documento
-                    doc = Document(
-                        company_id=azienda_id,
-                        title=title,
-                        filename=f"manus_manual_{m['id']}.pdf",  # Placeholder
-                        original_filename=f"{title}.pdf",
-                        description=f"Manuale sincronizzato da Manus - {m.get('description', '')}",
-                        user_id=1,  # Admin user
-                        uploader_email="admin@example.com",
-                        department_id=1,  # Default department
-                        visibility='privato',
-                        downloadable=True,
-                        tag="Manus Manual",
-                        categoria_ai="Manuale QMS"
-                    )
-                    db.session.add(doc)
-                    db.session.flush()  # Per ottenere l'ID
-                    logger.info(f"✅ Creato nuovo documento: {title}")
-
-                # Gestisci link Manus
-                link = (ManusManualLink.query
-                        .filter_by(azienda_id=azienda_id, manus_manual_id=m["id"])
-                        .first())
-                
-                if not link:
-                    link = ManusManualLink(
-                        azienda_id=azienda_id,
-                        documento_id=doc.id,
-                        manus_manual_id=m["id"],
-                        manus_version=version
-                    )
-                    db.session.add(link)
-                    logger.info(f"✅ Creato link Manus per: {title}")
-                else:
-                    # Aggiorna versione se cambiata
-                    if link.manus_version != version:
-                        link.manus_version = version
-                        logger.info(f"🔄 Aggiornata versione per: {title} -> {version}")
-                
-                link.last_sync_at = _utcnow()
-                
-            except Exception as e:
-                logger.error(f"❌ Errore sync manuale {m.get('id', 'unknown')}: {e}")
+            if not m.get("id"):
+                logger.error(f"❌ Manuale senza id ignorato: {m}")
                 continue
-        
+            remoti[m["id"]] = (m.get("title") or f"Manual {m['id']}", str(m.get("version") or "1"), m)
+
+        # Stato locale: una query per i link, una per i documenti dei manuali senza link
+        links = {l.manus_manual_id: l for l in ManusManualLink.query.filter_by(azienda_id=azienda_id)}
+        titoli = {title for manual_id, (title, _, _) in remoti.items() if manual_id not in links}
+        documenti = {}
+        if titoli:
+            for doc in (Document.query.filter(Document.company_id == azienda_id, Document.title.in_(titoli))
+                        .order_by(Document.id)):
+                documenti.setdefault(doc.title, doc)
+
+        nuovi_doc = []
+        for title, _, m in remoti.values():
+            if title in titoli and title not in documenti:
+                doc = _documento_manus(
+                    azienda_id,
+                    title=title,
+                    filename=f"manus_manual_{m['id']}.pdf",  # Placeholder
+                    original_filename=f"{title}.pdf",
+                    description=f"Manuale sincronizzato da Manus - {m.get('description', '')}",
+                    tag="Manus Manual",
+                    categoria_ai="Manuale QMS"
+                )
+                documenti[title] = doc
+                nuovi_doc.append(doc)
+        if nuovi_doc:
+            db.session.add_all(nuovi_doc)
+            db.session.flush()  # Per ottenere gli ID
+
+        adesso = _utcnow()
+        nuovi_link, aggiornati, versioni = [], [], 0
+        for manual_id, (title, version, _) in remoti.items():
+            link = links.get(manual_id)
+            if link is None:
+                nuovi_link.append({
+                    'azienda_id': azienda_id,
+                    'documento_id': documenti[title].id,
+                    'manus_manual_id': manual_id,
+                    'manus_version': version,
+                    'last_sync_at': adesso,
+                })
+                continue
+            if link.manus_version != version:
+                versioni += 1
+                logger.info(f"🔄 Aggiornata versione per: {title} -> {version}")
+            aggiornati.append({'id': link.id, 'manus_version': version, 'last_sync_at': adesso})
+
+        if nuovi_link:
+            db.session.execute(insert(ManusManualLink), nuovi_link)
+        if aggiornati:
+            # Update in blocco per chiave primaria
+            db.session.execute(update(ManusManualLink), aggiornati)
         db.session.commit()
-        logger.info(f"✅ Sync manuali completato per azienda {azienda_id}")
-        
+
+        stats = {'documenti_creati': len(nuovi_doc), 'link_creati': len(nuovi_link), 'versioni_aggiornate': versioni}
+        logger.info(f"✅ Sync manuali completato per azienda {azienda_id}: {stats}")
+        return stats
+
     except Exception as e:
         logger.error(f"❌ Errore sync manuali per azienda {azienda_id}: {e}")
         db.session.rollback()
         raise
 
-def sync_courses(azienda_id: int, azienda_ref: str):
+def sync_courses(azienda_id: int, azienda_ref: str, client: ManusClient = None, courses: list = None):
     """
     Sincronizza i corsi da Manus per un'azienda.
-    
+
     Args:
         azienda_id (int): ID dell'azienda nel sistema locale
         azienda_ref (str): Riferimento azienda in Manus
+        client (ManusClient): Client da riusare (opzionale)
+        courses (list): Elenco remoto già scaricato (opzionale)
+
+    Returns:
+        dict: Requisiti e link creati
     """
     try:
-        mc = ManusClient()
-        courses = mc.list_courses(azienda_ref)
-        
+        if courses is None:
+            courses = (client or ManusClient()).list_courses(azienda_ref)
         logger.info(f"🔄 Sync corsi per azienda {azienda_id} ({azienda_ref}): {len(courses)} corsi trovati")
-        
+
+        links = ManusCourseLink.query.filter_by(azienda_id=azienda_id).all()
+        per_corso = {l.manus_course_id: l for l in links}
+        per_requisito = {l.requisito_id: l for l in links}
+        requisiti = None
+
+        nuovi_doc, da_collegare, visti = [], [], set()
         for c in courses:
-            try:
-                code = c.get("code")
-                if not code:
-                    continue
-                
-                # Cerca documento esistente per codice corso
-                req = (Document.query
-                       .filter_by(company_id=azienda_id, tag="Manus Course")
-                       .filter(Document.title.contains(code))
-                       .first())
-                
-                if not req:
-                    # Crea nuovo documento requisito
-                    req = Document(
-                        company_id=azienda_id,
-                        title=f"Corso {code} - {c.get('title', 'Formazione')}",
-                        filename=f"manus_course_{c['id']}.pdf",  # Placeholder
-                        original_filename=f"corso_{code}.pdf",
-                        description=f"Corso sincronizzato da Manus - {c.get('description', '')}",
-                        user_id=1,  # Admin user
-                        uploader_email="admin@example.com",
-                        department_id=1,  # Default department
-                        visibility='privato',
-                        downloadable=True,
-                        tag="Manus Course",
-                        categoria_ai="Corso Formazione"
-                    )
-                    db.session.add(req)
-                    db.session.flush()
-                    logger.info(f"✅ Creato nuovo requisito corso: {code}")
-                
-                # Gestisci link corso
-                link = (ManusCourseLink.query
-                        .filter_by(azienda_id=azienda_id, requisito_id=req.id)
-                        .first())
-                
-                if not link:
-                    link = ManusCourseLink(
-                        azienda_id=azienda_id,
-                        requisito_id=req.id,
-                        manus_course_id=c["id"]
-                    )
-                    db.session.add(link)
-                    logger.info(f"✅ Creato link corso per: {code}")
-                
-                link.last_sync_at = _utcnow()
-                
-            except Exception as e:
-                logger.error(f"❌ Errore sync corso {c.get('id', 'unknown')}: {e}")
+            code = c.get("code")
+            if not code or not c.get("id"):
+                continue
+            link = per_corso.get(c["id"])
+            if link is not None:
+                visti.add(link.id)
+                continue
+
+            if requisiti is None:
+                # Requisiti dei corsi Manus dell'azienda, caricati solo se serve
+                requisiti = (Document.query.filter_by(company_id=azienda_id, tag="Manus Course")
+                             .order_by(Document.id).all())
+            req = next((d for d in requisiti if code in (d.title or "")), None)
+            if req is None:
+                req = _documento_manus(
+                    azienda_id,
+                    title=f"Corso {code} - {c.get('title', 'Formazione')}",
+                    filename=f"manus_course_{c['id']}.pdf",  # Placeholder
+                    original_filename=f"corso_{code}.pdf",
+                    description=f"Corso sincronizzato da Manus - {c.get('description', '')}",
+                    tag="Manus Course",
+                    categoria_ai="Corso Formazione"
+                )
+                requisiti.append(req)
+                nuovi_doc.append(req)
+            da_collegare.append((c["id"], req))
+
+        if nuovi_doc:
+            db.session.add_all(nuovi_doc)
+            db.session.flush()
+
+        adesso = _utcnow()
+        nuovi_link = []
+        for course_id, req in da_collegare:
+            link = per_requisito.get(req.id)
+            if link is not None:
+                # Requisito già collegato (anche in questa sincronizzazione)
+                if isinstance(link, ManusCourseLink):
+                    visti.add(link.id)
                 continue
-        
+            riga = {'azienda_id': azienda_id, 'requisito_id': req.id, 'manus_course_id': course_id,
+                    'last_sync_at': adesso}
+            nuovi_link.append(riga)
+            per_requisito[req.id] = riga
+
+        if nuovi_link:
+            db.session.execute(insert(ManusCourseLink), nuovi_link)
+        if visti:
+            db.session.execute(update(ManusCourseLink).where(ManusCourseLink.id.in_(visti)).values(last_sync_at=adesso))
         db.session.commit()
-        logger.info(f"✅ Sync corsi completato per azienda {azienda_id}")
-        
+
+        stats = {'requisiti_creati': len(nuovi_doc), 'link_creati': len(nuovi_link)}
+        logger.info(f"✅ Sync corsi completato per azienda {azienda_id}: {stats}")
+        return stats
+
     except Exception as e:
         logger.error(f"❌ Errore sync corsi per azienda {azienda_id}: {e}")
         db.session.rollback()
         raise
 
-def sync_completions_for_course(link: ManusCourseLink, since_iso: str = None):
+def _manus_user_id(row: dict) -> str:
+    return row.get("user_id", f"unknown_{row.get('id', 'unknown')}")
+
+def _applica_completamenti(per_link: list) -> tuple:
+    """
+    Applica in blocco i completamenti remoti (senza commit).
+
+    Args:
+        per_link (list): Coppie (ManusCourseLink, righe remote)
+
+    Returns:
+        tuple: Statistiche (creati, aggiornati, non mappati) e, per corso,
+            il completamento non mappato più vecchio da non superare col cursore
+    """
+    righe = [(link, row) for link, rows in per_link for row in rows]
+    email = {row["user_email"].lower() for _, row in righe if row.get("user_email")}
+    manus_ids = {_manus_user_id(row) for _, row in righe}
+
+    per_email = {}
+    if email:
+        per_email = dict(db.session.query(func.lower(User.email), User.id).filter(func.lower(User.email).in_(email)))
+    mapping = {}
+    if manus_ids:
+        mapping = {m.manus_user_id: m for m in ManusUserMapping.query.filter(ManusUserMapping.manus_user_id.in_(manus_ids))}
+
+    migliori, non_mappati, sospesi = {}, {}, {}
+    for link, row in righe:
+        completed_at = None
+        if row.get("completed_at"):
+            try:
+                completed_at = _parse_iso(row["completed_at"])
+            except ValueError:
+                logger.error(f"❌ Data di completamento non valida: {row.get('completed_at')}")
+
+        user_id = row.get("user_id_internal")
+        if not user_id:
+            user_id = per_email.get((row.get("user_email") or "").lower())
+        if not user_id:
+            m = mapping.get(_manus_user_id(row))
+            user_id = m.syn_user_id if m is not None and m.active else None
+        if not user_id:
+            # Mapping inattivo per revisione manuale
+            manus_user_id = _manus_user_id(row)
+            if manus_user_id not in mapping:
+                non_mappati.setdefault(manus_user_id, row.get("user_email"))
+            # Completamento da riprendere quando il mapping sarà attivato
+            if completed_at is not None:
+                corso = link.manus_course_id
+                if corso not in sospesi or completed_at < sospesi[corso]:
+                    sospesi[corso] = completed_at
+            continue
+
+        if completed_at is None:
+            continue
+
+        chiave = (user_id, link.requisito_id)
+        if chiave not in migliori or migliori[chiave][0] < completed_at:
+            migliori[chiave] = (completed_at, link.manus_course_id)
+
+    esistenti = {}
+    if migliori:
+        utenti = {user_id for user_id, _ in migliori}
+        requisiti = {requisito_id for _, requisito_id in migliori}
+        for rec_id, user_id, requisito_id, completed_at in (
+                db.session.query(TrainingCompletionManus.id, TrainingCompletionManus.user_id,
+                                 TrainingCompletionManus.requisito_id, TrainingCompletionManus.completed_at)
+                .filter(TrainingCompletionManus.user_id.in_(utenti),
+                        TrainingCompletionManus.requisito_id.in_(requisiti))):
+            esistenti[(user_id, requisito_id)] = (rec_id, completed_at)
+
+    nuovi, aggiornati = [], []
+    for (user_id, requisito_id), (completed_at, course_id) in migliori.items():
+        esistente = esistenti.get((user_id, requisito_id))
+        if esistente is None:
+            nuovi.append({'user_id': user_id, 'requisito_id': requisito_id, 'manus_course_id': course_id,
+                          'completed_at': completed_at})
+        elif esistente[1] < completed_at:
+            # Aggiorna se più recente
+            aggiornati.append({'id': esistente[0], 'completed_at': completed_at})
+
+    if nuovi:
+        db.session.execute(insert(TrainingCompletionManus), nuovi)
+    if aggiornati:
+        db.session.execute(update(TrainingCompletionManus), aggiornati)
+    if non_mappati:
+        db.session.execute(insert(ManusUserMapping), [
+            {'manus_user_id': manus_user_id, 'email': email, 'syn_user_id': None, 'active': False}
+            for manus_user_id, email in non_mappati.items()
+        ])
+        logger.warning(f"⚠️ {len(non_mappati)} utenti non mappati, creati mapping inattivi: "
+                       f"{', '.join(str(e) for e in non_mappati.values())}")
+    stats = {'creati': len(nuovi), 'aggiornati': len(aggiornati), 'non_mappati': len(non_mappati)}
+    return stats, sospesi
+
+def _risorsa_cursore(link: ManusCourseLink) -> str:
+    return f"completions:{link.manus_course_id}"
+
+def _sync_completamenti(azienda_id: int, links: list, client: ManusClient = None, since_iso: str = None,
+                        completo: bool = False) -> dict:
+    """
+    Scarica in parallelo i completamenti dei corsi e li applica in blocco.
+
+    Con `since_iso` esplicito (es. webhook) i cursori non vengono spostati;
+    altrimenti ogni corso riparte dal proprio cursore, o da zero se `completo`.
+    Il cursore non supera i completamenti di utenti non ancora mappati: sono
+    richiesti di nuovo finché un admin non attiva il mapping.
+    """
+    mc = client or ManusClient()
+    cursori = {c.risorsa: c for c in ManusSyncCursor.query.filter_by(azienda_id=azienda_id)}
+    avvio = _utcnow()
+
+    def _since(link):
+        if since_iso or completo:
+            return since_iso
+        cursore = cursori.get(_risorsa_cursore(link))
+        return cursore.cursor if cursore else None
+
+    def _scarica(link_since):
+        link, since = link_since
+        try:
+            return mc.list_course_completions(link.manus_course_id, since), None
+        except Exception as e:
+            return None, e
+
+    # Le richieste HTTP girano nei thread; il database solo in questo thread
+    risultati = mc.map(_scarica, [(link, _since(link)) for link in links])
+
+    per_link, prossimi, errori = [], {}, 0
+    for link, (payload, errore) in zip(links, risultati):
+        if errore is not None:
+            errori += 1
+            logger.error(f"❌ Errore download completamenti corso {link.manus_course_id}: {errore}")
+            continue
+        per_link.append((link, payload.get("items", [])))
+        prossimi[link.manus_course_id] = payload.get("next_since")
+
+    stats, sospesi = _applica_completamenti(per_link)
+
+    cursori_nuovi, cursori_aggiornati = [], []
+    for link, _ in ([] if since_iso else per_link):
+        valore = prossimi[link.manus_course_id] or (avvio - CURSOR_OVERLAP).isoformat(timespec="seconds") + "Z"
+        if link.manus_course_id in sospesi:
+            fermo = (sospesi[link.manus_course_id] - CURSOR_OVERLAP).isoformat(timespec="seconds") + "Z"
+            valore = min(valore, fermo, key=_parse_iso)
+        cursore = cursori.get(_risorsa_cursore(link))
+        if cursore is None:
+            cursori_nuovi.append({'azienda_id': azienda_id, 'risorsa': _risorsa_cursore(link), 'cursor': valore})
+        else:
+            cursori_aggiornati.append({'id': cursore.id, 'cursor': valore, 'updated_at': avvio})
+
+    if cursori_nuovi:
+        db.session.execute(insert(ManusSyncCursor), cursori_nuovi)
+    if cursori_aggiornati:
+        db.session.execute(update(ManusSyncCursor), cursori_aggiornati)
+    db.session.commit()
+
+    stats.update({'corsi': len(per_link), 'errori': errori,
+                  'righe': sum(len(rows) for _, rows in per_link)})
+    return stats
+
+def sync_completions_for_course(link: ManusCourseLink, since_iso: str = None, client: ManusClient = None):
     """
     Sincronizza i completamenti per un corso specifico.
-    
+
     Args:
         link (ManusCourseLink): Link del corso
-        since_iso (str): Data ISO da cui filtrare (opzionale)
+        since_iso (str): Data ISO da cui filtrare (opzionale, default cursore salvato)
+        client (ManusClient): Client da riusare (opzionale)
+
+    Returns:
+        dict: Statistiche della sincronizzazione
     """
     try:
-        mc = ManusClient()
-        payload = mc.list_course_completions(link.manus_course_id, since_iso)
-        
-        completions = payload.get("items", [])
-        logger.info(f"🔄 Sync completamenti per corso {link.manus_course_id}: {len(completions)} trovati")
-        
-        for row in completions:
-            try:
-                # ATTENZIONE: serve mappare l'utente Manus → user_id interno
-                user_id = row.get("user_id_internal")
-                email = row.get("user_email")
-                
-                if not user_id:
-                    # Prova a risolvere per email
-                    from services.manus_user_mapping import resolve_user_id
-                    user_id = resolve_user_id(None, email)
-                    
-                    if not user_id:
-                        # Crea mapping inattivo per revisione manuale
-                        from models import ManusUserMapping
-                        existing = ManusUserMapping.query.filter_by(
-                            manus_user_id=row.get("user_id", f"unknown_{row.get('id', 'unknown')}")
-                        ).first()
-                        
-                        if not existing:
-                            mapping = ManusUserMapping(
-                                manus_user_id=row.get("user_id", f"unknown_{row.get('id', 'unknown')}"),
-                                email=email,
-                                syn_user_id=None,
-                                active=False
-                            )
-                            db.session.add(mapping)
-                            db.session.commit()
-                            logger.warning(f"⚠️ Utente non mappato, creato mapping inattivo: {email}")
-                        
-                        continue
-                
-                completed_at_str = row.get("completed_at")
-                if not completed_at_str:
-                    continue
-                
-                # Converti stringa ISO in datetime
-                completed_at = datetime.fromisoformat(completed_at_str.replace("Z", "+00:00")).replace(tzinfo=None)
-                
-                # Cerca completamento esistente
-                rec = (TrainingCompletionManus.query
-                       .filter_by(user_id=user_id, requisito_id=link.requisito_id)
-                       .first())
-                
-                if not rec:
-                    rec = TrainingCompletionManus(
-                        user_id=user_id,
-                        requisito_id=link.requisito_id,
-                        manus_course_id=link.manus_course_id,
-                        completed_at=completed_at
-                    )
-                    db.session.add(rec)
-                    logger.info(f"✅ Creato completamento per utente {user_id}")
-                elif rec.completed_at < completed_at:
-                    # Aggiorna se più recente
-                    rec.completed_at = completed_at
-                    logger.info(f"🔄 Aggiornato completamento per utente {user_id}")
-                
-            except Exception as e:
-                logger.error(f"❌ Errore sync completamento: {e}")
-                continue
-        
-        db.session.commit()
-        logger.info(f"✅ Sync completamenti completato per corso {link.manus_course_id}")
-        
+        stats = _sync_completamenti(link.azienda_id, [link], client, since_iso)
+        if stats['errori']:
+            raise RuntimeError(f"download completamenti non riuscito per corso {link.manus_course_id}")
+        logger.info(f"✅ Sync completamenti completato per corso {link.manus_course_id}: {stats}")
+        return stats
+
     except Exception as e:
         logger.error(f"❌ Errore sync completamenti per corso {link.manus_course_id}: {e}")
         db.session.rollback()
         raise
 
+def sync_completions_for_company(azienda_id: int, client: ManusClient = None, completo: bool = False):
+    """
+    Sincronizza i completamenti di tutti i corsi di un'azienda, in parallelo
+    e in modo incrementale dai cursori salvati.
+
+    Args:
+        azienda_id (int): ID dell'azienda nel sistema locale
+        client (ManusClient): Client da riusare (opzionale)
+        completo (bool): Ignora i cursori e riscarica tutti i completamenti
+
+    Returns:
+        dict: Statistiche della sincronizzazione
+    """
+    try:
+        links = ManusCourseLink.query.filter_by(azienda_id=azienda_id).all()
+        stats = _sync_completamenti(azienda_id, links, client, completo=completo)
+        logger.info(f"✅ Sync completamenti completato per azienda {azienda_id}: {stats}")
+        return stats
+
+    except Exception as e:
+        logger.error(f"❌ Errore sync completamenti per azienda {azienda_id}: {e}")
+        db.session.rollback()
+        raise
+
 def sync_all_for_company(azienda_id: int, azienda_ref: str):
     """
     Sincronizza tutto per un'azienda: manuali, corsi e completamenti.
-    
+
     Args:
         azienda_id (int): ID dell'azienda nel sistema locale
         azienda_ref (str): Riferimento azienda in Manus
+
+    Returns:
+        dict: Statistiche per manuali, corsi e completamenti
     """
     logger.info(f"🚀 Avvio sync completo per azienda {azienda_id} ({azienda_ref})")
-    
+
     try:
-        # Sync manuali
-        sync_manuals(azienda_id, azienda_ref)
-        
-        # Sync corsi
-        sync_courses(azienda_id, azienda_ref)
-        
-        # Sync completamenti per tutti i corsi
-        course_links = ManusCourseLink.query.filter_by(azienda_id=azienda_id).all()
-        for link in course_links:
-            sync_completions_for_course(link)
-        
+        mc = ManusClient()
+        # Elenchi di manuali e corsi scaricati in parallelo
+        manuals, courses = mc.map(lambda elenco: elenco(azienda_ref), [mc.list_manuals, mc.list_courses])
+
+        stats = {
+            'manuali': sync_manuals(azienda_id, azienda_ref, mc, manuals),
+            'corsi': sync_courses(azienda_id, azienda_ref, mc, courses),
+            'completamenti': sync_completions_for_company(azienda_id, mc),
+        }
         logger.info(f"✅ Sync completo completato per azienda {azienda_id}")
-        
+        return stats
+
     except Exception as e:
         logger.error(f"❌ Errore sync completo per azienda {azienda_id}: {e}")
         raise
@@ -1,268 +1,502 @@
 """
 Servizio per la generazione di preview di file.
 Gestisce PDF, immagini e file Office.
+
+Le preview sono in una cache su disco indicizzata per hash del contenuto,
+dimensione e pagina (PREVIEW_CACHE_DIR/ab/<sha256>/<dimensione>_p<pagina>.png):
+documenti con lo stesso contenuto condividono le stesse immagini e un file
+modificato ha un hash nuovo, quindi le voci non vanno mai invalidate.
+
+Il rendering avviene in un pool di worker in background, avviato al momento
+dell'upload: la richiesta di preview serve l'immagine se è in cache, altrimenti
+accoda il rendering e risponde subito. Per ogni contenuto il PDF viene
+rasterizzato con una sola chiamata al renderer per tutte le pagine (fino a
+PREVIEW_MAX_PAGES) e i file Office sono convertiti da LibreOffice una sola volta.
+
+La cache ha un budget su disco (PREVIEW_CACHE_MAX_BYTES): ogni accesso aggiorna
+il mtime del file e, superato il budget, vengono eliminate le preview usate
+meno di recente (LRU).
 """
 
+import json
 import os
-import tempfile
+import shutil
 import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
-from PIL import Image
-import pikepdf
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, ImageSequence
 from flask import current_app
 
+# Lato lungo massimo (pixel) per ogni dimensione servita
+PREVIEW_SIZES = {
+    'thumb': 256,
+    'viewer': 1400,
+}
+DEFAULT_SIZE = 'viewer'
+DEFAULT_MAX_PAGES = 20
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 2 GB
+DEFAULT_WORKERS = 2
+DEFAULT_RENDER_TIMEOUT = 120
+RETRY_FAILED_AFTER_SEC = 3600
+TOUCH_INTERVAL_SEC = 60          # aggiornamento mtime LRU al massimo una volta al minuto
+BUDGET_CHECK_INTERVAL_SEC = 60   # controllo budget dopo i rendering al massimo una volta al minuto
+EVICT_TO_RATIO = 0.9             # l'eviction scende al 90% del budget per evitare esecuzioni continue
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tif', '.tiff', '.webp'}
+PDF_EXTENSIONS = {'.pdf'}
+OFFICE_EXTENSIONS = {'.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.odt', '.ods', '.odp', '.rtf'}
 
-def generate_pdf_preview(pdf_path: str, file_id: int) -> Optional[str]:
+META_FILENAME = 'meta.json'
+
+# Stati della preview per una coppia contenuto/dimensione/pagina
+STATO_PRONTA = 'pronta'
+STATO_IN_CODA = 'in_coda'
+STATO_NON_DISPONIBILE = 'non_disponibile'
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+_last_budget_check = 0.0
+
+
+class PreviewError(Exception):
+    """Errore di rendering di una preview."""
+
+
+def preview_kind(filename: str) -> Optional[str]:
     """
-    Genera preview della prima pagina di un PDF.
-    
-    Args:
-        pdf_path: Percorso del file PDF
-        file_id: ID del file per naming cache
-        
+    Tipo di sorgente della preview dal nome file.
+
     Returns:
-        Percorso del file preview PNG o None se errore
+        str: 'image', 'pdf', 'office' o None se il tipo non ha preview.
     """
-    try:
-        # Crea directory cache se non esiste
-        cache_dir = os.path.join(current_app.config.get('UPLOAD_FOLDER', 'uploads'), 'previews')
-        os.makedirs(cache_dir, exist_ok=True)
-        
-        # Nome file preview
-        preview_filename = f"preview_{file_id}.png"
-        preview_path = os.path.join(cache_dir, preview_filename)
-        
-        # Se esiste già, restituisci
-        if os.path.exists(preview_path):
-            return preview_path
-        
-        # Apri PDF con pikepdf
-        with pikepdf.open(pdf_path) as pdf:
-            if len(pdf.pages) == 0:
-                return None
-            
-            # Prendi prima pagina
-            first_page = pdf.pages[0]
-            
-            # Converti in immagine
-            # Nota: pikepdf non ha conversione diretta PDF->PNG
-            # Usiamo un approccio alternativo con subprocess
-            return _convert_pdf_to_image_subprocess(pdf_path, preview_path)
-            
-    except Exception as e:
-        current_app.logger.error(f"Errore generazione preview PDF {pdf_path}: {e}")
-        return None
+    ext = Path(filename or '').suffix.lower()
+    if ext in IMAGE_EXTENSIONS:
+        return 'image'
+    if ext in PDF_EXTENSIONS:
+        return 'pdf'
+    if ext in OFFICE_EXTENSIONS:
+        return 'office'
+    return None
+
+
+def pdf_renderer() -> Optional[str]:
+    """Renderer PDF disponibile sul sistema: 'pdftoppm' (poppler), 'gs' o None."""
+    for binary in ('pdftoppm', 'gs'):
+        if shutil.which(binary):
+            return binary
+    return None
+
 
+def office_converter() -> Optional[str]:
+    """Eseguibile LibreOffice per la conversione dei file Office, None se assente."""
+    return shutil.which('soffice') or shutil.which('libreoffice')
 
-def _convert_pdf_to_image_subprocess(pdf_path: str, output_path: str) -> Optional[str]:
+
+def can_render(kind: Optional[str]) -> bool:
+    """True se il sistema ha gli strumenti per generare preview del tipo indicato."""
+    if kind == 'image':
+        return True
+    if kind == 'pdf':
+        return pdf_renderer() is not None
+    if kind == 'office':
+        return pdf_renderer() is not None and office_converter() is not None
+    return False
+
+
+class PreviewCache:
     """
-    Converte PDF in immagine usando subprocess (pdftoppm, convert, etc.).
-    
-    Args:
-        pdf_path: Percorso PDF
-        output_path: Percorso output PNG
-        
-    Returns:
-        Percorso file generato o None se errore
+    Cache delle preview su disco indicizzata per hash del contenuto.
+
+    Ogni contenuto ha una directory con le immagini per dimensione/pagina e un
+    meta.json con il numero di pagine generate (o l'errore dell'ultimo rendering).
     """
-    try:
-        # Prova con pdftoppm (poppler-utils)
-        cmd = ['pdftoppm', '-png', '-singlefile', '-f', '1', '-l', '1', pdf_path, output_path.replace('.png', '')]
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-        
-        if result.returncode == 0 and os.path.exists(output_path):
-            return output_path
-        
-        # Fallback con convert (ImageMagick)
-        cmd = ['convert', f'{pdf_path}[0]', output_path]
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-        
-        if result.returncode == 0 and os.path.exists(output_path):
-            return output_path
-        
-        # Fallback con gs (Ghostscript)
-        cmd = ['gs', '-sDEVICE=pngalpha', '-dNOPAUSE', '-dBATCH', '-dSAFER', 
-               '-dFirstPage=1', '-dLastPage=1', '-r150', 
-               f'-sOutputFile={output_path}', pdf_path]
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-        
-        if result.returncode == 0 and os.path.exists(output_path):
-            return output_path
-            
-        return None
-        
-    except Exception as e:
-        current_app.logger.error(f"Errore conversione PDF->PNG: {e}")
-        return None
 
+    def __init__(self, root: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+
+    def dir_for(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def path_for(self, sha256: str, size: str, page: int) -> str:
+        return os.path.join(self.dir_for(sha256), f"{size}_p{page}.png")
+
+    def read_meta(self, sha256: str) -> Optional[dict]:
+        try:
+            with open(os.path.join(self.dir_for(sha256), META_FILENAME)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_meta(self, sha256: str, meta: dict):
+        directory = self.dir_for(sha256)
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = os.path.join(directory, f".{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(directory, META_FILENAME))
+
+    def get(self, sha256: str, size: str, page: int) -> Optional[str]:
+        """
+        Percorso della preview se presente in cache, aggiornandone l'uso (LRU).
+        """
+        path = self.path_for(sha256, size, page)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        now = time.time()
+        if now - stat.st_mtime > TOUCH_INTERVAL_SEC:
+            try:
+                os.utime(path, (now, now))
+            except OSError:
+                pass
+        return path
+
+    def put(self, sha256: str, size: str, page: int, image: Image.Image) -> str:
+        """Salva una preview in modo atomico (file temporaneo + rename)."""
+        directory = self.dir_for(sha256)
+        os.makedirs(directory, exist_ok=True)
+        path = self.path_for(sha256, size, page)
+        tmp_path = os.path.join(directory, f".{uuid.uuid4().hex}.tmp")
+        image.save(tmp_path, format='PNG', optimize=True)
+        os.replace(tmp_path, path)
+        return path
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not name.endswith('.png'):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def usage(self) -> int:
+        """Byte occupati dalle preview in cache."""
+        return sum(size for _, size, _ in self._entries())
+
+    def enforce_budget(self, max_bytes: Optional[int] = None) -> dict:
+        """
+        Elimina le preview usate meno di recente finché la cache rientra nel budget.
 
-def convert_office_to_pdf(office_path: str, file_id: int) -> Optional[str]:
+        Returns:
+            dict: Statistiche (bytes_prima, bytes_dopo, eliminati).
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        stats = {'bytes_prima': total, 'bytes_dopo': total, 'eliminati': 0}
+        if total <= max_bytes:
+            return stats
+
+        target = int(max_bytes * EVICT_TO_RATIO)
+        touched_dirs = set()
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            stats['eliminati'] += 1
+            touched_dirs.add(os.path.dirname(path))
+
+        # Contenuti senza più immagini: via anche meta.json, così verranno rigenerati
+        for directory in touched_dirs:
+            if not any(name.endswith('.png') for name in os.listdir(directory)):
+                shutil.rmtree(directory, ignore_errors=True)
+
+        stats['bytes_dopo'] = total
+        current_app.logger.info(
+            f"🧹 Cache preview: {stats['eliminati']} immagini eliminate, "
+            f"{stats['bytes_prima']} -> {stats['bytes_dopo']} byte (budget {max_bytes})"
+        )
+        return stats
+
+
+def get_preview_cache(app=None) -> PreviewCache:
     """
-    Converte file Office in PDF usando LibreOffice.
-    
-    Args:
-        office_path: Percorso file Office
-        file_id: ID del file per naming cache
-        
+    Restituisce la cache preview configurata (PREVIEW_CACHE_DIR, default UPLOAD_FOLDER/preview_cache).
+    """
+    app = app or current_app
+    root = app.config.get('PREVIEW_CACHE_DIR') or os.path.join(app.config.get('UPLOAD_FOLDER', 'uploads'), 'preview_cache')
+    return PreviewCache(root, int(app.config.get('PREVIEW_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)))
+
+
+def _max_pages() -> int:
+    return int(current_app.config.get('PREVIEW_MAX_PAGES', DEFAULT_MAX_PAGES))
+
+
+def _render_timeout() -> int:
+    return int(current_app.config.get('PREVIEW_RENDER_TIMEOUT', DEFAULT_RENDER_TIMEOUT))
+
+
+def _fit(image: Image.Image, size: str) -> Image.Image:
+    """Copia ridimensionata entro il lato lungo della dimensione (mai ingrandita)."""
+    limit = PREVIEW_SIZES[size]
+    fitted = image.copy()
+    fitted.thumbnail((limit, limit), Image.Resampling.LANCZOS)
+    return fitted
+
+
+def _normalize_mode(image: Image.Image) -> Image.Image:
+    if image.mode in ('RGB', 'RGBA', 'L', 'LA'):
+        return image
+    if image.mode == 'P' and 'transparency' in image.info:
+        return image.convert('RGBA')
+    return image.convert('RGB')
+
+
+def _store_pages(cache: PreviewCache, sha256: str, pages: List[Image.Image]) -> int:
+    """Salva tutte le dimensioni per ogni pagina a partire dalle immagini a piena risoluzione."""
+    for number, page in enumerate(pages, start=1):
+        page = _normalize_mode(page)
+        for size in PREVIEW_SIZES:
+            cache.put(sha256, size, number, _fit(page, size))
+    return len(pages)
+
+
+def _rasterize_pdf(pdf_path: str, workdir: str) -> List[str]:
+    """
+    Rasterizza le prime PREVIEW_MAX_PAGES pagine del PDF con una sola esecuzione del renderer.
+
     Returns:
-        Percorso del file PDF convertito o None se errore
+        list: Percorsi PNG delle pagine in ordine, alla risoluzione della dimensione 'viewer'.
     """
+    renderer = pdf_renderer()
+    if renderer is None:
+        raise PreviewError("Nessun renderer PDF disponibile (pdftoppm o gs)")
+
+    max_pages = _max_pages()
+    if renderer == 'pdftoppm':
+        cmd = ['pdftoppm', '-png', '-f', '1', '-l', str(max_pages),
+               '-scale-to', str(PREVIEW_SIZES['viewer']), pdf_path, os.path.join(workdir, 'pagina')]
+    else:
+        cmd = ['gs', '-sDEVICE=png16m', '-dNOPAUSE', '-dBATCH', '-dSAFER', '-dQUIET',
+               '-dFirstPage=1', f'-dLastPage={max_pages}', '-r130',
+               '-dTextAlphaBits=4', '-dGraphicsAlphaBits=4',
+               f"-sOutputFile={os.path.join(workdir, 'pagina-%d.png')}", pdf_path]
+
     try:
-        # Crea directory cache se non esiste
-        cache_dir = os.path.join(current_app.config.get('UPLOAD_FOLDER', 'uploads'), 'converted')
-        os.makedirs(cache_dir, exist_ok=True)
-        
-        # Nome file PDF convertito
-        pdf_filename = f"converted_{file_id}.pdf"
-        pdf_path = os.path.join(cache_dir, pdf_filename)
-        
-        # Se esiste già, restituisci
-        if os.path.exists(pdf_path):
-            return pdf_path
-        
-        # Converte con LibreOffice headless
-        cmd = [
-            'libreoffice', '--headless', '--convert-to', 'pdf',
-            '--outdir', cache_dir, office_path
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
-        
-        if result.returncode == 0:
-            # LibreOffice genera il file con nome originale + .pdf
-            original_name = Path(office_path).stem
-            generated_pdf = os.path.join(cache_dir, f"{original_name}.pdf")
-            
-            if os.path.exists(generated_pdf):
-                # Rinomina nel formato standard
-                os.rename(generated_pdf, pdf_path)
-                return pdf_path
-        
-        return None
-        
-    except Exception as e:
-        current_app.logger.error(f"Errore conversione Office->PDF {office_path}: {e}")
-        return None
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=_render_timeout())
+    except subprocess.TimeoutExpired:
+        raise PreviewError(f"Timeout rendering PDF con {renderer}")
+
+    pages = sorted(
+        (name for name in os.listdir(workdir) if name.startswith('pagina-') and name.endswith('.png')),
+        key=lambda name: int(name[len('pagina-'):-len('.png')])
+    )
+    if not pages:
+        raise PreviewError(f"Rendering PDF fallito con {renderer}: {result.stderr.strip()[:200]}")
+    return [os.path.join(workdir, name) for name in pages]
+
+
+def _convert_office(office_path: str, workdir: str) -> str:
+    """Converte un file Office in PDF con LibreOffice headless, in una directory di lavoro."""
+    converter = office_converter()
+    if converter is None:
+        raise PreviewError("LibreOffice non disponibile per la conversione Office")
+
+    # Profilo utente dedicato: istanze concorrenti di LibreOffice non condividono il lock
+    profile = Path(workdir, 'lo_profile').as_uri()
+    cmd = [converter, '--headless', f'-env:UserInstallation={profile}',
+           '--convert-to', 'pdf', '--outdir', workdir, office_path]
+    try:
+        subprocess.run(cmd, capture_output=True, text=True, timeout=_render_timeout())
+    except subprocess.TimeoutExpired:
+        raise PreviewError("Timeout conversione Office con LibreOffice")
+
+    pdf_path = os.path.join(workdir, f"{Path(office_path).stem}.pdf")
+    if not os.path.exists(pdf_path):
+        raise PreviewError("Conversione Office -> PDF fallita")
+    return pdf_path
 
 
-def resize_image(image_path: str, max_width: int = 800, max_height: int = 600) -> Optional[str]:
+def render_previews(sha256: str, source_path: str, kind: str, cache: Optional[PreviewCache] = None) -> dict:
     """
-    Ridimensiona un'immagine mantenendo le proporzioni.
-    
+    Genera tutte le pagine e dimensioni di un contenuto e aggiorna meta.json.
+
     Args:
-        image_path: Percorso immagine
-        max_width: Larghezza massima
-        max_height: Altezza massima
-        
+        sha256: Hash del contenuto (chiave della cache)
+        source_path: Percorso del file sorgente
+        kind: 'image', 'pdf' o 'office'
+
     Returns:
-        Percorso immagine ridimensionata o None se errore
+        dict: Meta del contenuto (pagine generate o errore).
     """
+    cache = cache or get_preview_cache()
+    started = time.monotonic()
     try:
-        with Image.open(image_path) as img:
-            # Calcola nuove dimensioni mantenendo proporzioni
-            width, height = img.size
-            ratio = min(max_width / width, max_height / height)
-            
-            if ratio >= 1:
-                # Immagine già più piccola, restituisci originale
-                return image_path
-            
-            new_width = int(width * ratio)
-            new_height = int(height * ratio)
-            
-            # Ridimensiona
-            resized_img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # Salva in cache
-            cache_dir = os.path.join(current_app.config.get('UPLOAD_FOLDER', 'uploads'), 'thumbnails')
-            os.makedirs(cache_dir, exist_ok=True)
-            
-            filename = Path(image_path).name
-            thumbnail_path = os.path.join(cache_dir, f"thumb_{filename}")
-            
-            resized_img.save(thumbnail_path, optimize=True, quality=85)
-            
-            return thumbnail_path
-            
+        if kind == 'image':
+            with Image.open(source_path) as img:
+                frames = [frame.copy() for _, frame in zip(range(_max_pages()), ImageSequence.Iterator(img))]
+            pages = _store_pages(cache, sha256, frames)
+        elif kind in ('pdf', 'office'):
+            with tempfile.TemporaryDirectory(prefix='preview_') as workdir:
+                pdf_path = _convert_office(source_path, workdir) if kind == 'office' else source_path
+                page_images = []
+                for page_path in _rasterize_pdf(pdf_path, workdir):
+                    with Image.open(page_path) as img:
+                        img.load()
+                        page_images.append(img)
+                pages = _store_pages(cache, sha256, page_images)
+        else:
+            raise PreviewError(f"Tipo senza preview: {kind}")
+
+        meta = {'pagine': pages, 'tipo': kind, 'generata_il': time.time()}
+        current_app.logger.info(
+            f"🖼️ Preview generate per {sha256[:12]}: {pages} pagine in {time.monotonic() - started:.1f}s"
+        )
     except Exception as e:
-        current_app.logger.error(f"Errore ridimensionamento immagine {image_path}: {e}")
-        return None
+        meta = {'pagine': 0, 'tipo': kind, 'errore': str(e)[:500], 'fallita_il': time.time()}
+        current_app.logger.error(f"❌ Errore generazione preview {sha256[:12]} ({source_path}): {e}")
+
+    cache.write_meta(sha256, meta)
+    return meta
 
 
-def get_preview_path(file_path: str, file_id: int, mime_type: str) -> Optional[str]:
+def preview_status(sha256: str, size: str, page: int, cache: Optional[PreviewCache] = None) -> Tuple[str, Optional[str]]:
     """
-    Ottiene il percorso del preview per un file.
-    
-    Args:
-        file_path: Percorso del file
-        file_id: ID del file
-        mime_type: Tipo MIME del file
-        
+    Stato di una preview in cache.
+
     Returns:
-        Percorso del preview o None se non disponibile
+        tuple: (stato, percorso) con stato STATO_PRONTA, STATO_IN_CODA (da generare
+        o in generazione) o STATO_NON_DISPONIBILE (pagina inesistente o errore recente).
     """
+    cache = cache or get_preview_cache()
+    path = cache.get(sha256, size, page)
+    if path:
+        return STATO_PRONTA, path
+
+    meta = cache.read_meta(sha256)
+    if meta is None:
+        return STATO_IN_CODA, None
+    if meta.get('errore'):
+        if time.time() - meta.get('fallita_il', 0) < RETRY_FAILED_AFTER_SEC:
+            return STATO_NON_DISPONIBILE, None
+        return STATO_IN_CODA, None
+    if page > meta.get('pagine', 0):
+        return STATO_NON_DISPONIBILE, None
+    # Immagine eliminata dall'eviction LRU: va rigenerata
+    return STATO_IN_CODA, None
+
+
+def _get_executor(app) -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = int(app.config.get('PREVIEW_WORKERS', DEFAULT_WORKERS))
+            _executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='preview')
+        return _executor
+
+
+def _maybe_enforce_budget(cache: PreviewCache):
+    global _last_budget_check
+    now = time.monotonic()
+    if now - _last_budget_check < BUDGET_CHECK_INTERVAL_SEC:
+        return
+    _last_budget_check = now
+    cache.enforce_budget()
+
+
+def _run_render(app, key: str, sha256: Optional[str], source_path: str, kind: str,
+                document_id: Optional[int]) -> dict:
     try:
-        file_ext = Path(file_path).suffix.lower()
-        
-        if mime_type.startswith('image/'):
-            # Immagini: ridimensiona
-            return resize_image(file_path)
-        
-        elif mime_type == 'application/pdf':
-            # PDF: genera preview
-            return generate_pdf_preview(file_path, file_id)
-        
-        elif mime_type in ['application/msword', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-                          'application/vnd.ms-excel', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                          'application/vnd.ms-powerpoint', 'application/vnd.openxmlformats-officedocument.presentationml.presentation']:
-            # Office: converti in PDF e poi genera preview
-            pdf_path = convert_office_to_pdf(file_path, file_id)
-            if pdf_path:
-                return generate_pdf_preview(pdf_path, f"{file_id}_converted")
-        
-        return None
-        
-    except Exception as e:
-        current_app.logger.error(f"Errore ottenimento preview {file_path}: {e}")
-        return None
+        with app.app_context():
+            if sha256 is None:
+                # Documento legacy senza hash: calcolato una volta e salvato in FileHash
+                from services.antivirus_service import antivirus_service
+                sha256 = antivirus_service.calculate_sha256(source_path)
+                if document_id is not None:
+                    antivirus_service.save_file_hash(document_id, hash_value=sha256)
+            cache = get_preview_cache(app)
+            meta = render_previews(sha256, source_path, kind, cache)
+            _maybe_enforce_budget(cache)
+            return meta
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
 
 
-def cleanup_old_previews(max_age_days: int = 7):
+def enqueue_preview(sha256: Optional[str], source_path: str, filename: str,
+                    document_id: Optional[int] = None, app=None) -> Optional[Future]:
     """
-    Pulisce i preview più vecchi di max_age_days giorni.
-    
+    Accoda la generazione delle preview di un contenuto nel pool di worker.
+
+    Un contenuto già in generazione non viene accodato di nuovo. Con
+    PREVIEW_ASYNC=false il rendering è eseguito subito nel thread chiamante.
+
     Args:
-        max_age_days: Età massima in giorni
+        sha256: Hash del contenuto (None per documenti legacy: calcolato dal worker)
+        source_path: Percorso del file sorgente
+        filename: Nome originale (determina il tipo di preview)
+        document_id: Documento a cui associare l'hash calcolato
+
+    Returns:
+        Future: Rendering in corso, o None se il tipo non ha preview.
     """
+    kind = preview_kind(filename)
+    if kind is None or not can_render(kind):
+        return None
+
+    app = app or current_app._get_current_object()
+    key = sha256 or f"file:{os.path.abspath(source_path)}"
+
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is not None:
+            return future
+        if not app.config.get('PREVIEW_ASYNC', True):
+            future = Future()
+            _inflight[key] = future
+        else:
+            future = _get_executor(app).submit(_run_render, app, key, sha256, source_path, kind, document_id)
+            _inflight[key] = future
+            return future
+
     try:
-        import time
-        from datetime import datetime, timedelta
-        
-        cache_dirs = [
-            os.path.join(current_app.config.get('UPLOAD_FOLDER', 'uploads'), 'previews'),
-            os.path.join(current_app.config.get('UPLOAD_FOLDER', 'uploads'), 'converted'),
-            os.path.join(current_app.config.get('UPLOAD_FOLDER', 'uploads'), 'thumbnails')
-        ]
-        
-        cutoff_time = datetime.now() - timedelta(days=max_age_days)
-        
-        for cache_dir in cache_dirs:
-            if not os.path.exists(cache_dir):
-                continue
-                
-            for filename in os.listdir(cache_dir):
-                file_path = os.path.join(cache_dir, filename)
-                
-                if os.path.isfile(file_path):
-                    file_time = datetime.fromtimestamp(os.path.getmtime(file_path))
-                    
-                    if file_time < cutoff_time:
-                        try:
-                            os.remove(file_path)
-                            current_app.logger.info(f"Rimosso preview vecchio: {file_path}")
-                        except Exception as e:
-                            current_app.logger.error(f"Errore rimozione preview {file_path}: {e}")
-                            
+        future.set_result(_run_render(app, key, sha256, source_path, kind, document_id))
     except Exception as e:
-        current_app.logger.error(f"Errore pulizia preview: {e}")
+        future.set_exception(e)
+    return future
+
+
+def enqueue_document_preview(document, app=None) -> Optional[Future]:
+    """Accoda le preview di un documento (hash dal blob store o da FileHash)."""
+    from models import FileHash
+
+    filename = document.original_filename or document.filename
+    sha256 = document.blob_sha256
+    if sha256 is None:
+        file_hash = FileHash.query.get(document.id)
+        sha256 = file_hash.value if file_hash else None
+    source_path = document.file_path
+    if not source_path or not os.path.exists(source_path):
+        return None
+    return enqueue_preview(sha256, source_path, filename, document_id=document.id, app=app)
+
+
+def shutdown_preview_workers(wait: bool = True):
+    """Arresta il pool di worker (test e chiusura del processo)."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
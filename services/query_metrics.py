@@ -0,0 +1,323 @@
+"""
+Strumentazione delle query SQL per richiesta e rilevamento dei pattern N+1.
+
+Gli eventi `before/after_cursor_execute` di SQLAlchemy (tutti gli engine,
+compreso il bind di reporting) registrano per la richiesta corrente:
+- numero di query e tempo totale sul database;
+- fingerprint delle istruzioni (letterali e liste IN normalizzati), per
+  riconoscere la stessa SELECT ripetuta riga per riga (lazy load in un ciclo).
+
+Una fingerprint SELECT ripetuta almeno QUERY_METRICS_N_PLUS_ONE_THRESHOLD
+volte nella stessa richiesta è segnalata come N+1. I dati finiscono:
+- negli header X-DB-* e Server-Timing (QUERY_METRICS_HEADERS, sviluppo);
+- nelle statistiche per endpoint del processo (pagina admin /admin/query-metrics);
+- nel log JSONL QUERY_METRICS_LOG_PATH per le richieste con N+1, lente o
+  con molte query (condiviso tra i worker gunicorn).
+"""
+
+import contextvars
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD = 10
+MAX_FINGERPRINT = 500
+TOP_FINGERPRINT = 5
+
+_profilo = contextvars.ContextVar('query_profile', default=None)
+_listeners_installed = False
+
+_RE_STRINGHE = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMERI = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_PARAMETRI = re.compile(r"%\([^)]*\)s|%s|(?<!:):\w+")
+_RE_LISTE_IN = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_RE_SPAZI = re.compile(r"\s+")
+
+
+def fingerprint(statement: str) -> str:
+    """
+    Forma normalizzata di un'istruzione SQL: stessi parametri o letterali
+    diversi producono la stessa fingerprint.
+    """
+    sql = _RE_STRINGHE.sub("?", statement)
+    sql = _RE_NUMERI.sub("?", sql)
+    sql = _RE_PARAMETRI.sub("?", sql)
+    sql = _RE_LISTE_IN.sub("(?...)", sql)
+    return _RE_SPAZI.sub(" ", sql).strip()[:MAX_FINGERPRINT]
+
+
+class QueryProfile:
+    """Query eseguite in un'unità di lavoro (richiesta, job, script)."""
+
+    def __init__(self, threshold: int = DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self.query = 0
+        self.db_ms = 0.0
+        self.per_fingerprint = {}
+
+    def registra(self, statement: str, durata_ms: float):
+        self.query += 1
+        self.db_ms += durata_ms
+        chiave = fingerprint(statement)
+        voce = self.per_fingerprint.get(chiave)
+        if voce is None:
+            voce = self.per_fingerprint[chiave] = {'count': 0, 'ms': 0.0}
+        voce['count'] += 1
+        voce['ms'] += durata_ms
+
+    def n_plus_one(self) -> list:
+        """SELECT ripetute almeno `threshold` volte, dalla più frequente."""
+        sospette = [
+            {'fingerprint': chiave, 'count': voce['count'], 'ms': round(voce['ms'], 2)}
+            for chiave, voce in self.per_fingerprint.items()
+            if voce['count'] >= self.threshold and chiave.upper().startswith(('SELECT', 'WITH'))
+        ]
+        return sorted(sospette, key=lambda voce: voce['count'], reverse=True)
+
+    def ripetute(self, limite: int = TOP_FINGERPRINT) -> list:
+        """Fingerprint eseguite più di una volta, dalla più frequente."""
+        voci = [
+            {'fingerprint': chiave, 'count': voce['count'], 'ms': round(voce['ms'], 2)}
+            for chiave, voce in self.per_fingerprint.items() if voce['count'] > 1
+        ]
+        return sorted(voci, key=lambda voce: voce['count'], reverse=True)[:limite]
+
+    def summary(self) -> dict:
+        return {
+            'query': self.query,
+            'db_ms': round(self.db_ms, 2),
+            'distinte': len(self.per_fingerprint),
+            'n_plus_one': self.n_plus_one(),
+        }
+
+
+@contextmanager
+def profila_query(threshold: int = DEFAULT_THRESHOLD):
+    """
+    Registra le query eseguite nel blocco (script, job, test).
+
+    Yields:
+        QueryProfile: profilo aggiornato durante il blocco
+    """
+    install_listeners()
+    profilo = QueryProfile(threshold)
+    token = _profilo.set(profilo)
+    try:
+        yield profilo
+    finally:
+        _profilo.reset(token)
+
+
+# === EVENTI SQLALCHEMY ===
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _profilo.get() is not None:
+        conn.info['query_metrics_start'] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profilo = _profilo.get()
+    inizio = conn.info.pop('query_metrics_start', None)
+    if profilo is None or inizio is None:
+        return
+    profilo.registra(statement, (time.perf_counter() - inizio) * 1000)
+
+
+def install_listeners():
+    """Registra gli eventi su tutti gli engine (una sola volta per processo)."""
+    global _listeners_installed
+    if _listeners_installed:
+        return
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    _listeners_installed = True
+
+
+# === STATISTICHE PER ENDPOINT ===
+
+class EndpointStats:
+    """Aggregati per endpoint delle richieste servite da questo processo."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoint = {}
+
+    def aggiungi(self, endpoint: str, profilo: QueryProfile, durata_ms: float):
+        sospette = profilo.n_plus_one()
+        with self._lock:
+            voce = self._endpoint.get(endpoint)
+            if voce is None:
+                voce = self._endpoint[endpoint] = {
+                    'richieste': 0, 'query': 0, 'query_max': 0, 'db_ms': 0.0,
+                    'durata_ms': 0.0, 'richieste_n_plus_one': 0, 'n_plus_one': {},
+                }
+            voce['richieste'] += 1
+            voce['query'] += profilo.query
+            voce['query_max'] = max(voce['query_max'], profilo.query)
+            voce['db_ms'] += profilo.db_ms
+            voce['durata_ms'] += durata_ms
+            if sospette:
+                voce['richieste_n_plus_one'] += 1
+                for sospetta in sospette:
+                    conteggio = voce['n_plus_one'].get(sospetta['fingerprint'], 0)
+                    voce['n_plus_one'][sospetta['fingerprint']] = max(conteggio, sospetta['count'])
+
+    def snapshot(self) -> list:
+        """Endpoint ordinati per query medie per richiesta."""
+        with self._lock:
+            righe = []
+            for endpoint, voce in self._endpoint.items():
+                richieste = voce['richieste']
+                top = sorted(voce['n_plus_one'].items(), key=lambda item: item[1], reverse=True)[:TOP_FINGERPRINT]
+                righe.append({
+                    'endpoint': endpoint,
+                    'richieste': richieste,
+                    'query_media': round(voce['query'] / richieste, 1),
+                    'query_max': voce['query_max'],
+                    'db_ms_medio': round(voce['db_ms'] / richieste, 2),
+                    'durata_ms_media': round(voce['durata_ms'] / richieste, 2),
+                    'richieste_n_plus_one': voce['richieste_n_plus_one'],
+                    'n_plus_one': [{'fingerprint': chiave, 'count': count} for chiave, count in top],
+                })
+        return sorted(righe, key=lambda riga: riga['query_media'], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._endpoint.clear()
+
+
+stats = EndpointStats()
+_log_lock = threading.Lock()
+
+
+def scrivi_log(path: str, voce: dict):
+    """Aggiunge una riga JSON al log delle richieste segnalate."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    riga = json.dumps(voce, ensure_ascii=False, default=str)
+    with _log_lock:
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(riga + "\n")
+
+
+def leggi_log(path: str, limite: int = 500) -> list:
+    """Ultime `limite` righe del log JSONL (tutti i worker)."""
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        righe = deque(f, maxlen=limite)
+    voci = []
+    for riga in righe:
+        try:
+            voci.append(json.loads(riga))
+        except ValueError:
+            continue
+    return voci
+
+
+# === INTEGRAZIONE FLASK ===
+
+def init_query_metrics(app):
+    """
+    Attiva la strumentazione per le richieste dell'app.
+
+    Args:
+        app: Istanza dell'applicazione Flask
+    """
+    if not app.config.get('QUERY_METRICS_ENABLED', True):
+        return
+    install_listeners()
+    threshold = int(app.config.get('QUERY_METRICS_N_PLUS_ONE_THRESHOLD', DEFAULT_THRESHOLD))
+    headers = app.config.get('QUERY_METRICS_HEADERS', False)
+    log_path = app.config.get('QUERY_METRICS_LOG_PATH')
+    log_min_query = int(app.config.get('QUERY_METRICS_LOG_MIN_QUERIES', 50))
+    slow_ms = float(app.config.get('QUERY_METRICS_SLOW_MS', 500))
+
+    @app.before_request
+    def _inizio_profilo():
+        g.query_profile_start = time.perf_counter()
+        g.query_profile_token = _profilo.set(QueryProfile(threshold))
+
+    @app.after_request
+    def _fine_profilo(response):
+        profilo = _profilo.get()
+        if profilo is None or 'query_profile_start' not in g:
+            return response
+        try:
+            durata_ms = (time.perf_counter() - g.query_profile_start) * 1000
+            endpoint = request.endpoint or request.path
+            sospette = profilo.n_plus_one()
+            stats.aggiungi(endpoint, profilo, durata_ms)
+
+            if headers:
+                response.headers['X-DB-Query-Count'] = str(profilo.query)
+                response.headers['X-DB-Time-Ms'] = f"{profilo.db_ms:.1f}"
+                response.headers['X-DB-N-Plus-One'] = str(len(sospette))
+                response.headers.add('Server-Timing', f"db;dur={profilo.db_ms:.1f};desc=\"{profilo.query} query\"")
+
+            if sospette:
+                logger.warning(f"⚠️ N+1 su {endpoint}: {sospette[0]['count']}x {sospette[0]['fingerprint'][:120]}")
+            if log_path and (sospette or profilo.query >= log_min_query or durata_ms >= slow_ms):
+                scrivi_log(log_path, {
+                    'ts': datetime.utcnow().isoformat(timespec='seconds'),
+                    'pid': os.getpid(),
+                    'endpoint': endpoint,
+                    'method': request.method,
+                    'path': request.path,
+                    'status': response.status_code,
+                    'durata_ms': round(durata_ms, 2),
+                    'query': profilo.query,
+                    'db_ms': round(profilo.db_ms, 2),
+                    'n_plus_one': sospette[:TOP_FINGERPRINT],
+                    'ripetute': profilo.ripetute(),
+                })
+        except Exception as e:
+            logger.error(f"❌ Errore metriche query: {e}")
+        return response
+
+    @app.teardown_request
+    def _chiudi_profilo(exc=None):
+        token = g.pop('query_profile_token', None)
+        if token is not None:
+            try:
+                _profilo.reset(token)
+            except ValueError:
+                # Token creato in un altro contesto (richiesta annidata nei test)
+                _profilo.set(None)
+
+    logger.info(f"🔎 Metriche query attive (N+1 da {threshold} ripetizioni, header {'on' if headers else 'off'})")
+
+
+def riepilogo_log(voci: list) -> list:
+    """Aggrega le righe del log JSONL per endpoint."""
+    per_endpoint = {}
+    for voce in voci:
+        endpoint = voce.get('endpoint') or voce.get('path')
+        riga = per_endpoint.setdefault(endpoint, {
+            'endpoint': endpoint, 'segnalazioni': 0, 'query_max': 0, 'db_ms_max': 0.0,
+            'n_plus_one': {}, 'ultima': None,
+        })
+        riga['segnalazioni'] += 1
+        riga['query_max'] = max(riga['query_max'], voce.get('query', 0))
+        riga['db_ms_max'] = max(riga['db_ms_max'], voce.get('db_ms', 0.0))
+        riga['ultima'] = voce.get('ts')
+        for sospetta in voce.get('n_plus_one', []):
+            conteggio = riga['n_plus_one'].get(sospetta['fingerprint'], 0)
+            riga['n_plus_one'][sospetta['fingerprint']] = max(conteggio, sospetta['count'])
+    risultato = []
+    for riga in per_endpoint.values():
+        top = sorted(riga['n_plus_one'].items(), key=lambda item: item[1], reverse=True)[:TOP_FINGERPRINT]
+        riga['n_plus_one'] = [{'fingerprint': chiave, 'count': count} for chiave, count in top]
+        risultato.append(riga)
+    return sorted(risultato, key=lambda riga: riga['segnalazioni'], reverse=True)
@@ -0,0 +1,491 @@
+"""
+Rollup giornalieri e mensili per trend e report periodici.
+
+I report (trend della dashboard documentale, report CEO, report personalizzati,
+analisi per periodo) non contano più documenti ed eventi mese per mese: leggono
+i contatori pre-aggregati di metric_rollup_daily / metric_rollup_monthly.
+
+`aggiorna_rollup()` è eseguito dallo scheduler ogni REPORT_ROLLUP_INTERVAL_MIN:
+
+- eventi (download, letture, firme, AdminLog per classe): ricalcola gli ultimi
+  REPORT_ROLLUP_LOOKBACK_DAYS giorni e, in più, i giorni degli eventi inseriti
+  dopo l'ultimo passaggio (ID oltre il watermark) anche se datati nel passato;
+- documenti: stato, firma e scadenza cambiano nel tempo, quindi i contatori
+  sono ricalcolati con una GROUP BY completa e scritti solo dove differiscono;
+- i mensili dei mesi toccati sono ricalcolati dai giornalieri.
+
+Letture: `totale`, `totali_per`, `serie_mensile` e `totali_cumulati` usano i mensili per i mesi
+interi del periodo e i giornalieri solo per i giorni ai bordi. La granularità
+è il giorno (UTC) e i dati sono aggiornati all'ultimo passaggio del job.
+"""
+
+import logging
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from flask import current_app
+from sqlalchemy import and_, case, func, or_
+
+from extensions import db
+from models import (
+    AdminLog, Document, DownloadLog, FirmaDocumento, LetturaPDF,
+    MetricRollupDaily, MetricRollupMonthly, RollupWatermark
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOOKBACK_DAYS = 2
+
+# === Metriche ===
+
+M_DOWNLOAD = 'download'
+M_LETTURE = 'letture'
+M_FIRME = 'firme'
+
+M_DOC_CARICATI = 'documenti.caricati'                         # per giorno di creazione
+M_DOC_IN_ATTESA = 'documenti.in_attesa'                       # per giorno di creazione
+M_DOC_APPROVATI = 'documenti.approvati'                       # per giorno di creazione
+M_DOC_FIRMATI = 'documenti.firmati'                           # per giorno di creazione
+M_DOC_APPROVATI_NON_FIRMATI = 'documenti.approvati_non_firmati'  # per giorno di creazione
+M_DOC_SCADENZA_NON_APPROVATI = 'documenti.scadenza_non_approvati'  # per giorno di scadenza
+M_DOC_APPROVATI_AGGIORNAMENTO = 'documenti.approvati_per_aggiornamento'  # per ultima modifica
+
+METRICHE_DOCUMENTI = (
+    M_DOC_CARICATI, M_DOC_IN_ATTESA, M_DOC_APPROVATI, M_DOC_FIRMATI,
+    M_DOC_APPROVATI_NON_FIRMATI, M_DOC_SCADENZA_NON_APPROVATI, M_DOC_APPROVATI_AGGIORNAMENTO,
+)
+
+# Classi di eventi AdminLog, riconosciute da sottostringhe dell'azione
+ADMIN_LOG_CLASSI = {
+    'permessi': ('permission',),
+    'documenti': ('create', 'delete', 'upload'),
+    'utenti': ('user', 'guest', 'role'),
+}
+M_ADMIN_LOG_TOTALE = 'admin_log.totale'
+
+DIMENSIONI = ('company_id', 'department_id', 'document_id')
+
+Chiave = Tuple[str, date, int, int, int]
+
+
+def metrica_admin_log(classe: str) -> str:
+    """Nome della metrica per una classe di eventi AdminLog."""
+    return f'admin_log.{classe}'
+
+
+METRICHE_ADMIN_LOG = (M_ADMIN_LOG_TOTALE,) + tuple(metrica_admin_log(c) for c in ADMIN_LOG_CLASSI)
+
+
+def filtro_admin_log(*classi: str):
+    """Espressione SQL che seleziona le azioni AdminLog delle classi indicate."""
+    action = func.lower(AdminLog.action)
+    patterns = [p for classe in classi for p in ADMIN_LOG_CLASSI[classe]]
+    return or_(*[action.like(f'%{p}%') for p in patterns])
+
+
+def classi_admin_log(action: Optional[str]) -> List[str]:
+    """Classi a cui appartiene un'azione AdminLog (anche più di una)."""
+    action = (action or '').lower()
+    return [classe for classe, patterns in ADMIN_LOG_CLASSI.items() if any(p in action for p in patterns)]
+
+
+# === Date ===
+
+def inizio_mese(giorno: date) -> date:
+    return giorno.replace(day=1)
+
+
+def sposta_mesi(giorno: date, mesi: int) -> date:
+    """Primo giorno del mese spostato di `mesi` (anche negativo)."""
+    indice = giorno.year * 12 + giorno.month - 1 + mesi
+    return date(indice // 12, indice % 12 + 1, 1)
+
+
+def _as_date(value) -> Optional[date]:
+    """Normalizza il risultato di func.date (stringa su SQLite, date su PostgreSQL)."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def _as_datetime(giorno: date) -> datetime:
+    return datetime.combine(giorno, datetime.min.time())
+
+
+def _giorni_contigui(giorni: Iterable[date]) -> List[Tuple[date, date]]:
+    """Raggruppa i giorni in intervalli contigui [inizio, fine] inclusivi."""
+    intervalli = []
+    for giorno in sorted(set(giorni)):
+        if intervalli and giorno == intervalli[-1][1] + timedelta(days=1):
+            intervalli[-1][1] = giorno
+        else:
+            intervalli.append([giorno, giorno])
+    return [(inizio, fine) for inizio, fine in intervalli]
+
+
+# === Scrittura ===
+
+def _watermark(sorgente: str) -> RollupWatermark:
+    watermark = db.session.get(RollupWatermark, sorgente)
+    if watermark is None:
+        watermark = RollupWatermark(sorgente=sorgente, last_id=0)
+        db.session.add(watermark)
+    return watermark
+
+
+def _applica(model, metriche: Sequence[str], nuovi: Dict[Chiave, int],
+             inizio: Optional[date] = None, fine_escl: Optional[date] = None) -> Set[Tuple[str, date]]:
+    """
+    Allinea le righe di `model` per `metriche` nel periodo ai valori `nuovi`,
+    scrivendo solo le differenze. Restituisce i (metrica, mese) modificati.
+    """
+    query = model.query.filter(model.metrica.in_(list(metriche)))
+    if inizio is not None:
+        query = query.filter(model.periodo >= inizio)
+    if fine_escl is not None:
+        query = query.filter(model.periodo < fine_escl)
+    esistenti = {(r.metrica, r.periodo, r.company_id, r.department_id, r.document_id): r for r in query}
+
+    modificate = set()
+    for chiave, valore in nuovi.items():
+        if not valore:
+            continue
+        row = esistenti.pop(chiave, None)
+        if row is None:
+            metrica, periodo, company_id, department_id, document_id = chiave
+            db.session.add(model(metrica=metrica, periodo=periodo, company_id=company_id,
+                                 department_id=department_id, document_id=document_id, valore=valore))
+            modificate.add(chiave)
+        elif row.valore != valore:
+            row.valore = valore
+            modificate.add(chiave)
+    for chiave, row in esistenti.items():
+        db.session.delete(row)
+        modificate.add(chiave)
+
+    return {(chiave[0], inizio_mese(chiave[1])) for chiave in modificate}
+
+
+def _conta_eventi(model, metrica: str):
+    """Conteggio per giorno e documento (con azienda e reparto) di una tabella di eventi."""
+    def conta(inizio: date, fine_escl: date) -> Dict[Chiave, int]:
+        giorno = func.date(model.timestamp)
+        rows = db.session.query(
+            giorno,
+            func.coalesce(Document.company_id, 0),
+            func.coalesce(Document.department_id, 0),
+            model.document_id,
+            func.count(model.id)
+        ).outerjoin(Document, Document.id == model.document_id).filter(
+            model.timestamp >= _as_datetime(inizio),
+            model.timestamp < _as_datetime(fine_escl)
+        ).group_by(giorno, Document.company_id, Document.department_id, model.document_id)
+
+        return {(metrica, _as_date(g), company_id, department_id, document_id or 0): n
+                for g, company_id, department_id, document_id, n in rows}
+    return conta
+
+
+def _conta_admin_log(inizio: date, fine_escl: date) -> Dict[Chiave, int]:
+    """Eventi AdminLog per giorno: totale e per classe."""
+    giorno = func.date(AdminLog.timestamp)
+    colonne = [func.sum(case((filtro_admin_log(classe), 1), else_=0)) for classe in ADMIN_LOG_CLASSI]
+    rows = db.session.query(giorno, func.count(AdminLog.id), *colonne).filter(
+        AdminLog.timestamp >= _as_datetime(inizio),
+        AdminLog.timestamp < _as_datetime(fine_escl)
+    ).group_by(giorno)
+
+    nuovi = {}
+    for row in rows:
+        periodo = _as_date(row[0])
+        nuovi[(M_ADMIN_LOG_TOTALE, periodo, 0, 0, 0)] = row[1]
+        for indice, classe in enumerate(ADMIN_LOG_CLASSI):
+            nuovi[(metrica_admin_log(classe), periodo, 0, 0, 0)] = int(row[2 + indice] or 0)
+    return nuovi
+
+
+def _sorgenti_eventi():
+    """(sorgente, modello, metriche, funzione di conteggio) per le tabelle di eventi."""
+    return [
+        ('download', DownloadLog, (M_DOWNLOAD,), _conta_eventi(DownloadLog, M_DOWNLOAD)),
+        ('letture', LetturaPDF, (M_LETTURE,), _conta_eventi(LetturaPDF, M_LETTURE)),
+        ('firme', FirmaDocumento, (M_FIRME,), _conta_eventi(FirmaDocumento, M_FIRME)),
+        ('admin_log', AdminLog, METRICHE_ADMIN_LOG, _conta_admin_log),
+    ]
+
+
+def _giorni_da_ricalcolare(model, last_id: int, max_id: int, oggi: date, lookback: int) -> Set[date]:
+    """
+    Finestra recente più i giorni degli eventi nuovi (ID oltre il watermark):
+    così anche un evento inserito in ritardo con una data passata corregge il
+    suo bucket. Alla prima esecuzione si ricostruisce tutto lo storico.
+    """
+    giorni = {oggi - timedelta(days=i) for i in range(lookback + 1)}
+    if last_id == 0 or last_id > max_id:
+        primo = _as_date(db.session.query(func.min(model.timestamp)).scalar())
+        if primo is not None and primo < oggi:
+            giorni.update(primo + timedelta(days=i) for i in range((oggi - primo).days))
+        return giorni
+
+    giorno = func.date(model.timestamp)
+    nuovi = db.session.query(giorno).filter(
+        model.id > last_id, model.id <= max_id, model.timestamp.isnot(None)
+    ).distinct()
+    giorni.update(_as_date(g) for (g,) in nuovi)
+    return giorni
+
+
+def _aggiorna_sorgente(sorgente, model, metriche, conta, oggi: date, lookback: int, stats: dict) -> Set[Tuple[str, date]]:
+    watermark = _watermark(sorgente)
+    max_id = db.session.query(func.max(model.id)).scalar() or 0
+    giorni = _giorni_da_ricalcolare(model, watermark.last_id, max_id, oggi, lookback)
+
+    modificate = set()
+    for inizio, fine in _giorni_contigui(giorni):
+        fine_escl = fine + timedelta(days=1)
+        modificate |= _applica(MetricRollupDaily, metriche, conta(inizio, fine_escl), inizio, fine_escl)
+
+    watermark.last_id = max_id
+    watermark.refreshed_at = datetime.utcnow()
+    stats['giorni'] += len(giorni)
+    return modificate
+
+
+def _conta_documenti() -> Dict[Chiave, int]:
+    """Contatori documentali per giorno (creazione, scadenza, ultima modifica), azienda e reparto."""
+    approvato = Document.stato_approvazione == 'approvato'
+    nuovi = {}
+
+    creazione = func.date(Document.created_at)
+    rows = db.session.query(
+        creazione, Document.company_id, Document.department_id,
+        func.count(Document.id),
+        func.sum(case((Document.stato_approvazione == 'in_attesa', 1), else_=0)),
+        func.sum(case((approvato, 1), else_=0)),
+        func.sum(case((Document.is_signed == True, 1), else_=0)),
+        func.sum(case((and_(approvato, Document.is_signed == False), 1), else_=0))
+    ).filter(Document.created_at.isnot(None)).group_by(creazione, Document.company_id, Document.department_id)
+    for giorno, company_id, department_id, *valori in rows:
+        chiave = (_as_date(giorno), company_id or 0, department_id or 0, 0)
+        for metrica, valore in zip((M_DOC_CARICATI, M_DOC_IN_ATTESA, M_DOC_APPROVATI,
+                                    M_DOC_FIRMATI, M_DOC_APPROVATI_NON_FIRMATI), valori):
+            nuovi[(metrica,) + chiave] = int(valore or 0)
+
+    for metrica, colonna, condizione in (
+        (M_DOC_SCADENZA_NON_APPROVATI, Document.expiry_date, Document.stato_approvazione != 'approvato'),
+        (M_DOC_APPROVATI_AGGIORNAMENTO, Document.updated_at, approvato),
+    ):
+        giorno = func.date(colonna)
+        rows = db.session.query(giorno, Document.company_id, Document.department_id, func.count(Document.id)).filter(
+            colonna.isnot(None), condizione
+        ).group_by(giorno, Document.company_id, Document.department_id)
+        for g, company_id, department_id, n in rows:
+            nuovi[(metrica, _as_date(g), company_id or 0, department_id or 0, 0)] = n
+
+    return nuovi
+
+
+def _aggiorna_mensili(modificate: Set[Tuple[str, date]]) -> int:
+    """Ricalcola dai giornalieri i mensili dei (metrica, mese) modificati."""
+    per_mese = defaultdict(set)
+    for metrica, mese in modificate:
+        per_mese[mese].add(metrica)
+
+    for mese, metriche in per_mese.items():
+        fine_escl = sposta_mesi(mese, 1)
+        rows = db.session.query(
+            MetricRollupDaily.metrica, MetricRollupDaily.company_id,
+            MetricRollupDaily.department_id, MetricRollupDaily.document_id,
+            func.sum(MetricRollupDaily.valore)
+        ).filter(
+            MetricRollupDaily.metrica.in_(list(metriche)),
+            MetricRollupDaily.periodo >= mese,
+            MetricRollupDaily.periodo < fine_escl
+        ).group_by(MetricRollupDaily.metrica, MetricRollupDaily.company_id,
+                   MetricRollupDaily.department_id, MetricRollupDaily.document_id)
+        nuovi = {(metrica, mese, company_id, department_id, document_id): int(valore or 0)
+                 for metrica, company_id, department_id, document_id, valore in rows}
+        _applica(MetricRollupMonthly, metriche, nuovi, mese, fine_escl)
+
+    return len(per_mese)
+
+
+def aggiorna_rollup(lookback_giorni: Optional[int] = None, oggi: Optional[date] = None) -> dict:
+    """
+    Aggiornamento incrementale dei rollup (job dello scheduler).
+
+    Args:
+        lookback_giorni: Giorni recenti sempre ricalcolati (default REPORT_ROLLUP_LOOKBACK_DAYS)
+        oggi: Giorno di riferimento (default oggi UTC, come i timestamp degli eventi)
+
+    Returns:
+        dict: Giorni ricalcolati, (metrica, mese) modificati e mesi riaggregati
+    """
+    if lookback_giorni is None:
+        lookback_giorni = current_app.config.get('REPORT_ROLLUP_LOOKBACK_DAYS', DEFAULT_LOOKBACK_DAYS)
+    oggi = oggi or datetime.utcnow().date()
+    stats = {'giorni': 0, 'modificate': 0, 'mesi': 0}
+
+    try:
+        modificate = set()
+        for sorgente, model, metriche, conta in _sorgenti_eventi():
+            modificate |= _aggiorna_sorgente(sorgente, model, metriche, conta, oggi, lookback_giorni, stats)
+
+        modificate |= _applica(MetricRollupDaily, METRICHE_DOCUMENTI, _conta_documenti())
+        _watermark('documenti').refreshed_at = datetime.utcnow()
+
+        stats['modificate'] = len(modificate)
+        stats['mesi'] = _aggiorna_mensili(modificate)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    logger.info(f"📊 Rollup report aggiornati: {stats['giorni']} giorni, "
+                f"{stats['modificate']} bucket modificati, {stats['mesi']} mesi")
+    return stats
+
+
+def ricostruisci_rollup() -> dict:
+    """Azzera i watermark e ricostruisce tutti i rollup dallo storico."""
+    RollupWatermark.query.update({RollupWatermark.last_id: 0})
+    db.session.commit()
+    return aggiorna_rollup()
+
+
+# === Lettura ===
+
+def _parti(inizio: Optional[date], fine: Optional[date]):
+    """
+    Scompone [inizio, fine] (inclusivo, estremi opzionali) in mesi interi,
+    letti dai mensili, e giorni ai bordi, letti dai giornalieri.
+    """
+    fine_escl = fine + timedelta(days=1) if fine is not None else None
+    primo_mese = None if inizio is None else (inizio if inizio.day == 1 else sposta_mesi(inizio, 1))
+    fine_mesi = None if fine_escl is None else inizio_mese(fine_escl)
+
+    if primo_mese is not None and fine_mesi is not None and primo_mese >= fine_mesi:
+        return [(MetricRollupDaily, inizio, fine_escl)]
+
+    parti = [(MetricRollupMonthly, primo_mese, fine_mesi)]
+    if inizio is not None and inizio < primo_mese:
+        parti.append((MetricRollupDaily, inizio, primo_mese))
+    if fine_escl is not None and fine_mesi < fine_escl:
+        parti.append((MetricRollupDaily, fine_mesi, fine_escl))
+    return parti
+
+
+def _somma(metriche: Sequence[str], inizio: Optional[date], fine: Optional[date],
+           raggruppa: Sequence[str] = (), session=None, **filtri) -> Dict[tuple, int]:
+    for nome in list(raggruppa) + list(filtri):
+        if nome not in DIMENSIONI + ('metrica',):
+            raise ValueError(f"Dimensione rollup non valida: {nome}")
+
+    session = session or db.session
+    risultato = defaultdict(int)
+    for model, start, end in _parti(inizio, fine):
+        colonne = [getattr(model, nome) for nome in raggruppa]
+        query = session.query(*colonne, func.sum(model.valore)).filter(model.metrica.in_(list(metriche)))
+        if start is not None:
+            query = query.filter(model.periodo >= start)
+        if end is not None:
+            query = query.filter(model.periodo < end)
+        for nome, valore in filtri.items():
+            if valore is not None:
+                query = query.filter(getattr(model, nome) == valore)
+        if colonne:
+            query = query.group_by(*colonne)
+        for row in query:
+            if row[-1] is not None:
+                risultato[tuple(row[:-1])] += int(row[-1])
+    return dict(risultato)
+
+
+def totale(metrica: str, inizio: Optional[date] = None, fine: Optional[date] = None,
+           session=None, **filtri) -> int:
+    """
+    Somma di una metrica nel periodo [inizio, fine] (giorni inclusi, estremi
+    opzionali), filtrabile per company_id, department_id, document_id.
+    """
+    return _somma([metrica], inizio, fine, session=session, **filtri).get((), 0)
+
+
+def totali_per(metriche: Sequence[str], dimensione: str, inizio: Optional[date] = None,
+               fine: Optional[date] = None, session=None, **filtri) -> Dict[int, Dict[str, int]]:
+    """Somme delle metriche per valore di una dimensione: {id: {metrica: valore}}."""
+    righe = _somma(metriche, inizio, fine, (dimensione, 'metrica'), session=session, **filtri)
+    risultato = defaultdict(lambda: {metrica: 0 for metrica in metriche})
+    for (chiave, metrica), valore in righe.items():
+        risultato[chiave][metrica] = valore
+    return dict(risultato)
+
+
+def serie_mensile(metrica: str, primo_mese: date, ultimo_mese: date,
+                  session=None, **filtri) -> Dict[date, int]:
+    """Valori mese per mese (inclusi i mesi a zero) tra due mesi compresi, dai mensili."""
+    for nome in filtri:
+        if nome not in DIMENSIONI:
+            raise ValueError(f"Dimensione rollup non valida: {nome}")
+
+    primo_mese, ultimo_mese = inizio_mese(primo_mese), inizio_mese(ultimo_mese)
+    session = session or db.session
+    query = session.query(MetricRollupMonthly.periodo, func.sum(MetricRollupMonthly.valore)).filter(
+        MetricRollupMonthly.metrica == metrica,
+        MetricRollupMonthly.periodo >= primo_mese,
+        MetricRollupMonthly.periodo <= ultimo_mese
+    )
+    for nome, valore in filtri.items():
+        if valore is not None:
+            query = query.filter(getattr(MetricRollupMonthly, nome) == valore)
+    valori = {_as_date(periodo): int(valore or 0) for periodo, valore in query.group_by(MetricRollupMonthly.periodo)}
+
+    serie = {}
+    mese = primo_mese
+    while mese <= ultimo_mese:
+        serie[mese] = valori.get(mese, 0)
+        mese = sposta_mesi(mese, 1)
+    return serie
+
+
+def totali_cumulati(metrica: str, fini: Iterable[date], session=None, **filtri) -> Dict[date, int]:
+    """
+    Somma di una metrica dall'inizio dei dati fino a ciascuna data (inclusa).
+
+    Due letture raggruppate per periodo in tutto, qualunque sia il numero di
+    date: i mensili per i mesi interi precedenti e i giornalieri per i giorni
+    del mese di ciascuna data.
+    """
+    for nome in filtri:
+        if nome not in DIMENSIONI:
+            raise ValueError(f"Dimensione rollup non valida: {nome}")
+
+    fini = sorted(set(fini))
+    if not fini:
+        return {}
+    session = session or db.session
+
+    def _serie(model, start: Optional[date], end: date) -> Dict[date, int]:
+        query = session.query(model.periodo, func.sum(model.valore)).filter(
+            model.metrica == metrica, model.periodo < end
+        )
+        if start is not None:
+            query = query.filter(model.periodo >= start)
+        for nome, valore in filtri.items():
+            if valore is not None:
+                query = query.filter(getattr(model, nome) == valore)
+        return {_as_date(periodo): int(valore or 0) for periodo, valore in query.group_by(model.periodo)}
+
+    mensili = _serie(MetricRollupMonthly, None, inizio_mese(fini[-1]))
+    giornalieri = _serie(MetricRollupDaily, inizio_mese(fini[0]), fini[-1] + timedelta(days=1))
+
+    risultato = {}
+    for fine in fini:
+        mese = inizio_mese(fine)
+        risultato[fine] = (sum(valore for periodo, valore in mensili.items() if periodo < mese)
+                           + sum(valore for giorno, valore in giornalieri.items() if mese <= giorno <= fine))
+    return risultato
@@ -0,0 +1,253 @@
+"""
+Sessioni di reporting: query analitiche pesanti fuori dal pool delle richieste interattive.
+
+Il bind SQLAlchemy 'reporting' è un engine separato, scelto da REPORTING_DATABASE_MODE:
+- 'primary' (default): stesso database con pool dedicato;
+- 'replica': REPORTING_DATABASE_URI (replica in lettura, standby Postgres);
+- 'snapshot': copia SQLite REPORTING_SNAPSHOT_PATH aggiornata dallo scheduler
+  ogni REPORT_SNAPSHOT_INTERVAL_MIN minuti (backup API di sqlite3).
+
+Le connessioni di reporting sono in sola lettura e con timeout per statement
+(REPORTING_STATEMENT_TIMEOUT_MS): su Postgres `statement_timeout`, su SQLite
+un progress handler che interrompe la query. Un report troppo pesante fallisce
+invece di tenere occupato il database per upload e firme.
+
+I percorsi di sola lettura si annotano con `@reporting_query` (funzioni e
+generatori) o `with reporting_session():`: dentro il blocco `db.session` e
+`Model.query` leggono dal bind di reporting. Flush e scritture (AdminLog
+degli export, alert) restano sul database principale anche dentro il blocco.
+"""
+
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from flask_sqlalchemy.session import Session
+from sqlalchemy import TextClause, event
+from sqlalchemy.pool import NullPool
+
+logger = logging.getLogger(__name__)
+
+REPORTING_BIND = 'reporting'
+MODES = ('primary', 'replica', 'snapshot')
+
+_reporting = contextvars.ContextVar('reporting_session', default=False)
+
+
+def _lettura(clause) -> bool:
+    if clause is None:
+        return False
+    if getattr(clause, 'is_select', False):
+        return True
+    # text(): lettura se è una SELECT (o una CTE)
+    return isinstance(clause, TextClause) and clause.text.lstrip().upper().startswith(('SELECT', 'WITH'))
+
+
+class RoutingSession(Session):
+    """
+    Sessione Flask-SQLAlchemy che, dentro `reporting_session()`, legge dal bind di reporting.
+
+    Solo le SELECT cambiano bind: flush (anche l'autoflush prima di una query)
+    e scritture restano sul database principale.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and _reporting.get() and not self._flushing and _lettura(clause):
+            engine = self._db.engines.get(REPORTING_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+
+@contextmanager
+def reporting_session():
+    """Blocco in cui le query di `db.session` vanno al database di reporting."""
+    token = _reporting.set(True)
+    try:
+        yield
+    finally:
+        _reporting.reset(token)
+
+
+def in_reporting_session() -> bool:
+    return _reporting.get()
+
+
+def reporting_query(func):
+    """Decoratore per funzioni (anche generatori, es. export in streaming) di sola lettura."""
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def generator_wrapper(*args, **kwargs):
+            gen = func(*args, **kwargs)
+            while True:
+                token = _reporting.set(True)
+                try:
+                    item = next(gen)
+                except StopIteration:
+                    return
+                finally:
+                    _reporting.reset(token)
+                yield item
+        return generator_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with reporting_session():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+# === CONFIGURAZIONE DEL BIND ===
+
+def reporting_bind(config) -> dict:
+    """
+    Opzioni del bind 'reporting' per SQLALCHEMY_BINDS, dalla configurazione.
+
+    Returns:
+        dict | None: url e opzioni dell'engine, None per SQLite in memoria
+    """
+    mode = (config.get('REPORTING_DATABASE_MODE') or 'primary').lower()
+    if mode not in MODES:
+        raise RuntimeError(f"REPORTING_DATABASE_MODE non valido: {mode} (ammessi: {', '.join(MODES)})")
+    timeout_ms = int(config.get('REPORTING_STATEMENT_TIMEOUT_MS', 30000))
+
+    if mode == 'replica':
+        url = config.get('REPORTING_DATABASE_URI')
+        if not url:
+            raise RuntimeError("REPORTING_DATABASE_MODE=replica richiede REPORTING_DATABASE_URI")
+    elif mode == 'snapshot':
+        url = f"sqlite:///{config['REPORTING_SNAPSHOT_PATH']}"
+    else:
+        url = config['SQLALCHEMY_DATABASE_URI']
+
+    if mode == 'primary' and url.startswith('sqlite') and url.rstrip('/').endswith((':memory:', 'sqlite:')):
+        # Un secondo engine in memoria sarebbe un database vuoto: si usa l'engine principale
+        return None
+
+    options = {'url': url}
+    if url.startswith('sqlite'):
+        # Snapshot sostituito sul disco: nessuna connessione riusata dopo l'aggiornamento
+        if mode == 'snapshot':
+            options['poolclass'] = NullPool
+    else:
+        options['pool_size'] = int(config.get('REPORTING_POOL_SIZE', 2))
+        options['max_overflow'] = 0
+        options['pool_pre_ping'] = True
+        if url.startswith('postgresql'):
+            options['connect_args'] = {
+                'options': f"-c statement_timeout={timeout_ms} -c default_transaction_read_only=on"
+            }
+    return options
+
+
+def _install_sqlite_limits(engine, timeout_ms: int, pragmas: dict):
+    """Sola lettura, pragma di profilo e timeout per statement sulle connessioni SQLite."""
+
+    @event.listens_for(engine, 'connect')
+    def _connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for nome, valore in pragmas.items():
+                cursor.execute(f"PRAGMA {nome}={valore}")
+            cursor.execute("PRAGMA query_only=ON")
+        finally:
+            cursor.close()
+        info = connection_record.info
+
+        def _interrompi():
+            inizio = info.get('reporting_statement_start')
+            return 1 if inizio is not None and (time.monotonic() - inizio) * 1000 > timeout_ms else 0
+
+        dbapi_connection.set_progress_handler(_interrompi, 10000)
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _inizio(conn, cursor, statement, parameters, context, executemany):
+        conn.info['reporting_statement_start'] = time.monotonic()
+
+    # Il timeout copre anche il fetch delle righe: azzerato al rilascio della connessione
+    @event.listens_for(engine, 'checkin')
+    def _fine(dbapi_connection, connection_record):
+        connection_record.info.pop('reporting_statement_start', None)
+
+
+def init_reporting(app):
+    """
+    Configura le connessioni del bind di reporting (dopo db.init_app).
+
+    Args:
+        app: Istanza dell'applicazione Flask
+    """
+    from extensions import db
+    from services.db_profile import sqlite_pragmas
+
+    with app.app_context():
+        engine = db.engines.get(REPORTING_BIND)
+    if engine is None:
+        return
+    snapshot = app.config.get('REPORTING_SNAPSHOT_PATH')
+    if app.config.get('REPORTING_DATABASE_MODE') == 'snapshot' and not os.path.exists(snapshot):
+        aggiorna_snapshot_reporting(app)
+    timeout_ms = int(app.config.get('REPORTING_STATEMENT_TIMEOUT_MS', 30000))
+    if engine.dialect.name == 'sqlite':
+        pragmas = sqlite_pragmas(app.config) if app.config.get('SQLITE_PRAGMAS_ENABLED', True) else {}
+        # Il journal mode è del database principale (o dello snapshot): non va toccato in sola lettura
+        pragmas.pop('journal_mode', None)
+        _install_sqlite_limits(engine, timeout_ms, pragmas)
+    elif engine.dialect.name != 'postgresql':
+        logger.warning(f"⚠️ Timeout di reporting non applicato per {engine.dialect.name}")
+    logger.info(f"📈 Sessioni di reporting: {app.config.get('REPORTING_DATABASE_MODE', 'primary')} "
+                f"({engine.url.render_as_string(hide_password=True)}), timeout {timeout_ms} ms")
+
+
+# === SNAPSHOT SQLITE ===
+
+def aggiorna_snapshot(source_path: str, snapshot_path: str) -> float:
+    """
+    Copia coerente del database SQLite (backup API) sostituita atomicamente.
+
+    Returns:
+        float: Secondi impiegati
+    """
+    started = time.monotonic()
+    os.makedirs(os.path.dirname(os.path.abspath(snapshot_path)), exist_ok=True)
+    tmp_path = f"{snapshot_path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+    target = sqlite3.connect(tmp_path)
+    try:
+        source.backup(target)
+        # Copia autonoma: niente file -wal/-shm accanto allo snapshot
+        target.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        target.close()
+        source.close()
+    os.replace(tmp_path, snapshot_path)
+    return time.monotonic() - started
+
+
+def aggiorna_snapshot_reporting(app) -> bool:
+    """
+    Aggiorna lo snapshot di reporting dal database principale (solo modalità
+    'snapshot' con database SQLite).
+
+    Returns:
+        bool: True se lo snapshot è stato aggiornato
+    """
+    from extensions import db
+
+    if (app.config.get('REPORTING_DATABASE_MODE') or 'primary').lower() != 'snapshot':
+        return False
+    with app.app_context():
+        url = db.engine.url
+    if url.get_backend_name() != 'sqlite' or not url.database:
+        logger.warning("⚠️ Snapshot di reporting disponibile solo con database SQLite su file")
+        return False
+    secondi = aggiorna_snapshot(url.database, app.config['REPORTING_SNAPSHOT_PATH'])
+    logger.info(f"📸 Snapshot di reporting aggiornato in {secondi:.1f}s")
+    return True
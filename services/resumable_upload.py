@@ -0,0 +1,370 @@
+"""
+Upload a chunk riprendibili (protocollo tus 1.0: creation, checksum, termination, expiration).
+
+Il client crea l'upload dichiarando la dimensione totale, poi invia i chunk
+in ordine con PATCH e `Upload-Offset`. Ogni chunk:
+- è verificato con `Upload-Checksum` (sha256/sha1/md5, base64) se presente:
+  un chunk corrotto non viene scritto e il client lo reinvia;
+- è aggiunto al file parziale in RESUMABLE_UPLOAD_DIR (stesso filesystem
+  degli upload) e alimenta lo SHA-256 dell'intero file, mantenuto tra le
+  richieste e ricostruito dal file parziale se la richiesta arriva a un
+  altro worker.
+
+Se la connessione cade a metà di un chunk senza checksum, i byte ricevuti
+restano validi e `HEAD` restituisce l'offset da cui riprendere. A upload
+completo il file viene chiuso (hash, MIME, verifica dell'hash dichiarato) e
+i form di upload esistenti lo ricevono tramite `upload_id` al posto del
+file multipart (`resumable_file`), con la stessa elaborazione di oggi.
+"""
+
+import base64
+import binascii
+import fcntl
+import hashlib
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from flask import after_this_request, current_app, has_request_context
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import ClientDisconnected
+
+from extensions import db
+from models import ResumableUpload
+from services.ingest import SNIFF_BYTES, sniff_mime
+
+logger = logging.getLogger(__name__)
+
+TUS_VERSION = '1.0.0'
+TUS_EXTENSIONS = 'creation,checksum,termination,expiration'
+CHECKSUM_ALGORITHMS = ('sha256', 'sha1', 'md5')
+READ_SIZE = 256 * 1024
+# Upload completato: tempo per inviare il form che lo usa
+COMPLETED_TTL = timedelta(hours=1)
+_MAX_HASHERS = 128
+
+_hashers = OrderedDict()
+_hashers_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    """Errore del protocollo con lo status HTTP da restituire."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+# === CONFIGURAZIONE ===
+
+def upload_dir(app=None) -> str:
+    app = app or current_app
+    return app.config.get('RESUMABLE_UPLOAD_DIR') or os.path.join(app.config.get('UPLOAD_FOLDER', 'uploads'),
+                                                                  'resumable')
+
+
+def max_size(app=None) -> int:
+    app = app or current_app
+    return int(app.config.get('RESUMABLE_UPLOAD_MAX_MB', 2048)) * 1024 * 1024
+
+
+def _expiry(app=None) -> datetime:
+    app = app or current_app
+    return datetime.utcnow() + timedelta(hours=int(app.config.get('RESUMABLE_UPLOAD_EXPIRE_HOURS', 24)))
+
+
+def partial_path(upload: ResumableUpload, app=None) -> str:
+    return os.path.join(upload_dir(app), f"{upload.id}.part")
+
+
+# === HEADER TUS ===
+
+def parse_metadata(header: Optional[str]) -> dict:
+    """`Upload-Metadata`: coppie `chiave valore_base64` separate da virgola."""
+    metadata = {}
+    for coppia in (header or '').split(','):
+        parti = coppia.strip().split(' ')
+        if not parti[0]:
+            continue
+        try:
+            metadata[parti[0]] = base64.b64decode(parti[1]).decode('utf-8') if len(parti) > 1 else ''
+        except (binascii.Error, UnicodeDecodeError):
+            raise UploadError(400, f"Upload-Metadata non valido per '{parti[0]}'")
+    return metadata
+
+
+def parse_checksum(header: Optional[str]):
+    """`Upload-Checksum`: `<algoritmo> <digest_base64>`."""
+    if not header:
+        return None
+    try:
+        algoritmo, valore = header.strip().split(' ', 1)
+        digest = base64.b64decode(valore)
+    except (ValueError, binascii.Error):
+        raise UploadError(400, "Upload-Checksum non valido")
+    if algoritmo.lower() not in CHECKSUM_ALGORITHMS:
+        raise UploadError(400, f"Algoritmo di checksum non supportato: {algoritmo}")
+    return algoritmo.lower(), digest
+
+
+# === HASH INCREMENTALE ===
+
+def _hasher_at(upload: ResumableUpload, f):
+    """SHA-256 dei primi `upload.offset` byte: dalla cache o rileggendo il file parziale."""
+    with _hashers_lock:
+        cached = _hashers.get(upload.id)
+        if cached is not None and cached[0] == upload.offset:
+            _hashers.move_to_end(upload.id)
+            return cached[1].copy()
+    hasher = hashlib.sha256()
+    f.seek(0)
+    restanti = upload.offset
+    while restanti > 0:
+        data = f.read(min(READ_SIZE, restanti))
+        if not data:
+            raise UploadError(500, "File parziale più corto dell'offset registrato")
+        hasher.update(data)
+        restanti -= len(data)
+    return hasher
+
+
+def _remember_hasher(upload_id: str, offset: int, hasher):
+    with _hashers_lock:
+        _hashers[upload_id] = (offset, hasher)
+        _hashers.move_to_end(upload_id)
+        while len(_hashers) > _MAX_HASHERS:
+            _hashers.popitem(last=False)
+
+
+def _forget_hasher(upload_id: str):
+    with _hashers_lock:
+        _hashers.pop(upload_id, None)
+
+
+# === OPERAZIONI ===
+
+def crea_upload(user_id: int, length: int, metadata: dict) -> ResumableUpload:
+    """
+    Registra un nuovo upload e crea il file parziale vuoto.
+
+    Args:
+        user_id (int): Utente che carica il file.
+        length (int): Dimensione totale dichiarata (`Upload-Length`).
+        metadata (dict): `filename`, `filetype`, `sha256` (opzionali) da `Upload-Metadata`.
+
+    Returns:
+        ResumableUpload: Upload creato.
+    """
+    if length < 0:
+        raise UploadError(400, "Upload-Length non valido")
+    if length > max_size():
+        raise UploadError(413, f"File oltre il limite di {max_size() // (1024 * 1024)} MB")
+    in_corso = ResumableUpload.query.filter_by(user_id=user_id, stato='in_corso').count()
+    if in_corso >= int(current_app.config.get('RESUMABLE_UPLOAD_MAX_PENDING', 10)):
+        raise UploadError(429, "Troppi upload in corso: completali o annullali prima di iniziarne altri")
+
+    expected = (metadata.get('sha256') or '').lower() or None
+    if expected and (len(expected) != 64 or any(c not in '0123456789abcdef' for c in expected)):
+        raise UploadError(400, "sha256 dichiarato non valido")
+
+    upload = ResumableUpload(
+        id=uuid.uuid4().hex,
+        user_id=user_id,
+        filename=(metadata.get('filename') or 'upload')[:255],
+        content_type=(metadata.get('filetype') or None),
+        length=length,
+        offset=0,
+        expected_sha256=expected,
+        stato='in_corso',
+        expires_at=_expiry(),
+    )
+    os.makedirs(upload_dir(), exist_ok=True)
+    open(partial_path(upload), 'wb').close()
+    db.session.add(upload)
+    db.session.commit()
+    logger.info(f"⬆️ Upload riprendibile {upload.id} avviato: {upload.filename} ({length} byte)")
+    return upload
+
+
+def get_upload(upload_id: str, user_id: int) -> ResumableUpload:
+    """Upload dell'utente ancora disponibile (404 se assente, annullato o scaduto)."""
+    upload = db.session.get(ResumableUpload, upload_id)
+    if upload is None or upload.user_id != user_id:
+        raise UploadError(404, "Upload non trovato")
+    if upload.stato == 'annullato' or upload.expires_at < datetime.utcnow():
+        raise UploadError(410, "Upload scaduto o annullato")
+    return upload
+
+
+def scrivi_chunk(upload: ResumableUpload, stream, offset: int, checksum=None) -> int:
+    """
+    Aggiunge un chunk al file parziale (PATCH).
+
+    Args:
+        upload: Upload in corso.
+        stream: Corpo della richiesta.
+        offset (int): `Upload-Offset` dichiarato dal client.
+        checksum: (algoritmo, digest) da `Upload-Checksum`, o None.
+
+    Returns:
+        int: Nuovo offset.
+    """
+    if upload.stato != 'in_corso':
+        raise UploadError(409, "Upload già completato")
+
+    with open(partial_path(upload), 'r+b') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadError(423, "Chunk già in scrittura per questo upload")
+        try:
+            # Offset aggiornato da un'altra richiesta prima del lock
+            db.session.refresh(upload)
+            if offset != upload.offset:
+                raise UploadError(409, f"Upload-Offset {offset} diverso dall'offset del server {upload.offset}")
+
+            hasher = _hasher_at(upload, f)
+            verifica = hashlib.new(checksum[0]) if checksum else None
+            f.seek(offset)
+            f.truncate()
+            ricevuti = 0
+            interrotto = False
+            try:
+                while True:
+                    data = stream.read(READ_SIZE)
+                    if not data:
+                        break
+                    if offset + ricevuti + len(data) > upload.length:
+                        raise UploadError(413, "Chunk oltre la dimensione dichiarata")
+                    f.write(data)
+                    hasher.update(data)
+                    if verifica is not None:
+                        verifica.update(data)
+                    ricevuti += len(data)
+            except ClientDisconnected:
+                interrotto = True
+            except Exception:
+                f.truncate(offset)
+                raise
+
+            if verifica is not None and (interrotto or verifica.digest() != checksum[1]):
+                # Chunk incompleto o corrotto: scartato, il client lo reinvia dallo stesso offset
+                f.truncate(offset)
+                raise UploadError(460, "Checksum del chunk non corrispondente")
+
+            f.flush()
+            os.fsync(f.fileno())
+            upload.offset = offset + ricevuti
+            upload.updated_at = datetime.utcnow()
+            upload.expires_at = _expiry()
+            db.session.commit()
+            _remember_hasher(upload.id, upload.offset, hasher)
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+    if interrotto:
+        logger.info(f"⚠️ Upload {upload.id} interrotto a {upload.offset}/{upload.length} byte")
+    return upload.offset
+
+
+def completa_upload(upload: ResumableUpload) -> ResumableUpload:
+    """
+    Chiude un upload con tutti i byte ricevuti: hash finale, MIME e verifica
+    dell'hash dichiarato. Idempotente.
+    """
+    if upload.stato == 'completato':
+        return upload
+    if not upload.is_complete:
+        raise UploadError(409, f"Upload incompleto: {upload.offset}/{upload.length} byte")
+
+    path = partial_path(upload)
+    with open(path, 'rb') as f:
+        sha256 = _hasher_at(upload, f).hexdigest()
+        f.seek(0)
+        head = f.read(SNIFF_BYTES)
+    _forget_hasher(upload.id)
+
+    if upload.expected_sha256 and upload.expected_sha256 != sha256:
+        annulla_upload(upload)
+        raise UploadError(460, "SHA-256 del file diverso da quello dichiarato")
+
+    upload.sha256 = sha256
+    upload.mime = sniff_mime(head, upload.filename)
+    upload.stato = 'completato'
+    upload.expires_at = datetime.utcnow() + COMPLETED_TTL
+    db.session.commit()
+    logger.info(f"✅ Upload riprendibile {upload.id} completato: {upload.filename} ({upload.length} byte)")
+    return upload
+
+
+def annulla_upload(upload: ResumableUpload):
+    """Annulla l'upload ed elimina il file parziale (DELETE)."""
+    _forget_hasher(upload.id)
+    try:
+        os.remove(partial_path(upload))
+    except FileNotFoundError:
+        pass
+    upload.stato = 'annullato'
+    db.session.commit()
+
+
+def resumable_file(upload_id: Optional[str], user_id: Optional[int] = None) -> Optional[FileStorage]:
+    """
+    File di un upload completato come FileStorage, per i form di upload che
+    ricevono `upload_id` al posto del file multipart.
+
+    Args:
+        upload_id: Identificativo dell'upload (campo `upload_id` del form).
+        user_id: Proprietario (default utente corrente).
+
+    Returns:
+        FileStorage | None: None se l'upload non esiste, non è dell'utente o non è completo.
+    """
+    if not upload_id:
+        return None
+    if user_id is None:
+        from flask_login import current_user
+        user_id = current_user.id
+    upload = db.session.get(ResumableUpload, upload_id)
+    if upload is None or upload.user_id != user_id or upload.stato != 'completato':
+        return None
+    path = partial_path(upload)
+    if not os.path.exists(path):
+        return None
+
+    stream = open(path, 'rb')
+    if has_request_context():
+        @after_this_request
+        def _chiudi(response):
+            stream.close()
+            return response
+
+    return FileStorage(stream=stream, filename=upload.filename,
+                       content_type=upload.content_type or upload.mime, content_length=upload.length)
+
+
+def pulisci_upload_scaduti(app=None) -> int:
+    """
+    Elimina file parziali e righe degli upload scaduti o annullati.
+
+    Returns:
+        int: Upload eliminati
+    """
+    adesso = datetime.utcnow()
+    scaduti = ResumableUpload.query.filter(
+        (ResumableUpload.expires_at < adesso) | (ResumableUpload.stato == 'annullato')
+    ).all()
+    for upload in scaduti:
+        _forget_hasher(upload.id)
+        try:
+            os.remove(partial_path(upload, app))
+        except FileNotFoundError:
+            pass
+        db.session.delete(upload)
+    db.session.commit()
+    return len(scaduti)
@@ -0,0 +1,142 @@
+"""
+Backend delle sessioni Flask (SESSION_BACKEND).
+
+- 'cookie' (default): sessione firmata nel cookie (SecureCookieSessionInterface
+  di Flask). Nessun I/O lato server; il contenuto è piccolo (utente
+  Flask-Login, token CSRF, ultima attività, flash) e leggibile ma non
+  modificabile dal client.
+- 'redis': Flask-Session su Redis, TTL pari a PERMANENT_SESSION_LIFETIME
+  rinnovato a ogni richiesta; sessioni condivise tra host e revocabili.
+- 'filesystem': comportamento precedente (directory flask_session/).
+
+Migrazione: con 'cookie' o 'redis' una richiesta che presenta il cookie di una
+sessione filesystem ancora valida viene caricata da SESSION_LEGACY_DIR e
+salvata nel nuovo backend, quindi il cambio non disconnette gli utenti. I file
+scaduti sono rimossi da `pulisci_sessioni_filesystem` (job dello scheduler).
+"""
+
+import logging
+import os
+import time
+from typing import Optional
+
+from flask.sessions import SecureCookieSessionInterface, SessionInterface
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('cookie', 'redis', 'filesystem')
+LEGACY_KEY_PREFIX = 'session:'
+
+
+class LegacyFilesystemSessionInterface(SessionInterface):
+    """
+    Avvolge il backend attivo: se la sessione aperta è vuota e il cookie
+    corrisponde a una sessione filesystem, ne copia il contenuto (una volta).
+    """
+
+    def __init__(self, inner: SessionInterface, legacy_dir: str):
+        from cachelib.file import FileSystemCache
+
+        self.inner = inner
+        self.legacy = FileSystemCache(cache_dir=legacy_dir)
+
+    def _legacy_data(self, sid: str) -> Optional[dict]:
+        try:
+            data = self.legacy.get(LEGACY_KEY_PREFIX + sid)
+        except Exception as e:
+            logger.warning(f"⚠️ Sessione filesystem illeggibile: {e}")
+            return None
+        if data:
+            self.legacy.delete(LEGACY_KEY_PREFIX + sid)
+        return data or None
+
+    def open_session(self, app, request):
+        session = self.inner.open_session(app, request)
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if session is not None and not session and cookie:
+            data = self._legacy_data(cookie)
+            if data:
+                session.update(data)
+                session.modified = True
+        return session
+
+    def save_session(self, app, session, response):
+        return self.inner.save_session(app, session, response)
+
+    def make_null_session(self, app):
+        return self.inner.make_null_session(app)
+
+    def is_null_session(self, obj):
+        return self.inner.is_null_session(obj)
+
+
+def _redis_session_client(app):
+    import redis
+
+    # Flask-Session serializza in bytes: client dedicato senza decode_responses
+    return redis.Redis.from_url(app.config.get('SESSION_REDIS_URL') or app.config['REDIS_URL'],
+                                socket_connect_timeout=5, socket_timeout=5)
+
+
+def init_sessions(app):
+    """
+    Configura il backend delle sessioni da SESSION_BACKEND.
+
+    Args:
+        app: Istanza dell'applicazione Flask
+    """
+    backend = (app.config.get('SESSION_BACKEND') or 'cookie').lower()
+    if backend not in BACKENDS:
+        raise RuntimeError(f"SESSION_BACKEND non valido: {backend} (ammessi: {', '.join(BACKENDS)})")
+
+    if backend == 'filesystem':
+        from flask_session import Session
+
+        app.config['SESSION_TYPE'] = 'filesystem'
+        app.config.setdefault('SESSION_FILE_DIR', app.config.get('SESSION_LEGACY_DIR'))
+        Session(app)
+    elif backend == 'redis':
+        from flask_session import Session
+
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = _redis_session_client(app)
+        app.config.setdefault('SESSION_KEY_PREFIX', 'synthia:session:')
+        Session(app)
+    else:
+        app.session_interface = SecureCookieSessionInterface()
+
+    legacy_dir = app.config.get('SESSION_LEGACY_DIR')
+    if backend != 'filesystem' and legacy_dir and os.path.isdir(legacy_dir):
+        app.session_interface = LegacyFilesystemSessionInterface(app.session_interface, legacy_dir)
+        logger.info(f"🔑 Sessioni {backend} con migrazione da {legacy_dir}")
+    else:
+        logger.info(f"🔑 Sessioni {backend}")
+    return backend
+
+
+def pulisci_sessioni_filesystem(directory: str, max_age_sec: float) -> int:
+    """
+    Elimina i file di sessione filesystem non aggiornati da più di `max_age_sec`
+    (sessioni scadute: ogni richiesta riscrive il file).
+
+    Returns:
+        int: Numero di file eliminati
+    """
+    if not directory or not os.path.isdir(directory):
+        return 0
+    soglia = time.time() - max_age_sec
+    eliminati = 0
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            # __wz_cache_count è il contatore interno di cachelib
+            if not entry.is_file() or entry.name.startswith('__'):
+                continue
+            try:
+                if entry.stat().st_mtime < soglia:
+                    os.remove(entry.path)
+                    eliminati += 1
+            except FileNotFoundError:
+                continue
+    if eliminati:
+        logger.info(f"🧹 Sessioni filesystem scadute eliminate: {eliminati}")
+    return eliminati
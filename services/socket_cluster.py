@@ -0,0 +1,230 @@
+"""
+Socket.IO su più worker: message queue, presenza condivisa e coalescenza degli emit.
+
+Con più worker gunicorn ogni processo conosce solo i propri client. Per
+raggiungere tutti:
+- gli emit passano dalla message queue di python-socketio (Redis, o un broker
+  kombu come amqp://), che li inoltra a ogni worker;
+- la presenza (chi è connesso, con quale ruolo, su quale worker) è in un
+  registro condiviso: una chiave per connessione con TTL rinnovato dal
+  heartbeat del worker che la gestisce, così le connessioni di un worker
+  terminato spariscono da sole alla scadenza;
+- gli aggiornamenti KPI ad alta frequenza sono accorpati: per ogni tipo di KPI
+  viene emesso solo l'ultimo valore per finestra.
+
+Senza Redis raggiungibile si ricade su un registro in memoria (un solo worker).
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PRESENCE_TTL_SEC = 60
+PRESENCE_PREFIX = 'socketio:presence'
+
+
+def worker_id() -> str:
+    """Identificativo del processo worker (host:pid)."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def message_queue_url(app) -> Optional[str]:
+    """
+    URL della message queue da SOCKETIO_MESSAGE_QUEUE ('auto', 'off' o URL).
+
+    In modalità 'auto' usa REDIS_URL se Redis è raggiungibile, altrimenti
+    nessuna coda (emit limitati al processo corrente).
+
+    Returns:
+        str | None: URL per SocketIO(message_queue=...)
+    """
+    setting = (app.config.get('SOCKETIO_MESSAGE_QUEUE') or 'off').strip()
+    if setting.lower() in ('off', 'none', 'false'):
+        return None
+    if setting.lower() != 'auto':
+        return setting
+    client = _redis_client(app)
+    if client is None:
+        logger.warning("⚠️ Socket.IO senza message queue: Redis non raggiungibile, emit solo nel worker corrente")
+        return None
+    return app.config.get('REDIS_URL')
+
+
+def _redis_client(app):
+    """Client Redis reale, o None se non disponibile (il mock è locale al processo)."""
+    try:
+        from infra.redis_client import get_redis_client, MockRedisClient
+
+        with app.app_context():
+            client = get_redis_client()
+        if not isinstance(client, MockRedisClient):
+            return client
+    except Exception as e:
+        logger.warning(f"⚠️ Redis non disponibile per Socket.IO: {e}")
+    return None
+
+
+# === REGISTRO PRESENZA ===
+
+class RedisPresence:
+    """
+    Presenza su Redis: hash sid -> dati connessione e sorted set sid -> scadenza.
+
+    Il sorted set permette di eliminare le connessioni scadute (worker
+    terminati senza disconnect) a ogni lettura.
+    """
+
+    backend = 'redis'
+
+    def __init__(self, client, ttl_sec=DEFAULT_PRESENCE_TTL_SEC, prefix=PRESENCE_PREFIX):
+        self.client = client
+        self.ttl_sec = ttl_sec
+        self.info_key = f"{prefix}:info"
+        self.expiry_key = f"{prefix}:expiry"
+
+    def register(self, sid: str, info: dict):
+        pipe = self.client.pipeline()
+        pipe.hset(self.info_key, sid, json.dumps(info, default=str))
+        pipe.zadd(self.expiry_key, {sid: time.time() + self.ttl_sec})
+        pipe.execute()
+
+    def heartbeat(self, sids):
+        if sids:
+            scadenza = time.time() + self.ttl_sec
+            self.client.zadd(self.expiry_key, {sid: scadenza for sid in sids}, xx=True)
+
+    def unregister(self, sid: str):
+        pipe = self.client.pipeline()
+        pipe.hdel(self.info_key, sid)
+        pipe.zrem(self.expiry_key, sid)
+        pipe.execute()
+
+    def _purge(self):
+        scaduti = self.client.zrangebyscore(self.expiry_key, '-inf', time.time())
+        if scaduti:
+            pipe = self.client.pipeline()
+            pipe.zrem(self.expiry_key, *scaduti)
+            pipe.hdel(self.info_key, *scaduti)
+            pipe.execute()
+
+    def get(self, sid: str) -> Optional[dict]:
+        valore = self.client.hget(self.info_key, sid)
+        return json.loads(valore) if valore else None
+
+    def connections(self) -> List[dict]:
+        self._purge()
+        return [json.loads(valore) for valore in self.client.hvals(self.info_key)]
+
+
+class LocalPresence:
+    """Presenza in memoria del processo (un solo worker o test)."""
+
+    backend = 'local'
+
+    def __init__(self, ttl_sec=DEFAULT_PRESENCE_TTL_SEC):
+        self.ttl_sec = ttl_sec
+        self._entries: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def register(self, sid: str, info: dict):
+        with self._lock:
+            self._entries[sid] = (info, time.time() + self.ttl_sec)
+
+    def heartbeat(self, sids):
+        scadenza = time.time() + self.ttl_sec
+        with self._lock:
+            for sid in sids:
+                if sid in self._entries:
+                    self._entries[sid] = (self._entries[sid][0], scadenza)
+
+    def unregister(self, sid: str):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def get(self, sid: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(sid)
+        return entry[0] if entry else None
+
+    def connections(self) -> List[dict]:
+        now = time.time()
+        with self._lock:
+            for sid in [sid for sid, (_, scadenza) in self._entries.items() if scadenza <= now]:
+                del self._entries[sid]
+            return [info for info, _ in self._entries.values()]
+
+
+def create_presence(app, shared: bool):
+    """
+    Registro presenza: Redis se la message queue è attiva e Redis raggiungibile.
+
+    Args:
+        app: Istanza dell'applicazione Flask
+        shared (bool): True se i worker condividono gli emit (message queue attiva)
+    """
+    ttl_sec = int(app.config.get('SOCKETIO_PRESENCE_TTL_SEC', DEFAULT_PRESENCE_TTL_SEC))
+    if shared:
+        client = _redis_client(app)
+        if client is not None:
+            return RedisPresence(client, ttl_sec=ttl_sec)
+        logger.warning("⚠️ Presenza Socket.IO in memoria: i conteggi riguardano solo il worker corrente")
+    return LocalPresence(ttl_sec=ttl_sec)
+
+
+def presence_summary(connections: List[dict]) -> dict:
+    """Conteggi per utente, ruolo e worker dalle connessioni attive."""
+    utenti = {}
+    for info in connections:
+        utenti.setdefault(info.get('user_id'), info.get('role') or 'unknown')
+    role_counts = {}
+    for role in utenti.values():
+        role_counts[role] = role_counts.get(role, 0) + 1
+    return {
+        'total_connected': len(utenti),
+        'connections': len(connections),
+        'role_counts': role_counts,
+        'workers': len({info.get('worker') for info in connections}),
+    }
+
+
+# === COALESCENZA EMIT ===
+
+class EmitCoalescer:
+    """
+    Accorpa emit frequenti: per ogni chiave resta solo l'ultimo payload della
+    finestra, emesso al flush successivo (eseguito dal thread di background).
+    """
+
+    def __init__(self, emit: Callable[[dict], None], interval_sec: float):
+        self.emit = emit
+        self.interval_sec = interval_sec
+        self._pending: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def submit(self, key: str, payload: dict):
+        with self._lock:
+            if key in self._pending:
+                self.coalesced += 1
+            self._pending[key] = payload
+
+    def flush(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for payload in pending.values():
+            try:
+                self.emit(payload)
+            except Exception as e:
+                logger.error(f"❌ Errore emissione accorpata: {e}")
+        return len(pending)
+
+    def run_forever(self, sleep: Callable[[float], None] = time.sleep):
+        while True:
+            sleep(self.interval_sec)
+            self.flush()
@@ -0,0 +1,647 @@
+"""
+Scanner dello storage e manifest di presenza dei file (tabella storage_manifest).
+
+Le route non interrogano più il filesystem riga per riga: leggono il manifest
+con `presence_map` / `file_available`. Il manifest è mantenuto in background:
+
+- `sweep()` percorre le root configurate (STORAGE_SCAN_ROOTS, default
+  UPLOAD_FOLDER), registra file nuovi o modificati (dimensione, mtime, hash) e
+  marca come mancanti quelli spariti; verifica anche i file referenziati dal
+  database fuori dalle root (firme, attestati, versioni);
+- `StorageWatcher` aggiorna il manifest in modo incrementale con inotify
+  (Linux, via ctypes) tra una sweep e l'altra. Su storage di rete inotify non
+  vede le modifiche fatte da altri host: restano le sweep periodiche.
+
+`missing_files()` e `orphaned_files()` elencano i file referenziati ma assenti
+e i file presenti ma non referenziati da nessun record.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import hashlib
+import logging
+import os
+import re
+import select
+import stat as stat_module
+import struct
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from flask import current_app
+
+from extensions import db
+from models import (
+    Document, DocumentVersion, FileBlob, PartecipazioneFormazione, StorageManifestEntry
+)
+from services.ingest import get_chunk_size
+
+logger = logging.getLogger(__name__)
+
+# 'resumable': file .part degli upload a chunk, che crescono a ogni PATCH
+DEFAULT_EXCLUDE = ('preview_cache', 'tmp', 'previews', 'converted', 'thumbnails', 'resumable')
+DEFAULT_BATCH_SIZE = 500
+QUERY_CHUNK = 500
+WATCH_DEBOUNCE_SEC = 2.0
+
+_SHA256_NAME = re.compile(r'^[0-9a-f]{64}$')
+
+
+# === Configurazione ===
+
+def scan_roots(app=None) -> List[str]:
+    """Directory scansionate: STORAGE_SCAN_ROOTS (separate da virgola) o UPLOAD_FOLDER."""
+    app = app or current_app
+    value = app.config.get('STORAGE_SCAN_ROOTS') or app.config.get('UPLOAD_FOLDER', 'uploads')
+    return [os.path.abspath(root.strip()) for root in value.split(',') if root.strip()]
+
+
+def excluded_dirs(app=None) -> Set[str]:
+    """Nomi di directory ignorate dalla scansione (cache, file temporanei e upload a chunk in corso)."""
+    app = app or current_app
+    value = app.config.get('STORAGE_SCAN_EXCLUDE')
+    names = DEFAULT_EXCLUDE if value is None else value.split(',')
+    exclude = {name.strip() for name in names if name.strip()}
+    # La directory di staging degli upload resumable non è mai indicizzata, anche se rinominata
+    resumable_dir = app.config.get('RESUMABLE_UPLOAD_DIR')
+    if resumable_dir:
+        exclude.add(os.path.basename(os.path.normpath(resumable_dir)))
+    return exclude
+
+
+def _root_for(path: str, roots: List[str]) -> Optional[str]:
+    for root in roots:
+        if path.startswith(root + os.sep):
+            return root
+    return None
+
+
+# === Scansione ===
+
+def _walk(root: str, exclude: Set[str]) -> Iterator[Tuple[str, os.stat_result]]:
+    """File regolari sotto `root` con il loro stat, saltando le directory escluse."""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name not in exclude:
+                                stack.append(entry.path)
+                        elif entry.is_file():
+                            yield entry.path, entry.stat()
+                    except OSError:
+                        continue
+        except OSError as e:
+            logger.warning(f"Directory non leggibile durante la scansione: {directory} ({e})")
+
+
+def _content_hash(path: str) -> Optional[str]:
+    # I blob sono indirizzati per hash e immutabili: il nome è già lo SHA-256
+    name = os.path.basename(path)
+    if _SHA256_NAME.match(name):
+        return name
+    sha256 = hashlib.sha256()
+    chunk_size = get_chunk_size()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                sha256.update(chunk)
+    except OSError:
+        return None
+    return sha256.hexdigest()
+
+
+def _record(entries: Dict[str, StorageManifestEntry], path: str, root: Optional[str],
+            stat: Optional[os.stat_result], now: datetime, hash_files: bool, stats: dict):
+    """Aggiorna (o crea) la voce del manifest per un file dato il suo stat (None = assente)."""
+    entry = entries.get(path)
+    if stat is None:
+        if entry is None:
+            entry = entries[path] = StorageManifestEntry(path=path, root=root, present=False,
+                                                         first_seen_at=now, missing_since=now)
+            db.session.add(entry)
+            stats['mancanti'] += 1
+        elif entry.present:
+            entry.present = False
+            entry.missing_since = now
+            stats['mancanti'] += 1
+        entry.checked_at = now
+        return
+
+    if entry is None:
+        entry = entries[path] = StorageManifestEntry(path=path, root=root, first_seen_at=now)
+        db.session.add(entry)
+        stats['nuovi'] += 1
+        changed = True
+    else:
+        changed = entry.size != stat.st_size or entry.mtime != stat.st_mtime
+        if not entry.present:
+            stats['ripristinati'] += 1
+        elif changed:
+            stats['modificati'] += 1
+        else:
+            stats['invariati'] += 1
+
+    entry.root = root
+    entry.present = True
+    entry.missing_since = None
+    entry.checked_at = now
+    if changed or entry.sha256 is None:
+        entry.size = stat.st_size
+        entry.mtime = stat.st_mtime
+        entry.sha256 = _content_hash(path) if hash_files else None
+
+
+def _new_stats() -> dict:
+    return {'file': 0, 'nuovi': 0, 'modificati': 0, 'invariati': 0, 'ripristinati': 0, 'mancanti': 0}
+
+
+def _load_entries(paths: Iterable[str]) -> Dict[str, StorageManifestEntry]:
+    paths = list(paths)
+    entries = {}
+    for i in range(0, len(paths), QUERY_CHUNK):
+        chunk = paths[i:i + QUERY_CHUNK]
+        for entry in StorageManifestEntry.query.filter(StorageManifestEntry.path.in_(chunk)):
+            entries[entry.path] = entry
+    return entries
+
+
+def refresh_paths(paths: Iterable[str], hash_files: Optional[bool] = None) -> dict:
+    """
+    Aggiorna il manifest per un insieme di percorsi (eventi inotify, file referenziati).
+
+    Returns:
+        dict: Statistiche (file, nuovi, modificati, invariati, ripristinati, mancanti).
+    """
+    hash_files = current_app.config.get('STORAGE_SCAN_HASH', True) if hash_files is None else hash_files
+    roots = scan_roots()
+    paths = sorted({os.path.abspath(p) for p in paths if p})
+    stats = _new_stats()
+    now = datetime.utcnow()
+
+    for i in range(0, len(paths), DEFAULT_BATCH_SIZE):
+        batch = paths[i:i + DEFAULT_BATCH_SIZE]
+        entries = _load_entries(batch)
+        for path in batch:
+            try:
+                stat = os.stat(path)
+                if not stat_module.S_ISREG(stat.st_mode):
+                    continue
+            except OSError:
+                stat = None
+            stats['file'] += 1
+            _record(entries, path, _root_for(path, roots), stat, now, hash_files, stats)
+        db.session.commit()
+    return stats
+
+
+def mark_missing_under(directory: str) -> int:
+    """Marca come mancanti tutti i file del manifest sotto una directory rimossa o spostata."""
+    prefix = os.path.abspath(directory).rstrip(os.sep) + os.sep
+    now = datetime.utcnow()
+    count = StorageManifestEntry.query.filter(
+        StorageManifestEntry.path.startswith(prefix, autoescape=True),
+        StorageManifestEntry.present.is_(True)
+    ).update({'present': False, 'missing_since': now, 'checked_at': now}, synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+def sweep(roots: Optional[List[str]] = None, hash_files: Optional[bool] = None,
+          batch_size: int = DEFAULT_BATCH_SIZE, include_referenced: bool = True) -> dict:
+    """
+    Scansione completa delle root: allinea il manifest allo stato del filesystem.
+
+    Args:
+        roots: Directory da scansionare (default STORAGE_SCAN_ROOTS)
+        hash_files: Calcola l'hash dei file nuovi o modificati (default STORAGE_SCAN_HASH)
+        batch_size: Voci aggiornate per commit
+        include_referenced: Verifica anche i file referenziati dal DB fuori dalle root
+
+    Returns:
+        dict: Statistiche della scansione.
+    """
+    hash_files = current_app.config.get('STORAGE_SCAN_HASH', True) if hash_files is None else hash_files
+    roots = [os.path.abspath(r) for r in roots] if roots else scan_roots()
+    exclude = excluded_dirs()
+    stats = _new_stats()
+    started = time.monotonic()
+    now = datetime.utcnow()
+
+    for root in roots:
+        entries = {entry.path: entry for entry in StorageManifestEntry.query.filter_by(root=root)}
+        seen = set()
+        pending = 0
+        for path, stat in _walk(root, exclude):
+            seen.add(path)
+            stats['file'] += 1
+            _record(entries, path, root, stat, now, hash_files, stats)
+            pending += 1
+            if pending >= batch_size:
+                db.session.commit()
+                pending = 0
+
+        for path, entry in entries.items():
+            if path not in seen and entry.present:
+                _record(entries, path, root, None, now, hash_files, stats)
+        db.session.commit()
+
+    if include_referenced:
+        outside = [p for p in referenced_paths() if _root_for(p, roots) is None]
+        extra = refresh_paths(outside, hash_files=hash_files)
+        for key, value in extra.items():
+            stats[key] += value
+
+    stats['durata_sec'] = round(time.monotonic() - started, 2)
+    logger.info(
+        f"🗂️ Scansione storage: {stats['file']} file, {stats['nuovi']} nuovi, {stats['modificati']} modificati, "
+        f"{stats['mancanti']} mancanti in {stats['durata_sec']}s"
+    )
+    return stats
+
+
+# === Interrogazione ===
+
+def _referenced(include_blobs: bool = False) -> Dict[str, List[Tuple[str, int]]]:
+    """
+    Percorsi referenziati dal database: percorso -> [(tipo, id)].
+
+    Args:
+        include_blobs: Include tutti i blob registrati, anche senza riferimenti
+            (in attesa della garbage collection).
+    """
+    from services.blob_store import get_blob_store
+
+    store = get_blob_store()
+    refs: Dict[str, List[Tuple[str, int]]] = {}
+
+    def _add(path, tipo, ref_id):
+        if path:
+            refs.setdefault(os.path.abspath(path), []).append((tipo, ref_id))
+
+    for p in PartecipazioneFormazione.query.filter(
+            (PartecipazioneFormazione.firma_presenza_path.isnot(None)) |
+            (PartecipazioneFormazione.attestato_path.isnot(None))):
+        _add(p.firma_presenza_path, 'firma_presenza', p.id)
+        _add(p.attestato_path, 'attestato', p.id)
+
+    for doc_id, sha256 in db.session.query(Document.id, Document.blob_sha256).filter(Document.blob_sha256.isnot(None)):
+        _add(store.path_for(sha256), 'documento', doc_id)
+
+    for version_id, sha256, file_path in db.session.query(
+            DocumentVersion.id, DocumentVersion.blob_sha256, DocumentVersion.file_path):
+        if sha256:
+            _add(store.path_for(sha256), 'versione', version_id)
+        elif file_path:
+            _add(file_path, 'versione', version_id)
+
+    if include_blobs:
+        for (sha256,) in db.session.query(FileBlob.sha256):
+            refs.setdefault(store.path_for(sha256), [])
+
+    return refs
+
+
+def referenced_paths() -> List[str]:
+    """Percorsi assoluti dei file referenziati dal database (senza accessi al filesystem)."""
+    return list(_referenced())
+
+
+def presence_map(paths: Iterable[Optional[str]], fallback: bool = True) -> Dict[Optional[str], bool]:
+    """
+    Presenza di più file letta dal manifest con poche query.
+
+    Args:
+        paths: Percorsi da verificare (None = file non impostato, sempre assente)
+        fallback: Per i percorsi mai visti dallo scanner verifica il filesystem
+
+    Returns:
+        dict: percorso originale -> True se presente.
+    """
+    paths = list(paths)
+    absolute = {p: os.path.abspath(p) for p in paths if p}
+    entries = _load_entries(set(absolute.values()))
+    result = {}
+    for path in paths:
+        if not path:
+            result[path] = False
+            continue
+        entry = entries.get(absolute[path])
+        if entry is not None:
+            result[path] = entry.present
+        else:
+            result[path] = os.path.isfile(path) if fallback else False
+    return result
+
+
+def file_available(path: Optional[str], verify_missing: bool = True) -> bool:
+    """
+    True se il file è disponibile secondo il manifest.
+
+    Args:
+        path: Percorso del file
+        verify_missing: Se il manifest lo dà per mancante, conferma sul filesystem
+            (file ripristinato dopo l'ultima scansione).
+    """
+    if not path:
+        return False
+    present = presence_map([path])[path]
+    if not present and verify_missing:
+        return os.path.isfile(path)
+    return present
+
+
+def missing_files(limit: Optional[int] = None) -> List[dict]:
+    """
+    File referenziati dal database ma mancanti sullo storage.
+
+    I documenti non ancora migrati nel blob store sono mancanti se nessuno dei
+    loro percorsi legacy risulta presente.
+
+    Returns:
+        list: Dizionari con path, riferimenti [(tipo, id)], missing_since e mai_visto.
+    """
+    from services.blob_store import legacy_candidates
+
+    refs = _referenced()
+    entries = _load_entries(refs)
+    missing = []
+    for path in sorted(refs):
+        entry = entries.get(path)
+        if entry is not None and entry.present:
+            continue
+        missing.append({
+            'path': path,
+            'riferimenti': refs[path],
+            'missing_since': entry.missing_since if entry is not None else None,
+            'mai_visto': entry is None
+        })
+        if limit and len(missing) >= limit:
+            return missing
+
+    for doc in Document.query.filter(Document.blob_sha256.is_(None)):
+        candidates = [os.path.abspath(p) for p in legacy_candidates(doc)]
+        found = _load_entries(candidates)
+        if any(entry.present for entry in found.values()):
+            continue
+        missing.append({
+            'path': candidates[0] if candidates else None,
+            'riferimenti': [('documento', doc.id)],
+            'missing_since': None,
+            'mai_visto': not found
+        })
+        if limit and len(missing) >= limit:
+            break
+    return missing
+
+
+def orphaned_files(limit: Optional[int] = None) -> List[dict]:
+    """
+    File presenti nelle root scansionate ma non referenziati da nessun record.
+
+    Per i documenti non ancora migrati nel blob store sono considerati
+    referenziati tutti i percorsi legacy possibili.
+    """
+    from services.blob_store import legacy_candidates
+
+    referenced = set(_referenced(include_blobs=True))
+    for doc in Document.query.filter(Document.blob_sha256.is_(None)):
+        referenced.update(os.path.abspath(p) for p in legacy_candidates(doc))
+
+    orphans = []
+    query = StorageManifestEntry.query.filter(
+        StorageManifestEntry.root.isnot(None),
+        StorageManifestEntry.present.is_(True)
+    ).order_by(StorageManifestEntry.path)
+    for entry in query.yield_per(QUERY_CHUNK):
+        if entry.path in referenced:
+            continue
+        orphans.append({'path': entry.path, 'size': entry.size, 'mtime': entry.mtime, 'sha256': entry.sha256})
+        if limit and len(orphans) >= limit:
+            break
+    return orphans
+
+
+def manifest_stats() -> dict:
+    """Totali del manifest: file presenti, mancanti, byte e ultima verifica."""
+    presenti, byte_totali = db.session.query(
+        db.func.count(StorageManifestEntry.path), db.func.coalesce(db.func.sum(StorageManifestEntry.size), 0)
+    ).filter(StorageManifestEntry.present.is_(True)).one()
+    mancanti = StorageManifestEntry.query.filter(StorageManifestEntry.present.is_(False)).count()
+    ultima = db.session.query(db.func.max(StorageManifestEntry.checked_at)).scalar()
+    return {'presenti': presenti, 'mancanti': mancanti, 'bytes': int(byte_totali), 'ultimo_controllo': ultima}
+
+
+# === Aggiornamento incrementale (inotify) ===
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_ATTRIB | IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_DELETE_SELF | IN_MOVE_SELF)
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def _libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class StorageWatcher:
+    """
+    Aggiorna il manifest con gli eventi inotify delle root scansionate.
+
+    Gli eventi sono accumulati e applicati a blocchi ogni WATCH_DEBOUNCE_SEC
+    secondi in un app context; in caso di overflow della coda kernel o di
+    limite di watch raggiunto viene richiesta una sweep completa.
+    """
+
+    def __init__(self, app, roots: Optional[List[str]] = None, debounce: float = WATCH_DEBOUNCE_SEC):
+        self.app = app
+        with app.app_context():
+            self.roots = roots or scan_roots(app)
+            self.exclude = excluded_dirs(app)
+        self.debounce = debounce
+        self._libc = _libc()
+        self._fd = None
+        self._watches: Dict[int, str] = {}
+        self._pending_files: Set[str] = set()
+        self._pending_dirs: Set[str] = set()
+        self._full_sweep = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def available() -> bool:
+        """True se inotify è utilizzabile su questo sistema."""
+        return _libc() is not None
+
+    def _add_watch(self, directory: str) -> bool:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK | IN_ONLYDIR)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                logger.warning("⚠️ Limite inotify max_user_watches raggiunto: restano le scansioni periodiche")
+                self._full_sweep = True
+            return False
+        self._watches[wd] = directory
+        return True
+
+    def _add_tree(self, directory: str):
+        for dirpath, dirnames, _ in os.walk(directory):
+            dirnames[:] = [d for d in dirnames if d not in self.exclude]
+            if not self._add_watch(dirpath):
+                dirnames[:] = []
+
+    def start(self) -> 'StorageWatcher':
+        """Registra i watch sulle root e avvia il thread di lettura eventi."""
+        if self._libc is None:
+            raise OSError("inotify non disponibile")
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 fallita")
+        for root in self.roots:
+            if os.path.isdir(root):
+                self._add_tree(root)
+        self._thread = threading.Thread(target=self._run, name='storage-watcher', daemon=True)
+        self._thread.start()
+        logger.info(f"👁️ Watcher storage attivo su {len(self._watches)} directory")
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _handle(self, wd: int, mask: int, name: str):
+        if mask & IN_Q_OVERFLOW:
+            self._full_sweep = True
+            return
+        directory = self._watches.get(wd)
+        if directory is None:
+            return
+        if mask & IN_IGNORED:
+            self._watches.pop(wd, None)
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            self._pending_dirs.add(directory)
+            return
+        if not name:
+            return
+        path = os.path.join(directory, name)
+        if mask & IN_ISDIR:
+            if name in self.exclude:
+                return
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                # Directory nuova o spostata qui: watch e registrazione dei file già presenti
+                self._add_tree(path)
+                self._pending_files.update(p for p, _ in _walk(path, self.exclude))
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self._pending_dirs.add(path)
+            return
+        self._pending_files.add(path)
+
+    def _read_events(self, data: bytes):
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode('utf-8', 'surrogateescape')
+            offset += length
+            self._handle(wd, mask, name)
+
+    def flush(self):
+        """Applica al manifest gli eventi accumulati."""
+        files, dirs, full = self._pending_files, self._pending_dirs, self._full_sweep
+        self._pending_files, self._pending_dirs, self._full_sweep = set(), set(), False
+        if not (files or dirs or full):
+            return
+        with self.app.app_context():
+            try:
+                if full:
+                    sweep(self.roots, include_referenced=False)
+                    return
+                for directory in dirs:
+                    mark_missing_under(directory)
+                if files:
+                    refresh_paths(files)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"❌ Errore aggiornamento manifest da inotify: {e}")
+
+    def _run(self):
+        last_event = None
+        while not self._stop.is_set():
+            try:
+                ready, _, _ = select.select([self._fd], [], [], 0.5)
+            except (OSError, ValueError):
+                break
+            if ready:
+                try:
+                    self._read_events(os.read(self._fd, 64 * 1024))
+                    last_event = last_event or time.monotonic()
+                except BlockingIOError:
+                    pass
+            if last_event and time.monotonic() - last_event >= self.debounce:
+                self.flush()
+                last_event = None
+        self.flush()
+
+
+_watcher: Optional[StorageWatcher] = None
+_watcher_lock = threading.Lock()
+
+
+def start_storage_watcher(app) -> Optional[StorageWatcher]:
+    """Avvia (una volta per processo) il watcher inotify se abilitato e disponibile."""
+    global _watcher
+    if not app.config.get('STORAGE_WATCH_ENABLED', True) or not StorageWatcher.available():
+        return None
+    with _watcher_lock:
+        if _watcher is None:
+            try:
+                _watcher = StorageWatcher(app).start()
+            except OSError as e:
+                logger.warning(f"⚠️ Watcher inotify non avviato ({e}): solo scansioni periodiche")
+                return None
+        return _watcher
+
+
+def stop_storage_watcher():
+    """Ferma il watcher inotify del processo, se attivo."""
+    global _watcher
+    with _watcher_lock:
+        if _watcher is not None:
+            _watcher.stop()
+            _watcher = None
@@ -0,0 +1,265 @@
+"""
+Indice materializzato della visibilità documenti per utente.
+
+La tabella `document_visibility` contiene una riga (user_id, document_id,
+reason, expires_at) per ogni motivo per cui un utente vede un documento:
+proprietario, condivisione temporanea (DocumentShare), autorizzazione
+esplicita (AuthorizedAccess), appartenenza all'azienda o al reparto.
+
+L'indice è aggiornato nella stessa transazione delle modifiche, tramite
+eventi di sessione SQLAlchemy: i controlli di accesso e i filtri di listing
+diventano un singolo lookup indicizzato invece di query ad hoc.
+"""
+
+import logging
+from datetime import datetime
+from typing import Iterable, Optional
+
+from flask import current_app, has_app_context
+from sqlalchemy import DateTime, String, cast, delete, event, func, insert, inspect, literal, null, or_, select, union_all
+
+from extensions import db
+from models import (
+    AuthorizedAccess, Company, Department, Document, DocumentShare, DocumentVisibility, User,
+    user_companies, user_departments
+)
+
+logger = logging.getLogger(__name__)
+
+# Ordine di priorità dei motivi (il primo trovato viene restituito)
+REASONS = ('proprietario', 'autorizzato', 'condivisione', 'reparto', 'azienda')
+CHUNK_SIZE = 500
+
+_listeners_registered = False
+
+
+def is_enabled() -> bool:
+    """Verifica se l'indice di visibilità è abilitato (VISIBILITY_INDEX_ENABLED)."""
+    if not has_app_context():
+        return False
+    return current_app.config.get('VISIBILITY_INDEX_ENABLED', True)
+
+
+# === COSTRUZIONE INDICE ===
+
+def _source_select(user_ids=None, document_ids=None):
+    """
+    SELECT che produce le righe di visibilità, opzionalmente ristretta a utenti o documenti.
+    """
+    d = Document.__table__
+    s = DocumentShare.__table__
+    a = AuthorizedAccess.__table__
+    no_expiry = cast(null(), DateTime)
+
+    owner = select(d.c.user_id, d.c.id, cast(literal('proprietario'), String), no_expiry) \
+        .where(d.c.user_id.isnot(None))
+    shares = select(s.c.user_id, s.c.file_id, cast(literal('condivisione'), String), func.max(s.c.expires_at)) \
+        .where(s.c.expires_at > datetime.utcnow()) \
+        .group_by(s.c.user_id, s.c.file_id)
+    authorized = select(a.c.user_id, a.c.document_id, cast(literal('autorizzato'), String), no_expiry)
+    company = select(user_companies.c.user_id, d.c.id, cast(literal('azienda'), String), no_expiry) \
+        .select_from(user_companies.join(d, d.c.company_id == user_companies.c.company_id))
+    department = select(user_departments.c.user_id, d.c.id, cast(literal('reparto'), String), no_expiry) \
+        .select_from(user_departments.join(d, d.c.department_id == user_departments.c.department_id))
+
+    if user_ids is not None:
+        owner = owner.where(d.c.user_id.in_(user_ids))
+        shares = shares.where(s.c.user_id.in_(user_ids))
+        authorized = authorized.where(a.c.user_id.in_(user_ids))
+        company = company.where(user_companies.c.user_id.in_(user_ids))
+        department = department.where(user_departments.c.user_id.in_(user_ids))
+    if document_ids is not None:
+        owner = owner.where(d.c.id.in_(document_ids))
+        shares = shares.where(s.c.file_id.in_(document_ids))
+        authorized = authorized.where(a.c.document_id.in_(document_ids))
+        company = company.where(d.c.id.in_(document_ids))
+        department = department.where(d.c.id.in_(document_ids))
+
+    return union_all(owner, shares, authorized, company, department)
+
+
+def _chunks(ids: Iterable[int]):
+    ids = sorted({i for i in ids if i is not None})
+    for i in range(0, len(ids), CHUNK_SIZE):
+        yield ids[i:i + CHUNK_SIZE]
+
+
+def refresh(connection, user_ids: Iterable[int] = (), document_ids: Iterable[int] = ()):
+    """
+    Ricalcola le righe dell'indice per gli utenti e i documenti indicati.
+
+    Args:
+        connection: Connessione SQLAlchemy (nella transazione corrente).
+        user_ids (Iterable[int]): Utenti da ricalcolare.
+        document_ids (Iterable[int]): Documenti da ricalcolare.
+    """
+    table = DocumentVisibility.__table__
+    columns = [table.c.user_id, table.c.document_id, table.c.reason, table.c.expires_at]
+
+    for chunk in _chunks(user_ids):
+        connection.execute(delete(table).where(table.c.user_id.in_(chunk)))
+        connection.execute(insert(table).from_select(columns, _source_select(user_ids=chunk)))
+    for chunk in _chunks(document_ids):
+        connection.execute(delete(table).where(table.c.document_id.in_(chunk)))
+        connection.execute(insert(table).from_select(columns, _source_select(document_ids=chunk)))
+
+
+def rebuild_all() -> int:
+    """
+    Ricostruisce completamente l'indice di visibilità.
+
+    Returns:
+        int: Numero di righe presenti nell'indice.
+    """
+    table = DocumentVisibility.__table__
+    columns = [table.c.user_id, table.c.document_id, table.c.reason, table.c.expires_at]
+    connection = db.session.connection()
+    connection.execute(delete(table))
+    connection.execute(insert(table).from_select(columns, _source_select()))
+    db.session.commit()
+    count = db.session.query(func.count()).select_from(table).scalar()
+    logger.info(f"✅ Indice visibilità ricostruito: {count} righe")
+    return count
+
+
+# === LOOKUP ===
+
+def _active_filter(now=None):
+    now = now or datetime.utcnow()
+    return or_(DocumentVisibility.expires_at.is_(None), DocumentVisibility.expires_at > now)
+
+
+def get_access_reason(user_id: int, document_id: int, reasons: Optional[Iterable[str]] = None) -> Optional[str]:
+    """
+    Restituisce il motivo principale per cui l'utente vede il documento.
+
+    Args:
+        user_id (int): ID utente.
+        document_id (int): ID documento.
+        reasons (Iterable[str], optional): Motivi da considerare (default tutti).
+
+    Returns:
+        str: Motivo ('proprietario', 'autorizzato', ...) o None se non visibile.
+    """
+    query = db.session.query(DocumentVisibility.reason).filter(
+        DocumentVisibility.user_id == user_id,
+        DocumentVisibility.document_id == document_id,
+        _active_filter()
+    )
+    if reasons is not None:
+        query = query.filter(DocumentVisibility.reason.in_(list(reasons)))
+    found = {row.reason for row in query.all()}
+    for reason in REASONS:
+        if reason in found:
+            return reason
+    return None
+
+
+def visible_document_ids(user_id: int, reasons: Optional[Iterable[str]] = None):
+    """
+    Subquery degli ID documento visibili all'utente, da usare in `Document.id.in_(...)`.
+
+    Args:
+        user_id (int): ID utente.
+        reasons (Iterable[str], optional): Motivi da considerare (default tutti).
+
+    Returns:
+        Select: Subquery SQLAlchemy.
+    """
+    query = select(DocumentVisibility.document_id).where(
+        DocumentVisibility.user_id == user_id,
+        _active_filter()
+    )
+    if reasons is not None:
+        query = query.where(DocumentVisibility.reason.in_(list(reasons)))
+    return query
+
+
+# === MANUTENZIONE INCREMENTALE ===
+
+def _history(obj, attr):
+    return inspect(obj).attrs[attr].history
+
+
+def _changed(obj, *attrs):
+    return any(_history(obj, attr).has_changes() for attr in attrs)
+
+
+def _collection_ids(obj, attr):
+    history = _history(obj, attr)
+    return {o.id for o in list(history.added) + list(history.deleted) if getattr(o, 'id', None)}
+
+
+def _before_flush(session, flush_context, instances):
+    """Raccoglie utenti e documenti la cui visibilità cambia con questo flush."""
+    dirty = session.info.setdefault('visibility_dirty', {'users': set(), 'docs': set(), 'objects': []})
+
+    for obj in session.new:
+        if isinstance(obj, (Document, DocumentShare, AuthorizedAccess)):
+            dirty['objects'].append(obj)
+        elif isinstance(obj, User) and (obj.companies or obj.departments):
+            dirty['objects'].append(obj)
+
+    for obj in session.deleted:
+        if isinstance(obj, Document):
+            dirty['docs'].add(obj.id)
+        elif isinstance(obj, (DocumentShare, AuthorizedAccess, User)):
+            dirty['users'].add(obj.id if isinstance(obj, User) else obj.user_id)
+
+    for obj in session.dirty:
+        if isinstance(obj, Document):
+            if _changed(obj, 'user_id', 'company_id', 'department_id'):
+                dirty['docs'].add(obj.id)
+        elif isinstance(obj, DocumentShare):
+            if _changed(obj, 'user_id', 'file_id', 'expires_at'):
+                dirty['users'].update(_history(obj, 'user_id').deleted or ())
+                dirty['objects'].append(obj)
+        elif isinstance(obj, AuthorizedAccess):
+            if _changed(obj, 'user_id', 'document_id'):
+                dirty['users'].update(_history(obj, 'user_id').deleted or ())
+                dirty['objects'].append(obj)
+        elif isinstance(obj, User):
+            if _changed(obj, 'companies', 'departments'):
+                dirty['users'].add(obj.id)
+        elif isinstance(obj, (Company, Department)):
+            dirty['users'].update(_collection_ids(obj, 'users'))
+
+
+def _after_flush_postexec(session, flush_context):
+    """Aggiorna l'indice nella stessa transazione del flush."""
+    dirty = session.info.pop('visibility_dirty', None)
+    if not dirty or not is_enabled():
+        return
+
+    users, docs = dirty['users'], dirty['docs']
+    for obj in dirty['objects']:
+        if isinstance(obj, Document):
+            docs.add(obj.id)
+        elif isinstance(obj, User):
+            users.add(obj.id)
+        else:
+            users.add(obj.user_id)
+
+    if users or docs:
+        refresh(session.connection(), user_ids=users, document_ids=docs)
+
+
+def _after_rollback(session):
+    session.info.pop('visibility_dirty', None)
+
+
+def register_visibility_listeners(session=None):
+    """
+    Registra gli eventi di sessione che mantengono l'indice (idempotente).
+
+    Args:
+        session: Sessione o scoped_session (default db.session).
+    """
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    session = session or db.session
+    event.listen(session, 'before_flush', _before_flush)
+    event.listen(session, 'after_flush_postexec', _after_flush_postexec)
+    event.listen(session, 'after_rollback', _after_rollback)
+    _listeners_registered = True
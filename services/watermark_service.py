@@ -1,12 +1,26 @@
 """
 Servizio per applicazione watermark dinamici ai PDF.
 Gestisce l'applicazione di watermark personalizzati con informazioni utente e timestamp.
+
+L'overlay (PDF di una pagina generato con reportlab) è messo in cache per
+(testo, geometria pagina, rotazione) e riusato tra pagine e download: un
+manuale di 300 pagine con formato uniforme genera un solo overlay. Il PDF
+sorgente è letto dal disco in modo incrementale e il risultato è scritto in un
+file temporaneo (in memoria fino a WATERMARK_SPOOL_MAX_BYTES) servito in
+streaming, senza tenere input e output interi in memoria come `bytes`.
+
+Motori: `pikepdf` (overlay importato una volta come Form XObject e
+referenziato da tutte le pagine) e `pypdf2` (merge del contenuto per pagina).
+WATERMARK_ENGINE=auto preferisce pikepdf se installato.
 """
 
 import os
 import logging
+import tempfile
+import threading
+from collections import OrderedDict
 from datetime import datetime
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, BinaryIO, Tuple
 from io import BytesIO
 
 try:
@@ -17,18 +31,77 @@ except ImportError:
     
 try:
     from PyPDF2 import PdfReader, PdfWriter
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.pagesizes import letter
-    from reportlab.lib.colors import Color
     PYPDF2_AVAILABLE = True
 except ImportError:
     PYPDF2_AVAILABLE = False
 
-from flask import current_app, request
+try:
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.colors import Color
+    REPORTLAB_AVAILABLE = True
+except ImportError:
+    REPORTLAB_AVAILABLE = False
+
+from flask import abort, current_app, request, send_file
 from flask_login import current_user
 
 logger = logging.getLogger(__name__)
 
+ENGINE_AUTO = 'auto'
+ENGINE_PIKEPDF = 'pikepdf'
+ENGINE_PYPDF2 = 'pypdf2'
+
+DEFAULT_OVERLAY_CACHE_SIZE = 256
+DEFAULT_SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+# Chiave overlay: (testo, x0, y0, larghezza, altezza, rotazione)
+OverlayKey = Tuple[str, float, float, float, float, int]
+
+
+class OverlayCache:
+    """
+    Cache LRU thread-safe degli overlay PDF (bytes) per testo e geometria pagina.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_OVERLAY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[OverlayKey, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_create(self, key: OverlayKey, factory) -> bytes:
+        with self._lock:
+            overlay = self._entries.get(key)
+            if overlay is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return overlay
+            self.misses += 1
+
+        overlay = factory()
+        with self._lock:
+            self._entries[key] = overlay
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return overlay
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def overlay_key(text: str, x0: float, y0: float, width: float, height: float, rotation: int) -> OverlayKey:
+    """Chiave normalizzata: geometria arrotondata al centesimo di punto, rotazione in 0/90/180/270."""
+    return (text, round(float(x0), 2), round(float(y0), 2),
+            round(float(width), 2), round(float(height), 2), int(rotation or 0) % 360)
+
 
 class WatermarkService:
     """
@@ -40,6 +113,9 @@ class WatermarkService:
         self.enabled = os.getenv('WATERMARK_ENABLED', 'True').lower() == 'true'
         self.template = os.getenv('WATERMARK_TEXT_TEMPLATE', 
                                  'User: {username} | {timestamp} | IP: {ip}')
+        self.engine = os.getenv('WATERMARK_ENGINE', ENGINE_AUTO).lower()
+        self.spool_max_bytes = int(os.getenv('WATERMARK_SPOOL_MAX_BYTES', str(DEFAULT_SPOOL_MAX_BYTES)))
+        self.overlays = OverlayCache(int(os.getenv('WATERMARK_OVERLAY_CACHE_SIZE', str(DEFAULT_OVERLAY_CACHE_SIZE))))
     
     def is_watermark_required(self, document, user) -> bool:
         """
@@ -132,24 +208,46 @@ class WatermarkService:
         except:
             return 'unknown'
     
-    def create_watermark_overlay(self, text: str, page_width: float, page_height: float) -> bytes:
+    def create_watermark_overlay(self, text: str, page_width: float, page_height: float,
+                                 rotation: int = 0, x0: float = 0, y0: float = 0) -> bytes:
         """
         Crea un overlay PDF con il watermark.
         
+        L'overlay ha lo stesso sistema di coordinate della pagina (origine del
+        MediaBox inclusa) e, per le pagine con /Rotate, il testo è ruotato in
+        modo da risultare orizzontale nel verso di lettura.
+        
         Args:
             text: Testo del watermark
-            page_width: Larghezza della pagina
-            page_height: Altezza della pagina
+            page_width: Larghezza della pagina (MediaBox, senza rotazione)
+            page_height: Altezza della pagina (MediaBox, senza rotazione)
+            rotation: Valore /Rotate della pagina (0, 90, 180, 270)
+            x0: Ascissa dell'origine del MediaBox
+            y0: Ordinata dell'origine del MediaBox
             
         Returns:
             bytes: PDF overlay con watermark
         """
-        if not PYPDF2_AVAILABLE:
-            raise ImportError("PyPDF2 e reportlab sono richiesti per il watermark")
+        if not REPORTLAB_AVAILABLE:
+            raise ImportError("reportlab è richiesto per il watermark")
+        
+        rotation = int(rotation or 0) % 360
         
         # Crea PDF temporaneo con watermark
         packet = BytesIO()
-        can = canvas.Canvas(packet, pagesize=(page_width, page_height))
+        can = canvas.Canvas(packet, pagesize=(x0 + page_width, y0 + page_height), pageCompression=1)
+        
+        # Spazio "visivo": origine in basso a sinistra della pagina come appare a schermo
+        can.translate(x0, y0)
+        if rotation == 90:
+            can.translate(page_width, 0)
+        elif rotation == 180:
+            can.translate(page_width, page_height)
+        elif rotation == 270:
+            can.translate(0, page_height)
+        if rotation:
+            can.rotate(rotation)
+        visual_width, visual_height = (page_height, page_width) if rotation in (90, 270) else (page_width, page_height)
         
         # Configurazione watermark
         can.setFont("Helvetica", 10)
@@ -162,18 +260,126 @@ class WatermarkService:
         
         # Watermark diagonale aggiuntivo (opzionale)
         can.saveState()
-        can.translate(page_width/2, page_height/2)
+        can.translate(visual_width / 2, visual_height / 2)
         can.rotate(45)
         can.setFont("Helvetica", 20)
         can.setFillColor(Color(0.8, 0.8, 0.8, alpha=0.1))  # Molto trasparente
-        can.drawCentredText(0, 0, text.split('|')[0].strip())  # Solo username
+        can.drawCentredString(0, 0, text.split('|')[0].strip())  # Solo username
         can.restoreState()
         
         can.save()
         
-        packet.seek(0)
         return packet.getvalue()
     
+    def get_overlay(self, text: str, page_width: float, page_height: float,
+                    rotation: int = 0, x0: float = 0, y0: float = 0) -> bytes:
+        """Overlay dalla cache, generato solo al primo uso per testo e geometria."""
+        key = overlay_key(text, x0, y0, page_width, page_height, rotation)
+        return self.overlays.get_or_create(
+            key, lambda: self.create_watermark_overlay(text, key[3], key[4], key[5], key[1], key[2])
+        )
+    
+    def resolve_engine(self, engine: Optional[str] = None) -> str:
+        """
+        Motore da usare: quello richiesto (o WATERMARK_ENGINE) se disponibile.
+        
+        Raises:
+            ImportError: Se nessuna libreria PDF è disponibile
+        """
+        engine = (engine or self.engine or ENGINE_AUTO).lower()
+        available = {
+            ENGINE_PIKEPDF: PIKEPDF_AVAILABLE and REPORTLAB_AVAILABLE,
+            ENGINE_PYPDF2: PYPDF2_AVAILABLE and REPORTLAB_AVAILABLE,
+        }
+        if engine in available:
+            if not available[engine]:
+                raise ImportError(f"Motore watermark '{engine}' non disponibile")
+            return engine
+        for candidate in (ENGINE_PIKEPDF, ENGINE_PYPDF2):
+            if available[candidate]:
+                return candidate
+        raise ImportError("Nessuna libreria PDF disponibile per il watermark (PyPDF2, pikepdf + reportlab)")
+    
+    def _stamp_pypdf2(self, source: BinaryIO, watermark_text: str, output: BinaryIO):
+        """Merge dell'overlay in cache su ogni pagina con PyPDF2."""
+        pdf_reader = PdfReader(source)
+        pdf_writer = PdfWriter()
+        # Overlay già letti per questo documento: una sola PdfReader per geometria
+        parsed = {}
+        
+        for page in pdf_reader.pages:
+            box = page.mediabox
+            x0, y0 = float(box.left), float(box.bottom)
+            key = overlay_key(watermark_text, x0, y0, float(box.width), float(box.height), page.rotation)
+            overlay_page = parsed.get(key)
+            if overlay_page is None:
+                overlay_bytes = self.get_overlay(watermark_text, key[3], key[4], key[5], key[1], key[2])
+                overlay_page = parsed[key] = PdfReader(BytesIO(overlay_bytes)).pages[0]
+            
+            page.merge_page(overlay_page)
+            pdf_writer.add_page(page)
+        
+        pdf_writer.write(output)
+    
+    def _stamp_pikepdf(self, source: BinaryIO, watermark_text: str, output: BinaryIO):
+        """Overlay come Form XObject condiviso da tutte le pagine con la stessa geometria."""
+        with pikepdf.open(source) as pdf:
+            forms = {}
+            
+            for page in pdf.pages:
+                box = [float(v) for v in page.mediabox]
+                x0, y0 = min(box[0], box[2]), min(box[1], box[3])
+                width, height = abs(box[2] - box[0]), abs(box[3] - box[1])
+                key = overlay_key(watermark_text, x0, y0, width, height, int(page.obj.get('/Rotate', 0)))
+                form = forms.get(key)
+                if form is None:
+                    overlay_bytes = self.get_overlay(watermark_text, key[3], key[4], key[5], key[1], key[2])
+                    with pikepdf.open(BytesIO(overlay_bytes)) as overlay_pdf:
+                        form = forms[key] = pdf.copy_foreign(overlay_pdf.pages[0].as_form_xobject())
+                
+                # L'overlay copre 1:1 lo spazio [0, 0, x0+w, y0+h] come la pagina generata da reportlab
+                page.add_overlay(form, pikepdf.Rectangle(0, 0, key[1] + key[3], key[2] + key[4]))
+            
+            pdf.save(output)
+    
+    def stamp(self, source: BinaryIO, watermark_text: str, output: BinaryIO, engine: Optional[str] = None) -> str:
+        """
+        Applica il watermark leggendo da `source` e scrivendo su `output`.
+        
+        Args:
+            source: PDF originale (file aperto in lettura binaria, con seek)
+            watermark_text: Testo del watermark
+            output: File di destinazione
+            engine: 'pikepdf', 'pypdf2' o 'auto' (default WATERMARK_ENGINE)
+            
+        Returns:
+            str: Motore utilizzato
+        """
+        engine = self.resolve_engine(engine)
+        if engine == ENGINE_PIKEPDF:
+            self._stamp_pikepdf(source, watermark_text, output)
+        else:
+            self._stamp_pypdf2(source, watermark_text, output)
+        return engine
+    
+    def watermark_file(self, file_path: str, watermark_text: str, engine: Optional[str] = None) -> BinaryIO:
+        """
+        Applica il watermark a un PDF su disco.
+        
+        Returns:
+            file: Risultato in un file temporaneo (in memoria fino a
+            WATERMARK_SPOOL_MAX_BYTES, poi su disco), riposizionato all'inizio.
+        """
+        output = tempfile.SpooledTemporaryFile(max_size=self.spool_max_bytes)
+        try:
+            with open(file_path, 'rb') as source:
+                self.stamp(source, watermark_text, output, engine)
+        except Exception:
+            output.close()
+            raise
+        output.seek(0)
+        return output
+    
     def apply_watermark_pypdf2(self, pdf_bytes: bytes, watermark_text: str) -> bytes:
         """
         Applica watermark usando PyPDF2.
@@ -185,37 +391,10 @@ class WatermarkService:
         Returns:
             bytes: PDF con watermark applicato
         """
-        if not PYPDF2_AVAILABLE:
-            raise ImportError("PyPDF2 e reportlab non sono disponibili")
-        
         try:
-            # Leggi PDF originale
-            pdf_reader = PdfReader(BytesIO(pdf_bytes))
-            pdf_writer = PdfWriter()
-            
-            # Processa ogni pagina
-            for page_num, page in enumerate(pdf_reader.pages):
-                # Ottieni dimensioni pagina
-                page_width = float(page.mediabox.width)
-                page_height = float(page.mediabox.height)
-                
-                # Crea overlay watermark
-                watermark_bytes = self.create_watermark_overlay(watermark_text, page_width, page_height)
-                watermark_pdf = PdfReader(BytesIO(watermark_bytes))
-                
-                # Applica watermark alla pagina
-                if len(watermark_pdf.pages) > 0:
-                    page.merge_page(watermark_pdf.pages[0])
-                
-                pdf_writer.add_page(page)
-            
-            # Genera PDF finale
             output_stream = BytesIO()
-            pdf_writer.write(output_stream)
-            output_stream.seek(0)
-            
+            self.stamp(BytesIO(pdf_bytes), watermark_text, output_stream, ENGINE_PYPDF2)
             return output_stream.getvalue()
-            
         except Exception as e:
             logger.error(f"Errore applicazione watermark PyPDF2: {e}")
             raise
@@ -231,25 +410,10 @@ class WatermarkService:
         Returns:
             bytes: PDF con watermark applicato
         """
-        if not PIKEPDF_AVAILABLE:
-            raise ImportError("pikepdf non è disponibile")
-        
         try:
-            # Apri PDF con pikepdf
-            with pikepdf.open(BytesIO(pdf_bytes)) as pdf:
-                for page in pdf.pages:
-                    # Aggiungi watermark come annotazione di testo
-                    # Questo è un approccio semplificato
-                    # Per implementazioni più complesse si può usare l'overlay
-                    pass
-                
-                # Salva PDF modificato
-                output_stream = BytesIO()
-                pdf.save(output_stream)
-                output_stream.seek(0)
-                
-                return output_stream.getvalue()
-                
+            output_stream = BytesIO()
+            self.stamp(BytesIO(pdf_bytes), watermark_text, output_stream, ENGINE_PIKEPDF)
+            return output_stream.getvalue()
         except Exception as e:
             logger.error(f"Errore applicazione watermark pikepdf: {e}")
             raise
@@ -273,23 +437,52 @@ class WatermarkService:
             logger.info("Watermark disabilitato, PDF restituito senza modifiche")
             return pdf_bytes
         
-        # Prova prima con PyPDF2 (più affidabile per watermark)
-        if PYPDF2_AVAILABLE:
-            try:
-                return self.apply_watermark_pypdf2(pdf_bytes, watermark_text)
-            except Exception as e:
-                logger.warning(f"Fallback da PyPDF2 a pikepdf: {e}")
+        output_stream = BytesIO()
+        self.stamp(BytesIO(pdf_bytes), watermark_text, output_stream)
+        return output_stream.getvalue()
+    
+    def watermark_response(self, document, user, file_path: str, download_name: Optional[str] = None,
+                           custom_vars: Optional[Dict[str, Any]] = None):
+        """
+        Risposta di download con watermark, se richiesto per il documento.
         
-        # Fallback su pikepdf
-        if PIKEPDF_AVAILABLE:
-            try:
-                return self.apply_watermark_pikepdf(pdf_bytes, watermark_text)
-            except Exception as e:
-                logger.error(f"Errore anche con pikepdf: {e}")
-                raise
+        Args:
+            document: Oggetto Document
+            user: Utente che scarica (None per ospiti)
+            file_path: Percorso del PDF originale
+            download_name: Nome proposto al browser
+            custom_vars: Variabili aggiuntive per il template (es. email ospite)
+            
+        Returns:
+            Response: PDF con watermark servito in streaming, oppure None se il
+            watermark non è richiesto (download normale).
+        
+        Raises:
+            InternalServerError: Se il watermark è richiesto ma non può essere
+            applicato: il file originale non viene mai servito al suo posto.
+        """
+        if not self.is_watermark_required(document, user):
+            return None
         
-        # Nessuna libreria disponibile
-        raise ImportError("Nessuna libreria PDF disponibile per il watermark (PyPDF2, pikepdf)")
+        try:
+            watermark_text = self.generate_watermark_text(user, document, custom_vars)
+            output = self.watermark_file(file_path, watermark_text)
+        except Exception as e:
+            logger.error(f"Errore watermark al download del documento {document.id}, download bloccato: {e}")
+            abort(500, description="Impossibile applicare il watermark al documento")
+        
+        response = send_file(
+            output,
+            mimetype='application/pdf',
+            as_attachment=True,
+            download_name=download_name or document.original_filename or document.filename,
+            conditional=False
+        )
+        # Contenuto personalizzato per utente e orario: mai in cache condivise
+        response.cache_control.private = True
+        response.cache_control.no_store = True
+        response.call_on_close(output.close)
+        return response
     
     def process_document_for_watermark(self, document, user, file_path: str) -> bool:
         """
@@ -314,19 +507,24 @@ class WatermarkService:
                 logger.error(f"File non trovato: {file_path}")
                 return False
             
-            with open(file_path, 'rb') as f:
-                pdf_bytes = f.read()
+            if getattr(document, 'blob_sha256', None):
+                # Il blob è condiviso e indirizzato per hash: il watermark si applica al download
+                logger.info(f"Documento {document.id} nel blob store: watermark applicato al download")
+                return True
             
             # Genera testo watermark
             watermark_text = self.generate_watermark_text(user, document)
             logger.info(f"Applicando watermark: '{watermark_text}' al documento {document.id}")
             
-            # Applica watermark
-            watermarked_pdf = self.apply_watermark(pdf_bytes, watermark_text)
-            
-            # Salva il file con watermark
-            with open(file_path, 'wb') as f:
-                f.write(watermarked_pdf)
+            # Applica watermark su file temporaneo e sostituisci l'originale
+            tmp_path = f"{file_path}.watermark.tmp"
+            try:
+                with open(file_path, 'rb') as source, open(tmp_path, 'wb') as output:
+                    self.stamp(source, watermark_text, output)
+                os.replace(tmp_path, file_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
             
             logger.info(f"Watermark applicato con successo al documento {document.id}")
             
@@ -357,9 +555,12 @@ class WatermarkService:
             'watermark_enabled': self.enabled,
             'pypdf2_available': PYPDF2_AVAILABLE,
             'pikepdf_available': PIKEPDF_AVAILABLE,
-            'can_apply_watermark': PYPDF2_AVAILABLE or PIKEPDF_AVAILABLE,
+            'reportlab_available': REPORTLAB_AVAILABLE,
+            'can_apply_watermark': REPORTLAB_AVAILABLE and (PYPDF2_AVAILABLE or PIKEPDF_AVAILABLE),
+            'engine': self.engine,
+            'overlay_cache': {'entries': len(self.overlays), 'hits': self.overlays.hits, 'misses': self.overlays.misses},
             'template': self.template,
-            'recommended_install': 'pip install PyPDF2 reportlab pikepdf' if not (PYPDF2_AVAILABLE and PIKEPDF_AVAILABLE) else None
+            'recommended_install': 'pip install PyPDF2 reportlab pikepdf' if not (PYPDF2_AVAILABLE and PIKEPDF_AVAILABLE and REPORTLAB_AVAILABLE) else None
         }
 
 
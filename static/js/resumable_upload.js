@@ -0,0 +1,164 @@
+/**
+ * Upload a chunk riprendibili (tus 1.0) per i form di caricamento documenti.
+ *
+ * Nei form con attributo `data-resumable-upload` i file oltre la soglia
+ * (`data-resumable-threshold`, default 8 MB) vengono inviati a chunk a
+ * /uploads/resumable/ con checksum SHA-256 di ogni chunk. Dopo un'interruzione
+ * di rete l'upload riprende dall'offset del server (anche ricaricando la
+ * pagina: l'URL dell'upload è conservato in localStorage). A upload
+ * completato il form viene inviato con `upload_id` al posto del file.
+ */
+(function () {
+  "use strict";
+
+  const ENDPOINT = "/uploads/resumable/";
+  const CHUNK_SIZE = 8 * 1024 * 1024;
+  const MAX_RETRY = 8;
+
+  function csrfToken(form) {
+    const input = form.querySelector('input[name="csrf_token"]');
+    return input ? input.value : "";
+  }
+
+  function b64(bytes) {
+    let binary = "";
+    new Uint8Array(bytes).forEach(b => { binary += String.fromCharCode(b); });
+    return btoa(binary);
+  }
+
+  function metadata(file) {
+    const encode = value => btoa(unescape(encodeURIComponent(value)));
+    return `filename ${encode(file.name)},filetype ${encode(file.type || "application/octet-stream")}`;
+  }
+
+  function storageKey(file) {
+    return `tus:${file.name}:${file.size}:${file.lastModified}`;
+  }
+
+  const sleep = ms => new Promise(resolve => setTimeout(resolve, ms));
+
+  async function tusRequest(method, url, token, headers, body) {
+    const response = await fetch(url, {
+      method,
+      body,
+      credentials: "same-origin",
+      headers: Object.assign({ "Tus-Resumable": "1.0.0", "X-CSRFToken": token }, headers || {})
+    });
+    return response;
+  }
+
+  async function createOrResume(file, token) {
+    const key = storageKey(file);
+    const saved = localStorage.getItem(key);
+    if (saved) {
+      const head = await tusRequest("HEAD", saved, token);
+      if (head.ok) {
+        return { url: saved, offset: parseInt(head.headers.get("Upload-Offset"), 10) };
+      }
+      localStorage.removeItem(key);
+    }
+    const created = await tusRequest("POST", ENDPOINT, token, {
+      "Upload-Length": String(file.size),
+      "Upload-Metadata": metadata(file)
+    });
+    if (created.status !== 201) {
+      throw new Error(await created.text() || `Creazione upload fallita (${created.status})`);
+    }
+    const url = created.headers.get("Location");
+    localStorage.setItem(key, url);
+    return { url, offset: 0 };
+  }
+
+  async function upload(file, token, onProgress) {
+    let { url, offset } = await createOrResume(file, token);
+    let retry = 0;
+
+    while (offset < file.size) {
+      const chunk = file.slice(offset, offset + CHUNK_SIZE);
+      const headers = {
+        "Content-Type": "application/offset+octet-stream",
+        "Upload-Offset": String(offset)
+      };
+      let response = null;
+      try {
+        if (window.crypto && crypto.subtle) {
+          const digest = await crypto.subtle.digest("SHA-256", await chunk.arrayBuffer());
+          headers["Upload-Checksum"] = `sha256 ${b64(digest)}`;
+        }
+        response = await tusRequest("PATCH", url, token, headers, chunk);
+      } catch (err) {
+        response = null;  // rete assente
+      }
+      if (response && response.status === 204) {
+        offset = parseInt(response.headers.get("Upload-Offset"), 10);
+        retry = 0;
+        onProgress(offset, file.size);
+        continue;
+      }
+      if (response && response.status < 500 && ![409, 423, 460].includes(response.status)) {
+        throw new Error(await response.text() || `Upload fallito (${response.status})`);
+      }
+      // Rete interrotta, chunk corrotto o offset diverso: riprende dall'offset del server
+      if (++retry > MAX_RETRY) {
+        throw new Error("Connessione assente: riprova più tardi, l'upload riprenderà dal punto raggiunto");
+      }
+      await sleep(Math.min(30000, 1000 * 2 ** (retry - 1)));
+      const head = await tusRequest("HEAD", url, token).catch(() => null);
+      if (head && head.ok) {
+        offset = parseInt(head.headers.get("Upload-Offset"), 10);
+      }
+    }
+
+    const finalized = await tusRequest("POST", `${url}/finalize`, token);
+    const result = await finalized.json();
+    localStorage.removeItem(storageKey(file));
+    if (!result.success) {
+      throw new Error(result.error);
+    }
+    return result;
+  }
+
+  function attach(form) {
+    const threshold = parseInt(form.dataset.resumableThreshold || String(CHUNK_SIZE), 10);
+    const fileInput = form.querySelector('input[type="file"][name="file"]');
+    if (!fileInput) {
+      return;
+    }
+    const progress = document.createElement("div");
+    progress.className = "form-text mt-2";
+    fileInput.insertAdjacentElement("afterend", progress);
+
+    form.addEventListener("submit", async event => {
+      const file = fileInput.files[0];
+      if (!file || file.size <= threshold || form.dataset.resumableDone) {
+        return;
+      }
+      event.preventDefault();
+      event.stopImmediatePropagation();
+      const buttons = form.querySelectorAll('[type="submit"]');
+      buttons.forEach(b => { b.disabled = true; });
+      try {
+        const result = await upload(file, csrfToken(form), (sent, total) => {
+          progress.textContent = `⬆️ Caricamento ${Math.floor(sent * 100 / total)}% (${(sent / 1048576).toFixed(1)} / ${(total / 1048576).toFixed(1)} MB)`;
+        });
+        const hidden = document.createElement("input");
+        hidden.type = "hidden";
+        hidden.name = "upload_id";
+        hidden.value = result.upload_id;
+        form.appendChild(hidden);
+        // Il file è già sul server: il form invia solo i campi
+        fileInput.disabled = true;
+        form.dataset.resumableDone = "1";
+        progress.textContent = "✅ File caricato, salvataggio del documento...";
+        form.submit();
+      } catch (err) {
+        progress.textContent = `❌ ${err.message}`;
+        buttons.forEach(b => { b.disabled = false; });
+      }
+    }, true);
+  }
+
+  document.addEventListener("DOMContentLoaded", () => {
+    document.querySelectorAll("form[data-resumable-upload]").forEach(attach);
+  });
+})();
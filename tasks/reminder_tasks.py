@@ -6,7 +6,6 @@ Gestisce l'invio di promemoria per documenti in scadenza.
 
 from datetime import datetime, timedelta
 from flask import current_app
-from flask_mail import Message
 import logging
 
 # Configurazione logging
@@ -152,17 +151,16 @@ def send_email_reminder(email, subject, message):
         subject (str): Oggetto email
         message (str): Messaggio
     """
-    from app import mail
+    from services.mail_queue import enqueue_email
     
     try:
-        msg = Message(
+        enqueue_email(
             subject=subject,
             recipients=[email],
             body=message,
             sender=current_app.config.get('MAIL_DEFAULT_SENDER', 'noreply@mercurysurgelati.org')
         )
-        mail.send(msg)
-        logger.info(f"✅ Email reminder inviata a {email}")
+        logger.info(f"✅ Email reminder accodata per {email}")
         
     except Exception as e:
         logger.error(f"❌ Errore invio email a {email}: {e}")
@@ -0,0 +1,177 @@
+"""
+Test batch di analisi AI retroattiva (scripts.analisi_batch): ripresa da checkpoint e batch falliti.
+"""
+
+import asyncio
+import csv
+import importlib
+import json
+import sys
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from types import ModuleType, SimpleNamespace
+
+# Dipendenze dell'app FastAPI (app/, non importabile accanto ad app.py Flask): sostituite
+# nei test, che rimpiazzano comunque analisi, salvataggio, sync e notifiche
+DIPENDENZE = {
+    'app.models': ('Document', 'DocumentoAnalizzato'),
+    'app.models.analisi_lean': ('AnalisiLean',),
+    'app.services.pdf_ai': ('extract_text_from_pdf', 'generate_summary', 'classify_document'),
+    'app.services.lean_checker': ('check_lean_principles',),
+    'app.services.persistence': ('salva_risultati_analisi',),
+    'app.services.obeya_sync': ('sync_with_focusme_ai',),
+    'app.services.notifiche_ai': ('invia_notifica_ai',),
+}
+
+
+@pytest.fixture
+def analisi_batch(monkeypatch):
+    for nome, attributi in DIPENDENZE.items():
+        modulo = ModuleType(nome)
+        for attributo in attributi:
+            setattr(modulo, attributo, None)
+        monkeypatch.setitem(sys.modules, nome, modulo)
+    monkeypatch.delitem(sys.modules, 'scripts.analisi_batch', raising=False)
+    return importlib.import_module('scripts.analisi_batch')
+
+
+class FakeSession:
+    """Sessione minima: conta commit e rollback, può fallire al primo commit."""
+
+    def __init__(self, fallisci_commit=False):
+        self.fallisci_commit = fallisci_commit
+        self.commit_count = 0
+        self.rollback_count = 0
+
+    def commit(self):
+        if self.fallisci_commit:
+            self.fallisci_commit = False
+            raise RuntimeError("database non disponibile")
+        self.commit_count += 1
+
+    def rollback(self):
+        self.rollback_count += 1
+
+
+@pytest.fixture
+def batch(analisi_batch, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    documenti = [
+        SimpleNamespace(id=i, filename=f"doc{i}.pdf", uploader_email=f"u{i}@example.com",
+                        filepath=f"/tmp/doc{i}.pdf", ai_analyzed=False)
+        for i in range(1, 5)
+    ]
+    stato = {'analizzati': [], 'sincronizzati': [], 'notifiche': []}
+
+    def prossimo_batch(db, dopo_id, from_date, to_date, limite):
+        return [doc for doc in documenti if doc.id > dopo_id][:limite]
+
+    def analizza_file(filepath):
+        stato['analizzati'].append(filepath)
+        return {"testo": True, "summary": "ok", "classification": "Qualità", "lean_check": {}}
+
+    def salva_risultati(risultati, db, commit=True):
+        return [SimpleNamespace(id=100 + n, synced=False) for n, _ in enumerate(risultati)]
+
+    async def sync(documento_ai):
+        stato['sincronizzati'].append(documento_ai.id)
+        documento_ai.synced = True
+
+    async def notifica(email, messaggio, titolo):
+        stato['notifiche'].append((email, titolo))
+
+    monkeypatch.setattr(analisi_batch, '_prossimo_batch', prossimo_batch)
+    monkeypatch.setattr(analisi_batch, '_analizza_file', analizza_file)
+    monkeypatch.setattr(analisi_batch, 'salva_risultati_analisi', salva_risultati)
+    monkeypatch.setattr(analisi_batch, 'sync_with_focusme_ai', sync)
+    monkeypatch.setattr(analisi_batch, 'invia_notifica_ai', notifica)
+    stato['documenti'] = documenti
+    return stato
+
+
+def _esegui(analisi_batch, db, tmp_path, **kwargs):
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        return asyncio.run(analisi_batch.analizza_documenti_non_analizzati(
+            db, dimensione_batch=2, checkpoint_path=str(tmp_path / 'checkpoint.json'), pool=pool, **kwargs
+        ))
+
+
+def _righe(report_path):
+    with open(report_path, newline='') as f:
+        return list(csv.reader(f))
+
+
+class TestAnalisiBatch:
+    """Test corsa a batch con checkpoint."""
+
+    def test_resume_from_checkpoint(self, analisi_batch, batch, tmp_path):
+        """Una corsa interrotta riparte dopo l'ultimo id confermato sullo stesso report."""
+        report = tmp_path / 'batch_report_precedente.csv'
+        report.write_text("ID,Nome,Stato AI,Esito Sync\r\n1,doc1.pdf,ok,sincronizzato\r\n2,doc2.pdf,ok,sincronizzato\r\n")
+        (tmp_path / 'checkpoint.json').write_text(json.dumps({
+            'report': str(report), 'ultimo_id': 2, 'from_date': None, 'to_date': None,
+        }))
+        db = FakeSession()
+
+        report_path = _esegui(analisi_batch, db, tmp_path)
+
+        assert report_path == str(report)
+        assert batch['analizzati'] == ['/tmp/doc3.pdf', '/tmp/doc4.pdf']
+        righe = _righe(report_path)
+        assert righe[0] == ['ID', 'Nome', 'Stato AI', 'Esito Sync']
+        assert [riga[0] for riga in righe[1:]] == ['1', '2', '3', '4']
+        assert not (tmp_path / 'checkpoint.json').exists()
+
+    def test_checkpoint_other_window_is_ignored(self, analisi_batch, batch, tmp_path):
+        """Un checkpoint di un'altra finestra di date non viene ripreso."""
+        (tmp_path / 'checkpoint.json').write_text(json.dumps({
+            'report': 'vecchio.csv', 'ultimo_id': 2, 'from_date': '2026-01-01', 'to_date': None,
+        }))
+
+        report_path = _esegui(analisi_batch, FakeSession(), tmp_path)
+
+        assert report_path != 'vecchio.csv'
+        assert len(batch['analizzati']) == 4
+
+    def test_failed_batch_skips_obeya_sync(self, analisi_batch, batch, tmp_path):
+        """Se il commit del batch fallisce nessun documento viene sincronizzato con Obeya."""
+        db = FakeSession(fallisci_commit=True)
+
+        report_path = _esegui(analisi_batch, db, tmp_path)
+
+        # Primo batch (doc 1-2) annullato, secondo batch (doc 3-4) salvato e sincronizzato
+        assert db.rollback_count == 1
+        assert batch['sincronizzati'] == [100, 101]
+        righe = {riga[0]: riga for riga in _righe(report_path)[1:]}
+        assert righe['1'][2] == 'errore' and 'database non disponibile' in righe['1'][3]
+        assert righe['2'][2] == 'errore'
+        assert righe['3'][2:] == ['ok', 'sincronizzato']
+        assert sorted(email for email, _ in batch['notifiche']) == ['u1@example.com', 'u2@example.com']
+
+    def test_sync_runs_after_commit(self, analisi_batch, batch, tmp_path, monkeypatch):
+        """La sync Obeya vede solo analisi già confermate dal commit."""
+        db = FakeSession()
+        commit_alla_sync = []
+
+        async def sync(documento_ai):
+            commit_alla_sync.append(db.commit_count)
+            documento_ai.synced = True
+
+        monkeypatch.setattr(analisi_batch, 'sync_with_focusme_ai', sync)
+
+        _esegui(analisi_batch, db, tmp_path)
+
+        # Due batch: commit delle analisi prima della sync, poi commit dei flag synced
+        assert commit_alla_sync == [1, 1, 3, 3]
+        assert db.commit_count == 4
+
+    def test_process_pool_is_reused(self, analisi_batch):
+        """Il pool di processi è creato una volta e sostituito solo se rotto."""
+        pool = analisi_batch._pool_processi(2)
+        try:
+            assert analisi_batch._pool_processi(2) is pool
+            analisi_batch._scarta_pool(pool)
+            nuovo = analisi_batch._pool_processi(2)
+            assert nuovo is not pool
+        finally:
+            analisi_batch._scarta_pool(analisi_batch._pool_processi(2))
@@ -0,0 +1,86 @@
+"""
+Test suite di benchmark (benchmarks/): dataset sintetico, misura dei casi e confronto con la baseline.
+"""
+
+import re
+
+from benchmarks.casi import CasoNonDisponibile
+from benchmarks.run import confronta, misura_caso, riassumi
+from benchmarks.seed import popola
+from models import AccessRequest, Document, DownloadLog, FirmaDocumento, PartecipazioneFormazione, User
+
+
+def _caso_ok(esito):
+    return {'stato': 'ok', 'mediana_ms': esito[0], 'query': esito[1]}
+
+
+class TestBenchmarks:
+    """Test per seed riproducibile, PDF sintetici validi e rilevazione delle regressioni."""
+
+    def test_seed_dataset_and_pdfs(self, app, database, tmp_path):
+        """Il dataset rispetta la scala e i PDF hanno xref coerente con gli oggetti."""
+        with app.app_context():
+            seed = popola(scala=1, seed=7, pdf_dir=str(tmp_path), pdf=2, pagine=3)
+
+            assert User.query.count() == 60 and Document.query.count() == 300
+            assert DownloadLog.query.count() == 3000 and FirmaDocumento.query.count() == 900
+            assert AccessRequest.query.count() == 300
+            assert {p.attestato_path for p in PartecipazioneFormazione.query} <= set(seed['pdf'])
+            titoli = [d.title for d in Document.query.order_by(Document.id).limit(5)]
+
+        # Stesso seed, stesso dataset
+        database.drop_all()
+        database.create_all()
+        with app.app_context():
+            popola(scala=1, seed=7)
+            assert [d.title for d in Document.query.order_by(Document.id).limit(5)] == titoli
+
+        data = (tmp_path / "manuale_000.pdf").read_bytes()
+        assert data.startswith(b"%PDF-1.4") and data.rstrip().endswith(b"%%EOF")
+        xref = int(re.search(rb"startxref\n(\d+)", data).group(1))
+        offsets = [int(riga[:10]) for riga in data[xref:].split(b"\n")[3:] if riga.endswith(b" n ")]
+        assert len(offsets) == 3 + 3 * 2
+        for numero, offset in enumerate(offsets, start=1):
+            assert data[offset:].startswith(b"%d 0 obj" % numero)
+        assert b"/Count 3" in data
+
+    def test_measure_cases(self):
+        """Riscaldamento escluso dal tempo; casi non disponibili o in errore non interrompono la suite."""
+        contatore = {'query': 0}
+        giri = []
+
+        def caso(ctx):
+            def esegui():
+                giri.append(1)
+                contatore['query'] += 2
+            return esegui
+
+        def mancante(ctx):
+            raise CasoNonDisponibile("reportlab non installato")
+
+        def rotto(ctx):
+            def esegui():
+                raise RuntimeError("GET /report-firme -> HTTP 500")
+            return esegui
+
+        risultato = misura_caso(caso, {}, 4, contatore)
+        assert len(giri) == 5
+        assert risultato['stato'] == 'ok' and risultato['ripetizioni'] == 4 and risultato['query'] == 2
+        assert risultato['min_ms'] <= risultato['mediana_ms'] <= risultato['p95_ms']
+        assert misura_caso(mancante, {}, 4, contatore) == {'stato': 'saltato', 'motivo': "reportlab non installato"}
+        assert misura_caso(rotto, {}, 4, contatore)['motivo'] == "RuntimeError: GET /report-firme -> HTTP 500"
+        assert riassumi([0.003, 0.001, 0.002])['mediana_ms'] == 2.0
+
+    def test_compare_with_baseline(self):
+        """Regressione oltre soglia sulla mediana o query in più; i casi saltati non si confrontano."""
+        baseline = {'casi': {'report_firme': _caso_ok((100.0, 50)), 'watermark': _caso_ok((40.0, 0)),
+                             'files_api.get_file_tree': _caso_ok((10.0, 3)), 'export.attestati_zip': _caso_ok((5.0, 2))}}
+        attuale = {'casi': {'report_firme': _caso_ok((80.0, 50)), 'watermark': _caso_ok((55.0, 0)),
+                            'files_api.get_file_tree': _caso_ok((11.0, 4)),
+                            'export.attestati_zip': {'stato': 'saltato', 'motivo': "nessun PDF"}}}
+
+        regressioni = confronta(attuale, baseline, soglia=0.25)
+        assert [(r['caso'], r['metrica']) for r in regressioni] == [('watermark', 'mediana_ms'),
+                                                                    ('files_api.get_file_tree', 'query')]
+        assert regressioni[0]['rapporto'] == 1.38
+        assert confronta(attuale, baseline, soglia=0.5)[0]['caso'] == 'files_api.get_file_tree'
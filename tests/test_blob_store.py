@@ -0,0 +1,176 @@
+"""
+Test blob store content-addressable (services.blob_store).
+"""
+
+import io
+import os
+import pytest
+
+from extensions import db
+from models import Company, Department, Document, DocumentVersion, FileBlob, FileHash, User
+from services.blob_store import (
+    gc_blobs, get_blob_store, migrate_legacy_files, register_blob_listeners, resolve_path
+)
+
+
+@pytest.fixture
+def storage(app, tmp_path):
+    """UPLOAD_FOLDER e blob store in una directory temporanea."""
+    previous = {key: app.config.get(key) for key in ('UPLOAD_FOLDER', 'BLOB_STORE_ROOT')}
+    app.config['UPLOAD_FOLDER'] = str(tmp_path / "uploads")
+    app.config['BLOB_STORE_ROOT'] = str(tmp_path / "blobs")
+    yield tmp_path
+    app.config.update(previous)
+
+
+def _crea_base():
+    company = Company(name="Mercury")
+    db.session.add(company)
+    db.session.flush()
+    department = Department(name="Qualità", company_id=company.id)
+    user = User(username="mario", email="mario@mercury.com", password="x", role="user")
+    db.session.add_all([department, user])
+    db.session.flush()
+    return company, department, user
+
+
+def _documento(company, department, user, filename, **kwargs):
+    doc = Document(title=filename, filename=filename, original_filename=filename, user_id=user.id,
+                   uploader_email=user.email, company_id=company.id, department_id=department.id, **kwargs)
+    db.session.add(doc)
+    return doc
+
+
+class TestBlobStore:
+    """Test per deduplicazione, conteggio riferimenti, risoluzione percorsi e migrazione."""
+
+    @pytest.fixture(autouse=True)
+    def _listeners(self):
+        register_blob_listeners()
+
+    def test_identical_content_stored_once(self, app, database, storage):
+        """Lo stesso contenuto produce un solo file, in una directory a due livelli."""
+        with app.app_context():
+            store = get_blob_store()
+            first, created = store.put_stream(io.BytesIO(b"contenuto allegato"), filename="a.txt")
+            second, created_again = store.put_stream(io.BytesIO(b"contenuto allegato"), filename="b.txt")
+
+            assert created and not created_again
+            assert first.sha256 == second.sha256
+            path = store.path_for(first.sha256)
+            assert path == os.path.join(store.root, first.sha256[:2], first.sha256[2:4], first.sha256)
+            assert open(path, 'rb').read() == b"contenuto allegato"
+            assert os.listdir(os.path.join(store.root, 'tmp')) == []
+
+    def test_reference_counting(self, app, database, storage):
+        """Documenti e versioni aggiornano ref_count all'inserimento, modifica ed eliminazione."""
+        with app.app_context():
+            company, department, user = _crea_base()
+            sha_a, sha_b = 'a' * 64, 'b' * 64
+            db.session.add_all([FileBlob(sha256=sha_a), FileBlob(sha256=sha_b)])
+            doc1 = _documento(company, department, user, "uno.pdf", blob_sha256=sha_a)
+            doc2 = _documento(company, department, user, "due.pdf", blob_sha256=sha_a)
+            db.session.commit()
+            db.session.add(DocumentVersion(document_id=doc1.id, version_number=1, blob_sha256=sha_a))
+            db.session.commit()
+            assert db.session.get(FileBlob, sha_a).ref_count == 3
+
+            doc2.blob_sha256 = sha_b
+            db.session.commit()
+            db.session.delete(doc1.versions[0])
+            db.session.commit()
+
+            blob_a = db.session.get(FileBlob, sha_a)
+            assert blob_a.ref_count == 1
+            assert blob_a.released_at is not None
+            assert db.session.get(FileBlob, sha_b).ref_count == 1
+
+    def test_resolve_path(self, app, database, storage):
+        """I documenti nel blob store si risolvono dall'hash, quelli legacy dai percorsi storici."""
+        with app.app_context():
+            company, department, user = _crea_base()
+            legacy_dir = storage / "uploads" / "Mercury" / "Qualità"
+            legacy_dir.mkdir(parents=True)
+            (legacy_dir / "vecchio.pdf").write_bytes(b"legacy")
+            legacy = _documento(company, department, user, "vecchio.pdf")
+            db.session.add(FileBlob(sha256='c' * 64))
+            nuovo = _documento(company, department, user, "nuovo.pdf", blob_sha256='c' * 64)
+            db.session.commit()
+
+            assert resolve_path(legacy) == str(legacy_dir / "vecchio.pdf")
+            assert legacy.file_path == resolve_path(legacy)
+            assert resolve_path(nuovo) == get_blob_store().path_for('c' * 64)
+
+    def test_new_version_points_document_to_blob(self, app, database, storage):
+        """Una nuova versione importa il file nel blob store e aggiorna l'hash del documento."""
+        from utils.version_utils import attiva_nuova_versione, ripristina_versione
+
+        with app.app_context():
+            company, department, user = _crea_base()
+            legacy_dir = storage / "uploads" / "Mercury" / "Qualità"
+            legacy_dir.mkdir(parents=True)
+            (legacy_dir / "manuale.pdf").write_bytes(b"v1")
+            (storage / "manuale_v2.pdf").write_bytes(b"v2")
+            doc = _documento(company, department, user, "manuale.pdf")
+            db.session.commit()
+
+            nuova = attiva_nuova_versione(doc, "manuale_v2.pdf", str(storage / "manuale_v2.pdf"), user)
+            assert doc.blob_sha256 == nuova.blob_sha256
+            assert open(doc.file_path, 'rb').read() == b"v2"
+
+            precedente = next(v for v in doc.versions if not v.is_active)
+            assert precedente.blob_sha256 is None and precedente.file_path == str(legacy_dir / "manuale.pdf")
+            ripristina_versione(precedente.id, user)
+            assert doc.blob_sha256 == precedente.blob_sha256
+            assert open(doc.file_path, 'rb').read() == b"v1"
+
+    def test_migration_deduplicates_legacy_files(self, app, database, storage):
+        """La migrazione sposta i file legacy nel blob store senza duplicare i contenuti uguali."""
+        with app.app_context():
+            company, department, user = _crea_base()
+            uploads = storage / "uploads"
+            (uploads / "Mercury" / "Qualità").mkdir(parents=True)
+            (uploads / "temp").mkdir()
+            (uploads / "Mercury" / "Qualità" / "copia1.pdf").write_bytes(b"stesso allegato")
+            (uploads / "temp" / "copia2.pdf").write_bytes(b"stesso allegato")
+            (uploads / "versione.pdf").write_bytes(b"allegato diverso")
+
+            doc1 = _documento(company, department, user, "copia1.pdf")
+            doc2 = _documento(company, department, user, "copia2.pdf")
+            _documento(company, department, user, "mancante.pdf")
+            db.session.flush()
+            db.session.add(DocumentVersion(document_id=doc1.id, version_number=1,
+                                           file_path=str(uploads / "versione.pdf")))
+            db.session.commit()
+
+            stats = migrate_legacy_files(remove_legacy=True)
+
+            assert stats['migrati'] == 2
+            assert stats['deduplicati'] == 1
+            assert stats['mancanti'] == 1
+            assert stats['bytes_risparmiati'] == len(b"stesso allegato")
+            assert doc1.blob_sha256 == doc2.blob_sha256
+            assert db.session.get(FileBlob, doc1.blob_sha256).ref_count == 2
+            assert db.session.get(FileHash, doc1.id).value == doc1.blob_sha256
+            assert open(resolve_path(doc2), 'rb').read() == b"stesso allegato"
+            assert doc1.versions[0].file_path == get_blob_store().path_for(doc1.versions[0].blob_sha256)
+            assert not (uploads / "temp" / "copia2.pdf").exists()
+
+    def test_gc_removes_unreferenced_blobs(self, app, database, storage):
+        """I blob senza riferimenti vengono eliminati dopo il periodo di grazia."""
+        with app.app_context():
+            company, department, user = _crea_base()
+            store = get_blob_store()
+            result, _ = store.put_stream(io.BytesIO(b"da eliminare"))
+            db.session.add(FileBlob(sha256=result.sha256, size=result.size))
+            doc = _documento(company, department, user, "temp.pdf", blob_sha256=result.sha256)
+            db.session.commit()
+
+            assert gc_blobs(grace_hours=0)['eliminati'] == 0
+            db.session.delete(doc)
+            db.session.commit()
+
+            stats = gc_blobs(grace_hours=0)
+            assert stats['eliminati'] == 1
+            assert not store.exists(result.sha256)
+            assert db.session.get(FileBlob, result.sha256) is None
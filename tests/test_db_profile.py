@@ -0,0 +1,50 @@
+"""
+Test profilo SQLite e coda di scrittura (services.db_profile).
+"""
+
+from sqlalchemy import create_engine, text
+
+from models import SecurityAuditLog
+from services.db_profile import SerialWriter, install_sqlite_pragmas, sqlite_pragmas
+
+
+class TestDbProfile:
+    """Test per pragma per connessione e scrittura in batch dal writer unico."""
+
+    def test_pragmas_applied_on_every_connection(self, tmp_path):
+        """WAL, busy_timeout, synchronous, mmap e cache su ogni nuova connessione."""
+        engine = create_engine(f"sqlite:///{tmp_path / 'profilo.db'}")
+        pragmas = sqlite_pragmas({'SQLITE_BUSY_TIMEOUT_MS': 7000, 'SQLITE_CACHE_SIZE_KB': 2048})
+        assert install_sqlite_pragmas(engine, pragmas)
+
+        with engine.connect() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == 'wal'
+            assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 7000
+            assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+            assert conn.execute(text("PRAGMA cache_size")).scalar() == -2048
+            assert conn.execute(text("PRAGMA mmap_size")).scalar() == 256 * 1024 * 1024
+        engine.dispose()
+
+    def test_memory_database_skips_wal(self):
+        """I database in memoria ricevono i pragma tranne journal_mode."""
+        engine = create_engine("sqlite://")
+        install_sqlite_pragmas(engine, sqlite_pragmas({}))
+        with engine.connect() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == 'memory'
+            assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+
+    def test_serial_writer_batches_inserts(self, app, database):
+        """Le righe accodate sono scritte in pochi batch e tutte presenti dopo il flush."""
+        writer = SerialWriter(app, max_batch=50, flush_ms=50)
+        for numero in range(120):
+            writer.submit(SecurityAuditLog, {'ip': '10.0.0.1', 'action': f"GET pagina_{numero}",
+                                             'meta': {'n': numero}})
+        writer.flush()
+        writer.stop()
+
+        with app.app_context():
+            assert SecurityAuditLog.query.filter(SecurityAuditLog.action.like('GET pagina_%')).count() == 120
+            riga = SecurityAuditLog.query.filter_by(action="GET pagina_7").one()
+            assert riga.meta == {'n': 7} and riga.ts is not None
+        assert writer.scritte == 120 and writer.errori == 0
+        assert 3 <= writer.batch < 120
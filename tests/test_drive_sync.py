@@ -0,0 +1,181 @@
+"""
+Test sincronizzazione Google Drive (services.drive_sync) contro un Drive fake locale.
+"""
+
+import os
+import pytest
+from datetime import datetime, timedelta
+
+from extensions import db
+from models import Company, Department, Document, DriveFolderCache, DriveUploadJob, User
+from scripts.fake_drive import start_fake_drive
+from services import drive_sync
+from services.drive_sync import (
+    DriveSyncClient, build_drive_service, enqueue_drive_upload, process_drive_queue
+)
+
+CHUNK = 256 * 1024
+
+
+@pytest.fixture
+def fake_drive():
+    server = start_fake_drive()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def drive_client(app, fake_drive):
+    app.config['GOOGLE_DRIVE_DISCOVERY_URL'] = fake_drive.discovery_url
+    with app.app_context():
+        client = DriveSyncClient(build_drive_service(app), 'root', chunk_size=CHUNK)
+    yield client
+    app.config.pop('GOOGLE_DRIVE_DISCOVERY_URL', None)
+
+
+def _crea_documento(tmp_path, size=CHUNK * 2 + 1000):
+    company = Company(name="Mercury")
+    db.session.add(company)
+    db.session.flush()
+    department = Department(name="Qualità", company_id=company.id)
+    user = User(username="mario", email="mario@mercury.com", password="x", role="user")
+    db.session.add_all([department, user])
+    db.session.flush()
+    local_path = tmp_path / "manuale.pdf"
+    local_path.write_bytes(os.urandom(size))
+    doc = Document(title="Manuale", filename="manuale.pdf", original_filename="Manuale HACCP.pdf",
+                   user_id=user.id, uploader_email=user.email, company_id=company.id,
+                   department_id=department.id, tag="HACCP")
+    db.session.add(doc)
+    db.session.commit()
+    return doc, str(local_path)
+
+
+class TestDriveSync:
+    """Test per cache cartelle, coda upload e ripresa degli upload resumable."""
+
+    def test_enqueue_does_not_call_drive(self, app, database, tmp_path, fake_drive):
+        """L'accodamento non effettua chiamate a Drive e aggiorna la nota di stato."""
+        with app.app_context():
+            doc, local_path = _crea_documento(tmp_path)
+            job = enqueue_drive_upload(doc, local_path)
+            assert job.subfolders == ["Mercury", "Qualità", "HACCP"]
+            assert doc.drive_status_note.startswith("⏳")
+            assert fake_drive.state.list_calls == 0
+            assert enqueue_drive_upload(doc, local_path).id == job.id
+
+    def test_chunked_upload_updates_document(self, app, database, tmp_path, fake_drive, drive_client):
+        """L'upload a chunk completa il documento con ID Drive e nota di stato."""
+        with app.app_context():
+            doc, local_path = _crea_documento(tmp_path)
+            enqueue_drive_upload(doc, local_path)
+            stats = process_drive_queue(client=drive_client)
+
+            assert stats['caricati'] == 1
+            uploaded = fake_drive.state.files[doc.drive_file_id]
+            assert uploaded['name'] == "Manuale HACCP.pdf"
+            assert uploaded['content'] == open(local_path, 'rb').read()
+            assert doc.drive_status_note.startswith("✅")
+            assert DriveUploadJob.query.one().stato == 'caricato'
+
+    def test_folder_path_is_cached(self, app, database, tmp_path, fake_drive, drive_client):
+        """Le cartelle vengono cercate una sola volta e restano in cache su DB."""
+        with app.app_context():
+            folder_id = drive_client.resolve_folder(["Mercury", "Qualità", "HACCP"])
+            calls = fake_drive.state.list_calls
+            assert drive_client.resolve_folder(["Mercury", "Qualità", "HACCP"]) == folder_id
+            assert fake_drive.state.list_calls == calls
+            db.session.commit()
+
+            # Nuovo client (es. dopo riavvio): la cache persistente evita le ricerche
+            fresh = DriveSyncClient(drive_client.service, 'root', chunk_size=CHUNK)
+            assert fresh.resolve_folder(["Mercury", "Qualità", "HACCP"]) == folder_id
+            assert fake_drive.state.list_calls == calls
+            assert DriveFolderCache.query.count() == 3
+
+    def test_interrupted_upload_resumes(self, app, database, tmp_path, fake_drive, drive_client):
+        """Un upload interrotto riprende dall'ultimo byte confermato."""
+        with app.app_context():
+            doc, local_path = _crea_documento(tmp_path)
+            size = os.path.getsize(local_path)
+            job = enqueue_drive_upload(doc, local_path)
+
+            # Dopo il primo chunk confermato Drive risponde 503 al successivo
+            original_upload = drive_client.upload_file
+
+            def _upload(*args, on_progress=None, **kwargs):
+                def _progress(uri, sent):
+                    on_progress(uri, sent)
+                    fake_drive.state.fail_puts = 1
+                return original_upload(*args, on_progress=_progress, **kwargs)
+
+            drive_client.upload_file = _upload
+            stats = process_drive_queue(client=drive_client)
+            drive_client.upload_file = original_upload
+
+            assert stats['errori'] == 1
+            assert job.stato == 'in_coda'
+            assert job.resumable_uri
+            assert job.bytes_inviati == CHUNK
+
+            job.prossimo_tentativo = datetime.utcnow()
+            db.session.commit()
+            stats = process_drive_queue(client=drive_client)
+
+            assert stats['caricati'] == 1
+            assert fake_drive.state.files[doc.drive_file_id]['content'] == open(local_path, 'rb').read()
+            assert fake_drive.state.bytes_ricevuti == size
+
+    def test_expired_session_restarts_upload(self, app, database, tmp_path, fake_drive, drive_client):
+        """Una sessione resumable scaduta (404) viene scartata e l'upload riparte da zero."""
+        with app.app_context():
+            doc, local_path = _crea_documento(tmp_path)
+            job = enqueue_drive_upload(doc, local_path)
+            job.resumable_uri = f"{fake_drive.base_url}/upload/session/scaduta"
+            job.bytes_inviati = CHUNK
+            db.session.commit()
+
+            stats = process_drive_queue(client=drive_client)
+            assert stats['errori'] == 1
+            assert job.resumable_uri is None and job.bytes_inviati == 0
+
+            job.prossimo_tentativo = datetime.utcnow()
+            db.session.commit()
+            assert process_drive_queue(client=drive_client)['caricati'] == 1
+            assert fake_drive.state.files[doc.drive_file_id]['content'] == open(local_path, 'rb').read()
+
+    def test_missing_local_file_fails(self, app, database, tmp_path, drive_client):
+        """Un file locale mancante marca subito l'upload come fallito."""
+        with app.app_context():
+            doc, local_path = _crea_documento(tmp_path)
+            enqueue_drive_upload(doc, local_path + ".missing")
+            stats = process_drive_queue(client=drive_client)
+            assert stats['falliti'] == 1
+            assert doc.drive_status_note.startswith("❌")
+
+    def test_concurrent_claims_take_job_once(self, app, database, tmp_path, monkeypatch):
+        """Due worker che leggono la coda insieme: solo uno prenota l'upload."""
+        with app.app_context():
+            doc, local_path = _crea_documento(tmp_path)
+            job = enqueue_drive_upload(doc, local_path)
+            # Upload orfano: in corso senza heartbeat, prenotabile da entrambi
+            job.stato = 'in_corso'
+            job.updated_at = datetime.utcnow() - timedelta(seconds=drive_sync.STALE_AFTER_SEC + 60)
+            db.session.commit()
+
+            candidati = drive_sync._candidati
+            secondo = []
+
+            def _candidati_in_gara(batch_size, now):
+                ids = candidati(batch_size, now)
+                # L'altro worker prenota dopo questa lettura ma prima dell'UPDATE
+                monkeypatch.setattr(drive_sync, '_candidati', candidati)
+                secondo.extend(drive_sync._claim_jobs(batch_size, now))
+                return ids
+
+            monkeypatch.setattr(drive_sync, '_candidati', _candidati_in_gara)
+            primo = drive_sync._claim_jobs(10, datetime.utcnow())
+
+            assert [j.id for j in secondo] == [job.id]
+            assert primo == []
+            assert DriveUploadJob.query.one().stato == 'in_corso'
@@ -0,0 +1,220 @@
+"""
+Test registro eventi unificato (services.event_store): cattura, partizioni, archivio e prime letture.
+"""
+
+import os
+from datetime import date, datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import Table
+from sqlalchemy.exc import OperationalError
+
+from extensions import db
+from models import DocumentAuditLog, DocumentReadLog, EventArchiveSegment, FirstReadBitmap, SecurityAuditLog, User
+from services import event_store
+from services.db_profile import SerialWriter
+from services.event_store import (
+    applica_retention, conta_eventi, ha_letto, install_listeners, leggi_eventi, partizioni_live, registra_evento,
+    segna_lettura,
+)
+
+_CHIAVI = ('EVENT_STORE_ENABLED', 'EVENT_STORE_CAPTURE', 'EVENT_STORE_LIVE_MONTHS',
+           'EVENT_STORE_RETENTION_MONTHS', 'EVENT_STORE_SOURCE_RETENTION_MONTHS', 'EVENT_ARCHIVE_DIR')
+
+
+@pytest.fixture
+def registro(app, database, tmp_path):
+    previous = {key: app.config.get(key) for key in _CHIAVI}
+    app.config.update({
+        'EVENT_STORE_ENABLED': True,
+        'EVENT_STORE_CAPTURE': None,
+        'EVENT_STORE_LIVE_MONTHS': 3,
+        'EVENT_STORE_RETENTION_MONTHS': 24,
+        'EVENT_STORE_SOURCE_RETENTION_MONTHS': 0,
+        'EVENT_ARCHIVE_DIR': str(tmp_path / "eventi"),
+    })
+    install_listeners()
+    yield tmp_path
+    with app.app_context():
+        for mese in partizioni_live():
+            event_store._elimina_partizione(mese, db.engine)
+    event_store._bitmap_cache.clear()
+    app.config.update(previous)
+
+
+class TestEventStore:
+    """Test per replica dei log, batch della coda, bitmap delle letture e archivio mensile."""
+
+    def test_log_rows_mirrored_after_commit(self, app, registro):
+        """Le righe di log confermate finiscono nel registro; quelle annullate no."""
+        with app.app_context():
+            db.session.add(DocumentAuditLog(document_id=7, user_id=3, evento="📥 Download eseguito"))
+            db.session.commit()
+            db.session.add(DocumentAuditLog(document_id=7, user_id=3, evento="annullato"))
+            db.session.flush()
+            db.session.rollback()
+
+            adesso = datetime.utcnow()
+            eventi = list(leggi_eventi(adesso.replace(day=1, hour=0), adesso, document_id=7))
+        assert len(eventi) == 1
+        assert eventi[0]['fonte'] == 'document_audit_logs'
+        assert eventi[0]['azione'] == "📥 Download eseguito"
+        assert eventi[0]['user_id'] == 3 and 'rif_id' in eventi[0]['dati']
+
+    def test_serial_writer_adds_events_to_batch(self, app, registro):
+        """L'audit delle richieste accodato genera gli eventi nello stesso batch."""
+        writer = SerialWriter(app, max_batch=100, flush_ms=50)
+        for numero in range(30):
+            writer.submit(SecurityAuditLog, {'ip': '10.0.0.2', 'action': f"GET /docs/{numero}",
+                                             'object_type': 'document', 'object_id': numero})
+        writer.flush()
+        writer.stop()
+
+        with app.app_context():
+            adesso = datetime.utcnow()
+            conteggi = conta_eventi(adesso.replace(day=1, hour=0), adesso, per='fonte')
+            evento = next(leggi_eventi(adesso.replace(day=1, hour=0), adesso, document_id=5))
+        assert conteggi['security_audit_log'] == 30
+        assert evento['ip'] == '10.0.0.2' and evento['azione'] == "GET /docs/5"
+        assert writer.errori == 0
+
+    def test_serial_writer_keeps_audit_when_events_fail(self, app, registro, monkeypatch):
+        """Un errore sulle partizioni del registro non fa perdere il batch di audit."""
+        def _errore(*args, **kwargs):
+            raise OperationalError("CREATE TABLE eventi", {}, Exception("disk I/O error"))
+
+        monkeypatch.setattr(event_store, 'assicura_partizione', _errore)
+        writer = SerialWriter(app, max_batch=100, flush_ms=50)
+        for numero in range(5):
+            writer.submit(SecurityAuditLog, {'ip': '10.0.0.3', 'action': f"GET /docs/{numero}"})
+        writer.flush()
+        writer.stop()
+
+        with app.app_context():
+            assert SecurityAuditLog.query.filter_by(ip='10.0.0.3').count() == 5
+        assert writer.errori == 0 and writer.scritte == 5
+
+    def test_partition_created_by_other_worker(self, app, registro, monkeypatch):
+        """Se un altro worker crea la partizione tra controllo e creazione, la scrittura prosegue."""
+        with app.app_context():
+            registra_evento('test', 'primo')
+            mese = event_store.mese_di(datetime.utcnow())
+            event_store._partizioni.discard(mese)
+
+            # Creazione senza controllo preventivo: la tabella c'è già, come dopo una corsa persa
+            create = Table.create
+            monkeypatch.setattr(Table, 'create', lambda self, bind, checkfirst=False: create(self, bind))
+            monkeypatch.setattr(event_store, 'inspect', lambda conn: SimpleNamespace(has_table=lambda nome: False))
+            event_store.assicura_partizione(mese)
+            monkeypatch.undo()
+
+            registra_evento('test', 'secondo')
+            adesso = datetime.utcnow()
+            assert conta_eventi(adesso.replace(day=1, hour=0), adesso, per='fonte')['test'] == 2
+
+    def test_first_read_bitmap(self, app, registro):
+        """Il bitmap parte dalle letture già registrate e segnala solo la prima lettura."""
+        with app.app_context():
+            db.session.add(DocumentReadLog(user_id=12, document_id=4))
+            db.session.commit()
+
+            assert ha_letto(12, 4)
+            assert not segna_lettura(12, 4)
+            assert segna_lettura(9, 4)
+            db.session.commit()
+            assert not segna_lettura(9, 4)
+
+            # Un altro processo (cache vuota) legge il bitmap salvato
+            event_store._bitmap_cache.clear()
+            assert ha_letto(9, 4) and not ha_letto(10, 4)
+
+    def test_first_read_keeps_bits_written_by_other_processes(self, app, registro):
+        """La scrittura del bitmap parte dalla riga salvata, non dalla copia in cache di un altro processo."""
+        with app.app_context():
+            assert segna_lettura(5, 8)
+            db.session.commit()
+            assert ha_letto(5, 8)
+
+            # Un altro processo (cache ferma a prima) registra la lettura dell'utente 7
+            event_store._bitmap_cache.clear()
+            event_store._ricorda_bitmap(8, bytearray())
+            assert segna_lettura(7, 8)
+            db.session.commit()
+
+            event_store._bitmap_cache.clear()
+            assert ha_letto(5, 8) and ha_letto(7, 8)
+            assert FirstReadBitmap.query.count() == 1
+
+    def test_read_is_tracked_when_bitmap_update_fails(self, app, registro, monkeypatch):
+        """Se il bitmap non si aggiorna la lettura resta registrata e il bitmap è ricostruito dai log."""
+        from utils import read_tracker
+
+        with app.app_context():
+            user = User(username="lia", email="lia@mercury.com", password="x", role="user")
+            db.session.add(user)
+            db.session.commit()
+            documento = SimpleNamespace(id=11, title="Manuale", filename="manuale.pdf")
+            assert segna_lettura(3, 11)
+            db.session.add(DocumentReadLog(user_id=3, document_id=11))
+            db.session.commit()
+
+            def _errore(*args, **kwargs):
+                raise OperationalError("UPDATE first_read_bitmaps", {}, Exception("database is locked"))
+
+            monkeypatch.setattr(read_tracker, 'segna_lettura', _errore)
+            monkeypatch.setattr('utils.audit_logger.log_event', lambda *args, **kwargs: None)
+            with app.test_request_context('/docs/11'):
+                read_log = read_tracker.track_document_read(documento, user)
+
+            assert read_log is not None and read_log.is_first_read
+            assert DocumentReadLog.query.filter_by(user_id=user.id, document_id=11).count() == 1
+            assert FirstReadBitmap.query.count() == 0
+            assert ha_letto(user.id, 11) and ha_letto(3, 11)
+
+    def test_archive_and_retention(self, app, registro):
+        """Le partizioni vecchie passano in segmenti gzip, restano leggibili e scadono per retention."""
+        with app.app_context():
+            for ts in (datetime(2026, 1, 15), datetime(2026, 7, 2), datetime(2026, 7, 30), datetime(2026, 10, 1)):
+                registra_evento('manus_sync', 'sync', user_id=1, ts=ts, utenti=3)
+            assert partizioni_live() == ['202601', '202607', '202610']
+
+            stats = applica_retention(app, oggi=date(2026, 10, 19))
+            assert stats == {'righe_log_eliminate': 0, 'archiviate': 2, 'eventi_archiviati': 3, 'segmenti_eliminati': 0}
+            assert partizioni_live() == ['202610']
+
+            eventi = list(leggi_eventi(datetime(2026, 1, 1), datetime(2026, 10, 31), fonte='manus_sync'))
+            assert [e['ts'].month for e in eventi] == [1, 7, 7, 10]
+            assert eventi[0]['dati'] == {'utenti': 3}
+            assert conta_eventi(datetime(2026, 1, 1), datetime(2026, 10, 31), per='mese') == {
+                '202601': 1, '202607': 2, '202610': 1}
+
+            app.config['EVENT_STORE_RETENTION_MONTHS'] = 6
+            assert applica_retention(app, oggi=date(2026, 10, 19))['segmenti_eliminati'] == 1
+            segmento, = EventArchiveSegment.query.all()
+            assert segmento.mese == '202607' and segmento.righe == 2
+            assert sorted(os.listdir(registro / "eventi")) == ['eventi_202607.jsonl.gz']
+
+    def test_source_log_retention(self, app, registro):
+        """Le righe di log già nel registro scadono dalle tabelle d'origine; le precedenti e le letture restano."""
+        with app.app_context():
+            # Riga scritta prima dell'attivazione del registro: non ne esiste una copia
+            app.config['EVENT_STORE_ENABLED'] = False
+            db.session.add(DocumentAuditLog(document_id=1, user_id=3, evento="prima", timestamp=datetime(2025, 1, 10)))
+            db.session.commit()
+            app.config['EVENT_STORE_ENABLED'] = True
+            db.session.add_all([
+                DocumentAuditLog(document_id=1, user_id=3, evento="vecchia", timestamp=datetime(2025, 6, 10)),
+                DocumentAuditLog(document_id=1, user_id=3, evento="recente", timestamp=datetime(2026, 10, 5)),
+                DocumentReadLog(user_id=3, document_id=1, timestamp=datetime(2025, 6, 10)),
+            ])
+            db.session.commit()
+
+            app.config['EVENT_STORE_SOURCE_RETENTION_MONTHS'] = 12
+            stats = applica_retention(app, oggi=date(2026, 10, 19))
+
+            assert stats['righe_log_eliminate'] == 1
+            assert sorted(r.evento for r in DocumentAuditLog.query) == ['prima', 'recente']
+            assert DocumentReadLog.query.count() == 1
+            eventi = list(leggi_eventi(datetime(2025, 6, 1), datetime(2025, 6, 30), fonte='document_audit_logs'))
+            assert [e['azione'] for e in eventi] == ['vecchia']
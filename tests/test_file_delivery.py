@@ -0,0 +1,84 @@
+"""
+Test consegna download (services.file_delivery): X-Accel-Redirect e risposte condizionali.
+"""
+
+import pytest
+
+from services.file_delivery import accel_location, deliver_file, file_etag, parse_accel_mappings
+
+
+@pytest.fixture
+def delivery_config(app, tmp_path):
+    previous = {key: app.config.get(key) for key in ('FILE_DELIVERY_BACKEND', 'X_ACCEL_MAPPINGS')}
+    app.config['X_ACCEL_MAPPINGS'] = f"{tmp_path / 'uploads'}=/protected/uploads/"
+    yield tmp_path
+    app.config.update(previous)
+
+
+def _crea_file(base, relative, content):
+    path = base / relative
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    return str(path)
+
+
+class TestFileDelivery:
+    """Test per backend x-accel, fallback Python, Range ed ETag."""
+
+    def test_accel_redirect_hands_off_to_nginx(self, app, delivery_config):
+        """Con il backend x-accel il worker risponde con i soli header."""
+        app.config['FILE_DELIVERY_BACKEND'] = 'x-accel'
+        path = _crea_file(delivery_config, "uploads/Mercury/Qualità/manuale 1.pdf", b"%PDF-1.7 contenuto")
+        with app.test_request_context('/download'):
+            response = deliver_file(path, download_name="Manuale qualità.pdf")
+
+        assert response.status_code == 200
+        assert response.headers['X-Accel-Redirect'] == "/protected/uploads/Mercury/Qualit%C3%A0/manuale%201.pdf"
+        assert response.get_data() == b""
+        assert response.mimetype == 'application/pdf'
+        disposition = response.headers['Content-Disposition']
+        assert disposition.startswith('attachment; filename="Manuale qualita.pdf"')
+        assert "filename*=UTF-8''Manuale%20qualit%C3%A0.pdf" in disposition
+
+    def test_unmapped_path_falls_back_to_worker(self, app, delivery_config):
+        """Un file fuori dalle directory mappate viene servito dal worker."""
+        app.config['FILE_DELIVERY_BACKEND'] = 'x-accel'
+        path = _crea_file(delivery_config, "reports/report.csv", b"a;b\n1;2\n")
+        with app.test_request_context('/download'):
+            response = deliver_file(path)
+            response.direct_passthrough = False
+
+        assert 'X-Accel-Redirect' not in response.headers
+        assert response.get_data() == b"a;b\n1;2\n"
+
+    def test_range_request_returns_partial_content(self, app, delivery_config):
+        """Il backend Python risponde 206 alle richieste Range."""
+        app.config['FILE_DELIVERY_BACKEND'] = 'python'
+        path = _crea_file(delivery_config, "uploads/grande.bin", bytes(range(256)) * 4)
+        with app.test_request_context('/download', headers={'Range': 'bytes=100-199'}):
+            response = deliver_file(path)
+            response.direct_passthrough = False
+
+        assert response.status_code == 206
+        assert response.headers['Content-Range'] == 'bytes 100-199/1024'
+        assert response.get_data() == (bytes(range(256)) * 4)[100:200]
+
+    def test_if_none_match_returns_not_modified(self, app, delivery_config):
+        """Un ETag già noto al client produce 304; per i blob l'ETag è lo SHA-256."""
+        app.config['FILE_DELIVERY_BACKEND'] = 'python'
+        sha256 = 'ab' * 32
+        path = _crea_file(delivery_config, f"uploads/blobs/ab/ab/{sha256}", b"blob")
+        assert file_etag(path) == sha256
+
+        with app.test_request_context('/download', headers={'If-None-Match': f'"{sha256}"'}):
+            response = deliver_file(path, download_name="documento.txt")
+
+        assert response.status_code == 304
+        assert response.headers['ETag'] == f'"{sha256}"'
+
+    def test_parse_mappings_prefers_longest_directory(self, tmp_path):
+        """La directory più specifica prevale nella scelta della location."""
+        mappings = parse_accel_mappings(f"{tmp_path}=/protected/root, {tmp_path / 'blobs'}=/protected/blobs")
+        assert accel_location(str(tmp_path / "blobs" / "ab" / "file"), mappings) == "/protected/blobs/ab/file"
+        assert accel_location(str(tmp_path / "altro.pdf"), mappings) == "/protected/root/altro.pdf"
+        assert accel_location("/etc/passwd", mappings) is None
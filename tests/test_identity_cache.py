@@ -0,0 +1,116 @@
+"""
+Test cache identità utente (services.identity_cache).
+"""
+
+import pytest
+from contextlib import contextmanager
+from sqlalchemy import event
+
+from extensions import db
+from models import Company, Department, User
+from services.identity_cache import (
+    get_principal, invalidate_identity, load_identity, register_identity_listeners
+)
+
+
+@contextmanager
+def _count_queries():
+    """Conta le query SQL eseguite nel blocco."""
+    statements = []
+
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', _before)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', _before)
+
+
+def _crea_utente():
+    mercury = Company(name="Mercury")
+    other = Company(name="Other")
+    db.session.add_all([mercury, other])
+    db.session.flush()
+    qualita = Department(name="Qualità", company_id=mercury.id)
+    db.session.add(qualita)
+    user = User(username="mario", email="mario@mercury.com", password="x", role="user")
+    user.companies.append(mercury)
+    user.departments.append(qualita)
+    db.session.add(user)
+    db.session.commit()
+    return user.id, mercury.id, other.id, qualita.id
+
+
+class TestIdentityCache:
+    """Test per caricamento, riuso e invalidazione dell'identità utente."""
+
+    @pytest.fixture(autouse=True)
+    def _setup(self, app):
+        register_identity_listeners()
+        invalidate_identity()
+        yield
+        app.config.pop('IDENTITY_CACHE_TTL_SEC', None)
+
+    def test_cache_hit_needs_no_queries(self, app, database):
+        """Dopo il primo caricamento, identità e appartenenze non richiedono SQL."""
+        with app.app_context():
+            user_id, mercury_id, _, qualita_id = _crea_utente()
+            db.session.remove()
+
+            with _count_queries() as first:
+                load_identity(user_id)
+            assert len(first) == 1
+            db.session.remove()
+
+            with _count_queries() as second:
+                user = load_identity(user_id)
+                principal = get_principal(user)
+                company_ids = [c.id for c in user.companies]
+            assert second == []
+            assert principal.company_ids == (mercury_id,)
+            assert principal.department_ids == (qualita_id,)
+            assert company_ids == [mercury_id]
+
+    def test_membership_edit_invalidates(self, app, database):
+        """Modificare le aziende dell'utente invalida la cache al commit."""
+        with app.app_context():
+            user_id, _, other_id, _ = _crea_utente()
+            user = load_identity(user_id)
+            user.companies.clear()
+            user.companies.append(db.session.get(Company, other_id))
+            db.session.commit()
+            db.session.remove()
+
+            assert get_principal(load_identity(user_id)).company_ids == (other_id,)
+
+    def test_role_change_invalidates(self, app, database):
+        """Un cambio di ruolo è visibile alla richiesta successiva."""
+        with app.app_context():
+            user_id, _, _, _ = _crea_utente()
+            user = load_identity(user_id)
+            user.role = 'admin'
+            db.session.commit()
+            db.session.remove()
+
+            principal = get_principal(load_identity(user_id))
+            assert principal.role == 'admin'
+            assert principal.is_admin
+
+    def test_disabled_with_zero_ttl(self, app, database):
+        """Con TTL 0 ogni caricamento interroga il database."""
+        with app.app_context():
+            app.config['IDENTITY_CACHE_TTL_SEC'] = 0
+            user_id, _, _, _ = _crea_utente()
+            db.session.remove()
+            load_identity(user_id)
+            db.session.remove()
+            with _count_queries() as statements:
+                load_identity(user_id)
+            assert len(statements) >= 1
+
+    def test_unknown_user(self, app, database):
+        """Un ID inesistente restituisce None."""
+        with app.app_context():
+            assert load_identity(999) is None
@@ -0,0 +1,53 @@
+"""
+Test indici compositi e index advisor (services.index_advisor).
+"""
+
+from services.index_advisor import analizza, colonne_filtrate, fingerprint_dal_log
+from services.query_metrics import fingerprint, scrivi_log
+
+
+class TestIndexAdvisor:
+    """Test per piani di esecuzione, scansioni complete e indici suggeriti."""
+
+    def test_hot_filters_use_composite_indexes(self, app, database):
+        """Le query del detector, degli alert download e delle condivisioni non scansionano le tabelle."""
+        query = [
+            "SELECT access_requests_new.id FROM access_requests_new WHERE access_requests_new.requested_by = ? "
+            "AND access_requests_new.file_id = ? AND access_requests_new.created_at >= ?",
+            "SELECT download_log.user_id, count(download_log.id) FROM download_log WHERE download_log.timestamp >= ? "
+            "AND download_log.timestamp <= ? AND download_log.status = ? GROUP BY download_log.user_id",
+            "SELECT document_shares.id FROM document_shares WHERE document_shares.file_id = ? "
+            "AND document_shares.user_id = ? AND document_shares.expires_at > ?",
+            "SELECT reminders.id FROM reminders WHERE reminders.tipo = ? AND reminders.entita_id = ? "
+            "AND reminders.scadenza = ?",
+        ]
+        with app.app_context():
+            risultati = analizza(database.engine, {fingerprint(sql): {'occorrenze': 1} for sql in query})
+        assert len(risultati) == 4
+        assert all(not r['scansioni'] and 'errore' not in r for r in risultati)
+
+    def test_full_scan_reported_with_suggested_index(self, app, database):
+        """Un filtro su colonne senza indice è segnalato con l'indice da creare."""
+        sql = fingerprint("SELECT r.id FROM reminders AS r WHERE r.destinatario_email = 'a@b.it' "
+                          "AND r.ultimo_invio < '2026-01-01'")
+        with app.app_context():
+            risultato, = analizza(database.engine, {sql: {'occorrenze': 12, 'endpoint': {'reminder.lista'}}})
+        scansione, = risultato['scansioni']
+        assert scansione['tabella'] == 'reminders'
+        assert scansione['colonne'] == ['destinatario_email', 'ultimo_invio']
+        assert scansione['indice_suggerito'] == (
+            "CREATE INDEX ix_reminders_destinatario_email_ultimo_invio ON reminders (destinatario_email, ultimo_invio)"
+        )
+        assert risultato['endpoint'] == ['reminder.lista']
+
+    def test_fingerprints_from_metrics_log(self, tmp_path):
+        """Le fingerprint del log JSONL sono sommate per occorrenze ed endpoint."""
+        path = str(tmp_path / "query_metrics.jsonl")
+        sql = "SELECT companies.name FROM companies WHERE companies.id = ?"
+        scrivi_log(path, {'endpoint': 'files_api.get_file_tree', 'n_plus_one': [{'fingerprint': sql, 'count': 40}]})
+        scrivi_log(path, {'endpoint': 'docs.lista', 'ripetute': [{'fingerprint': sql, 'count': 3}]})
+
+        dati = fingerprint_dal_log(path)
+        assert dati[sql]['occorrenze'] == 43
+        assert dati[sql]['endpoint'] == {'files_api.get_file_tree', 'docs.lista'}
+        assert colonne_filtrate(sql, 'companies') == ['id']
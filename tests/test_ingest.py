@@ -0,0 +1,118 @@
+"""
+Test pipeline di ingest in singola lettura (services.ingest, services.antivirus_service)
+contro un clamd fake locale.
+"""
+
+import hashlib
+import io
+import pytest
+
+from models import AntivirusHashCache, AntivirusScan, FileHash
+from scripts.fake_clamd import EICAR, start_fake_clamd
+from services.antivirus_service import AntivirusService
+from services.clamd_client import ClamdClient
+from services.ingest import ingest_stream, sniff_mime
+
+
+class _CountingStream(io.BytesIO):
+    """BytesIO che conta le letture effettuate."""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return super().read(size)
+
+
+@pytest.fixture
+def fake_clamd():
+    server = start_fake_clamd()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def service(fake_clamd):
+    service = AntivirusService()
+    service._client = ClamdClient(unix_socket=None, host='127.0.0.1', port=fake_clamd.port, timeout=5)
+    yield service
+    service.client.close()
+
+
+class TestIngest:
+    """Test per lettura unica, pool clamd, cache versione e cache hash puliti."""
+
+    def test_single_pass_hash_size_mime(self, tmp_path):
+        """Una sola lettura dello stream produce hash, dimensione, MIME e copia su disco."""
+        data = b'%PDF-1.7\n' + b'x' * (3 * 1024 * 1024)
+        stream = _CountingStream(data)
+        dest = tmp_path / "copia.pdf"
+        result = ingest_stream(stream, dest_path=str(dest), filename="manuale.bin", chunk_size=1024 * 1024)
+
+        assert result.sha256 == hashlib.sha256(data).hexdigest()
+        assert result.size == len(data)
+        assert result.mime == 'application/pdf'
+        assert dest.read_bytes() == data
+        assert stream.reads == 5  # 4 chunk + EOF
+        assert sniff_mime(b'qualsiasi', 'report.csv') == 'text/csv'
+
+    def test_connection_reused_and_version_cached(self, app, database, service, fake_clamd):
+        """Più scansioni riusano la stessa connessione e interrogano VERSION una sola volta."""
+        with app.app_context():
+            for i in range(3):
+                result = service.ingest(io.BytesIO(f"documento {i}".encode()))
+                assert result.scan['verdict'] == 'clean'
+
+            assert fake_clamd.state.connections == 1
+            assert fake_clamd.state.version_calls == 1
+            assert fake_clamd.state.ping_calls == 0
+            assert fake_clamd.state.scans == 3
+
+    def test_infected_file_is_blocked(self, app, database, service, fake_clamd):
+        """Un file con firma EICAR viene rilevato e rifiutato."""
+        with app.app_context():
+            result = service.ingest(io.BytesIO(b'prefisso ' + EICAR))
+            assert result.scan['verdict'] == 'infected'
+            assert 'EICAR' in result.scan['details']
+
+            is_safe, scan_result = service.record_ingest(42, result)
+            assert not is_safe
+            assert FileHash.query.get(42).value == result.sha256
+            assert AntivirusScan.query.filter_by(file_id=42).count() == 1
+            assert AntivirusHashCache.query.count() == 0
+
+    def test_known_clean_hash_skips_scan(self, app, database, service, fake_clamd):
+        """Un hash già pulito per la signature corrente non viene riscansionato."""
+        with app.app_context():
+            data = b'contenuto invariato' * 1000
+            first = service.ingest(io.BytesIO(data))
+            assert first.scan['verdict'] == 'clean'
+            assert AntivirusHashCache.query.count() == 1
+
+            second = service.ingest(io.BytesIO(data))
+            assert second.scan['verdict'] == 'clean'
+            assert second.scan.get('cached') is True
+            assert fake_clamd.state.scans == 1
+
+            # Nuove signature: il file viene scansionato di nuovo
+            fake_clamd.state.signature = '27001'
+            service.client.version(force=True)
+            third = service.ingest(io.BytesIO(data))
+            assert not third.scan.get('cached')
+            assert fake_clamd.state.scans == 2
+
+    def test_clamd_unavailable_respects_strict_mode(self, app, database):
+        """Senza clamd il verdetto è 'error' e la modalità strict blocca il file."""
+        service = AntivirusService()
+        service._client = ClamdClient(unix_socket=None, host='127.0.0.1', port=1, timeout=1)
+        with app.app_context():
+            result = service.ingest(io.BytesIO(b'dati'))
+            assert result.scan['verdict'] == 'error'
+            assert result.size == 4
+
+            service.strict_mode = True
+            is_safe, _ = service.record_ingest(7, result)
+            assert not is_safe
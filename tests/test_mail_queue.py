@@ -0,0 +1,117 @@
+"""
+Test coda email in uscita (services.mail_queue).
+"""
+
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from extensions import db, mail
+from models import OutboundEmail
+from services.mail_queue import enqueue_email, process_email_queue, flush_email_queue
+
+
+class TestMailQueue:
+    """Test per accodamento e invio batch delle email."""
+
+    def test_enqueue_does_not_send(self, app, database):
+        """L'accodamento non apre connessioni SMTP."""
+        with app.app_context():
+            with mail.record_messages() as outbox:
+                email = enqueue_email("Test", ["a@mercury.com"], body="ciao")
+            assert email.stato == 'in_coda'
+            assert outbox == []
+
+    def test_idempotency_key_deduplicates(self, app, database):
+        """Due email con la stessa chiave producono una sola riga."""
+        with app.app_context():
+            first = enqueue_email("Test", ["a@mercury.com"], body="1", idempotency_key="k-1")
+            second = enqueue_email("Test", ["a@mercury.com"], body="2", idempotency_key="k-1")
+            assert first.id == second.id
+            assert OutboundEmail.query.filter_by(idempotency_key="k-1").count() == 1
+
+    def test_batch_uses_single_connection(self, app, database):
+        """Un batch riusa una sola connessione SMTP."""
+        with app.app_context():
+            for i in range(5):
+                enqueue_email(f"Test {i}", [f"user{i}@mercury.com"], body="ciao")
+
+            with patch.object(mail, 'connect', wraps=mail.connect) as connect:
+                with mail.record_messages() as outbox:
+                    stats = process_email_queue(batch_size=10)
+
+            assert connect.call_count == 1
+            assert stats['inviate'] == 5
+            assert len(outbox) == 5
+            assert OutboundEmail.query.filter_by(stato='inviata').count() == 5
+
+    def test_failed_send_is_retried_with_backoff(self, app, database):
+        """Un errore SMTP pianifica un nuovo tentativo e poi marca la email come fallita."""
+        with app.app_context():
+            email = enqueue_email("Test", ["a@mercury.com"], body="ciao", max_tentativi=2)
+
+            with patch.object(mail, 'connect', side_effect=ConnectionRefusedError("smtp down")):
+                stats = process_email_queue()
+            assert stats['errori'] == 1
+            assert email.stato == 'in_coda'
+            assert email.tentativi == 1
+            assert email.prossimo_tentativo > datetime.utcnow()
+
+            email.prossimo_tentativo = datetime.utcnow() - timedelta(seconds=1)
+            db.session.commit()
+            with patch.object(mail, 'connect', side_effect=ConnectionRefusedError("smtp down")):
+                process_email_queue()
+            assert email.stato == 'fallita'
+
+    def test_flush_sends_attachments(self, app, database):
+        """Gli allegati vengono ricostruiti al momento dell'invio."""
+        with app.app_context():
+            enqueue_email("Firmato", ["a@mercury.com"], html="<p>ok</p>",
+                          attachments=[("doc.pdf", "application/pdf", b"%PDF-1.4")])
+            with mail.record_messages() as outbox:
+                flush_email_queue()
+            assert len(outbox) == 1
+            assert outbox[0].attachments[0].data == b"%PDF-1.4"
+
+    def test_claimed_emails_are_skipped_by_other_workers(self, app, database):
+        """Le email prenotate da un altro worker non vengono reinviate."""
+        with app.app_context():
+            presa = enqueue_email("Presa", ["a@mercury.com"], body="1")
+            libera = enqueue_email("Libera", ["b@mercury.com"], body="2")
+            presa.stato = 'in_invio'
+            presa.prossimo_tentativo = datetime.utcnow() + timedelta(minutes=10)
+            db.session.commit()
+
+            with mail.record_messages() as outbox:
+                stats = process_email_queue()
+            assert stats['inviate'] == 1
+            assert [m.subject for m in outbox] == ["Libera"]
+            assert presa.stato == 'in_invio' and libera.stato == 'inviata'
+
+            # Prenotazione scaduta (worker terminato): l'email torna in coda e parte
+            presa.prossimo_tentativo = datetime.utcnow() - timedelta(seconds=1)
+            db.session.commit()
+            with mail.record_messages() as outbox:
+                process_email_queue()
+            assert [m.subject for m in outbox] == ["Presa"]
+
+    def test_each_sent_email_is_committed(self, app, database):
+        """Un errore a metà batch non rimette in coda le email già inviate."""
+        with app.app_context():
+            for i in range(3):
+                enqueue_email(f"Test {i}", [f"user{i}@mercury.com"], body="ciao")
+
+            inviate = []
+
+            def send(msg):
+                if len(inviate) == 2:
+                    raise KeyboardInterrupt("worker terminato")
+                inviate.append(msg.subject)
+
+            with patch('flask_mail.Connection.send', side_effect=send):
+                try:
+                    process_email_queue()
+                except KeyboardInterrupt:
+                    db.session.rollback()
+
+            stati = {e.subject: e.stato for e in OutboundEmail.query}
+            assert stati == {"Test 0": 'inviata', "Test 1": 'inviata', "Test 2": 'in_invio'}
@@ -0,0 +1,166 @@
+"""
+Test sincronizzazione Manus (services.manus_sync) contro un server Manus locale finto.
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from extensions import db
+from models import (Company, Document, ManusCourseLink, ManusManualLink, ManusSyncCursor, ManusUserMapping,
+                    TrainingCompletionManus, User)
+from services.manus_sync import sync_all_for_company, sync_completions_for_company
+from services.manus_user_mapping import upsert_mapping
+from services.query_metrics import profila_query
+
+
+class FakeManus:
+    """Stato del server finto: manuali, corsi, completamenti e richieste ricevute."""
+
+    def __init__(self):
+        self.manuals = [{'id': f"m{n}", 'title': f"Manuale {n}", 'version': 1} for n in range(5)]
+        self.courses = [{'id': "c1", 'code': "SIC01", 'title': "Sicurezza"},
+                        {'id': "c2", 'code': "PRIV", 'title': "Privacy"}]
+        self.completions = {
+            'c1': [{'id': 1, 'user_email': "Mario@Mercury.com", 'user_id': "u1", 'completed_at': "2026-10-01T08:00:00Z"},
+                   {'id': 2, 'user_email': "ignoto@esterno.it", 'user_id': "u9", 'completed_at': "2026-10-02T08:00:00Z"}],
+            'c2': [{'id': 3, 'user_email': "anna@mercury.com", 'user_id': "u2", 'completed_at': "2026-10-03T09:30:00Z"}],
+        }
+        self.richieste = []
+        self.errori_courses = 1
+
+    def rispondi(self, path, query):
+        per_page = int(query.get('per_page', ['100'])[0])
+        page = int(query.get('page', ['1'])[0])
+        if path == '/manuals':
+            items = self.manuals
+        elif path == '/courses':
+            if self.errori_courses:
+                self.errori_courses -= 1
+                return 503, {'error': 'busy'}
+            items = self.courses
+        elif path.startswith('/courses/') and path.endswith('/completions'):
+            items = self.completions.get(path.split('/')[2], [])
+            if 'since' in query:
+                items = [row for row in items if row['completed_at'] >= query['since'][0]]
+        else:
+            return 404, {'error': 'not found'}
+        pages = max(1, -(-len(items) // per_page))
+        return 200, {'items': items[(page - 1) * per_page:page * per_page], 'page': page, 'pages': pages}
+
+
+@pytest.fixture
+def manus(app):
+    stato = FakeManus()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            stato.richieste.append((url.path, query))
+            status, body = stato.rispondi(url.path, query)
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    chiavi = ('MANUS_BASE_URL', 'MANUS_API_KEY', 'MANUS_PAGE_SIZE', 'MANUS_MAX_WORKERS')
+    previous = {key: app.config.get(key) for key in chiavi}
+    app.config.update({'MANUS_BASE_URL': f"http://127.0.0.1:{server.server_port}", 'MANUS_API_KEY': "test",
+                       'MANUS_PAGE_SIZE': 2, 'MANUS_MAX_WORKERS': 3})
+    yield stato
+    server.shutdown()
+    server.server_close()
+    app.config.update(previous)
+
+
+def _crea_azienda():
+    company = Company(name="Mercury")
+    db.session.add(company)
+    db.session.add_all([User(username="mario", email="mario@mercury.com", password="x", role="user"),
+                        User(username="anna", email="anna@mercury.com", password="x", role="user")])
+    db.session.commit()
+    return company.id
+
+
+class TestManusSync:
+    """Test per diff dello stato locale, pagine in parallelo e cursori incrementali."""
+
+    def test_full_sync_applies_remote_state_in_bulk(self, app, database, manus):
+        """Pagine, retry e mapping utenti: stato locale allineato senza query per elemento."""
+        with app.app_context():
+            azienda_id = _crea_azienda()
+            # Documento già presente con lo stesso titolo: collegato, non duplicato
+            db.session.add(Document(company_id=azienda_id, title="Manuale 2", filename="m2.pdf",
+                                    original_filename="m2.pdf", user_id=1, uploader_email="mario@mercury.com",
+                                    department_id=1))
+            db.session.commit()
+
+            with profila_query(threshold=3) as profilo:
+                stats = sync_all_for_company(azienda_id, "mercury")
+
+            assert profilo.n_plus_one() == []
+            assert stats['manuali'] == {'documenti_creati': 4, 'link_creati': 5, 'versioni_aggiornate': 0}
+            assert stats['corsi'] == {'requisiti_creati': 2, 'link_creati': 2}
+            assert stats['completamenti']['creati'] == 2 and stats['completamenti']['non_mappati'] == 1
+            assert Document.query.filter_by(title="Manuale 2").count() == 1
+            assert ManusManualLink.query.count() == 5 and ManusCourseLink.query.count() == 2
+            assert {m.manus_user_id: m.active for m in ManusUserMapping.query} == {'u9': False}
+            assert ManusSyncCursor.query.count() == 2
+
+        pagine_manuali = sorted(q['page'][0] for path, q in manus.richieste if path == '/manuals')
+        assert pagine_manuali == ['1', '2', '3']
+        assert not any('since' in q for path, q in manus.richieste if path.endswith('/completions'))
+
+    def test_incremental_completions_from_cursor(self, app, database, manus):
+        """La seconda sincronizzazione chiede solo le novità e aggiorna i completamenti più recenti."""
+        with app.app_context():
+            azienda_id = _crea_azienda()
+            sync_all_for_company(azienda_id, "mercury")
+            cursore = ManusSyncCursor.query.filter_by(azienda_id=azienda_id, risorsa="completions:c1").one().cursor
+
+            manus.completions['c1'].append({'id': 4, 'user_email': "mario@mercury.com", 'user_id': "u1",
+                                            'completed_at': "2099-01-01T10:00:00Z"})
+            manus.richieste.clear()
+            stats = sync_completions_for_company(azienda_id)
+
+            # Righe: il nuovo completamento e quello di u9, ancora non mappato
+            assert stats['creati'] == 0 and stats['aggiornati'] == 1 and stats['righe'] == 2
+            mario = User.query.filter_by(email="mario@mercury.com").one()
+            rec = TrainingCompletionManus.query.filter_by(user_id=mario.id).one()
+            assert rec.completed_at.year == 2099
+
+        richieste = {path: q for path, q in manus.richieste}
+        assert richieste['/courses/c1/completions']['since'] == [cursore]
+
+    def test_completion_applied_after_user_is_mapped(self, app, database, manus):
+        """Il cursore resta fermo sui completamenti non mappati: compaiono appena il mapping è attivo."""
+        with app.app_context():
+            azienda_id = _crea_azienda()
+            sync_all_for_company(azienda_id, "mercury")
+            cursore = ManusSyncCursor.query.filter_by(azienda_id=azienda_id, risorsa="completions:c1").one()
+            assert cursore.cursor <= "2026-10-02T08:00:00Z"
+
+            luca = User(username="luca", email="luca@mercury.com", password="x", role="user")
+            db.session.add(luca)
+            db.session.commit()
+            upsert_mapping("u9", luca.id)
+
+            stats = sync_completions_for_company(azienda_id)
+
+            assert stats['creati'] == 1
+            rec = TrainingCompletionManus.query.filter_by(user_id=luca.id).one()
+            assert rec.manus_course_id == "c1"
+            # Nessun completamento in sospeso: il cursore torna ad avanzare
+            cursore = ManusSyncCursor.query.filter_by(azienda_id=azienda_id, risorsa="completions:c1").one()
+            assert cursore.cursor > "2026-10-02T08:00:00Z"
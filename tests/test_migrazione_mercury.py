@@ -0,0 +1,139 @@
+"""
+Test migrazione DOCS Mercury a batch (scripts/migrazione_docs_mercury.py): batch, checkpoint e dry-run.
+"""
+
+import json
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+
+from extensions import db
+from scripts.migrazione_docs_mercury import Checkpoint, DataMigrator
+
+_SCHEMA_ORIGINE = """
+CREATE TABLE companies (id INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE user_companies (user_id INTEGER, company_id INTEGER);
+CREATE TABLE documents (id INTEGER PRIMARY KEY, company_id INTEGER);
+CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT, email TEXT, password TEXT, first_name TEXT,
+                    last_name TEXT, role TEXT, company_id INTEGER, department_id INTEGER, created_at DATETIME,
+                    last_login DATETIME, is_active BOOLEAN, access_expiration DATETIME);
+CREATE TABLE guest_users (id INTEGER PRIMARY KEY, email TEXT, password_hash TEXT, registered_at DATETIME,
+                          is_active BOOLEAN, access_expiration DATETIME, last_login DATETIME);
+CREATE TABLE guest_activities (guest_user_id INTEGER, document_id INTEGER);
+CREATE TABLE guest_comments (guest_user_id INTEGER, document_id INTEGER);
+"""
+
+
+@pytest.fixture
+def basi(tmp_path):
+    """Database origine con 7 utenti e 3 guest Mercury, destinazione con lo schema dell'applicazione."""
+    origine = create_engine(f"sqlite:///{tmp_path / 'origine.db'}")
+    destinazione = create_engine(f"sqlite:///{tmp_path / 'destinazione.db'}")
+    with origine.begin() as conn:
+        for statement in _SCHEMA_ORIGINE.split(';'):
+            if statement.strip():
+                conn.execute(text(statement))
+        conn.execute(text("INSERT INTO companies VALUES (1, 'Mercury Surgelati'), (2, 'Altra')"))
+        conn.execute(text("INSERT INTO documents VALUES (10, 1), (11, 2)"))
+        conn.execute(text("INSERT INTO user_companies VALUES (8, 1)"))
+        conn.execute(
+            text("INSERT INTO users (id, username, email, password, first_name, last_name, role, company_id, "
+                 "created_at) VALUES (:id, :username, :email, 'hash', 'Nome', 'Cognome', 'user', :company, "
+                 "'2025-01-01 08:00:00')"),
+            [{'id': n, 'username': f"utente{n}", 'email': f"utente{n}@mercury.com", 'company': 1} for n in range(1, 7)]
+            + [{'id': 7, 'username': "esterno", 'email': "esterno@altra.it", 'company': 2},
+               {'id': 8, 'username': "collegato", 'email': "collegato@mercury.com", 'company': 2}]
+        )
+        conn.execute(
+            text("INSERT INTO guest_users (id, email, password_hash, registered_at) "
+                 "VALUES (:id, :email, 'hash', '2025-02-01 09:00:00')"),
+            [{'id': n, 'email': f"guest{n}@esterno.it"} for n in range(1, 5)]
+        )
+        conn.execute(text("INSERT INTO guest_activities VALUES (1, 10), (2, 10), (4, 11)"))
+        conn.execute(text("INSERT INTO guest_comments VALUES (3, 10)"))
+
+    db.metadata.create_all(bind=destinazione)
+    with destinazione.begin() as conn:
+        conn.execute(text("INSERT INTO users (username, email, password, first_name, last_name, role, can_download) "
+                          "VALUES ('utente2', 'utente2@mercury.com', 'hash', 'Vecchio', 'Cognome', 'user', 1)"))
+
+    sessioni = sessionmaker(bind=origine)(), sessionmaker(bind=destinazione)()
+    yield sessioni + (destinazione,)
+    for sessione in sessioni:
+        sessione.close()
+    origine.dispose()
+    destinazione.dispose()
+
+
+def _conta(sessione, tabella):
+    return sessione.execute(text(f"SELECT COUNT(*) FROM {tabella}")).scalar()
+
+
+class TestMigrazioneMercury:
+    """Test per verifica a batch, insert multipli, ripresa da checkpoint e report del dry-run."""
+
+    def test_batched_migration_with_checkpoint(self, basi, tmp_path):
+        """Query per batch e non per riga; il checkpoint registra l'ultimo id di ogni fase."""
+        origine, destinazione, engine = basi
+        statement = []
+
+        def registra(conn, cursor, sql, *args):
+            statement.append(sql)
+
+        event.listen(engine, 'before_cursor_execute', registra)
+
+        checkpoint = Checkpoint(str(tmp_path / "checkpoint.json"))
+        migrator = DataMigrator(origine, destinazione, batch_size=3, checkpoint=checkpoint)
+        assert migrator.migrate_users() and migrator.migrate_guests()
+        event.remove(engine, 'before_cursor_execute', registra)
+
+        assert migrator.stats['users_imported'] == 6 and migrator.stats['users_skipped'] == 1
+        assert migrator.stats['guests_imported'] == 3
+        assert _conta(destinazione, 'users') == 7 and _conta(destinazione, 'guest_users') == 3
+        assert _conta(destinazione, 'attivita_ai') == 9
+        assert destinazione.execute(text("SELECT first_name FROM users WHERE email = 'utente2@mercury.com'")).scalar() \
+            == "Vecchio"
+        # 3 batch utenti + 1 guest, al massimo 4 statement ciascuno (verifica, insert, id, attività AI)
+        insert_utenti = [s for s in statement if s.lstrip().startswith('INSERT INTO users')]
+        assert len(insert_utenti) == 3 and len(statement) <= 16
+        assert json.loads((tmp_path / "checkpoint.json").read_text()) == {'users': 8, 'guests': 3}
+        assert migrator.stats['throughput']['users']['righe'] == 7
+
+    def test_resume_after_failed_batch(self, basi, tmp_path):
+        """Un batch fallito viene annullato; la nuova esecuzione riparte dal checkpoint senza duplicati."""
+        origine, destinazione, _ = basi
+        destinazione.execute(text("INSERT INTO users (username, email, password, role) "
+                                  "VALUES ('utente5', 'altro@mercury.com', 'hash', 'user')"))
+        destinazione.commit()
+
+        path = str(tmp_path / "checkpoint.json")
+        migrator = DataMigrator(origine, destinazione, batch_size=2, checkpoint=Checkpoint(path))
+        assert not migrator.migrate_users()
+        assert Checkpoint(path).get('users') == 4
+        assert _conta(destinazione, 'users') == 5
+
+        destinazione.execute(text("DELETE FROM users WHERE email = 'altro@mercury.com'"))
+        destinazione.commit()
+        ripresa = DataMigrator(origine, destinazione, batch_size=2, checkpoint=Checkpoint(path))
+        assert ripresa.migrate_users()
+        assert ripresa.stats['users_imported'] == 3
+        assert _conta(destinazione, 'users') == 7
+        assert _conta(destinazione, 'attivita_ai') == 6
+
+    def test_dry_run_diff_report(self, basi, tmp_path):
+        """Il dry-run scrive solo il report delle differenze e non tocca destinazione e checkpoint."""
+        origine, destinazione, _ = basi
+        report = tmp_path / "diff.jsonl"
+        migrator = DataMigrator(origine, destinazione, batch_size=4,
+                                checkpoint=Checkpoint(str(tmp_path / "checkpoint.json")), report_path=str(report))
+        assert migrator.migrate_users(dry_run=True, overwrite=True)
+        migrator.close_report()
+
+        voci = {voce['email']: voce for voce in map(json.loads, report.read_text().splitlines())}
+        assert voci['utente1@mercury.com']['azione'] == 'nuovo'
+        assert voci['utente2@mercury.com']['azione'] == 'aggiorna'
+        assert voci['utente2@mercury.com']['differenze'] == {'first_name': ["Vecchio", "Nome"]}
+        assert migrator.stats['users_imported'] == 6 and migrator.stats['users_updated'] == 1
+        assert _conta(destinazione, 'users') == 1 and _conta(destinazione, 'attivita_ai') == 0
+        assert not (tmp_path / "checkpoint.json").exists()
@@ -0,0 +1,113 @@
+"""
+Test cache preview per hash contenuto (services.preview_service): rendering
+multi-pagina, worker in background ed eviction LRU.
+"""
+
+import os
+import time
+import pytest
+from PIL import Image
+
+from services import preview_service
+from services.preview_service import (
+    STATO_IN_CODA, STATO_NON_DISPONIBILE, STATO_PRONTA,
+    enqueue_preview, get_preview_cache, preview_kind, preview_status, render_previews
+)
+
+
+@pytest.fixture
+def preview_config(app, tmp_path):
+    keys = ('PREVIEW_CACHE_DIR', 'PREVIEW_CACHE_MAX_BYTES', 'PREVIEW_ASYNC', 'PREVIEW_MAX_PAGES')
+    previous = {key: app.config.get(key) for key in keys}
+    app.config['PREVIEW_CACHE_DIR'] = str(tmp_path / "preview_cache")
+    app.config['PREVIEW_CACHE_MAX_BYTES'] = 10 * 1024 * 1024
+    app.config['PREVIEW_ASYNC'] = True
+    app.config['PREVIEW_MAX_PAGES'] = 20
+    yield tmp_path
+    preview_service.shutdown_preview_workers()
+    app.config.update(previous)
+
+
+def _immagine(path, size=(2000, 1000), frames=1):
+    images = [Image.new('RGB', size, color=(40 * i, 100, 200)) for i in range(frames)]
+    images[0].save(str(path), save_all=frames > 1, append_images=images[1:])
+    return str(path)
+
+
+class TestPreviewCache:
+    """Test per chiavi per hash, dimensioni, pagine, pool di worker ed eviction."""
+
+    def test_renders_all_sizes_and_pages(self, app, preview_config):
+        """Un contenuto multi-pagina produce thumb e viewer per ogni pagina."""
+        source = _immagine(preview_config / "scansione.tiff", frames=3)
+        sha256 = 'a' * 64
+        with app.app_context():
+            meta = render_previews(sha256, source, 'image')
+            assert meta['pagine'] == 3
+
+            stato, path = preview_status(sha256, 'thumb', 2)
+            assert stato == STATO_PRONTA
+            assert path == os.path.join(str(preview_config / "preview_cache"), 'aa', sha256, 'thumb_p2.png')
+            assert max(Image.open(path).size) == 256
+            assert max(Image.open(preview_status(sha256, 'viewer', 1)[1]).size) == 1400
+            assert preview_status(sha256, 'viewer', 4)[0] == STATO_NON_DISPONIBILE
+            assert preview_status('b' * 64, 'viewer', 1)[0] == STATO_IN_CODA
+
+    def test_background_worker_deduplicates(self, app, preview_config, monkeypatch):
+        """Lo stesso contenuto accodato più volte viene generato una sola volta."""
+        source = _immagine(preview_config / "foto.png")
+        calls = []
+        original = preview_service.render_previews
+
+        def _lento(*args, **kwargs):
+            calls.append(args[0])
+            time.sleep(0.2)
+            return original(*args, **kwargs)
+
+        monkeypatch.setattr(preview_service, 'render_previews', _lento)
+        with app.app_context():
+            first = enqueue_preview('c' * 64, source, "foto.png")
+            second = enqueue_preview('c' * 64, source, "foto.png")
+            assert first is second
+            assert first.result(timeout=10)['pagine'] == 1
+            assert calls == ['c' * 64]
+            assert preview_status('c' * 64, 'thumb', 1)[0] == STATO_PRONTA
+            assert enqueue_preview('d' * 64, source, "archivio.zip") is None
+
+    def test_failed_render_is_not_retried_immediately(self, app, preview_config):
+        """Un errore di rendering viene registrato e la preview risulta non disponibile."""
+        broken = preview_config / "rotto.png"
+        broken.write_bytes(b"non un'immagine")
+        with app.app_context():
+            meta = render_previews('e' * 64, str(broken), 'image')
+            assert meta['pagine'] == 0 and meta['errore']
+            assert preview_status('e' * 64, 'viewer', 1)[0] == STATO_NON_DISPONIBILE
+
+    def test_lru_eviction_respects_budget(self, app, preview_config):
+        """Oltre il budget vengono eliminate le preview usate meno di recente."""
+        source = _immagine(preview_config / "grande.png", size=(1400, 1400))
+        with app.app_context():
+            cache = get_preview_cache()
+            for sha256 in ('1' * 64, '2' * 64, '3' * 64):
+                render_previews(sha256, source, 'image', cache)
+            # La più vecchia per creazione è la più recente per uso
+            old = time.time() - 3600
+            for i, sha256 in enumerate(('2' * 64, '3' * 64, '1' * 64)):
+                for size in ('thumb', 'viewer'):
+                    os.utime(cache.path_for(sha256, size, 1), (old + i, old + i))
+            assert cache.get('1' * 64, 'viewer', 1)
+
+            per_content = sum(os.path.getsize(cache.path_for('1' * 64, size, 1)) for size in ('thumb', 'viewer'))
+            stats = cache.enforce_budget(max_bytes=int(per_content * 2.5))
+
+            assert stats['bytes_dopo'] <= per_content * 2.5 * 0.9
+            assert not os.path.exists(cache.dir_for('2' * 64))
+            assert cache.get('1' * 64, 'viewer', 1)
+            assert preview_status('2' * 64, 'viewer', 1)[0] == STATO_IN_CODA
+
+    def test_preview_kind(self):
+        """Il tipo di sorgente è determinato dall'estensione."""
+        assert preview_kind("Manuale.PDF") == 'pdf'
+        assert preview_kind("offerta.docx") == 'office'
+        assert preview_kind("foto.jpeg") == 'image'
+        assert preview_kind("dati.zip") is None
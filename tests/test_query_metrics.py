@@ -0,0 +1,83 @@
+"""
+Test metriche query per richiesta e rilevamento N+1 (services.query_metrics).
+"""
+
+from flask import Flask
+from sqlalchemy import create_engine, text
+
+from services.query_metrics import fingerprint, init_query_metrics, leggi_log, profila_query, stats
+
+
+def _engine():
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE companies (id INTEGER PRIMARY KEY, name TEXT)"))
+        conn.execute(text("INSERT INTO companies (id, name) VALUES (1, 'A'), (2, 'B'), (3, 'C')"))
+    return engine
+
+
+class TestQueryMetrics:
+    """Test per fingerprint, conteggio delle query e segnalazione N+1 nelle richieste."""
+
+    def test_fingerprint_normalizes_literals_and_in_lists(self):
+        """Parametri, letterali e liste IN di lunghezza diversa danno la stessa fingerprint."""
+        a = fingerprint("SELECT * FROM documents WHERE id = 5 AND title = 'x'  AND company_id IN (?, ?, ?)")
+        b = fingerprint("SELECT *\n FROM documents WHERE id = ? AND title = 'altro' AND company_id IN (?, ?)")
+        assert a == b == "SELECT * FROM documents WHERE id = ? AND title = ? AND company_id IN (?...)"
+        assert fingerprint("SELECT x::text FROM t WHERE id = :id") == "SELECT x::text FROM t WHERE id = ?"
+
+    def test_profile_flags_repeated_selects(self):
+        """Una SELECT per riga oltre la soglia è segnalata; una query con IN no."""
+        engine = _engine()
+        with profila_query(threshold=3) as profilo, engine.connect() as conn:
+            for company_id in (1, 2, 3, 1):
+                conn.execute(text("SELECT name FROM companies WHERE id = :id"), {'id': company_id}).scalar()
+            conn.execute(text("SELECT name FROM companies WHERE id IN (1, 2, 3)")).all()
+
+        assert profilo.query == 5
+        sospette = profilo.n_plus_one()
+        assert len(sospette) == 1
+        assert sospette[0]['count'] == 4 and 'WHERE id = ?' in sospette[0]['fingerprint']
+
+        # Fuori dal blocco le query non vengono registrate
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1")).scalar()
+        assert profilo.query == 5
+
+    def test_request_headers_stats_and_log(self, tmp_path):
+        """Header di sviluppo, statistiche per endpoint e riga JSONL per la richiesta con N+1."""
+        engine = _engine()
+        log_path = tmp_path / "query_metrics.jsonl"
+        app = Flask(__name__)
+        app.config.update(QUERY_METRICS_HEADERS=True, QUERY_METRICS_N_PLUS_ONE_THRESHOLD=3,
+                          QUERY_METRICS_LOG_PATH=str(log_path))
+        init_query_metrics(app)
+
+        @app.route('/albero')
+        def albero():
+            with engine.connect() as conn:
+                ids = [r[0] for r in conn.execute(text("SELECT id FROM companies"))]
+                nomi = [conn.execute(text("SELECT name FROM companies WHERE id = :id"), {'id': i}).scalar()
+                        for i in ids]
+            return {'nomi': nomi}
+
+        @app.route('/ping')
+        def ping():
+            return 'ok'
+
+        stats.reset()
+        client = app.test_client()
+        response = client.get('/albero')
+        assert response.headers['X-DB-Query-Count'] == '4'
+        assert response.headers['X-DB-N-Plus-One'] == '1'
+        assert response.headers['Server-Timing'].startswith('db;dur=')
+        assert client.get('/ping').headers['X-DB-Query-Count'] == '0'
+
+        voci = leggi_log(str(log_path))
+        assert len(voci) == 1
+        assert voci[0]['endpoint'] == 'albero' and voci[0]['n_plus_one'][0]['count'] == 3
+
+        per_endpoint = {riga['endpoint']: riga for riga in stats.snapshot()}
+        assert per_endpoint['albero']['query_max'] == 4
+        assert per_endpoint['albero']['richieste_n_plus_one'] == 1
+        assert per_endpoint['ping']['query_media'] == 0
@@ -0,0 +1,150 @@
+"""
+Test rollup giornalieri e mensili dei report (services.report_rollup).
+"""
+
+from datetime import date, datetime, timedelta
+
+from extensions import db
+from models import (
+    AdminLog, Company, Department, Document, DownloadLog, LetturaPDF,
+    MetricRollupDaily, MetricRollupMonthly, User
+)
+from services.report_rollup import (
+    M_ADMIN_LOG_TOTALE, M_DOC_APPROVATI_NON_FIRMATI, M_DOC_IN_ATTESA, M_DOC_SCADENZA_NON_APPROVATI,
+    M_DOWNLOAD, M_LETTURE, _parti, aggiorna_rollup, metrica_admin_log, serie_mensile, totale, totali_cumulati, totali_per
+)
+
+OGGI = date(2025, 3, 10)
+
+
+def _documento(**campi):
+    company = Company.query.first()
+    if company is None:
+        company = Company(name="Mercury")
+        db.session.add(company)
+        db.session.flush()
+        db.session.add(Department(name="Qualità", company_id=company.id))
+        db.session.add(User(username="anna", email="anna@mercury.com", password="x", role="user"))
+        db.session.flush()
+    department = Department.query.first()
+    user = User.query.first()
+    valori = dict(title="Manuale", filename="manuale.pdf", user_id=user.id, uploader_email=user.email,
+                  company_id=company.id, department_id=department.id)
+    valori.update(campi)
+    doc = Document(**valori)
+    db.session.add(doc)
+    db.session.flush()
+    return doc
+
+
+def _download(doc, quando):
+    db.session.add(DownloadLog(user_id=doc.user_id, document_id=doc.id, timestamp=quando))
+
+
+class TestReportRollup:
+    """Test per aggiornamento incrementale, correzione dei dati tardivi e letture per periodo."""
+
+    def test_totals_match_raw_counts_across_months(self, app, database):
+        """Le somme su periodi a cavallo di mesi coincidono con i conteggi grezzi."""
+        with app.app_context():
+            doc = _documento()
+            altro = _documento(title="Procedura")
+            for quando in (datetime(2025, 1, 5, 9), datetime(2025, 1, 31, 23), datetime(2025, 2, 1, 0, 30),
+                           datetime(2025, 2, 14, 12), datetime(2025, 3, 9, 8)):
+                _download(doc, quando)
+            _download(altro, datetime(2025, 2, 14, 13))
+            db.session.add(LetturaPDF(user_id=doc.user_id, document_id=doc.id, timestamp=datetime(2025, 2, 2)))
+            db.session.commit()
+
+            aggiorna_rollup(oggi=OGGI)
+
+            assert totale(M_DOWNLOAD) == 6
+            assert totale(M_DOWNLOAD, date(2025, 1, 31), date(2025, 2, 28)) == 4
+            assert totale(M_DOWNLOAD, date(2025, 1, 15), date(2025, 3, 9), document_id=doc.id) == 4
+            assert totale(M_LETTURE, date(2025, 2, 1), date(2025, 2, 1)) == 0
+            assert totali_per([M_DOWNLOAD], 'document_id', date(2025, 2, 1), date(2025, 2, 28)) == {
+                doc.id: {M_DOWNLOAD: 2}, altro.id: {M_DOWNLOAD: 1}
+            }
+            assert serie_mensile(M_DOWNLOAD, date(2024, 12, 1), date(2025, 3, 1)) == {
+                date(2024, 12, 1): 0, date(2025, 1, 1): 2, date(2025, 2, 1): 3, date(2025, 3, 1): 1
+            }
+            fini = [date(2024, 12, 31), date(2025, 1, 31), date(2025, 2, 13), date(2025, 3, 9)]
+            assert totali_cumulati(M_DOWNLOAD, fini) == {fine: totale(M_DOWNLOAD, fine=fine) for fine in fini}
+            assert list(totali_cumulati(M_DOWNLOAD, fini).values()) == [0, 2, 3, 6]
+            mensile = db.session.get(MetricRollupMonthly, (M_DOWNLOAD, date(2025, 2, 1), doc.company_id,
+                                                           doc.department_id, doc.id))
+            assert mensile.valore == 2
+
+    def test_late_events_correct_past_buckets(self, app, database):
+        """Un evento inserito dopo il passaggio ma datato nel passato corregge giorno e mese."""
+        with app.app_context():
+            doc = _documento()
+            _download(doc, datetime(2025, 3, 9))
+            db.session.commit()
+            aggiorna_rollup(lookback_giorni=1, oggi=OGGI)
+
+            _download(doc, datetime(2024, 11, 20))  # fuori dalla finestra recente
+            recente = DownloadLog.query.filter_by(document_id=doc.id).first()
+            db.session.delete(recente)  # rimozione dentro la finestra recente
+            db.session.commit()
+            aggiorna_rollup(lookback_giorni=1, oggi=OGGI)
+
+            assert serie_mensile(M_DOWNLOAD, date(2024, 11, 1), date(2025, 3, 1)) == {
+                date(2024, 11, 1): 1, date(2024, 12, 1): 0, date(2025, 1, 1): 0,
+                date(2025, 2, 1): 0, date(2025, 3, 1): 0
+            }
+            assert MetricRollupDaily.query.filter_by(metrica=M_DOWNLOAD).count() == 1
+
+    def test_document_metrics_follow_status_changes(self, app, database):
+        """I contatori documentali riflettono i cambi di stato al passaggio successivo."""
+        with app.app_context():
+            doc = _documento(stato_approvazione='in_attesa', created_at=datetime(2025, 2, 3),
+                             expiry_date=datetime(2025, 2, 20))
+            _documento(stato_approvazione='approvato', is_signed=False, created_at=datetime(2025, 1, 10))
+            db.session.commit()
+            aggiorna_rollup(oggi=OGGI)
+
+            assert totale(M_DOC_IN_ATTESA, date(2025, 2, 1), date(2025, 2, 28)) == 1
+            assert totale(M_DOC_SCADENZA_NON_APPROVATI, date(2025, 2, 1), date(2025, 2, 28)) == 1
+            assert totale(M_DOC_APPROVATI_NON_FIRMATI) == 1
+
+            doc.stato_approvazione = 'approvato'
+            doc.is_signed = True
+            db.session.commit()
+            aggiorna_rollup(oggi=OGGI)
+
+            assert totale(M_DOC_IN_ATTESA, date(2025, 2, 1), date(2025, 2, 28)) == 0
+            assert serie_mensile(M_DOC_SCADENZA_NON_APPROVATI, date(2025, 2, 1), date(2025, 2, 1)) == {
+                date(2025, 2, 1): 0
+            }
+            assert totale(M_DOC_APPROVATI_NON_FIRMATI) == 1
+
+    def test_admin_log_classes(self, app, database):
+        """Gli eventi AdminLog sono contati per classe (un'azione può averne più d'una)."""
+        with app.app_context():
+            for action in ("update_permission", "create_user", "Upload documento", "login"):
+                db.session.add(AdminLog(action=action, performed_by="admin", timestamp=datetime(2025, 2, 5)))
+            db.session.commit()
+            aggiorna_rollup(oggi=OGGI)
+
+            febbraio = (date(2025, 2, 1), date(2025, 2, 28))
+            assert totale(M_ADMIN_LOG_TOTALE, *febbraio) == 4
+            assert totale(metrica_admin_log('permessi'), *febbraio) == 1
+            assert totale(metrica_admin_log('documenti'), *febbraio) == 2
+            assert totale(metrica_admin_log('utenti'), *febbraio) == 1
+
+    def test_period_split_uses_monthly_rows_for_whole_months(self):
+        """Mesi interi dai mensili, giorni ai bordi dai giornalieri."""
+        parti = _parti(date(2025, 1, 15), date(2025, 4, 10))
+        assert [(m.__tablename__, a, b) for m, a, b in parti] == [
+            ('metric_rollup_monthly', date(2025, 2, 1), date(2025, 4, 1)),
+            ('metric_rollup_daily', date(2025, 1, 15), date(2025, 2, 1)),
+            ('metric_rollup_daily', date(2025, 4, 1), date(2025, 4, 11)),
+        ]
+        assert [m.__tablename__ for m, _, _ in _parti(date(2025, 2, 3), date(2025, 2, 20))] == ['metric_rollup_daily']
+        assert [(m.__tablename__, a, b) for m, a, b in _parti(None, date(2025, 3, 31))] == [
+            ('metric_rollup_monthly', None, date(2025, 4, 1))
+        ]
+        assert _parti(date(2025, 1, 1), date(2025, 1, 1) + timedelta(days=30)) == [
+            (MetricRollupMonthly, date(2025, 1, 1), date(2025, 2, 1))
+        ]
@@ -0,0 +1,155 @@
+"""
+Test sessioni di reporting (services.reporting_db).
+"""
+
+import sqlite3
+
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import NullPool
+
+from extensions import db
+from models import SecurityAuditLog
+from services.reporting_db import (
+    REPORTING_BIND, _install_sqlite_limits, aggiorna_snapshot, aggiorna_snapshot_reporting, in_reporting_session,
+    init_reporting, reporting_bind, reporting_query, reporting_session,
+)
+
+
+class TestReportingDb:
+    """Test per scelta del bind, limiti delle connessioni e snapshot SQLite."""
+
+    def test_bind_by_mode(self, tmp_path):
+        """primary usa un pool dedicato, snapshot il file copiato, replica richiede l'URI."""
+        primario = f"sqlite:///{tmp_path / 'app.db'}"
+        assert reporting_bind({'SQLALCHEMY_DATABASE_URI': primario}) == {'url': primario}
+        assert reporting_bind({'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:'}) is None
+
+        snapshot = reporting_bind({'SQLALCHEMY_DATABASE_URI': primario, 'REPORTING_DATABASE_MODE': 'snapshot',
+                                   'REPORTING_SNAPSHOT_PATH': str(tmp_path / 'snap.db')})
+        assert snapshot['url'].endswith('snap.db') and snapshot['poolclass'] is NullPool
+
+        replica = reporting_bind({'REPORTING_DATABASE_MODE': 'replica',
+                                  'REPORTING_DATABASE_URI': 'postgresql://report@replica/docs',
+                                  'REPORTING_STATEMENT_TIMEOUT_MS': 5000})
+        assert replica['max_overflow'] == 0
+        assert 'statement_timeout=5000' in replica['connect_args']['options']
+        with pytest.raises(RuntimeError):
+            reporting_bind({'REPORTING_DATABASE_MODE': 'replica'})
+
+    def test_sqlite_connection_is_read_only_with_timeout(self, tmp_path):
+        """Le scritture sono rifiutate e una query oltre il timeout viene interrotta."""
+        path = tmp_path / 'app.db'
+        with sqlite3.connect(path) as conn:
+            conn.execute("CREATE TABLE t (n INTEGER)")
+        engine = create_engine(f"sqlite:///{path}")
+        _install_sqlite_limits(engine, timeout_ms=50, pragmas={'busy_timeout': 1000})
+
+        with engine.connect() as conn:
+            assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 1000
+            with pytest.raises(OperationalError):
+                conn.execute(text("INSERT INTO t VALUES (1)"))
+        with engine.connect() as conn:
+            with pytest.raises(OperationalError, match="interrupted"):
+                conn.execute(text(
+                    "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT count(*) FROM c"
+                )).scalar()
+        engine.dispose()
+
+    def test_snapshot_copies_database(self, tmp_path):
+        """Lo snapshot contiene i dati del database principale ed è sostituito a ogni aggiornamento."""
+        sorgente = tmp_path / 'app.db'
+        snapshot = tmp_path / 'report' / 'snap.db'
+        with sqlite3.connect(sorgente) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE t (n INTEGER)")
+            conn.execute("INSERT INTO t VALUES (1)")
+        aggiorna_snapshot(str(sorgente), str(snapshot))
+        with sqlite3.connect(sorgente) as conn:
+            conn.execute("INSERT INTO t VALUES (2)")
+        aggiorna_snapshot(str(sorgente), str(snapshot))
+
+        with sqlite3.connect(snapshot) as conn:
+            assert conn.execute("SELECT count(*) FROM t").fetchone()[0] == 2
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'delete'
+        assert not (tmp_path / 'report' / 'snap.db.tmp').exists()
+
+    def test_decorator_scopes_functions_and_generators(self):
+        """Il contesto di reporting è attivo solo durante l'esecuzione, anche tra i chunk di un generatore."""
+
+        @reporting_query
+        def report():
+            return in_reporting_session()
+
+        @reporting_query
+        def stream():
+            yield in_reporting_session()
+            yield in_reporting_session()
+
+        assert report() is True
+        gen = stream()
+        assert next(gen) is True
+        assert in_reporting_session() is False
+        assert list(gen) == [True]
+        assert in_reporting_session() is False
+
+    def test_session_routes_reads_to_snapshot(self, tmp_path):
+        """Dentro reporting_session() db.session legge dallo snapshot, fuori dal database principale."""
+        app = Flask(__name__)
+        app.config.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'app.db'}",
+                          REPORTING_DATABASE_MODE='snapshot', REPORTING_SNAPSHOT_PATH=str(tmp_path / 'snap.db'))
+        app.config['SQLALCHEMY_BINDS'] = {REPORTING_BIND: reporting_bind(app.config)}
+        db.init_app(app)
+        try:
+            with app.app_context():
+                db.session.execute(text("CREATE TABLE t (n INTEGER)"))
+                db.session.execute(text("INSERT INTO t VALUES (1)"))
+                db.session.commit()
+            init_reporting(app)
+
+            with app.app_context():
+                db.session.execute(text("INSERT INTO t VALUES (2)"))
+                db.session.commit()
+                conta = text("SELECT count(*) FROM t")
+                with reporting_session():
+                    assert db.session.execute(conta).scalar() == 1
+                assert db.session.execute(conta).scalar() == 2
+                db.session.remove()
+
+            assert aggiorna_snapshot_reporting(app)
+            with app.app_context(), reporting_session():
+                assert db.session.execute(text("SELECT count(*) FROM t")).scalar() == 2
+                db.session.remove()
+                for engine in db.engines.values():
+                    engine.dispose()
+        finally:
+            # Il bind registrato sull'istanza condivisa romperebbe create_all delle app senza reporting
+            db.metadatas.pop(REPORTING_BIND, None)
+
+    def test_pending_write_flushes_to_primary(self, tmp_path):
+        """Una scrittura in sospeso prima del blocco di reporting va al database principale con l'autoflush."""
+        app = Flask(__name__)
+        app.config.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'app.db'}",
+                          REPORTING_DATABASE_MODE='snapshot', REPORTING_SNAPSHOT_PATH=str(tmp_path / 'snap.db'))
+        app.config['SQLALCHEMY_BINDS'] = {REPORTING_BIND: reporting_bind(app.config)}
+        db.init_app(app)
+        try:
+            with app.app_context():
+                SecurityAuditLog.__table__.create(db.engine)
+            init_reporting(app)
+
+            with app.app_context():
+                db.session.add(SecurityAuditLog(ip='10.0.0.4', action="GET /report"))
+                with reporting_session():
+                    # Autoflush dell'INSERT sul principale, SELECT sullo snapshot (ancora vuoto)
+                    assert SecurityAuditLog.query.count() == 0
+                    assert db.session.execute(text("SELECT count(*) FROM security_audit_log")).scalar() == 0
+                db.session.commit()
+                assert SecurityAuditLog.query.count() == 1
+                db.session.remove()
+                for engine in db.engines.values():
+                    engine.dispose()
+        finally:
+            db.metadatas.pop(REPORTING_BIND, None)
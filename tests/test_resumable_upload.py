@@ -0,0 +1,115 @@
+"""
+Test upload a chunk riprendibili (services.resumable_upload): offset, checksum e chiusura.
+"""
+
+import base64
+import hashlib
+import io
+from datetime import datetime, timedelta
+
+import pytest
+
+from extensions import db
+from models import ResumableUpload, User
+from services import resumable_upload
+from services.resumable_upload import (
+    UploadError, completa_upload, crea_upload, get_upload, parse_checksum, parse_metadata,
+    pulisci_upload_scaduti, resumable_file, scrivi_chunk,
+)
+
+
+@pytest.fixture
+def upload_config(app, tmp_path):
+    previous = {
+        'RESUMABLE_UPLOAD_DIR': app.config.get('RESUMABLE_UPLOAD_DIR'),
+        'RESUMABLE_UPLOAD_MAX_PENDING': app.config.get('RESUMABLE_UPLOAD_MAX_PENDING', 10),
+    }
+    app.config['RESUMABLE_UPLOAD_DIR'] = str(tmp_path / "resumable")
+    yield tmp_path
+    app.config.update(previous)
+
+
+def _crea_utente():
+    user = User(username="mario", email="mario@mercury.com", password="x", role="user")
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def _metadata(**valori):
+    return ','.join(f"{k} {base64.b64encode(v.encode()).decode()}" for k, v in valori.items())
+
+
+def _checksum(data):
+    return f"sha256 {base64.b64encode(hashlib.sha256(data).digest()).decode()}"
+
+
+class TestResumableUpload:
+    """Test per creazione, chunk, ripresa dopo errori e consegna ai form di upload."""
+
+    def test_chunks_resume_and_complete(self, app, database, upload_config):
+        """I chunk si accodano dall'offset del server e lo SHA-256 sopravvive al cambio di worker."""
+        contenuto = b"%PDF-1.7\n" + b"x" * 5000
+        with app.app_context():
+            user = _crea_utente()
+            upload = crea_upload(user.id, len(contenuto),
+                                 parse_metadata(_metadata(filename="manuale.pdf", filetype="application/pdf")))
+
+            assert scrivi_chunk(upload, io.BytesIO(contenuto[:2000]), 0,
+                                parse_checksum(_checksum(contenuto[:2000]))) == 2000
+            with pytest.raises(UploadError) as offset_errato:
+                scrivi_chunk(upload, io.BytesIO(contenuto[2000:]), 1000)
+            assert offset_errato.value.status == 409
+
+            # Chunk corrotto: scartato, l'offset resta quello dell'ultimo chunk valido
+            with pytest.raises(UploadError) as corrotto:
+                scrivi_chunk(upload, io.BytesIO(contenuto[2000:4000]), 2000, parse_checksum(_checksum(b"altro")))
+            assert corrotto.value.status == 460
+            assert get_upload(upload.id, user.id).offset == 2000
+
+            # Richiesta servita da un altro worker: hash ricostruito dal file parziale
+            resumable_upload._hashers.clear()
+            scrivi_chunk(upload, io.BytesIO(contenuto[2000:]), 2000)
+            completa_upload(upload)
+
+            assert upload.stato == 'completato'
+            assert upload.sha256 == hashlib.sha256(contenuto).hexdigest()
+            assert upload.mime == 'application/pdf'
+            with app.test_request_context('/upload'):
+                file = resumable_file(upload.id, user.id)
+                assert file.filename == "manuale.pdf"
+                assert file.read() == contenuto
+                file.close()
+                assert resumable_file(upload.id, user.id + 1) is None
+
+    def test_declared_sha256_mismatch_cancels_upload(self, app, database, upload_config):
+        """Un file diverso dall'hash dichiarato non viene consegnato."""
+        with app.app_context():
+            user = _crea_utente()
+            upload = crea_upload(user.id, 4, {'filename': 'a.txt', 'sha256': hashlib.sha256(b"abcd").hexdigest()})
+            scrivi_chunk(upload, io.BytesIO(b"abce"), 0)
+
+            with pytest.raises(UploadError) as errore:
+                completa_upload(upload)
+            assert errore.value.status == 460
+            with pytest.raises(UploadError) as annullato:
+                get_upload(upload.id, user.id)
+            assert annullato.value.status == 410
+
+    def test_limits_and_cleanup(self, app, database, upload_config):
+        """Troppi upload in corso sono rifiutati; gli scaduti vengono eliminati con il file."""
+        app.config['RESUMABLE_UPLOAD_MAX_PENDING'] = 1
+        with app.app_context():
+            user = _crea_utente()
+            upload = crea_upload(user.id, 10, {'filename': 'lungo.bin'})
+            with pytest.raises(UploadError) as troppi:
+                crea_upload(user.id, 10, {'filename': 'altro.bin'})
+            assert troppi.value.status == 429
+
+            path = resumable_upload.partial_path(upload)
+            upload.expires_at = datetime.utcnow() - timedelta(minutes=1)
+            database.session.commit()
+
+            assert pulisci_upload_scaduti() == 1
+            assert ResumableUpload.query.count() == 0
+            assert not (upload_config / "resumable" / path.rsplit('/', 1)[-1]).exists()
@@ -0,0 +1,88 @@
+"""
+Test scheduler singleton con leader election (scheduler_leader).
+"""
+
+from datetime import datetime, timedelta
+
+from apscheduler.triggers.interval import IntervalTrigger
+
+from extensions import db
+from models import SchedulerLeaderLock, ScheduledJobStatus
+from scheduler_leader import (
+    DatabaseLeaderLock, FileLeaderLock, LeaderElectedScheduler, run_tracked_job
+)
+
+
+class TestLeaderLock:
+    """Test per i backend di lock."""
+
+    def test_database_lock_single_holder(self, app, database):
+        """Solo un processo alla volta detiene il lock."""
+        with app.app_context():
+            a = DatabaseLeaderLock(db.engine, 'host:1:a', lease_sec=60)
+            b = DatabaseLeaderLock(db.engine, 'host:2:b', lease_sec=60)
+            assert a.acquire() is True
+            assert b.acquire() is False
+            assert a.renew() is True
+
+    def test_database_lock_takeover_after_expiry(self, app, database):
+        """Un lease scaduto può essere acquisito da un altro processo."""
+        with app.app_context():
+            a = DatabaseLeaderLock(db.engine, 'host:1:a', lease_sec=60)
+            b = DatabaseLeaderLock(db.engine, 'host:2:b', lease_sec=60)
+            assert a.acquire()
+            lock = db.session.get(SchedulerLeaderLock, a.name)
+            lock.expires_at = datetime.utcnow() - timedelta(seconds=1)
+            db.session.commit()
+            assert b.acquire() is True
+            assert a.renew() is False
+
+    def test_file_lock_single_holder(self, tmp_path):
+        """Il lock su file esclude gli altri processi dello stesso host."""
+        path = str(tmp_path / 'scheduler.lock')
+        a = FileLeaderLock(path, 'a')
+        b = FileLeaderLock(path, 'b')
+        assert a.acquire() is True
+        assert b.acquire() is False
+        a.release()
+        assert b.acquire() is True
+        b.release()
+
+
+class TestLeaderElectedScheduler:
+    """Test per scheduler e bookkeeping dei job."""
+
+    def test_only_leader_starts_scheduler(self, app, database):
+        """Con due istanze solo una avvia lo scheduler."""
+        registrar = lambda scheduler, app: scheduler.add_job(
+            func=lambda: None, trigger=IntervalTrigger(hours=1), id='noop', name='Noop')
+        with app.app_context():
+            first = LeaderElectedScheduler(app, [registrar], lock=DatabaseLeaderLock(db.engine, 'a'))
+            second = LeaderElectedScheduler(app, [registrar], lock=DatabaseLeaderLock(db.engine, 'b'))
+        try:
+            first.tick()
+            second.tick()
+            assert first.is_leader is True
+            assert second.is_leader is False
+            with app.app_context():
+                assert db.session.get(ScheduledJobStatus, 'noop').next_run_at is not None
+        finally:
+            first.stop()
+            second.stop()
+
+    def test_tracked_job_records_duration_and_errors(self, app, database):
+        """Il wrapper registra esecuzioni, durata ed errori."""
+        leader = LeaderElectedScheduler(app, [], lock=FileLeaderLock('/dev/null', 'x'))
+
+        def failing():
+            raise ValueError("boom")
+
+        run_tracked_job(app, leader, 'job_ok', lambda: None, ())
+        run_tracked_job(app, leader, 'job_ko', failing, ())
+        with app.app_context():
+            ok = db.session.get(ScheduledJobStatus, 'job_ok')
+            ko = db.session.get(ScheduledJobStatus, 'job_ko')
+            assert ok.last_status == 'success' and ok.run_count == 1
+            assert ok.last_duration_ms is not None
+            assert ko.last_status == 'error' and ko.error_count == 1
+            assert 'boom' in ko.last_error
@@ -0,0 +1,72 @@
+"""
+Test backend delle sessioni e migrazione dal filesystem (services.session_backend).
+"""
+
+import os
+import time
+from datetime import timedelta
+
+import pytest
+from cachelib.file import FileSystemCache
+from flask import Flask, session
+
+from services.session_backend import LEGACY_KEY_PREFIX, init_sessions, pulisci_sessioni_filesystem
+
+
+def _app(backend, legacy_dir):
+    app = Flask(__name__)
+    app.config.update(SECRET_KEY='test-secret-key', SESSION_BACKEND=backend,
+                      SESSION_LEGACY_DIR=str(legacy_dir), PERMANENT_SESSION_LIFETIME=timedelta(minutes=30))
+    init_sessions(app)
+
+    @app.route('/whoami')
+    def whoami():
+        return {'user_id': session.get('_user_id'), 'guest_email': session.get('guest_email')}
+
+    return app
+
+
+class TestSessionBackend:
+    """Test per sessioni su cookie firmato, migrazione delle sessioni filesystem e pulizia."""
+
+    def test_legacy_filesystem_session_moves_to_signed_cookie(self, tmp_path):
+        """Il cookie di una sessione filesystem viene convertito senza perdere il login."""
+        FileSystemCache(cache_dir=str(tmp_path)).set(LEGACY_KEY_PREFIX + 'abc123', {'_user_id': '7'})
+        app = _app('cookie', tmp_path)
+        client = app.test_client()
+        client.set_cookie(app.config['SESSION_COOKIE_NAME'], 'abc123')
+
+        response = client.get('/whoami')
+        assert response.json['user_id'] == '7'
+        nuovo_cookie = client.get_cookie(app.config['SESSION_COOKIE_NAME']).value
+        assert nuovo_cookie != 'abc123'
+        assert FileSystemCache(cache_dir=str(tmp_path)).get(LEGACY_KEY_PREFIX + 'abc123') is None
+
+        # Richieste successive: solo cookie firmato
+        assert client.get('/whoami').json['user_id'] == '7'
+
+    def test_unknown_cookie_gives_empty_session(self, tmp_path):
+        """Un cookie senza sessione legacy produce una sessione vuota."""
+        app = _app('cookie', tmp_path)
+        client = app.test_client()
+        client.set_cookie(app.config['SESSION_COOKIE_NAME'], 'sconosciuto')
+        assert client.get('/whoami').json == {'user_id': None, 'guest_email': None}
+
+    def test_cleanup_removes_only_expired_files(self, tmp_path):
+        """Sono eliminati i file non aggiornati oltre la durata della sessione."""
+        vecchio = tmp_path / "vecchio"
+        recente = tmp_path / "recente"
+        contatore = tmp_path / "__wz_cache_count"
+        for path in (vecchio, recente, contatore):
+            path.write_bytes(b"x")
+        passato = time.time() - 3600
+        os.utime(vecchio, (passato, passato))
+        os.utime(contatore, (passato, passato))
+
+        assert pulisci_sessioni_filesystem(str(tmp_path), 1800) == 1
+        assert sorted(os.listdir(tmp_path)) == ["__wz_cache_count", "recente"]
+
+    def test_invalid_backend(self, tmp_path):
+        """Un backend sconosciuto blocca l'avvio."""
+        with pytest.raises(RuntimeError):
+            _app('memcached', tmp_path)
@@ -0,0 +1,148 @@
+"""
+Test scanner dello storage e manifest di presenza file (services.storage_scanner).
+"""
+
+import os
+import time
+import pytest
+
+from extensions import db
+from models import (
+    Company, Department, Document, EventoFormazione, FileBlob, PartecipazioneFormazione,
+    StorageManifestEntry, User
+)
+from services.blob_store import get_blob_store
+from services.storage_scanner import (
+    StorageWatcher, file_available, missing_files, orphaned_files, presence_map, sweep
+)
+
+
+@pytest.fixture
+def storage(app, tmp_path):
+    """UPLOAD_FOLDER, blob store e root di scansione in una directory temporanea."""
+    keys = ('UPLOAD_FOLDER', 'BLOB_STORE_ROOT', 'STORAGE_SCAN_ROOTS', 'STORAGE_SCAN_HASH')
+    previous = {key: app.config.get(key) for key in keys}
+    uploads = tmp_path / "uploads"
+    uploads.mkdir()
+    app.config['UPLOAD_FOLDER'] = str(uploads)
+    app.config['BLOB_STORE_ROOT'] = str(uploads / "blobs")
+    app.config['STORAGE_SCAN_ROOTS'] = str(uploads)
+    app.config['STORAGE_SCAN_HASH'] = True
+    yield uploads
+    app.config.update(previous)
+
+
+def _scrivi(path, content=b"contenuto"):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    return str(path)
+
+
+def _partecipazione(firma=None, attestato=None):
+    user = User(username="anna", email="anna@mercury.com", password="x", role="user")
+    evento = EventoFormazione(titolo="Sicurezza")
+    db.session.add_all([user, evento])
+    db.session.flush()
+    partecipazione = PartecipazioneFormazione(evento_id=evento.id, user_id=user.id,
+                                              firma_presenza_path=firma, attestato_path=attestato)
+    db.session.add(partecipazione)
+    db.session.commit()
+    return partecipazione, user
+
+
+class TestStorageScanner:
+    """Test per sweep incrementale, lettura del manifest, mancanti/orfani e inotify."""
+
+    def test_sweep_tracks_new_changed_and_missing_files(self, app, database, storage):
+        """La sweep registra file nuovi, modifiche (con nuovo hash) e file spariti."""
+        with app.app_context():
+            a = _scrivi(storage / "Mercury" / "a.pdf", b"uno")
+            b = _scrivi(storage / "b.pdf", b"due")
+            _scrivi(storage / "preview_cache" / "aa" / "thumb_p1.png", b"cache")
+            _scrivi(storage / "resumable" / "0f3c.part", b"upload in corso")
+
+            stats = sweep()
+            assert stats['nuovi'] == 2
+            entry = db.session.get(StorageManifestEntry, a)
+            assert entry.present and entry.size == 3 and entry.root == str(storage)
+            first_hash = entry.sha256
+
+            with open(a, 'wb') as f:
+                f.write(b"uno modificato")
+            os.utime(a, (time.time() + 5, time.time() + 5))
+            os.remove(b)
+            stats = sweep()
+
+            assert stats['modificati'] == 1 and stats['mancanti'] == 1 and stats['nuovi'] == 0
+            assert db.session.get(StorageManifestEntry, a).sha256 != first_hash
+            missing = db.session.get(StorageManifestEntry, b)
+            assert not missing.present and missing.missing_since is not None
+
+    def test_presence_map_reads_manifest(self, app, database, storage):
+        """Dopo la sweep la presenza è letta dal manifest, non dal filesystem."""
+        with app.app_context():
+            path = _scrivi(storage / "attestato.pdf")
+            sweep()
+            os.remove(path)  # non ancora visto dallo scanner
+
+            assert presence_map([path, None]) == {path: True, None: False}
+            assert file_available(path)
+            mai_visto = str(storage / "mai_visto.pdf")
+            assert presence_map([mai_visto], fallback=False) == {mai_visto: False}
+
+    def test_missing_and_orphaned_files(self, app, database, storage, tmp_path):
+        """Referenze senza file e file senza referenze sono riportati separatamente."""
+        with app.app_context():
+            firma = _scrivi(tmp_path / "firme" / "firma_1.png")  # fuori dalle root
+            attestato = str(storage / "attestati" / "attestato_1.pdf")  # mai creato
+            partecipazione, user = _partecipazione(firma=firma, attestato=attestato)
+
+            company = Company(name="Mercury")
+            db.session.add(company)
+            db.session.flush()
+            department = Department(name="Qualità", company_id=company.id)
+            db.session.add(department)
+            sha256 = 'd' * 64
+            blob = _scrivi(storage / "blobs" / "dd" / "dd" / sha256)
+            db.session.add(FileBlob(sha256=sha256))
+            db.session.add(Document(title="Manuale", filename="manuale.pdf", original_filename="manuale.pdf",
+                                    user_id=user.id, uploader_email=user.email, company_id=company.id,
+                                    department_id=department.id, blob_sha256=sha256))
+            orfano = _scrivi(storage / "vecchi" / "copia.pdf")
+            db.session.commit()
+
+            sweep()
+
+            mancanti = missing_files()
+            assert [m['path'] for m in mancanti] == [attestato]
+            assert mancanti[0]['riferimenti'] == [('attestato', partecipazione.id)]
+            assert db.session.get(StorageManifestEntry, firma).present
+            assert [o['path'] for o in orphaned_files()] == [orfano]
+            assert blob == get_blob_store().path_for(sha256)
+
+    @pytest.mark.skipif(not StorageWatcher.available(), reason="inotify non disponibile")
+    def test_inotify_watcher_updates_manifest(self, app, database, storage):
+        """Il watcher registra creazioni ed eliminazioni senza una nuova sweep."""
+        with app.app_context():
+            vecchio = _scrivi(storage / "reparto" / "vecchio.pdf")
+            sweep()
+
+        watcher = StorageWatcher(app, debounce=0.1).start()
+        try:
+            nuovo = _scrivi(storage / "reparto" / "nuovo.pdf")
+            _scrivi(storage / "nuova_cartella" / "dentro.pdf")
+            os.remove(vecchio)
+            deadline = time.time() + 5
+            with app.app_context():
+                while time.time() < deadline:
+                    db.session.expire_all()
+                    entries = {e.path: e.present for e in StorageManifestEntry.query}
+                    if entries.get(nuovo) and entries.get(vecchio) is False and \
+                            entries.get(str(storage / "nuova_cartella" / "dentro.pdf")):
+                        break
+                    time.sleep(0.1)
+                assert entries.get(nuovo) is True
+                assert entries.get(vecchio) is False
+                assert entries.get(str(storage / "nuova_cartella" / "dentro.pdf")) is True
+        finally:
+            watcher.stop()
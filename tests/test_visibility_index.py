@@ -0,0 +1,111 @@
+"""
+Test indice di visibilità documenti (services.visibility_index).
+"""
+
+import pytest
+from datetime import datetime, timedelta
+
+from extensions import db
+from models import AuthorizedAccess, Company, Department, Document, DocumentShare, DocumentVisibility, User
+from services.visibility_index import (
+    get_access_reason, rebuild_all, register_visibility_listeners, visible_document_ids
+)
+
+
+def _crea_scenario():
+    """Due aziende con un reparto ciascuna, un proprietario e un utente esterno."""
+    mercury = Company(name="Mercury")
+    other = Company(name="Other")
+    db.session.add_all([mercury, other])
+    db.session.flush()
+    qualita = Department(name="Qualità", company_id=mercury.id)
+    logistica = Department(name="Logistica", company_id=other.id)
+    db.session.add_all([qualita, logistica])
+    db.session.flush()
+
+    owner = User(username="owner", email="owner@mercury.com", password="x", role="user")
+    owner.companies.append(mercury)
+    esterno = User(username="esterno", email="esterno@other.com", password="x", role="user")
+    esterno.companies.append(other)
+    db.session.add_all([owner, esterno])
+    db.session.flush()
+
+    doc = Document(title="Manuale", filename="manuale.pdf", user_id=owner.id, uploader_email=owner.email,
+                   company_id=mercury.id, department_id=qualita.id)
+    db.session.add(doc)
+    db.session.commit()
+    return owner, esterno, doc, other, logistica
+
+
+def _visible(user_id, reasons=None):
+    return {row[0] for row in db.session.execute(visible_document_ids(user_id, reasons))}
+
+
+class TestVisibilityIndex:
+    """Test per il mantenimento incrementale dell'indice di visibilità."""
+
+    @pytest.fixture(autouse=True)
+    def _listeners(self):
+        register_visibility_listeners()
+
+    def test_owner_and_company_rows_on_insert(self, app, database):
+        """Il nuovo documento è visibile al proprietario e ai membri dell'azienda."""
+        with app.app_context():
+            owner, esterno, doc, _, _ = _crea_scenario()
+            assert get_access_reason(owner.id, doc.id) == 'proprietario'
+            assert doc.id in _visible(owner.id, reasons=('azienda',))
+            assert get_access_reason(esterno.id, doc.id) is None
+
+    def test_share_grants_and_expires(self, app, database):
+        """Una condivisione temporanea è visibile solo fino alla scadenza."""
+        with app.app_context():
+            owner, esterno, doc, _, _ = _crea_scenario()
+            share = DocumentShare(file_id=doc.id, user_id=esterno.id, granted_by=owner.id,
+                                  expires_at=datetime.utcnow() + timedelta(days=1))
+            db.session.add(share)
+            db.session.commit()
+            assert get_access_reason(esterno.id, doc.id) == 'condivisione'
+
+            share.expires_at = datetime.utcnow() - timedelta(minutes=1)
+            db.session.commit()
+            assert get_access_reason(esterno.id, doc.id) is None
+
+    def test_membership_change_updates_index(self, app, database):
+        """Aggiungere o togliere un'azienda all'utente aggiorna la visibilità."""
+        with app.app_context():
+            owner, esterno, doc, other, _ = _crea_scenario()
+            esterno.companies.append(doc.company)
+            db.session.commit()
+            assert get_access_reason(esterno.id, doc.id) == 'azienda'
+
+            esterno.companies.clear()
+            esterno.companies.append(other)
+            db.session.commit()
+            assert get_access_reason(esterno.id, doc.id) is None
+
+    def test_document_move_and_delete(self, app, database):
+        """Spostare un documento di reparto o cancellarlo aggiorna le sue righe."""
+        with app.app_context():
+            owner, esterno, doc, other, logistica = _crea_scenario()
+            db.session.add(AuthorizedAccess(user_id=esterno.id, document_id=doc.id))
+            db.session.commit()
+            assert get_access_reason(esterno.id, doc.id) == 'autorizzato'
+
+            esterno.departments.append(logistica)
+            doc.department_id = logistica.id
+            db.session.commit()
+            assert doc.id in _visible(esterno.id, reasons=('reparto',))
+
+            AuthorizedAccess.query.filter_by(document_id=doc.id).delete()
+            db.session.delete(doc)
+            db.session.commit()
+            assert DocumentVisibility.query.filter_by(document_id=doc.id).count() == 0
+
+    def test_rebuild_matches_incremental(self, app, database):
+        """La ricostruzione completa produce le stesse righe della manutenzione incrementale."""
+        with app.app_context():
+            _crea_scenario()
+            before = {(r.user_id, r.document_id, r.reason) for r in DocumentVisibility.query.all()}
+            rebuild_all()
+            after = {(r.user_id, r.document_id, r.reason) for r in DocumentVisibility.query.all()}
+            assert before == after
@@ -0,0 +1,106 @@
+"""
+Test watermark PDF (services.watermark_service): cache overlay e motori di stampa.
+"""
+
+import io
+import pytest
+from werkzeug.exceptions import InternalServerError
+
+from services.watermark_service import (
+    ENGINE_PIKEPDF, ENGINE_PYPDF2, OverlayCache, WatermarkService, overlay_key
+)
+
+
+def _pdf(pages, rotate_last=False):
+    canvas = pytest.importorskip("reportlab.pdfgen.canvas")
+    buffer = io.BytesIO()
+    can = canvas.Canvas(buffer, pagesize=(595.28, 841.89))
+    for number in range(pages):
+        if rotate_last and number == pages - 1:
+            can.setPageRotation(90)
+        can.drawString(72, 720, f"Pagina {number + 1}")
+        can.showPage()
+    can.save()
+    return buffer.getvalue()
+
+
+class TestWatermark:
+    """Test per riuso degli overlay, chiavi di cache e motori PyPDF2/pikepdf."""
+
+    def test_overlay_reused_across_pages_and_downloads(self, monkeypatch):
+        """Un overlay per testo e geometria, generato una volta sola."""
+        service = WatermarkService()
+        created = []
+
+        def _crea(text, width, height, rotation=0, x0=0, y0=0):
+            created.append((text, width, height, rotation))
+            return b"%PDF overlay"
+
+        monkeypatch.setattr(service, 'create_watermark_overlay', _crea)
+        for _ in range(300):
+            service.get_overlay("User: mario", 595.276, 841.89)
+        service.get_overlay("User: mario", 595.28, 841.89, rotation=90)
+        service.get_overlay("User: luigi", 595.28, 841.89)
+
+        assert created == [("User: mario", 595.28, 841.89, 0),
+                           ("User: mario", 595.28, 841.89, 90),
+                           ("User: luigi", 595.28, 841.89, 0)]
+        assert service.overlays.hits == 299
+
+    def test_overlay_cache_is_lru(self):
+        """Oltre la capienza si elimina l'overlay usato meno di recente."""
+        cache = OverlayCache(max_entries=2)
+        a, b, c = (overlay_key(t, 0, 0, 100, 100, -90) for t in "abc")
+        assert a[5] == 270
+        cache.get_or_create(a, lambda: b"a")
+        cache.get_or_create(b, lambda: b"b")
+        cache.get_or_create(a, lambda: b"nuovo a")
+        cache.get_or_create(c, lambda: b"c")
+
+        assert cache.get_or_create(a, lambda: b"rigenerato") == b"a"
+        assert cache.get_or_create(b, lambda: b"rigenerato") == b"rigenerato"
+
+    @pytest.mark.parametrize("engine, module", [(ENGINE_PYPDF2, "PyPDF2"), (ENGINE_PIKEPDF, "pikepdf")])
+    def test_engines_stamp_every_page(self, engine, module):
+        """Entrambi i motori applicano il watermark a tutte le pagine, ruotate comprese."""
+        pytest.importorskip(module)
+        PyPDF2 = pytest.importorskip("PyPDF2")
+        service = WatermarkService()
+        output = io.BytesIO()
+
+        used = service.stamp(io.BytesIO(_pdf(20, rotate_last=True)), "User: mario | 01/01/2025", output, engine)
+
+        assert used == engine
+        reader = PyPDF2.PdfReader(io.BytesIO(output.getvalue()))
+        assert len(reader.pages) == 20
+        assert all("mario" in page.extract_text() for page in reader.pages)
+        assert service.overlays.misses == 2  # formato verticale + pagina ruotata
+
+    def test_download_without_watermark_requirement(self, app):
+        """Documenti pubblici o non PDF usano il download normale."""
+        class _Doc:
+            id = 1
+            filename = "manuale.pdf"
+            visibility = "pubblico"
+
+        with app.test_request_context('/download'):
+            assert WatermarkService().watermark_response(_Doc(), None, "/non/esiste.pdf") is None
+
+    def test_download_fails_closed_when_watermark_fails(self, app, monkeypatch):
+        """Se il watermark richiesto non può essere applicato il download è bloccato."""
+        class _Doc:
+            id = 1
+            filename = "riservato.pdf"
+            original_filename = "riservato.pdf"
+            visibility = "privato"
+
+        service = WatermarkService()
+        service.enabled = True
+
+        def _errore(*args, **kwargs):
+            raise RuntimeError("PDF corrotto")
+
+        monkeypatch.setattr(service, 'watermark_file', _errore)
+        with app.test_request_context('/download'):
+            with pytest.raises(InternalServerError):
+                service.watermark_response(_Doc(), None, "/non/esiste.pdf", custom_vars={'username': 'ospite'})
@@ -4,10 +4,13 @@ from datetime import datetime
 from flask import current_app
 from extensions import db, bcrypt
 from models import Document, Company, Department
-from utils_extra import save_file_and_upload_to_drive, allowed_file, notify_upload  # assicurati che siano in utils_extra.py
+from werkzeug.utils import secure_filename
+from utils_extra import allowed_file, notify_upload  # assicurati che siano in utils_extra.py
 from services.antivirus_service import antivirus_service
+from services.blob_store import get_blob_store, store_upload
+from services.preview_service import enqueue_preview
+from services.resumable_upload import resumable_file
 import os
-import tempfile
 
 upload_bp = Blueprint('upload', __name__, url_prefix='/upload')
 
@@ -19,7 +22,7 @@ def upload_home():
 @login_required
 def upload_to_drive():
     if request.method == 'POST':
-        file = request.files.get('file')
+        file = request.files.get('file') or resumable_file(request.form.get('upload_id'))
         title = request.form.get('title')
         description = request.form.get('description')
         note = request.form.get('note')
@@ -43,23 +46,11 @@ def upload_to_drive():
             flash("❌ Estensione file non valida", "danger")
             return redirect(url_for('upload.upload_to_drive'))
 
-        # 🛡️ Prima verifica antivirus del file caricato
+        # 🛡️ Antivirus, hash e salvataggio nel blob store in una sola lettura dello stream caricato
+        ingest_result = None
         try:
-            # Salva temporaneamente il file per la scansione
-            with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-                file.seek(0)  # Reset position
-                temp_file.write(file.read())
-                temp_file_path = temp_file.name
-                file.seek(0)  # Reset per uso successivo
-            
-            # Scansiona il file con ClamAV
-            scan_result = antivirus_service.scan_file_path(temp_file_path)
-            
-            # Rimuovi file temporaneo
-            try:
-                os.unlink(temp_file_path)
-            except:
-                pass
+            ingest_result = store_upload(file)
+            scan_result = ingest_result.scan
             
             # Controlla risultato scansione
             if scan_result['verdict'] == 'infected':
@@ -83,9 +74,13 @@ def upload_to_drive():
             else:
                 flash("⚠️ Errore scansione antivirus, ma upload consentito.", "warning")
 
-        # 🔄 Salvataggio multiplo per combinazioni azienda/reparto
+        # 🔄 Un solo blob condiviso da tutte le combinazioni azienda/reparto
         saved_documents = []
         try:
+            if ingest_result is None:
+                ingest_result = store_upload(file, scan=False)
+            new_filename = f"{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{secure_filename(file.filename)}"
+
             for company_id in company_ids:
                 company = Company.query.get(company_id)
                 if not company:
@@ -96,11 +91,6 @@ def upload_to_drive():
                     if not department:
                         continue
 
-                    # 📁 Salva il file con struttura personalizzata
-                    local_path, _ = save_file_and_upload_to_drive(
-                        file, upload_to_drive=False
-                    )
-                    new_filename = os.path.basename(local_path)
                     drive_file_id = None
 
                     doc = Document(
@@ -117,22 +107,24 @@ def upload_to_drive():
                         shared_email=shared_email,
                         password=bcrypt.generate_password_hash(password).decode('utf-8') if password else None,
                         drive_file_id=drive_file_id,
+                        blob_sha256=ingest_result.sha256,
+                        file_size=ingest_result.size,
                         created_at=datetime.utcnow()
                     )
 
                     db.session.add(doc)
                     db.session.flush()  # Ottieni l'ID del documento
                     
-                    saved_documents.append((doc.id, local_path))
+                    saved_documents.append(doc.id)
                     notify_upload(doc)  # opzionale
 
             db.session.commit()
             
-            # 🛡️ Post-commit: calcola hash e salva risultati scansione per ogni documento
-            for doc_id, file_path in saved_documents:
+            # 🛡️ Post-commit: salva hash e risultato scansione per ogni documento
+            for doc_id in saved_documents:
                 try:
-                    # Processa file: calcola hash SHA-256 e salva risultato antivirus
-                    is_safe, detailed_scan = antivirus_service.process_uploaded_file(file_path, doc_id)
+                    # Stesso contenuto per tutte le combinazioni: nessuna nuova lettura
+                    is_safe, detailed_scan = antivirus_service.record_ingest(doc_id, ingest_result)
                     
                     if not is_safe:
                         current_app.logger.warning(f"Documento {doc_id} marcato come non sicuro dopo elaborazione")
@@ -140,6 +132,11 @@ def upload_to_drive():
                 except Exception as e:
                     current_app.logger.error(f"Errore post-processing documento {doc_id}: {e}")
             
+            # 🖼️ Preview generate in background, una volta per il contenuto condiviso
+            if saved_documents:
+                enqueue_preview(ingest_result.sha256, get_blob_store().path_for(ingest_result.sha256),
+                                file.filename, document_id=saved_documents[0])
+            
             flash("✅ Documento caricato con successo per tutte le combinazioni", "success")
 
         except Exception as e:
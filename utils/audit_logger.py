@@ -10,7 +10,7 @@ from models import db, DocumentAuditLog
 logger = logging.getLogger(__name__)
 
 
-def log_event(document, evento, note_ai=None, user_override=None):
+def log_event(document, evento, note_ai=None, user_override=None, commit=True):
     """
     Registra un evento di audit per un documento.
     
@@ -19,6 +19,7 @@ def log_event(document, evento, note_ai=None, user_override=None):
         evento (str): Descrizione dell'evento
         note_ai (str, optional): Note aggiuntive generate dall'AI
         user_override: Utente specifico (se diverso da current_user)
+        commit (bool): False per lasciare il commit al chiamante (stessa transazione)
         
     Returns:
         DocumentAuditLog: Il log creato
@@ -40,7 +41,8 @@ def log_event(document, evento, note_ai=None, user_override=None):
         )
         
         db.session.add(log)
-        db.session.commit()
+        if commit:
+            db.session.commit()
         
         logger.info(f"Audit log creato: {evento} per documento {document.id}")
         return log
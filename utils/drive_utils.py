@@ -1,34 +1,20 @@
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
 import os
 import logging
-from datetime import datetime
+
+from services.drive_sync import get_drive_client
 
 # Configurazione logging
 logger = logging.getLogger(__name__)
 
 def get_drive_service():
     """
-    Inizializza e restituisce il servizio Google Drive.
+    Restituisce il servizio Google Drive condiviso del processo.
     
     Returns:
         googleapiclient.discovery.Resource: Servizio Google Drive
     """
     try:
-        # Carica credenziali dal file JSON
-        credentials_path = os.getenv("GOOGLE_DRIVE_SERVICE_ACCOUNT_JSON")
-        if not credentials_path or not os.path.exists(credentials_path):
-            raise FileNotFoundError(f"File credenziali Google Drive non trovato: {credentials_path}")
-        
-        creds = service_account.Credentials.from_service_account_file(
-            credentials_path,
-            scopes=["https://www.googleapis.com/auth/drive"]
-        )
-        
-        service = build('drive', 'v3', credentials=creds)
-        logger.info("Servizio Google Drive inizializzato correttamente")
-        return service
+        return get_drive_client().service
         
     except Exception as e:
         logger.error(f"Errore nell'inizializzazione Google Drive: {str(e)}")
@@ -74,7 +60,10 @@ def create_or_get_folder(service, folder_name, parent_id):
 
 def upload_to_drive(local_path, nome_file, subfolders):
     """
-    Carica un file su Google Drive nella struttura di cartelle specificata.
+    Carica subito un file su Google Drive nella struttura di cartelle specificata.
+    
+    Per gli upload dalle richieste HTTP usare `services.drive_sync.enqueue_drive_upload`,
+    che esegue l'upload in background.
     
     Args:
         local_path (str): Percorso del file locale
@@ -89,41 +78,8 @@ def upload_to_drive(local_path, nome_file, subfolders):
         if not os.path.exists(local_path):
             raise FileNotFoundError(f"File locale non trovato: {local_path}")
         
-        # Inizializza servizio Drive
-        service = get_drive_service()
-        
-        # Ottieni ID cartella root
-        root_folder_id = os.getenv("GOOGLE_DRIVE_ROOT_FOLDER_ID")
-        if not root_folder_id:
-            raise ValueError("GOOGLE_DRIVE_ROOT_FOLDER_ID non configurato")
-        
-        # Naviga/crea struttura cartelle
-        current_parent_id = root_folder_id
-        for folder_name in subfolders:
-            if folder_name:  # Salta cartelle vuote
-                current_parent_id = create_or_get_folder(service, folder_name, current_parent_id)
-        
-        # Prepara metadata file
-        file_metadata = {
-            'name': nome_file,
-            'parents': [current_parent_id]
-        }
-        
-        # Carica file
-        media = MediaFileUpload(local_path, resumable=True)
-        uploaded_file = service.files().create(
-            body=file_metadata, 
-            media_body=media, 
-            fields='id,name,webViewLink'
-        ).execute()
-        
-        file_id = uploaded_file.get('id')
-        web_link = uploaded_file.get('webViewLink')
-        
-        logger.info(f"File '{nome_file}' caricato su Drive con ID: {file_id}")
-        logger.info(f"Link visualizzazione: {web_link}")
-        
-        return file_id
+        # Cartelle risolte dalla cache persistente, upload resumable a chunk
+        return get_drive_client().upload_file(local_path, nome_file, subfolders)
         
     except Exception as e:
         logger.error(f"Errore nell'upload su Drive del file '{nome_file}': {str(e)}")
@@ -140,8 +96,7 @@ def delete_from_drive(file_id):
         bool: True se eliminato con successo
     """
     try:
-        service = get_drive_service()
-        service.files().delete(fileId=file_id).execute()
+        get_drive_client().delete_file(file_id)
         logger.info(f"File con ID {file_id} eliminato da Google Drive")
         return True
         
@@ -160,13 +115,7 @@ def get_file_info(file_id):
         dict: Informazioni del file
     """
     try:
-        service = get_drive_service()
-        file_info = service.files().get(
-            fileId=file_id, 
-            fields='id,name,size,createdTime,modifiedTime,webViewLink'
-        ).execute()
-        
-        return file_info
+        return get_drive_client().get_file(file_id)
         
     except Exception as e:
         logger.error(f"Errore nel recupero info file {file_id}: {str(e)}")
@@ -180,9 +129,8 @@ def check_drive_connection():
         bool: True se connessione OK
     """
     try:
-        service = get_drive_service()
         # Prova a listare i file per verificare la connessione
-        service.files().list(pageSize=1).execute()
+        get_drive_client().check_connection()
         logger.info("Connessione Google Drive verificata con successo")
         return True
         
@@ -7,6 +7,7 @@ from datetime import datetime
 from flask import current_app, request
 from flask_login import current_user
 from models import db, DocumentReadLog, Document
+from services.event_store import dimentica_bitmap, ha_letto, invalida_bitmap, segna_lettura
 
 logger = logging.getLogger(__name__)
 
@@ -31,13 +32,7 @@ def track_document_read(document, user=None, duration=None):
             logger.warning("Tentativo di tracciare lettura da utente non autenticato")
             return None
         
-        # Verifica se è la prima lettura
-        existing_read = DocumentReadLog.query.filter_by(
-            user_id=user.id,
-            document_id=document.id
-        ).first()
-        
-        is_first_read = existing_read is None
+        is_first_read = segna_prima_lettura(user.id, document.id)
         
         # Crea il log di lettura
         read_log = DocumentReadLog(
@@ -50,22 +45,60 @@ def track_document_read(document, user=None, duration=None):
         )
         
         db.session.add(read_log)
-        db.session.commit()
         
-        # Log anche nell'audit
+        # Log anche nell'audit, nella stessa transazione
         from utils.audit_logger import log_event
         evento = "👁️ Prima lettura" if is_first_read else "👁️ Rilettura"
-        log_event(document, evento, user_override=user)
+        log_event(document, evento, user_override=user, commit=False)
+        db.session.commit()
         
         logger.info(f"Lettura tracciata: documento {document.id} da {user.email}")
         return read_log
         
     except Exception as e:
         db.session.rollback()
+        dimentica_bitmap(document.id)
         logger.error(f"Errore nel tracciamento lettura: {str(e)}")
         return None
 
 
+def segna_prima_lettura(user_id, document_id):
+    """
+    Aggiorna il bitmap delle prime letture, senza far perdere la lettura se fallisce.
+    
+    Va chiamata senza modifiche in sospeso nella sessione: in caso di errore
+    la transazione viene annullata, il bitmap eliminato (sarà ricostruito dai
+    log di lettura) e la prima lettura ricavata dai log.
+    
+    Args:
+        user_id (int): ID utente
+        document_id (int): ID documento
+        
+    Returns:
+        bool: True se è la prima lettura dell'utente
+    """
+    try:
+        # Prima lettura dal bitmap del documento (senza ricerca nei log di lettura)
+        is_first_read = segna_lettura(user_id, document_id)
+        db.session.flush()
+        return is_first_read
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"Bitmap letture non aggiornato per documento {document_id}, ricostruito dai log: {e}")
+    
+    try:
+        invalida_bitmap(document_id)
+        db.session.flush()
+    except Exception as e:
+        db.session.rollback()
+        dimentica_bitmap(document_id)
+        logger.error(f"Errore nell'invalidazione del bitmap letture del documento {document_id}: {e}")
+    
+    return not db.session.query(
+        DocumentReadLog.query.filter_by(user_id=user_id, document_id=document_id).exists()
+    ).scalar()
+
+
 def has_user_read_document(user, document):
     """
     Verifica se un utente ha letto un documento.
@@ -80,12 +113,7 @@ def has_user_read_document(user, document):
     if not user.is_authenticated:
         return False
     
-    existing_log = DocumentReadLog.query.filter_by(
-        document_id=document.id, 
-        user_id=user.id
-    ).first()
-    
-    return existing_log is not None
+    return ha_letto(user.id, document.id)
 
 
 def get_user_read_stats(user):
@@ -7,6 +7,14 @@ import shutil
 from datetime import datetime
 from models import Document, DocumentVersion, db
 from flask_login import current_user
+from services.blob_store import ensure_blob, get_blob_store, legacy_path, resolve_path
+
+
+def _importa_blob(percorso):
+    """Importa un file nel blob store e restituisce il risultato (hash, dimensione)."""
+    result, _ = get_blob_store().put_file(percorso)
+    ensure_blob(result)
+    return result
 
 
 def salva_versione_anteriore(document, current_user, note=None):
@@ -32,12 +40,12 @@ def salva_versione_anteriore(document, current_user, note=None):
         # Crea la nuova versione
         versione = DocumentVersion(
             document_id=document.id,
-            filename=document.filename,
-            filepath=document.file_path,
-            uploaded_by=current_user.id,
+            file_path=document.file_path,
+            blob_sha256=document.blob_sha256,
+            uploaded_by=current_user.username,
             is_active=False,  # La versione precedente non è più attiva
             version_number=nuovo_numero,
-            note=note
+            notes=note
         )
         
         db.session.add(versione)
@@ -75,9 +83,12 @@ def attiva_nuova_versione(document, nuovo_filename, nuovo_filepath, current_user
             is_active=True
         ).update({"is_active": False})
         
+        # Il nuovo file entra nel blob store: il percorso del documento è ricavato dall'hash
+        blob = _importa_blob(nuovo_filepath)
+        
         # Aggiorna il documento principale
         document.filename = nuovo_filename
-        document.file_path = nuovo_filepath
+        document.blob_sha256 = blob.sha256
         document.updated_at = datetime.utcnow()
         
         # Crea la nuova versione attiva
@@ -89,12 +100,12 @@ def attiva_nuova_versione(document, nuovo_filename, nuovo_filepath, current_user
         
         nuova_versione = DocumentVersion(
             document_id=document.id,
-            filename=nuovo_filename,
-            filepath=nuovo_filepath,
-            uploaded_by=current_user.id,
+            file_path=get_blob_store().path_for(blob.sha256),
+            blob_sha256=blob.sha256,
+            uploaded_by=current_user.username,
             is_active=True,
             version_number=nuovo_numero,
-            note=note or "Versione principale"
+            notes=note or "Versione principale"
         )
         
         db.session.add(nuova_versione)
@@ -123,7 +134,8 @@ def ripristina_versione(version_id, current_user):
         document = versione.document
         
         # Verifica che il file esista
-        if not os.path.exists(versione.filepath):
+        percorso = resolve_path(versione)
+        if not percorso:
             raise Exception("File della versione non trovato")
         
         # Salva la versione attuale come storica
@@ -135,14 +147,17 @@ def ripristina_versione(version_id, current_user):
             document_id=document.id
         ).update({"is_active": False})
         
+        # Le versioni non ancora migrate entrano nel blob store
+        if not versione.blob_sha256:
+            versione.blob_sha256 = _importa_blob(percorso).sha256
+        
         # Aggiorna il documento principale
-        document.filename = versione.filename
-        document.file_path = versione.filepath
+        document.blob_sha256 = versione.blob_sha256
         document.updated_at = datetime.utcnow()
         
         # Attiva la versione selezionata
         versione.is_active = True
-        versione.note = f"Ripristinata da {current_user.username} il {datetime.utcnow().strftime('%d/%m/%Y %H:%M')}"
+        versione.notes = f"Ripristinata da {current_user.username} il {datetime.utcnow().strftime('%d/%m/%Y %H:%M')}"
         
         db.session.commit()
         
@@ -171,9 +186,11 @@ def elimina_versione(version_id, current_user):
         if versione.is_active:
             raise Exception("Non è possibile eliminare la versione attiva")
         
-        # Elimina il file fisico se esiste
-        if os.path.exists(versione.filepath):
-            os.remove(versione.filepath)
+        # I blob sono condivisi e vengono rimossi da gc_blobs; i file legacy si eliminano subito
+        if not versione.blob_sha256:
+            percorso = legacy_path(versione)
+            if percorso:
+                os.remove(percorso)
         
         # Elimina la versione dal database
         db.session.delete(versione)